@@ -0,0 +1,242 @@
+# 帳票DX テンプレート差分 系列アライメント
+#
+# deep_diff のリスト比較などで使う系列比較アルゴリズム（標準ライブラリのみ）。
+# opcodes は difflib.SequenceMatcher.get_opcodes と同じ (tag, i1, i2, j1, j2) 形式。
+
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+Opcode = Tuple[str, int, int, int, int]
+
+# Myers の編集距離 D の既定上限。超えた部分は置換ブロック1つとして扱う。
+DEFAULT_MAX_EDIT_DISTANCE = 256
+
+
+def _myers_edits(a: Sequence, b: Sequence, max_d: int) -> Optional[List[str]]:
+    # Myers の O((N+M)D) 貪欲法で編集列（"=", "-", "+"）を求める。
+    # D が max_d を超えたら None を返す。
+    n, m = len(a), len(b)
+    v: Dict[int, int] = {1: 0}
+    trace: List[Dict[int, int]] = []
+    for d in range(min(n + m, max_d) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m)
+    return None
+
+
+def _myers_backtrack(trace: List[Dict[int, int]], n: int, m: int) -> List[str]:
+    edits: List[str] = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            edits.append("=")
+            x -= 1
+            y -= 1
+        if d > 0:
+            edits.append("+" if x == prev_x else "-")
+        x, y = prev_x, prev_y
+    edits.reverse()
+    return edits
+
+
+def _edits_to_opcodes(edits: List[str], i0: int, j0: int) -> List[Opcode]:
+    # 編集列を opcodes にまとめる（隣接する削除+挿入は replace）
+    opcodes: List[Opcode] = []
+    i, j = i0, j0
+    pos = 0
+    while pos < len(edits):
+        if edits[pos] == "=":
+            start_i, start_j = i, j
+            while pos < len(edits) and edits[pos] == "=":
+                i += 1
+                j += 1
+                pos += 1
+            opcodes.append(("equal", start_i, i, start_j, j))
+            continue
+        start_i, start_j = i, j
+        while pos < len(edits) and edits[pos] != "=":
+            if edits[pos] == "-":
+                i += 1
+            else:
+                j += 1
+            pos += 1
+        if i > start_i and j > start_j:
+            tag = "replace"
+        elif i > start_i:
+            tag = "delete"
+        else:
+            tag = "insert"
+        opcodes.append((tag, start_i, i, start_j, j))
+    return opcodes
+
+
+def myers_opcodes(
+    a: Sequence, b: Sequence, max_d: int = DEFAULT_MAX_EDIT_DISTANCE
+) -> List[Opcode]:
+    # 2系列の差分を opcodes で返す。
+    # 共通の先頭・末尾を先に除くので、局所的な変更ならほぼ線形時間で済む。
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < n - prefix
+        and suffix < m - prefix
+        and a[n - 1 - suffix] == b[m - 1 - suffix]
+    ):
+        suffix += 1
+
+    opcodes: List[Opcode] = []
+    if prefix:
+        opcodes.append(("equal", 0, prefix, 0, prefix))
+
+    core_a = a[prefix : n - suffix]
+    core_b = b[prefix : m - suffix]
+    if core_a or core_b:
+        edits = _myers_edits(core_a, core_b, max_d)
+        if edits is None:
+            # 差分が大きすぎる場合は1つの置換ブロックとして扱う
+            if core_a and core_b:
+                tag = "replace"
+            elif core_a:
+                tag = "delete"
+            else:
+                tag = "insert"
+            opcodes.append((tag, prefix, n - suffix, prefix, m - suffix))
+        else:
+            opcodes.extend(_edits_to_opcodes(edits, prefix, prefix))
+
+    if suffix:
+        opcodes.append(("equal", n - suffix, n, m - suffix, m))
+    return opcodes
+
+
+def longest_increasing_subsequence(seq: Sequence[int]) -> Set[int]:
+    # 狭義単調増加な最長部分列を O(n log n) で求め、その位置（seq の添字）の集合を返す
+    tails: List[int] = []  # 長さ L+1 の部分列の末尾値
+    tail_pos: List[int] = []  # その末尾の seq 上の位置
+    prev: List[int] = [-1] * len(seq)
+    for pos, value in enumerate(seq):
+        L = bisect_left(tails, value)
+        if L == len(tails):
+            tails.append(value)
+            tail_pos.append(pos)
+        else:
+            tails[L] = value
+            tail_pos[L] = pos
+        prev[pos] = tail_pos[L - 1] if L > 0 else -1
+
+    result: Set[int] = set()
+    pos = tail_pos[-1] if tail_pos else -1
+    while pos >= 0:
+        result.add(pos)
+        pos = prev[pos]
+    return result
+
+
+def _merge_opcodes(opcodes: List[Opcode]) -> List[Opcode]:
+    # 隣接する equal 同士・非 equal 同士をまとめ、タグを付け直す
+    merged: List[List] = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 == i2 and j1 == j2:
+            continue
+        if merged and (merged[-1][0] == "equal") == (tag == "equal"):
+            merged[-1][2] = i2
+            merged[-1][4] = j2
+        else:
+            merged.append([tag, i1, i2, j1, j2])
+    result: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in merged:
+        if tag != "equal":
+            if i2 > i1 and j2 > j1:
+                tag = "replace"
+            elif i2 > i1:
+                tag = "delete"
+            else:
+                tag = "insert"
+        result.append((tag, i1, i2, j1, j2))
+    return result
+
+
+def patience_opcodes(
+    a: Sequence, b: Sequence, max_d: int = DEFAULT_MAX_EDIT_DISTANCE
+) -> List[Opcode]:
+    # patience diff。両系列で1回ずつしか出現しない要素を目印に区間を分割していき、
+    # 目印のない区間だけを Myers で比較する。行数の多いテキストでもほぼ線形で済む。
+    out: List[Opcode] = []
+    # 作業スタック: ("region", a0, a1, b0, b1) か ("ops", [opcode, ...])。先頭から順に処理する。
+    stack: List[Tuple] = [("region", 0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == "ops":
+            out.extend(item[1])
+            continue
+        _kind, a0, a1, b0, b1 = item
+
+        # 共通の先頭・末尾
+        start_a, start_b = a0, b0
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            a0 += 1
+            b0 += 1
+        out.append(("equal", start_a, a0, start_b, b0))
+        end_a, end_b = a1, b1
+        while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+            a1 -= 1
+            b1 -= 1
+        tail = ("equal", a1, end_a, b1, end_b)
+        if a0 == a1 or b0 == b1:
+            out.append(("delete", a0, a1, b0, b1))
+            out.append(tail)
+            continue
+
+        # 区間内で一意な要素の対応を取り、その最長増加部分列を目印にする
+        count_a: Dict = {}
+        for i in range(a0, a1):
+            count_a[a[i]] = count_a.get(a[i], 0) + 1
+        count_b: Dict = {}
+        pos_b: Dict = {}
+        for j in range(b0, b1):
+            count_b[b[j]] = count_b.get(b[j], 0) + 1
+            pos_b[b[j]] = j
+        pairs = [
+            (i, pos_b[a[i]])
+            for i in range(a0, a1)
+            if count_a[a[i]] == 1 and count_b.get(a[i]) == 1
+        ]
+        keep = longest_increasing_subsequence([j for _i, j in pairs])
+        anchors = [pairs[n] for n in sorted(keep)]
+        if not anchors:
+            for tag, i1, i2, j1, j2 in myers_opcodes(a[a0:a1], b[b0:b1], max_d):
+                out.append((tag, i1 + a0, i2 + a0, j1 + b0, j2 + b0))
+            out.append(tail)
+            continue
+
+        # 目印で区切った区間を逆順に積む（後から積んだものが先に処理される）
+        stack.append(("ops", [tail]))
+        next_a, next_b = a1, b1
+        for i, j in reversed(anchors):
+            stack.append(("region", i + 1, next_a, j + 1, next_b))
+            stack.append(("ops", [("equal", i, i + 1, j, j + 1)]))
+            next_a, next_b = i, j
+        stack.append(("region", a0, next_a, b0, next_b))
+    return _merge_opcodes(out)
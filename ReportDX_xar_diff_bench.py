@@ -0,0 +1,655 @@
+# 帳票DX テンプレート差分 ベンチマーク
+#
+# 合成した .xar（オブジェクト数・種類の比率・テーブルの入れ子の深さ・明細あたりのフレーム数・
+# 文字列長・旧→新の変更率を指定）を使って、処理段階ごとの所要時間とピークメモリを計測し、JSON に保存する。
+# 前回の結果 JSON を --baseline に渡すと段階ごとに比較し、しきい値を超えて遅くなった段階があれば終了コード 1。
+#
+#   python ReportDX_xar_diff_bench.py --objects 5000 -o bench.json
+#   python ReportDX_xar_diff_bench.py --objects 5000 -o bench_new.json --baseline bench.json
+#
+# 時間は repeat 回の最小値。ピークメモリは時間計測とは別に tracemalloc 下で1回実行した、
+# その段階で増えた Python ヒープの最大量（tracemalloc は遅いので時間計測には含めない）。
+# cold_start は新しいインタプリタで読み込み・比較の経路（エンジン）を import する時間で、予算
+# （--cold-start-budget）を超えるか、Excel 出力・画面用の重いモジュールまで読み込んでいれば終了コード 1。
+#
+#   python ReportDX_xar_diff_bench.py --cold-start-only   # 起動時間だけを確かめる（CI 向け）
+
+import argparse
+import copy
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ReportDX_xar_diff_bindings import build_binding_index
+from ReportDX_xar_diff_engine import (
+    build_excel_report,
+    build_markdown_report,
+    compare_indexes,
+    index_objects,
+    load_xar_from_bytes,
+)
+from ReportDX_xar_diff_rules import SeverityRules
+from ReportDX_xar_diff_stream import load_xar_streaming
+from ReportDX_xar_diff_text import canonical_text_diff
+from ReportDX_xar_diff_threeway import compare_three_way
+
+BENCH_FORMAT_VERSION = 2
+
+# オブジェクト種類の既定の比率
+DEFAULT_MIX: Dict[str, int] = {"text": 5, "rect": 3, "tableregion": 2}
+
+# 合成テンプレートの配置。A4 縦（pt）のページを縦に並べ、ページを枠に区切ってオブジェクトを1つずつ置く
+# （枠の中に収まる大きさにするので、元のテンプレートでは重ならない。移動の変更で隣と重なることはある）
+BENCH_PAGE_SIZE = (595.0, 842.0)
+BENCH_SLOT_SIZE = (110.0, 40.0)
+
+# 比較時、これより短い段階（秒）は誤差とみなして回帰判定しない
+REGRESSION_MIN_SECONDS = 0.01
+
+STAGES = (
+    "cold_start",
+    "load_xar_from_bytes",
+    "load_xar_streaming",
+    "index_objects",
+    "deep_diff",
+    "compare_counts",
+    "classify_severity",
+    "build_markdown_report",
+    "build_excel_report",
+    "text_diff",
+    "three_way",
+    "binding_index",
+    "binding_impact",
+)
+
+# binding_impact で問い合わせるデータセット参照の数
+BINDING_IMPACT_QUERIES = 100
+
+# cold_start で import するモジュール（.xar の読み込みと比較の経路）
+COLD_START_MODULES = ("ReportDX_xar_diff_engine", "ReportDX_xar_diff_stream")
+# 上の import で読み込まれてはいけないモジュール（Excel 出力・画面を使うときだけ読み込む）
+COLD_START_HEAVY_MODULES = ("pandas", "numpy", "xlsxwriter", "streamlit")
+# cold_start の既定の予算（秒、import にかかった時間。インタプリタ自体の起動は含めない）
+COLD_START_BUDGET = 0.1
+
+_COLD_START_SCRIPT = """
+import importlib, json, sys, time
+heavy, modules = sys.argv[1].split(","), sys.argv[2:]
+started = time.perf_counter()
+for name in modules:
+    importlib.import_module(name)
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "heavy": sorted(m for m in heavy if m in sys.modules)}))
+"""
+
+
+# --- 合成テンプレート ---------------------------------------------------------
+
+
+def _text(rnd: random.Random, chars: int) -> str:
+    return "".join(rnd.choice("あいうえおかきくけこABCDEFGH0123456789 ") for _ in range(chars))
+
+
+def _table(rnd: random.Random, depth: int, frames: int, chars: int, tag: str) -> Dict[str, Any]:
+    # テーブル1つ。depth > 1 なら先頭フレームの下にさらにテーブルを入れ子にする。
+    ds = f"DS.{tag}"
+    frame_list = []
+    for j in range(frames):
+        frame: Dict[str, Any] = {
+            "id": f"{tag}_f{j}",
+            "bind": f"{ds}.col{j}",
+            "width": float(rnd.randint(10, 80)),
+            "text": _text(rnd, chars),
+        }
+        if j == 0 and depth > 1:
+            frame["tables"] = [_table(rnd, depth - 1, frames, chars, f"{tag}_n")]
+        frame_list.append(frame)
+    return {
+        "column_count": frames,
+        "drive_dataset": {"ref": ds},
+        "details": [{"frames": frame_list}],
+    }
+
+
+def _object(
+    rnd: random.Random, i: int, kind: str, table_depth: int, frames: int, chars: int
+) -> Dict[str, Any]:
+    # i 番目の枠の中に置く（枠の左上から 0〜5 ずらし、右・下に 5 以上の隙間を残す）
+    (page_w, page_h), (slot_w, slot_h) = BENCH_PAGE_SIZE, BENCH_SLOT_SIZE
+    cols, rows = int(page_w // slot_w), int(page_h // slot_h)
+    page, slot = divmod(i, cols * rows)
+    row, col = divmod(slot, cols)
+    o: Dict[str, Any] = {
+        "id": f"obj{i:06d}",
+        "name": f"{kind}_{i}",
+        "impl_uri": f"oxa:{kind}",
+        "rect": {
+            "x": col * slot_w + rnd.randint(0, 5),
+            "y": page * page_h + row * slot_h + rnd.randint(0, 5),
+            "width": float(rnd.randint(10, int(slot_w) - 10)),
+            "height": float(rnd.randint(5, int(slot_h) - 10)),
+        },
+        "show": True,
+        "lock": False,
+        "enabled": True,
+    }
+    if kind == "text":
+        o["impl"] = {
+            "data": {"value": _text(rnd, chars)},
+            "font": {"name": "Gothic", "size": 10.5, "color": "#000000", "align": "left"},
+        }
+    elif kind == "rect":
+        o["impl"] = {
+            "stroke": {"size": 1, "color": "#000000"},
+            "fill": {"color": "#ffffff"},
+        }
+    else:
+        o["impl"] = {"tables": [_table(rnd, table_depth, frames, chars, f"T{i}")]}
+    return o
+
+
+def generate_template(
+    objects: int = 1000,
+    mix: Optional[Dict[str, int]] = None,
+    table_depth: int = 1,
+    frames_per_detail: int = 5,
+    string_chars: int = 20,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    # 合成テンプレート（.xat の JSON）を作る。mix は種類 -> 比率（text / rect / tableregion）。
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    objs = []
+    for i in range(objects):
+        kind = rnd.choices(kinds, weights)[0]
+        objs.append(_object(rnd, i, kind, table_depth, frames_per_detail, string_chars))
+    return {"version": "1.0", "name": "bench", "objects": objs}
+
+
+def _frames_of(o: Dict[str, Any]) -> List[Dict[str, Any]]:
+    tables = (o.get("impl") or {}).get("tables") or []
+    return tables[0]["details"][0]["frames"] if tables else []
+
+
+def mutate_template(
+    tpl: Dict[str, Any],
+    rate: float = 0.05,
+    string_chars: int = 20,
+    seed: int = 1,
+) -> Dict[str, Any]:
+    # tpl をコピーし、オブジェクトの rate の割合に変更を加えた新テンプレートを返す。
+    # 変更は位置・テキスト・フォントサイズ・バインド・フレーム挿入/削除のいずれか。
+    # さらに rate/4 の割合でオブジェクトを削除・追加する。
+    rnd = random.Random(seed)
+    new = copy.deepcopy(tpl)
+    objs = new["objects"]
+    for o in objs:
+        if rnd.random() >= rate:
+            continue
+        frames = _frames_of(o)
+        choice = rnd.randrange(4 if frames else 3)
+        if choice == 0:
+            o["rect"]["x"] += rnd.randint(1, 20)
+        elif choice == 1 and o["impl_uri"] == "oxa:text":
+            o["impl"]["data"]["value"] = _text(rnd, string_chars)
+        elif choice == 1:
+            o["rect"]["height"] += 1
+        elif choice == 2 and o["impl_uri"] == "oxa:text":
+            o["impl"]["font"]["size"] += 1
+        elif choice == 2:
+            o["name"] += "_v2"
+        else:
+            op = rnd.randrange(3)
+            if op == 0:
+                frames[rnd.randrange(len(frames))]["bind"] += "_renamed"
+            elif op == 1:
+                frames.insert(
+                    rnd.randrange(len(frames) + 1),
+                    {"id": f"{o['id']}_ins", "bind": "DS.Inserted", "width": 10.0},
+                )
+            else:
+                del frames[rnd.randrange(len(frames))]
+
+    n_struct = int(len(objs) * rate / 4)
+    for _ in range(min(n_struct, len(objs))):
+        del objs[rnd.randrange(len(objs))]
+    base = len(tpl["objects"])
+    for n in range(n_struct):
+        objs.append(_object(rnd, base + n, "text", 1, 1, string_chars))
+    return new
+
+
+def template_to_xar(tpl: Dict[str, Any]) -> bytes:
+    # テンプレートJSONを .xar（ZIP）のバイト列にする
+    with io.BytesIO() as buffer:
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("template.xat", json.dumps(tpl, ensure_ascii=False))
+        return buffer.getvalue()
+
+
+# --- 計測 ---------------------------------------------------------------------
+
+
+def _measure(
+    setup: Callable[[], Tuple[Any, ...]],
+    fn: Callable[..., Any],
+    repeat: int,
+    memory: bool,
+) -> Tuple[Any, Dict[str, Any]]:
+    # setup() の戻り値を引数に fn を repeat 回実行し、最小時間と（memory なら）メモリを返す。
+    # メモリはピーク（peak_bytes）と、戻り値が保持している分（retained_bytes / retained_blocks）。
+    # setup の実行時間は含めない。
+    best = float("inf")
+    result = None
+    for _ in range(max(repeat, 1)):
+        args = setup()
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    stage: Dict[str, Any] = {"seconds": round(best, 6)}
+    if memory:
+        args = setup()
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            kept = fn(*args)
+            current, peak = tracemalloc.get_traced_memory()
+            stage["peak_bytes"] = peak - base
+            stage["retained_bytes"] = current - base
+            stage["retained_blocks"] = sum(
+                s.count for s in tracemalloc.take_snapshot().statistics("filename")
+            )
+            del kept
+        finally:
+            tracemalloc.stop()
+    return result, stage
+
+
+def measure_cold_start(
+    modules: Tuple[str, ...] = COLD_START_MODULES, repeat: int = 3
+) -> Dict[str, Any]:
+    # 新しいインタプリタで modules を import する時間を repeat 回計り、最小値を返す。
+    # process_seconds はインタプリタの起動を含むプロセス全体、heavy_modules は読み込まれてしまった
+    # COLD_START_HEAVY_MODULES。
+    best = process_best = float("inf")
+    heavy: List[str] = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", _COLD_START_SCRIPT, ",".join(COLD_START_HEAVY_MODULES), *modules],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+        process_best = min(process_best, time.perf_counter() - started)
+        measured = json.loads(completed.stdout)
+        best = min(best, measured["seconds"])
+        heavy = measured["heavy"]
+    return {
+        "seconds": round(best, 6),
+        "process_seconds": round(process_best, 6),
+        "heavy_modules": heavy,
+    }
+
+
+def check_cold_start(stage: Dict[str, Any], budget: float) -> List[str]:
+    # cold_start の結果が予算を超えていれば、その理由を返す（空なら問題なし）
+    problems = []
+    if stage["seconds"] > budget:
+        problems.append(f"import に {stage['seconds']:.3f} 秒かかりました（予算 {budget:.3f} 秒）")
+    if stage["heavy_modules"]:
+        problems.append(f"重いモジュールを読み込んでいます: {', '.join(stage['heavy_modules'])}")
+    return problems
+
+
+def run_benchmark(
+    objects: int = 1000,
+    mix: Optional[Dict[str, int]] = None,
+    table_depth: int = 1,
+    frames_per_detail: int = 5,
+    string_chars: int = 20,
+    mutation_rate: float = 0.05,
+    seed: int = 0,
+    repeat: int = 1,
+    memory: bool = True,
+    diff_workers: Optional[int] = None,
+    progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    # 合成テンプレートで各段階を計測し、結果（JSON 化できる dict）を返す
+    params = {
+        "objects": objects,
+        "mix": mix or DEFAULT_MIX,
+        "table_depth": table_depth,
+        "frames_per_detail": frames_per_detail,
+        "string_chars": string_chars,
+        "mutation_rate": mutation_rate,
+        "seed": seed,
+        "repeat": repeat,
+        "diff_workers": diff_workers,
+    }
+    tpl_old = generate_template(objects, mix, table_depth, frames_per_detail, string_chars, seed)
+    tpl_new = mutate_template(tpl_old, mutation_rate, string_chars, seed + 1)
+    # 3者比較の B（同じ基準を別に変更したもの）
+    tpl_other = mutate_template(tpl_old, mutation_rate, string_chars, seed + 2)
+    xar_old = template_to_xar(tpl_old)
+    xar_new = template_to_xar(tpl_new)
+    del tpl_old, tpl_new
+
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    def record(name: str, stage: Dict[str, Any]) -> None:
+        stages[name] = stage
+        if progress is not None:
+            progress(name, stage)
+
+    record("cold_start", measure_cold_start(repeat=repeat))
+
+    (tpl_a, txt_a), stage = _measure(lambda: (xar_old,), load_xar_from_bytes, repeat, memory)
+    tpl_b, _txt_b = load_xar_from_bytes(xar_new)
+    record("load_xar_from_bytes", stage)
+
+    (meta_a, _idx, _stats), stage = _measure(lambda: (xar_old,), load_xar_streaming, repeat, memory)
+    meta_b, _idx, _stats = load_xar_streaming(xar_new)
+    record("load_xar_streaming", stage)
+
+    _idx, stage = _measure(lambda: (tpl_a,), index_objects, repeat, memory)
+    record("index_objects", stage)
+
+    # 部分木ハッシュはインデックスに溜まるので、毎回作り直したインデックスで比較する
+    result, stage = _measure(
+        lambda: (index_objects(tpl_a), index_objects(tpl_b)),
+        lambda a, b: compare_indexes(a, b, workers=diff_workers),
+        repeat,
+        memory,
+    )
+    # 重要度判定はパスごとにメモ化されるので、毎回新しいルールで全パスを判定する
+    paths = [d.segments for det in result["changed_detail"].values() for d in det["diffs"]]
+    if "retained_bytes" in stage and paths:
+        stage["retained_bytes_per_diff"] = round(stage["retained_bytes"] / len(paths), 1)
+    record("deep_diff", stage)
+
+    # 件数だけの比較（ビューアのサマリー用。差分一覧を作らない）
+    _counts, stage = _measure(
+        lambda: (index_objects(tpl_a), index_objects(tpl_b)),
+        lambda a, b: compare_indexes(a, b, workers=diff_workers, detail="counts"),
+        repeat,
+        memory,
+    )
+    record("compare_counts", stage)
+
+    _severities, stage = _measure(
+        lambda: (SeverityRules(),),
+        lambda rules: [rules.severity_of(p) for p in paths],
+        repeat,
+        memory,
+    )
+    record("classify_severity", stage)
+
+    report_args = (
+        result["added"],
+        result["removed"],
+        result["changed_rows"],
+        result["changed_detail"],
+    )
+    md, stage = _measure(
+        lambda: (result["old_name"], result["new_name"]) + report_args,
+        build_markdown_report,
+        repeat,
+        memory,
+    )
+    record("build_markdown_report", stage)
+
+    xlsx, stage = _measure(lambda: report_args, build_excel_report, repeat, memory)
+    record("build_excel_report", stage)
+
+    (text, text_stats), stage = _measure(
+        lambda: (meta_a, index_objects(tpl_a), meta_b, index_objects(tpl_b)),
+        canonical_text_diff,
+        repeat,
+        memory,
+    )
+    record("text_diff", stage)
+
+    # 基準 = 旧、A = 新、B = 別の変更。比べる目安は deep_diff（基準 → A の2者比較1回）
+    three_way, stage = _measure(
+        lambda: (index_objects(tpl_a), index_objects(tpl_b), index_objects(tpl_other)),
+        compare_three_way,
+        repeat,
+        memory,
+    )
+    record("three_way", stage)
+
+    # 旧・新をまとめた逆引き索引（新は旧と同じオブジェクトの抽出結果を使う）と、データセット単位の問い合わせ
+    bindings, stage = _measure(
+        lambda: ({"old": index_objects(tpl_a), "new": index_objects(tpl_b)},),
+        build_binding_index,
+        repeat,
+        memory,
+    )
+    record("binding_index", stage)
+    datasets = [r for r in bindings.references() if bindings.kind_of(r) == "dataset"]
+    queries = datasets[:: max(len(datasets) // BINDING_IMPACT_QUERIES, 1)][:BINDING_IMPACT_QUERIES]
+    impacts, stage = _measure(
+        lambda: (queries,), lambda refs: [bindings.impact(r) for r in refs], repeat, memory
+    )
+    record("binding_impact", stage)
+
+    return {
+        "format": BENCH_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "sizes": {
+            "xar_bytes_old": len(xar_old),
+            "xar_bytes_new": len(xar_new),
+            "xat_chars_old": len(txt_a),
+            "objects_old": len(tpl_a.get("objects", [])),
+            "objects_new": len(tpl_b.get("objects", [])),
+            "added": len(result["added"]),
+            "removed": len(result["removed"]),
+            "changed": len(result["changed_rows"]),
+            "overlaps": len(result["overlaps"]),
+            "diff_entries": len(paths),
+            "markdown_chars": len(md),
+            "excel_bytes": len(xlsx),
+            "text_diff_lines": text_stats["lines"],
+            "three_way_objects": len(three_way["rows"]),
+            "three_way_conflicts": sum(1 for r in three_way["rows"] if r["status"] == "conflict"),
+            "binding_references": len(bindings.references()),
+            "binding_impact_queries": len(queries),
+            "binding_impact_sites": sum(len(sites) for sites in impacts),
+        },
+        "stages": stages,
+        "total_seconds": round(sum(s["seconds"] for s in stages.values()), 6),
+    }
+
+
+def compare_benchmarks(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 1.25
+) -> List[Dict[str, Any]]:
+    # 段階ごとに前回結果と比較した行を返す（regression=True はしきい値を超えて遅くなった段階）
+    rows = []
+    for name in STAGES:
+        base = baseline.get("stages", {}).get(name)
+        cur = current.get("stages", {}).get(name)
+        if base is None or cur is None:
+            continue
+        ratio = cur["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        rows.append(
+            {
+                "stage": name,
+                "baseline_seconds": base["seconds"],
+                "current_seconds": cur["seconds"],
+                "ratio": round(ratio, 3),
+                "baseline_peak_bytes": base.get("peak_bytes"),
+                "current_peak_bytes": cur.get("peak_bytes"),
+                "baseline_retained_bytes": base.get("retained_bytes"),
+                "current_retained_bytes": cur.get("retained_bytes"),
+                "regression": ratio > threshold
+                and cur["seconds"] - base["seconds"] > REGRESSION_MIN_SECONDS,
+            }
+        )
+    return rows
+
+
+# --- エントリーポイント --------------------------------------------------------
+
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    # "text=5,rect=3,tableregion=2" 形式
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        kind, _sep, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"未知のオブジェクト種類です: {kind}")
+        mix[kind] = int(weight or 1)
+    if not mix or not any(mix.values()):
+        raise argparse.ArgumentTypeError("比率が指定されていません。")
+    return mix
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="合成 .xar で帳票DX テンプレート差分の処理段階ごとの時間・メモリを計測します。"
+    )
+    parser.add_argument("--objects", type=int, default=1000, help="オブジェクト数")
+    parser.add_argument(
+        "--mix", type=_parse_mix, default=DEFAULT_MIX,
+        help="種類ごとの比率（例: text=5,rect=3,tableregion=2）",
+    )
+    parser.add_argument("--table-depth", type=int, default=1, help="テーブルの入れ子の深さ")
+    parser.add_argument("--frames", type=int, default=5, help="明細あたりのフレーム数")
+    parser.add_argument("--string-chars", type=int, default=20, help="テキスト値の文字数")
+    parser.add_argument(
+        "--mutation-rate", type=float, default=0.05, help="旧→新で変更するオブジェクトの割合"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--repeat", type=int, default=3, help="各段階の繰り返し回数（最小値を採用）")
+    parser.add_argument(
+        "--diff-workers", type=int, default=None,
+        help="deep_diff 段階の並列プロセス数（既定: 直列）",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="ピークメモリを計測しない（tracemalloc の実行を省く）"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, default=Path("xar_diff_bench.json"), help="結果 JSON の出力先"
+    )
+    parser.add_argument("--baseline", type=Path, default=None, help="比較する前回の結果 JSON")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25,
+        help="回帰とみなす所要時間の比（前回比、既定 1.25）",
+    )
+    parser.add_argument(
+        "--cold-start-budget", type=float, default=COLD_START_BUDGET,
+        help=f"エンジンの import にかけてよい秒数（既定 {COLD_START_BUDGET}、超えたら終了コード 1）",
+    )
+    parser.add_argument(
+        "--cold-start-only", action="store_true",
+        help="起動時間（cold_start）だけを計測・判定する（結果 JSON は書かない）",
+    )
+    parser.add_argument(
+        "--save-xar", type=Path, default=None,
+        help="生成した旧/新 .xar を保存するディレクトリ（ビューアでの確認用）",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+
+    if args.cold_start_only:
+        stage = measure_cold_start(repeat=args.repeat)
+        problems = check_cold_start(stage, args.cold_start_budget)
+        print(
+            f"{'cold_start':24s} {stage['seconds']:9.3f} s"
+            f"（プロセス全体 {stage['process_seconds']:.3f} s）"
+        )
+        for problem in problems:
+            print(f"cold_start: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+
+    if args.save_xar:
+        tpl_old = generate_template(
+            args.objects, args.mix, args.table_depth, args.frames, args.string_chars, args.seed
+        )
+        tpl_new = mutate_template(tpl_old, args.mutation_rate, args.string_chars, args.seed + 1)
+        args.save_xar.mkdir(parents=True, exist_ok=True)
+        (args.save_xar / "bench_old.xar").write_bytes(template_to_xar(tpl_old))
+        (args.save_xar / "bench_new.xar").write_bytes(template_to_xar(tpl_new))
+
+    def progress(name: str, stage: Dict[str, Any]) -> None:
+        peak = stage.get("peak_bytes")
+        mem = ""
+        if peak is not None:
+            mem = (
+                f"  peak {peak / 1e6:9.1f} MB  retained {stage['retained_bytes'] / 1e6:9.1f} MB"
+                f" / {stage['retained_blocks']:,} blocks"
+            )
+        if "retained_bytes_per_diff" in stage:
+            mem += f" ({stage['retained_bytes_per_diff']:.0f} B/差分)"
+        print(f"{name:24s} {stage['seconds']:9.3f} s{mem}")
+
+    result = run_benchmark(
+        objects=args.objects,
+        mix=args.mix,
+        table_depth=args.table_depth,
+        frames_per_detail=args.frames,
+        string_chars=args.string_chars,
+        mutation_rate=args.mutation_rate,
+        seed=args.seed,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        diff_workers=args.diff_workers,
+        progress=progress,
+    )
+    sizes = result["sizes"]
+    print(
+        f"objects={sizes['objects_old']} xar={sizes['xar_bytes_old']:,} bytes "
+        f"追加={sizes['added']} 削除={sizes['removed']} 変更={sizes['changed']} "
+        f"差分={sizes['diff_entries']} 合計={result['total_seconds']:.3f} s"
+    )
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("format") != result["format"]:
+            print("警告: 前回結果と合成テンプレートの形式が異なります。", file=sys.stderr)
+        elif baseline.get("params") != result["params"]:
+            print("警告: 前回結果と計測条件が異なります。", file=sys.stderr)
+        result["comparison"] = compare_benchmarks(baseline, result, args.threshold)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with args.output.open("w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    problems = check_cold_start(result["stages"]["cold_start"], args.cold_start_budget)
+    for problem in problems:
+        print(f"cold_start: {problem}", file=sys.stderr)
+    regressions = [r for r in result.get("comparison", []) if r["regression"]]
+    for r in result.get("comparison", []):
+        mark = " ← 回帰" if r["regression"] else ""
+        print(
+            f"{r['stage']:24s} {r['baseline_seconds']:9.3f} → {r['current_seconds']:9.3f} s "
+            f"(x{r['ratio']}){mark}"
+        )
+    return 1 if regressions or problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
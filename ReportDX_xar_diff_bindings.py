@@ -0,0 +1,300 @@
+# 帳票DX テンプレート差分 データバインドの逆引き索引
+#
+# オブジェクトの木全体から、データセット・フィールドへの参照（キー名が *bind* / *dataset* の値の文字列）を集め、
+# 参照 -> (テンプレート, オブジェクトID, パス) の逆引き索引を作る。複数のテンプレートを1つの索引に入れられる。
+#   - 参照の抽出はオブジェクトハッシュごとに覚えておき、同じオブジェクトは（別のテンプレートにあっても）辿り直さない。
+#     読み込み直したテンプレートを入れ直すと、ハッシュが変わったオブジェクトだけ辿る
+#   - 問い合わせは参照のソート済み一覧を二分探索する（"DS.Order" なら "DS.Order" と配下の "DS.Order.amount" など）
+#   - フィールド参照（"DS.Order.amount"）のデータセットは、索引にあるデータセット参照（drive_dataset.ref など）の
+#     うち "." 区切りで最長の前方一致。なければ最後の "." より前
+# 差分結果をデータセットごとにまとめる summarize_by_dataset も、JSON を辿り直さずに索引から引く。
+
+import bisect
+import fnmatch
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from ReportDX_xar_diff_engine import ObjectIndex, as_object_index
+from ReportDX_xar_diff_entry import Segments, intern_path, render_path
+from ReportDX_xar_diff_rules import SEVERITY_COUNT_KEYS
+
+# 値をデータバインドの参照とみなすキー名（大文字小文字は区別しない）。先に一致したものの種類になる
+BINDING_KEY_PATTERNS: Tuple[Tuple[str, str], ...] = (
+    ("*dataset*", "dataset"),
+    ("*bind*", "field"),
+)
+
+# オブジェクトハッシュごとに覚えておく抽出結果の上限（超えたら捨てて作り直す）
+BINDING_MEMO_MAX = 1 << 18
+
+# 参照1件: (参照, パスのセグメント, 種類 "dataset" / "field")
+Binding = Tuple[str, Segments, str]
+
+# 参照されている場所: (テンプレート, オブジェクトID, パスのセグメント)
+BindingSite = Tuple[str, str, Segments]
+
+
+@lru_cache(maxsize=4096)
+def binding_key_kind(key: str) -> Optional[str]:
+    # キー名がデータバインドのキーならその種類、そうでなければ None
+    lowered = key.lower()
+    for pattern, kind in BINDING_KEY_PATTERNS:
+        if fnmatch.fnmatchcase(lowered, pattern):
+            return kind
+    return None
+
+
+def object_bindings(o: Any, path: Segments = ("object",)) -> List[Binding]:
+    # オブジェクトの木全体からデータバインドの参照を集める（パス順）。
+    # バインドのキーの値が dict/list なら、その中の文字列も同じ種類の参照とする（drive_dataset.ref など）。
+    # 再帰せずにスタックで辿る。
+    found: List[Binding] = []
+    stack: List[Tuple[Any, Segments, Optional[str]]] = [(o, path, None)]
+    while stack:
+        node, segments, kind = stack.pop()
+        if isinstance(node, dict):
+            # 内側のキーがバインドのキーならその種類、そうでなければ外側の種類を引き継ぐ
+            children = [
+                (v, (*segments, k), (binding_key_kind(k) if isinstance(k, str) else None) or kind)
+                for k, v in node.items()
+            ]
+        elif isinstance(node, list):
+            children = [(v, (*segments, i), kind) for i, v in enumerate(node)]
+        else:
+            if kind is not None and isinstance(node, str) and node:
+                found.append((node, intern_path(segments), kind))
+            continue
+        stack.extend(reversed(children))
+    return found
+
+
+class BindingIndex:
+    # データバインドの逆引き索引。add_template() でテンプレート（ObjectIndex）を入れ、impact() で引く。
+    # memo（オブジェクトハッシュ -> 参照）を渡すと、複数の索引で抽出結果を共有する。
+
+    def __init__(self, memo: Optional[Dict[str, List[Binding]]] = None) -> None:
+        self._sites: Dict[str, Set[BindingSite]] = {}
+        self._kinds: Dict[str, str] = {}
+        # (テンプレート, オブジェクトID) -> (オブジェクトハッシュ, 参照)
+        self._objects: Dict[Tuple[str, str], Tuple[str, List[Binding]]] = {}
+        self._templates: Dict[str, Set[str]] = {}
+        self._memo: Dict[str, List[Binding]] = memo if memo is not None else {}
+        self._sorted: Optional[List[str]] = None
+        self._datasets: Optional[Set[str]] = None
+
+    def add_template(self, name: str, idx: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        # テンプレート name の参照を入れる（同じ名前があれば置き換える）。
+        # 戻り値: {objects, scanned（辿ったオブジェクト数）, references}
+        idx: ObjectIndex = as_object_index(idx)
+        previous = self._templates.get(name, set())
+        for oid in previous - idx.keys():
+            self._drop_object(name, oid)
+        if len(self._memo) > BINDING_MEMO_MAX:
+            self._memo.clear()
+        scanned = 0
+        for oid, o in idx.items():
+            digest = idx.hashes[oid]
+            known = self._objects.get((name, oid))
+            if known is not None and known[0] == digest:
+                continue
+            if known is not None:
+                self._drop_object(name, oid)
+            bindings = self._memo.get(digest)
+            if bindings is None:
+                bindings = object_bindings(o)
+                self._memo[digest] = bindings
+                scanned += 1
+            self._objects[(name, oid)] = (digest, bindings)
+            for ref, segments, kind in bindings:
+                self._sites.setdefault(ref, set()).add((name, oid, segments))
+                if self._kinds.get(ref) != "dataset":
+                    self._kinds[ref] = kind
+            if bindings:
+                self._invalidate()
+        self._templates[name] = set(idx.keys())
+        return {
+            "objects": len(idx),
+            "scanned": scanned,
+            "references": sum(len(self._objects[(name, oid)][1]) for oid in idx),
+        }
+
+    def remove_template(self, name: str) -> None:
+        for oid in self._templates.pop(name, set()):
+            self._drop_object(name, oid)
+
+    def _drop_object(self, name: str, oid: str) -> None:
+        _digest, bindings = self._objects.pop((name, oid))
+        for ref, segments, _kind in bindings:
+            sites = self._sites.get(ref)
+            if sites is None:
+                continue
+            sites.discard((name, oid, segments))
+            if not sites:
+                del self._sites[ref]
+                del self._kinds[ref]
+        if bindings:
+            self._invalidate()
+
+    def _invalidate(self) -> None:
+        self._sorted = None
+        self._datasets = None
+
+    def _sorted_references(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self._sites)
+        return self._sorted
+
+    @property
+    def templates(self) -> List[str]:
+        return sorted(self._templates)
+
+    def references(self, prefix: str = "") -> List[str]:
+        # prefix で始まる参照（ソート済み）
+        refs = self._sorted_references()
+        start = bisect.bisect_left(refs, prefix)
+        end = bisect.bisect_left(refs, prefix + "\U0010ffff") if prefix else len(refs)
+        return refs[start:end]
+
+    def kind_of(self, ref: str) -> Optional[str]:
+        return self._kinds.get(ref)
+
+    def dataset_of(self, ref: str) -> str:
+        # 参照が属するデータセット（データセット参照ならそれ自身）
+        if self._datasets is None:
+            self._datasets = {r for r, kind in self._kinds.items() if kind == "dataset"}
+        if ref in self._datasets:
+            return ref
+        head = ref
+        while "." in head:
+            head = head.rsplit(".", 1)[0]
+            if head in self._datasets:
+                return head
+        return ref.rsplit(".", 1)[0] if "." in ref else ref
+
+    def impact(self, ref: str, templates: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        # ref（データセットまたはフィールド）と、その配下（ref + "." で始まる参照）を参照している場所。
+        # templates を渡すとそのテンプレートだけ。テンプレート・ID・パスの順に並べて返す。
+        wanted = set(templates) if templates is not None else None
+        sites = []
+        for found in self.references(ref):
+            if found != ref and not found.startswith(ref + "."):
+                continue
+            for template, oid, segments in self._sites[found]:
+                if wanted is None or template in wanted:
+                    sites.append((template, oid, segments, found))
+        sites.sort(key=lambda s: (s[0], s[1], render_path(s[2])))
+        return [
+            {
+                "template": template,
+                "id": oid,
+                "path": render_path(segments),
+                "reference": found,
+                "kind": self._kinds[found],
+                "dataset": self.dataset_of(found),
+            }
+            for template, oid, segments, found in sites
+        ]
+
+    def bindings_of(self, template: str, oid: str) -> List[Binding]:
+        # オブジェクトの参照（索引にないオブジェクトは空）
+        known = self._objects.get((template, oid))
+        return known[1] if known is not None else []
+
+
+def build_binding_index(templates: Dict[str, Dict[str, Dict[str, Any]]]) -> BindingIndex:
+    # {テンプレート名: ObjectIndex} をまとめて1つの索引にする
+    index = BindingIndex()
+    for name, idx in templates.items():
+        index.add_template(name, idx)
+    return index
+
+
+def summarize_by_dataset(
+    result: Dict[str, Any],
+    bindings: BindingIndex,
+    old_template: str,
+    new_template: str,
+) -> List[Dict[str, Any]]:
+    # 差分結果（compare_indexes）を、オブジェクトが参照しているデータセットごとにまとめる。
+    # bindings には旧テンプレートを old_template、新テンプレートを new_template の名前で入れておく。
+    # 行: {dataset, added, removed, changed, binding_changes, 重要度別件数, ids, changes}
+    #   changes は参照そのものが変わった箇所 {id, path, old, new}（旧・新どちらかのデータセットの行に入る）
+    groups: Dict[str, Dict[str, Any]] = {}
+
+    def group(dataset: str) -> Dict[str, Any]:
+        g = groups.get(dataset)
+        if g is None:
+            g = groups[dataset] = {
+                "dataset": dataset,
+                "added": 0,
+                "removed": 0,
+                "changed": 0,
+                "binding_changes": 0,
+                **{key: 0 for key in SEVERITY_COUNT_KEYS.values()},
+                "ids": [],
+                "changes": [],
+            }
+        return g
+
+    for side, template, objects in (
+        ("added", new_template, result["added"]),
+        ("removed", old_template, result["removed"]),
+    ):
+        for o in objects:
+            refs = bindings.bindings_of(template, o["id"])
+            for dataset in {bindings.dataset_of(ref) for ref, _s, _k in refs}:
+                g = group(dataset)
+                g[side] += 1
+                g["ids"].append(o["id"])
+
+    for row in result["changed_rows"]:
+        oid = row["id"]
+        old_id = row.get("old_id", oid)
+        old_refs = bindings.bindings_of(old_template, old_id)
+        new_refs = bindings.bindings_of(new_template, oid)
+        datasets = {bindings.dataset_of(ref) for ref, _s, _k in (*old_refs, *new_refs)}
+        for dataset in datasets:
+            g = group(dataset)
+            g["changed"] += 1
+            g["ids"].append(oid)
+            for key in SEVERITY_COUNT_KEYS.values():
+                g[key] += row[key]
+        for change in _binding_changes(oid, old_refs, new_refs):
+            refs = (change["old"], change["new"])
+            for dataset in {bindings.dataset_of(r) for r in refs if r is not None}:
+                g = group(dataset)
+                g["binding_changes"] += 1
+                g["changes"].append(change)
+
+    return sorted(
+        groups.values(), key=lambda g: (-g["binding_changes"], -g["changed"], g["dataset"])
+    )
+
+
+def _binding_changes(
+    oid: str, old_refs: List[Binding], new_refs: List[Binding]
+) -> List[Dict[str, Any]]:
+    # 参照の増減（件数込み）を変更とする。リストの挿入・削除で位置がずれただけの参照は変更にしない。
+    # 同じパスで参照が入れ替わったものは1件（old -> new）にまとめる。
+    gone = Counter(ref for ref, _s, _k in old_refs) - Counter(ref for ref, _s, _k in new_refs)
+    came = Counter(ref for ref, _s, _k in new_refs) - Counter(ref for ref, _s, _k in old_refs)
+    old_at: Dict[Segments, str] = {}
+    for ref, segments, _k in old_refs:
+        if gone[ref] > 0:
+            gone[ref] -= 1
+            old_at[segments] = ref
+    new_at: Dict[Segments, str] = {}
+    for ref, segments, _k in new_refs:
+        if came[ref] > 0:
+            came[ref] -= 1
+            new_at[segments] = ref
+    return [
+        {
+            "id": oid,
+            "path": render_path(segments),
+            "old": old_at.get(segments),
+            "new": new_at.get(segments),
+        }
+        for segments in sorted(old_at.keys() | new_at.keys(), key=render_path)
+    ]
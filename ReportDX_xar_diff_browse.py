@@ -0,0 +1,107 @@
+# 帳票DX テンプレート差分 差分ブラウザの絞り込み・ページ分割
+#
+# ビューアの「変更」タブで、変更オブジェクト一覧と差分一覧を条件で絞り込み、1ページ分だけを取り出す。
+# 数千件の差分があるオブジェクト（tableregion など）でも、画面へ送るのは表示するページ分だけにする。
+# Streamlit に依存しない（条件の入力とページ番号の管理はビューア側）。
+
+import json
+from typing import Any, Collection, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from ReportDX_xar_diff_entry import DiffEntry, parse_path
+from ReportDX_xar_diff_rules import SEVERITY_COUNT_KEYS
+
+# 1ページの件数
+DIFF_PAGE_SIZE = 50
+ROW_PAGE_SIZE = 100
+
+# オブジェクト（の一部）の JSON を表示する最大文字数
+OBJECT_JSON_MAX_CHARS = 100_000
+
+T = TypeVar("T")
+
+
+def page_count(total: int, page_size: int) -> int:
+    # ページ数（0件でも1ページ）
+    return max(1, -(-total // page_size))
+
+
+def page_slice(items: Sequence[T], page: int, page_size: int) -> Sequence[T]:
+    # 1始まりの page ページ目（範囲外なら最終ページ）
+    page = min(max(page, 1), page_count(len(items), page_size))
+    start = (page - 1) * page_size
+    return items[start : start + page_size]
+
+
+def match_rows(
+    rows: Sequence[Dict[str, Any]],
+    query: str = "",
+    kinds: Optional[Collection[str]] = None,
+    severities: Optional[Collection[int]] = None,
+) -> List[Dict[str, Any]]:
+    # 変更オブジェクト一覧の絞り込み。
+    # query は ID・旧ID・旧/新 name の部分一致（大文字小文字を区別しない）、
+    # kinds は対象の kind、severities はその重要度の差分を1件以上含むオブジェクト（空ならすべて）。
+    query = query.strip().lower()
+    out = []
+    for row in rows:
+        if kinds and row.get("kind") not in kinds:
+            continue
+        if severities and not any(row[SEVERITY_COUNT_KEYS[s]] for s in severities):
+            continue
+        if query and not any(
+            query in str(row.get(k) or "").lower() for k in ("id", "old_id", "name_old", "name_new")
+        ):
+            continue
+        out.append(row)
+    return out
+
+
+def _normalize_prefix(prefix: str) -> str:
+    # "impl.tables[0]" のように object. を省いた指定も受け付ける
+    prefix = prefix.strip()
+    if prefix and prefix != "object" and not prefix.startswith(("object.", "object[")):
+        prefix = "object." + prefix
+    return prefix
+
+
+def filter_diffs(
+    diffs: Sequence[DiffEntry],
+    severities: Optional[Collection[int]] = None,
+    ops: Optional[Collection[str]] = None,
+    path_prefix: str = "",
+) -> List[DiffEntry]:
+    # 差分一覧の絞り込み（重要度・種別・パスの前方一致。空の条件は絞り込まない）
+    prefix = _normalize_prefix(path_prefix)
+    return [
+        d
+        for d in diffs
+        if (not severities or d.severity in severities)
+        and (not ops or d.op in ops)
+        and (not prefix or d.path.startswith(prefix))
+    ]
+
+
+def subtree_at(obj: Any, path_prefix: str) -> Tuple[str, Any]:
+    # オブジェクトのうちパス（path_prefix、object. は省略可）が指す部分と、その部分のパス。
+    # 辿れない場合は、辿れたところまでの部分を返す。
+    segments = parse_path(_normalize_prefix(path_prefix))[1:]
+    node = obj
+    reached = ["object"]
+    for seg in segments:
+        if isinstance(node, dict) and isinstance(seg, str) and seg in node:
+            node = node[seg]
+            reached.append(f".{seg}")
+        elif isinstance(node, list) and isinstance(seg, int) and seg < len(node):
+            node = node[seg]
+            reached.append(f"[{seg}]")
+        else:
+            break
+    return "".join(reached), node
+
+
+def json_preview(value: Any, max_chars: int = OBJECT_JSON_MAX_CHARS) -> Tuple[str, bool]:
+    # 表示用の JSON テキスト（max_chars で打ち切り）と、打ち切ったかどうか
+    text = json.dumps(value, ensure_ascii=False, indent=2, sort_keys=True, default=str)
+    if len(text) <= max_chars:
+        return text, False
+    return text[:max_chars], True
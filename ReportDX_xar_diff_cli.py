@@ -0,0 +1,514 @@
+# 帳票DX テンプレート差分 バッチCLI
+#
+# Streamlit を起動せずに多数の旧/新 .xar ペアを比較し、MD / XLSX / JSON レポートを書き出す。
+#
+#   python ReportDX_xar_diff_cli.py old1.xar new1.xar old2.xar new2.xar -o reports
+#   python ReportDX_xar_diff_cli.py --manifest pairs.csv -o reports --formats md,json
+#   python ReportDX_xar_diff_cli.py --library old_lib.zip new_lib/ -o reports --library-reports
+#   python ReportDX_xar_diff_cli.py --brief old1.xar new1.xar   # 差分の有無だけ（diff -q 相当）
+#   python ReportDX_xar_diff_cli.py --three-way base.xar a.xar b.xar -o reports   # 3者比較
+#   python ReportDX_xar_diff_cli.py --impact DS.Order lib/ extra.xar   # データセット・フィールドの参照箇所
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ReportDX_xar_diff_engine import (
+    DEFAULT_LIST_KEYS,
+    REPORT_FORMATS,
+    ObjectIndex,
+    compare_indexes,
+    indexes_differ,
+    summarize_result,
+    write_reports,
+)
+from ReportDX_xar_diff_bindings import BindingIndex
+from ReportDX_xar_diff_layout import MAX_NEW_OVERLAPS
+from ReportDX_xar_diff_library import (
+    STATUS_LABELS,
+    compare_libraries,
+    library_from_files,
+    list_library,
+    read_entry,
+    summarize_library,
+    write_library_reports,
+)
+from ReportDX_xar_diff_rules import RULES_ENV_VAR, load_severity_rules, set_severity_rules
+from ReportDX_xar_diff_stream import load_xar_streaming
+from ReportDX_xar_diff_threeway import (
+    OBJECT_STATUS_LABELS,
+    compare_three_way,
+    summarize_three_way,
+    write_three_way_reports,
+)
+from ReportDX_xar_diff_values import DEFAULT_REPORT_MAX_VALUE_CHARS
+
+# プロセスごとに保持するインデックス数（同じ基準テンプレートを何度も比較する場合に再利用）
+INDEX_CACHE_SIZE = 4
+
+_index_cache: "OrderedDict[Tuple[str, int, int], ObjectIndex]" = OrderedDict()
+
+
+# --- ペア一覧の組み立て -------------------------------------------------------
+
+
+def read_manifest(path: Path) -> List[Dict[str, str]]:
+    # マニフェストを読み込む。
+    # JSON: [{"old": ..., "new": ..., "name": ...}, ...]
+    # CSV/TSV: old,new[,name] の行（# で始まる行は無視）
+    # 相対パスはマニフェストのあるディレクトリ基準で解決する。
+    base = path.parent
+    if path.suffix.lower() == ".json":
+        entries = json.loads(path.read_text(encoding="utf-8"))
+    else:
+        delimiter = "\t" if path.suffix.lower() == ".tsv" else ","
+        entries = []
+        with path.open(encoding="utf-8", newline="") as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                if not row or row[0].strip().startswith("#"):
+                    continue
+                if len(row) < 2:
+                    raise ValueError(f"マニフェストの行に old/new がありません: {row}")
+                entry = {"old": row[0].strip(), "new": row[1].strip()}
+                if len(row) > 2 and row[2].strip():
+                    entry["name"] = row[2].strip()
+                entries.append(entry)
+
+    pairs = []
+    for e in entries:
+        pair = {"old": str(base / e["old"]), "new": str(base / e["new"])}
+        if e.get("name"):
+            pair["name"] = e["name"]
+        pairs.append(pair)
+    return pairs
+
+
+def assign_pair_names(pairs: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # 出力ディレクトリ名に使うペア名を決める（未指定なら新テンプレートのファイル名、重複は連番）
+    seen: Dict[str, int] = {}
+    named = []
+    for p in pairs:
+        name = p.get("name") or Path(p["new"]).stem
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        named.append(dict(p, name=name))
+    return named
+
+
+# --- 1ペア分の処理（ワーカープロセスで実行） -----------------------------------
+
+
+def load_index(path: str) -> ObjectIndex:
+    # .xar を読み込んでインデックス化する。パス・更新時刻・サイズが同じなら前回の結果を使う。
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    idx = _index_cache.get(key)
+    if idx is None:
+        _meta, idx, _stats = load_xar_streaming(path)
+        _index_cache[key] = idx
+        if len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    else:
+        _index_cache.move_to_end(key)
+    return idx
+
+
+def run_pair(task: Dict[str, Any]) -> Dict[str, Any]:
+    # 1ペアを比較してレポートを書き出し、集計行を返す
+    out_dir = Path(task["out_dir"]) / task["name"]
+    row: Dict[str, Any] = {"name": task["name"], "old": task["old"], "new": task["new"]}
+    try:
+        if task["brief"]:
+            # 差分の有無だけ。最初の差分で打ち切り、レポートは書かない
+            row["differs"] = indexes_differ(
+                load_index(task["old"]),
+                load_index(task["new"]),
+                list_mode=task["list_mode"],
+                list_keys=task["list_keys"],
+            )
+            row["status"] = "ok"
+            return row
+
+        result = compare_indexes(
+            load_index(task["old"]),
+            load_index(task["new"]),
+            old_name=Path(task["old"]).name,
+            new_name=Path(task["new"]).name,
+            list_mode=task["list_mode"],
+            list_keys=task["list_keys"],
+            workers=task["diff_workers"],
+            match_reid=task["match_reid"],
+            analyze_layout=task["analyze_layout"],
+            max_diffs_per_object=task["max_diffs"],
+            max_overlaps=task["max_overlaps"],
+        )
+
+        write_reports(result, out_dir, task["formats"], task["max_value_chars"])
+        row.update(summarize_result(result))
+        row["status"] = "ok"
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def run_pairs(
+    pairs: List[Dict[str, str]],
+    out_dir: Path,
+    formats: List[str],
+    workers: Optional[int] = None,
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    diff_workers: Optional[int] = None,
+    match_reid: bool = True,
+    analyze_layout: bool = True,
+    max_diffs: Optional[int] = None,
+    brief: bool = False,
+    max_overlaps: Optional[int] = MAX_NEW_OVERLAPS,
+) -> List[Dict[str, Any]]:
+    # 全ペアをプロセスプールで処理する（結果は入力順）。
+    # diff_workers > 1 なら、1ペア内の大きなテンプレートもオブジェクト単位で並列比較する。
+    # max_diffs はレポートに載せるオブジェクトあたりの差分の上限（件数の集計はすべて数える）。
+    # max_overlaps は新たな重なりの検出を打ち切る組数（None なら無制限）。
+    # brief なら差分の有無（differs）だけを調べ、レポートは書かない。
+    tasks = [
+        dict(
+            p,
+            out_dir=str(out_dir),
+            formats=list(formats),
+            list_mode=list_mode,
+            list_keys=tuple(list_keys),
+            max_value_chars=max_value_chars,
+            diff_workers=diff_workers,
+            match_reid=match_reid,
+            analyze_layout=analyze_layout,
+            max_diffs=max_diffs,
+            max_overlaps=max_overlaps,
+            brief=brief,
+        )
+        for p in assign_pair_names(pairs)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        return [run_pair(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        return list(pool.map(run_pair, tasks))
+
+
+# --- エントリーポイント --------------------------------------------------------
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="帳票DX テンプレート（.xar）の差分レポートを一括生成します。"
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="旧/新 .xar を交互に並べたペア列（old1 new1 old2 new2 ...）",
+    )
+    parser.add_argument(
+        "-m", "--manifest", type=Path, help="ペア一覧（.json / .csv / .tsv）"
+    )
+    parser.add_argument(
+        "-o", "--out-dir", type=Path, default=Path("xar_diff_reports"),
+        help="レポート出力先ディレクトリ（ペアごとにサブディレクトリを作成）",
+    )
+    parser.add_argument(
+        "-f", "--formats", default="md,xlsx,json",
+        help="出力形式をカンマ区切りで指定（md,xlsx,json）",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None,
+        help="並列プロセス数（既定: CPUコア数）",
+    )
+    parser.add_argument(
+        "--severity-rules", type=Path, default=None,
+        help="重要度ルールファイル（.json / .toml、形式は severity_rules.sample.json を参照）",
+    )
+    parser.add_argument(
+        "--list-mode", choices=("align", "index"), default="align",
+        help="リストの比較方法（align: キー/内容で対応付け、index: 添字同士）",
+    )
+    parser.add_argument(
+        "--list-keys", default=",".join(DEFAULT_LIST_KEYS),
+        help="リスト要素の対応付けに使うキー（カンマ区切り、先に見つかったものを使用）",
+    )
+    parser.add_argument(
+        "--diff-workers", type=int, default=None,
+        help="1ペア内のオブジェクト比較の並列プロセス数（大きなテンプレート向け、既定: 並列化しない）",
+    )
+    parser.add_argument(
+        "--no-reid", action="store_true",
+        help="ID が変わったオブジェクトを対応付けず、削除 + 追加として扱う",
+    )
+    parser.add_argument(
+        "--no-layout", action="store_true",
+        help="まとめて移動・サイズ変更された領域の集約と、新たな重なりの検出を行わない",
+    )
+    parser.add_argument(
+        "--max-diffs", type=int, default=None,
+        help="レポートに載せるオブジェクトあたりの差分の上限（件数の集計は省いた分も含む、既定: 無制限）",
+    )
+    parser.add_argument(
+        "--max-overlaps", type=int, default=MAX_NEW_OVERLAPS,
+        help=f"新たな重なりの検出を打ち切る組数（0 で無制限、既定: {MAX_NEW_OVERLAPS}）",
+    )
+    parser.add_argument(
+        "--brief", action="store_true",
+        help="差分の有無だけを調べる（最初の差分で打ち切り、レポートは書かない。差分ありのペアがあれば終了コード 1）",
+    )
+    parser.add_argument(
+        "--max-value-chars", type=int, default=DEFAULT_REPORT_MAX_VALUE_CHARS,
+        help="MD / XLSX レポートに書く旧値・新値1件あたりの最大文字数（0 で無制限）",
+    )
+    parser.add_argument(
+        "--library", nargs=2, metavar=("OLD", "NEW"), default=None,
+        help="ライブラリ同士を比較（フォルダまたは .xar をまとめた ZIP バンドル、.xar は相対パスで対応付け）",
+    )
+    parser.add_argument(
+        "--library-reports", nargs="?", const="*", default=None, metavar="NAMES",
+        help="--library で変更ありのテンプレートのレポートも書き出す"
+        "（テンプレート名をカンマ区切りで指定するとそれだけ、省略時は変更ありすべて）",
+    )
+    parser.add_argument(
+        "--three-way", nargs=3, metavar=("BASE", "A", "B"), default=None,
+        help="基準と、それを別々に変更した A・B を3者比較（競合があれば終了コード 1）",
+    )
+    parser.add_argument(
+        "--impact", action="append", metavar="REF", default=None,
+        help="データセット・フィールド（配下を含む）を参照している箇所を、ファイル引数の .xar・フォルダ・"
+        "ZIP バンドルから探す（複数指定可、見つからなければ終了コード 1）",
+    )
+    return parser
+
+
+def run_impact(args: argparse.Namespace) -> int:
+    # ファイル引数のテンプレートをすべて逆引き索引に入れ、--impact の参照箇所を表示する。
+    # フォルダ・ZIP バンドル内のテンプレートは「ソース名/相対パス」で表示する。
+    index = BindingIndex()
+    for source in args.files:
+        if Path(source).is_dir() or source.lower().endswith(".zip"):
+            prefix = Path(source).name + "/"
+            entries = list_library(source)
+        else:
+            prefix = ""
+            entries = library_from_files([source])
+        for name, entry in entries.items():
+            _meta, idx, _stats = load_xar_streaming(read_entry(entry))
+            index.add_template(prefix + name, idx)
+
+    found = 0
+    for ref in args.impact:
+        sites = index.impact(ref)
+        found += len(sites)
+        for site in sites:
+            print(f"{site['template']}\t{site['id']}\t{site['path']}\t{site['reference']}")
+        templates = len({s["template"] for s in sites})
+        print(
+            f"{ref}: 参照 {len(sites)} 件（テンプレート {templates} 件 / {len(index.templates)} 件中）",
+            file=sys.stderr,
+        )
+    return 0 if found else 1
+
+
+def run_three_way(args: argparse.Namespace, formats: List[str], list_keys: List[str]) -> int:
+    # 3者比較。レポートを out_dir に書き出し、競合のあるオブジェクトを表示する。
+    base_path, a_path, b_path = args.three_way
+    result = compare_three_way(
+        load_index(base_path),
+        load_index(a_path),
+        load_index(b_path),
+        base_name=Path(base_path).name,
+        a_name=Path(a_path).name,
+        b_name=Path(b_path).name,
+        list_mode=args.list_mode,
+        list_keys=list_keys,
+    )
+    write_three_way_reports(result, args.out_dir, formats, args.max_value_chars or None)
+    for row in result["rows"]:
+        if row["status"] == "conflict":
+            print(
+                f"{row['id']}: {OBJECT_STATUS_LABELS['conflict']} {row['conflict_cnt']} 件"
+                f" (🔴{row['critical_cnt']} 🟡{row['medium_cnt']} 🟢{row['minor_cnt']})"
+            )
+    summary = summarize_three_way(result)
+    print(
+        f"オブジェクト {summary['objects']} 件: 競合={summary['objects_conflict']} "
+        f"A・B 別々={summary['objects_both']} A のみ={summary['objects_a_only']} "
+        f"B のみ={summary['objects_b_only']} 同じ変更={summary['objects_same']}"
+    )
+    return 1 if summary["objects_conflict"] else 0
+
+
+def run_library(args: argparse.Namespace, formats: List[str], list_keys: List[str]) -> int:
+    # ライブラリ一括比較。サマリー表（library_summary.json / .csv）と、指定があればレポートを書き出す。
+    old_entries = list_library(args.library[0])
+    new_entries = list_library(args.library[1])
+    all_changed = args.library_reports == "*"
+    rows = compare_libraries(
+        old_entries,
+        new_entries,
+        workers=args.workers,
+        list_mode=args.list_mode,
+        list_keys=list_keys,
+        report_dir=args.out_dir if all_changed else None,
+        formats=formats,
+        max_value_chars=args.max_value_chars or None,
+        match_reid=not args.no_reid,
+        analyze_layout=not args.no_layout,
+    )
+    if args.library_reports and not all_changed:
+        names = [n.strip() for n in args.library_reports.split(",") if n.strip()]
+        unknown = [n for n in names if n not in old_entries or n not in new_entries]
+        if unknown:
+            print(f"旧/新の両方にないテンプレートです: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        write_library_reports(
+            old_entries,
+            new_entries,
+            names,
+            args.out_dir,
+            formats,
+            list_mode=args.list_mode,
+            list_keys=list_keys,
+            max_value_chars=args.max_value_chars or None,
+            match_reid=not args.no_reid,
+            analyze_layout=not args.no_layout,
+        )
+
+    totals = summarize_library(rows)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    with (args.out_dir / "library_summary.json").open("w", encoding="utf-8") as f:
+        json.dump(
+            {"old": args.library[0], "new": args.library[1], "totals": totals, "templates": rows},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    columns = list(rows[0]) if rows else ["name", "status"]
+    for r in rows:
+        columns.extend(k for k in r if k not in columns)
+    with (args.out_dir / "library_summary.csv").open("w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for row in rows:
+        if row["status"] == "changed":
+            print(
+                f"{row['name']}: 変更 追加={row['added']} 削除={row['removed']} "
+                f"変更={row['changed']} (🔴{row['critical']} 🟡{row['medium']} 🟢{row['minor']})"
+            )
+        elif row["status"] == "error":
+            print(f"{row['name']}: エラー {row['error']}", file=sys.stderr)
+        elif row["status"] != "unchanged":
+            print(f"{row['name']}: {STATUS_LABELS[row['status']]}")
+    print(
+        f"テンプレート {totals['templates']} 件: 追加={totals['added']} 削除={totals['removed']} "
+        f"変更={totals['changed']} 変更なし={totals['unchanged']}（うち未展開 {totals['skipped']}） "
+        f"エラー={totals['error']} (🔴{totals['critical']} 🟡{totals['medium']} 🟢{totals['minor']})"
+    )
+    return 1 if totals["error"] else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+
+    formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    unknown = sorted(set(formats) - set(REPORT_FORMATS))
+    if unknown:
+        parser.error(f"未対応の出力形式です: {', '.join(unknown)}")
+
+    if args.severity_rules:
+        # 先に読み込んで形式を検証し、ワーカープロセスへは環境変数で引き継ぐ
+        try:
+            set_severity_rules(load_severity_rules(args.severity_rules))
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"重要度ルールを読み込めません: {e}")
+        os.environ[RULES_ENV_VAR] = str(args.severity_rules.resolve())
+
+    list_keys = [k.strip() for k in args.list_keys.split(",") if k.strip()]
+    if args.impact:
+        if not args.files or args.manifest or args.library or args.three_way:
+            parser.error("--impact は探すテンプレートをファイル引数だけで指定してください。")
+        return run_impact(args)
+    if args.three_way:
+        if args.files or args.manifest or args.library:
+            parser.error("--three-way はファイル引数・--manifest・--library と同時に指定できません。")
+        return run_three_way(args, formats, list_keys)
+    if args.library:
+        if args.files or args.manifest:
+            parser.error("--library はファイル引数・--manifest と同時に指定できません。")
+        return run_library(args, formats, list_keys)
+
+    if len(args.files) % 2 != 0:
+        parser.error("ファイルは 旧/新 のペアで指定してください。")
+    pairs = [
+        {"old": args.files[i], "new": args.files[i + 1]}
+        for i in range(0, len(args.files), 2)
+    ]
+    if args.manifest:
+        pairs.extend(read_manifest(args.manifest))
+    if not pairs:
+        parser.error("比較するペアを指定してください（ファイル引数・--manifest または --library）。")
+
+    rows = run_pairs(
+        pairs,
+        args.out_dir,
+        formats,
+        workers=args.workers,
+        list_mode=args.list_mode,
+        list_keys=list_keys,
+        max_value_chars=args.max_value_chars or None,
+        diff_workers=args.diff_workers,
+        match_reid=not args.no_reid,
+        analyze_layout=not args.no_layout,
+        max_diffs=args.max_diffs,
+        brief=args.brief,
+        max_overlaps=args.max_overlaps or None,
+    )
+
+    if args.brief:
+        # 終了コードは diff -q と同じ（0: すべて差分なし、1: 差分あり、2: エラー）
+        differs = failed = 0
+        for row in rows:
+            if row["status"] != "ok":
+                failed += 1
+                print(f"{row['name']}: エラー {row['error']}", file=sys.stderr)
+            elif row["differs"]:
+                differs += 1
+                print(f"{row['name']}: 差分あり（{row['old']} → {row['new']}）")
+        return 2 if failed else (1 if differs else 0)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    with (args.out_dir / "summary.json").open("w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    failed = 0
+    for row in rows:
+        if row["status"] == "ok":
+            print(
+                f"{row['name']}: 追加={row['added']} 削除={row['removed']} "
+                f"変更={row['changed']} (🔴{row['critical']} 🟡{row['medium']} 🟢{row['minor']})"
+            )
+        else:
+            failed += 1
+            print(f"{row['name']}: エラー {row['error']}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1525 @@
+# 帳票DX テンプレート差分エンジン
+#
+# Streamlit に依存しない比較ロジック本体。ビューア（ReportDX_xar_diff_viewer.py）と
+# バッチCLI（ReportDX_xar_diff_cli.py）の両方から import して使う。
+
+import hashlib
+import io
+import json
+from pathlib import Path
+import time
+import zipfile
+from typing import Any, Collection, Dict, Generator, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from ReportDX_xar_diff_align import longest_increasing_subsequence, myers_opcodes
+from ReportDX_xar_diff_entry import DiffEntry, Segments, intern_path, parse_path
+from ReportDX_xar_diff_excel import write_excel_report
+from ReportDX_xar_diff_layout import (
+    LAYOUT_KIND_LABELS,
+    MAX_NEW_OVERLAPS,
+    describe_layout_group,
+    find_new_overlaps,
+    group_layout_shifts,
+    layout_severity_counts,
+)
+from ReportDX_xar_diff_match import REID_MIN_SCORE, match_features, match_objects
+from ReportDX_xar_diff_profile import StageProfiler
+from ReportDX_xar_diff_rules import (
+    SEVERITY_COUNT_KEYS,
+    SEVERITY_LEVELS,
+    SeverityRules,
+    get_severity_rules,
+    set_severity_rules,
+)
+from ReportDX_xar_diff_values import (
+    DEFAULT_REPORT_MAX_VALUE_CHARS,
+    VALUE_REF_MIN_CHARS,
+    format_value,
+    ValueRef,
+    make_value_ref,
+    value_for_json,
+)
+
+# 差分の種類
+DIFF_OPS = ("changed", "added", "removed", "moved")
+OP_LABELS = {"changed": "変更", "added": "追加", "removed": "削除", "moved": "移動"}
+
+# リスト要素を対応付けるキーの既定値（先に見つかったものを使う）
+DEFAULT_LIST_KEYS: Tuple[str, ...] = ("id",)
+
+# 並列比較する最小の比較対象数（これ未満はプロセス起動・結果転送のコストの方が大きい）
+PARALLEL_MIN_OBJECTS = 2000
+
+# 並列比較でワーカーあたりに割り当てるチャンク数（オブジェクトごとの処理時間のばらつきをならす）
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+# compare_indexes の detail（差分をどこまで作って保持するか）
+#   "full":   オブジェクトごとの差分一覧を作って保持する
+#   "counts": 重要度別の件数だけ数える（差分一覧は object_diffs() で必要になったオブジェクトの分だけ作る）
+COMPARE_DETAILS = ("full", "counts")
+
+# write_reports で書き出せるレポート形式
+REPORT_FORMATS = ("md", "xlsx", "json")
+
+# iter_markdown_report が1回に返す行数
+MARKDOWN_CHUNK_LINES = 512
+
+
+# --- 読み込み・インデックス ---------------------------------------------------
+
+
+def load_xar_from_bytes(bytes_data: bytes) -> Tuple[Dict[str, Any], str]:
+    # Uploadされた .xar (ZIP) から .xat JSON と元テキストを返す
+    with zipfile.ZipFile(io.BytesIO(bytes_data)) as z:
+        xat_name = None
+        for name in z.namelist():
+            if name.lower().endswith(".xat"):
+                xat_name = name
+                break
+        if not xat_name:
+            raise ValueError(".xar 内に .xat ファイルが見つかりませんでした。")
+        data = z.read(xat_name)
+        txt = data.decode("utf-8")
+        return json.loads(txt), txt
+
+
+def content_hash(bytes_data: bytes) -> str:
+    # アップロード内容のハッシュ（キャッシュキー用）
+    return hashlib.sha256(bytes_data).hexdigest()
+
+
+def load_xar_from_path(path: Union[str, Path]) -> Tuple[Dict[str, Any], str]:
+    # ディスク上の .xar を読み込む（バッチ処理用）
+    return load_xar_from_bytes(Path(path).read_bytes())
+
+
+# 部分木ハッシュの表（id(dict/list) -> ダイジェスト）。元のオブジェクトが生きている間だけ有効。
+SubtreeHashes = Dict[int, bytes]
+
+
+class ObjectIndex(dict):
+    # index_objects の戻り値。id -> オブジェクトの dict に加えて構造ハッシュを持つ。
+    #   hashes:         id -> オブジェクト全体のハッシュ（16進）。一致すれば比較不要。
+    #   subtree_hashes: id(入れ子の dict/list) -> 構造ハッシュ。変更のあったオブジェクトだけ
+    #                   subtree_hashes_for() で必要になった時点で計算する。
+    # subtree_hashes は id() をキーにするため pickle では引き継がず、受け取り側で再計算する。
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.hashes: Dict[str, str] = {}
+        self.subtree_hashes: SubtreeHashes = {}
+        self._subtree_done: Set[str] = set()
+
+    def __reduce__(self):
+        return (_rebuild_object_index, (dict(self), self.hashes))
+
+    def ensure_hashes(self) -> "ObjectIndex":
+        # オブジェクト単位のハッシュが未計算のものを計算する
+        if len(self.hashes) != len(self):
+            for oid, o in self.items():
+                if oid not in self.hashes:
+                    self.hashes[oid] = object_hash(o)
+        return self
+
+    def subtree_hashes_for(self, oid: str) -> SubtreeHashes:
+        # オブジェクト oid の部分木ハッシュを（未計算なら）計算し、表を返す
+        if oid not in self._subtree_done:
+            structural_hash(self[oid], self.subtree_hashes)
+            self._subtree_done.add(oid)
+        return self.subtree_hashes
+
+
+def _rebuild_object_index(objects: Dict[str, Any], hashes: Dict[str, str]) -> ObjectIndex:
+    idx = ObjectIndex(objects)
+    idx.hashes = hashes
+    return idx
+
+
+def object_hash(o: Any) -> str:
+    # オブジェクト全体のハッシュ（キー順を正規化したJSONのハッシュ）
+    canonical = json.dumps(o, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _feed_scalar(h: Any, v: Any) -> None:
+    # dict/list 以外の値を正規化したバイト列としてハッシュへ流し込む（型タグ＋長さ付き）
+    if isinstance(v, str):
+        data = v.encode("utf-8")
+        h.update(b"s%d:" % len(data))
+        h.update(data)
+    elif v is None:
+        h.update(b"n")
+    elif isinstance(v, bool):
+        h.update(b"T" if v else b"F")
+    else:
+        data = repr(v).encode("ascii")
+        h.update(b"%s%d:" % (type(v).__name__[:1].encode("ascii"), len(data)))
+        h.update(data)
+
+
+def _hash_node(v: Any, table: Optional[SubtreeHashes]) -> Generator[Any, bytes, bytes]:
+    # dict/list 1つ分のハッシュ。入れ子の dict/list を yield し、そのハッシュを send で受け取る
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(v, dict):
+        h.update(b"d")
+        for k in sorted(v):
+            key = str(k).encode("utf-8")
+            h.update(b"%d:" % len(key))
+            h.update(key)
+            e = v[k]
+            if isinstance(e, (dict, list)):
+                h.update((yield e))
+            else:
+                _feed_scalar(h, e)
+    else:
+        h.update(b"l%d:" % len(v))
+        for e in v:
+            if isinstance(e, (dict, list)):
+                h.update((yield e))
+            else:
+                _feed_scalar(h, e)
+    digest = h.digest()
+    if table is not None:
+        table[id(v)] = digest
+    return digest
+
+
+def structural_hash(v: Any, table: Optional[SubtreeHashes] = None) -> bytes:
+    # JSON値の正規化構造ハッシュ（Merkle木）。dict はキー順に依存しない。
+    # table を渡すと、入れ子の dict/list ごとのハッシュを id() をキーに記録する。
+    # 再帰せずにノードごとのジェネレータを積んで辿る（深い入れ子でも再帰の上限に当たらない）。
+    if not isinstance(v, (dict, list)):
+        h = hashlib.blake2b(digest_size=16)
+        _feed_scalar(h, v)
+        return h.digest()
+    stack = [_hash_node(v, table)]
+    digest = None
+    while True:
+        try:
+            child = stack[-1].send(digest)
+        except StopIteration as done:
+            stack.pop()
+            digest = done.value
+            if not stack:
+                return digest
+        else:
+            stack.append(_hash_node(child, table))
+            digest = None
+
+
+def as_object_index(idx: Dict[str, Dict[str, Any]]) -> ObjectIndex:
+    # 任意の id -> オブジェクト dict を、ハッシュ計算済みの ObjectIndex にする
+    if not isinstance(idx, ObjectIndex):
+        idx = ObjectIndex(idx)
+    return idx.ensure_hashes()
+
+
+def index_objects(tpl_json: Dict[str, Any], with_subtrees: bool = False) -> ObjectIndex:
+    # objects配列をidで引けるdictに変換し、オブジェクトごとのハッシュを計算する。
+    # with_subtrees=True なら入れ子の dict/list の構造ハッシュも先に全部計算しておく。
+    idx = ObjectIndex(
+        (o.get("id"), o)
+        for o in tpl_json.get("objects", [])
+        if o.get("id") is not None
+    )
+    idx.ensure_hashes()
+    if with_subtrees:
+        for oid in idx:
+            idx.subtree_hashes_for(oid)
+    return idx
+
+
+# --- 比較 ---------------------------------------------------------------------
+
+
+def summarize_object(o: Dict[str, Any]) -> Dict[str, Any]:
+    # オブジェクトの概略を取り出す（一覧表示用）
+    impl_uri = o.get("impl_uri")
+    rect = o.get("rect", {}) or {}
+    base = {
+        "id": o.get("id"),
+        "name": o.get("name"),
+        "type": impl_uri,
+        "x": rect.get("x"),
+        "y": rect.get("y"),
+        "width": rect.get("width"),
+        "height": rect.get("height"),
+        "show": o.get("show"),
+        "lock": o.get("lock"),
+        "enabled": o.get("enabled"),
+    }
+
+    impl = o.get("impl", {}) or {}
+
+    if impl_uri == "oxa:text":
+        data = impl.get("data", {}) or {}
+        font = impl.get("font", {}) or {}
+        base.update(
+            {
+                "kind": "text",
+                "text": data.get("value"),
+                "font_name": font.get("name"),
+                "font_size": font.get("size"),
+                "font_color": font.get("color"),
+                "align": font.get("align"),
+            }
+        )
+    elif impl_uri == "oxa:rect":
+        stroke = impl.get("stroke", {}) or {}
+        fill = stroke.get("fill", {}) or {}
+        base.update(
+            {
+                "kind": "rect",
+                "stroke_size": stroke.get("size"),
+                "stroke_color": fill.get("color"),
+            }
+        )
+    elif impl_uri == "oxa:tableregion":
+        tables = impl.get("tables", []) or []
+        table = tables[0] if tables else {}
+        drive_ds = table.get("drive_dataset", {}) or {}
+        details = table.get("details", []) or []
+        col_count = 0
+        if details:
+            first_detail = details[0]
+            frames = first_detail.get("frames", []) or []
+            col_count = len(frames)
+        base.update(
+            {
+                "kind": "tableregion",
+                "dataset_ref": drive_ds.get("ref"),
+                "column_count": col_count,
+            }
+        )
+    else:
+        base.update({"kind": "other"})
+
+    return base
+
+
+def deep_diff(
+    a: Any,
+    b: Any,
+    path: Union[str, Segments] = (),
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    hashes_a: Optional[SubtreeHashes] = None,
+    hashes_b: Optional[SubtreeHashes] = None,
+) -> List[DiffEntry]:
+    # JSONの一部（dict/list/値）同士を比較して、差分（DiffEntry）のリストを返す。
+    # path はパスのセグメント（キー名・添字）のタプル（文字列なら先頭の1セグメントとして扱う）。
+    # list_mode="align" ではリスト要素を list_keys のキー、なければ内容で対応付ける。
+    # "index" は従来どおり添字同士で比較する。
+    # hashes_a / hashes_b（ObjectIndex.subtree_hashes）があれば、ハッシュが一致する部分木は辿らない。
+    return list(iter_diff(a, b, path, list_mode, list_keys, hashes_a, hashes_b))
+
+
+def iter_diff(
+    a: Any,
+    b: Any,
+    path: Union[str, Segments] = (),
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    hashes_a: Optional[SubtreeHashes] = None,
+    hashes_b: Optional[SubtreeHashes] = None,
+) -> Iterator[DiffEntry]:
+    # deep_diff と同じ差分を同じ順に1件ずつ返す。
+    # 再帰せず、ノードごとのジェネレータを明示的なスタックに積んで辿るので、入れ子が深くても
+    # 再帰の上限に当たらず、途中のリストも作らない。件数だけ数える・最初の1件で打ち切るといった
+    # 使い方では、差分を溜めずに済む。
+    # 辿っている途中のパスはスタックと対応する1本のリスト（trail）で持ち、タプルは差分を
+    # 作るときだけ組み立てる（ノードごとにパスのタプルを作ると、深さの2乗のメモリになる）。
+    if isinstance(path, str):
+        path = (path,) if path else ()
+    opts = (list_mode, list_keys, hashes_a, hashes_b)
+    trail = list(path)
+    stack = [_diff_node(a, b, trail, opts)]
+    while stack:
+        for step in stack[-1]:
+            if type(step) is DiffEntry:
+                yield step
+            else:
+                # 子ノードへ降りる（子を辿り終えたら、親の続きから再開する）
+                child_a, child_b, seg = step
+                trail.append(seg)
+                stack.append(_diff_node(child_a, child_b, trail, opts))
+                break
+        else:
+            stack.pop()
+            if stack:
+                trail.pop()
+
+
+# _diff_node が返すもの: 差分、または辿る子ノード (a, b, セグメント)
+DiffStep = Union[DiffEntry, Tuple[Any, Any, Any]]
+
+
+def _entry(trail: List[Any], seg: Any, op: str, old: Any, new: Any) -> DiffEntry:
+    # trail の下の seg（None ならノード自身）の差分
+    segments = tuple(trail) if seg is None else (*trail, seg)
+    return DiffEntry(intern_path(segments), op, old, new)
+
+
+def _child(a: Any, b: Any, trail: List[Any], seg: Any) -> Optional[DiffStep]:
+    # 子要素の比較。dict/list 同士なら辿る子ノード、値なら差分（なければ None）
+    if type(a) is type(b) and isinstance(a, (dict, list)):
+        return (a, b, seg)
+    if a != b:
+        return _entry(trail, seg, "changed", a, b)
+    return None
+
+
+def _diff_node(a: Any, b: Any, trail: List[Any], opts: Tuple[Any, ...]) -> Iterator[DiffStep]:
+    # 1ノード分の比較。差分と、辿るべき子ノードを順に返す。
+    # trail はこのノードまでのパス（このジェネレータが動いている間だけ有効）。
+    list_mode, list_keys, hashes_a, hashes_b = opts
+
+    # 型が違う場合は即差分
+    if type(a) is not type(b):
+        if a != b:
+            yield _entry(trail, None, "changed", a, b)
+        return
+
+    if hashes_a is not None and hashes_b is not None and isinstance(a, (dict, list)):
+        ha = hashes_a.get(id(a))
+        if ha is not None and ha == hashes_b.get(id(b)):
+            return
+
+    # dict
+    if isinstance(a, dict):
+        keys = set(a.keys()) | set(b.keys())
+        for k in sorted(keys):
+            if k not in a:
+                yield _entry(trail, k, "added", None, b.get(k))
+            elif k not in b:
+                yield _entry(trail, k, "removed", a.get(k), None)
+            else:
+                step = _child(a[k], b[k], trail, k)
+                if step is not None:
+                    yield step
+        return
+
+    # list
+    if isinstance(a, list):
+        if list_mode == "index":
+            max_len = max(len(a), len(b))
+            for i in range(max_len):
+                if i >= len(a):
+                    yield _entry(trail, i, "added", None, b[i])
+                elif i >= len(b):
+                    yield _entry(trail, i, "removed", a[i], None)
+                else:
+                    step = _child(a[i], b[i], trail, i)
+                    if step is not None:
+                        yield step
+            return
+
+        key = _list_key(a, b, list_keys)
+        if key is not None:
+            yield from _diff_keyed_list(a, b, trail, key)
+        else:
+            yield from _diff_unkeyed_list(a, b, trail, hashes_a, hashes_b)
+        return
+
+    # 値
+    if a != b:
+        yield _entry(trail, None, "changed", a, b)
+
+
+def _has_unique_key(elements: List[Any], key: str) -> bool:
+    seen = set()
+    for e in elements:
+        if not isinstance(e, dict):
+            return False
+        v = e.get(key)
+        if not isinstance(v, (str, int)) or v in seen:
+            return False
+        seen.add(v)
+    return True
+
+
+def _list_key(a: List[Any], b: List[Any], list_keys: Sequence[str]) -> Optional[str]:
+    # 両リストの全要素が dict で、値が一意なキーを持っていればそのキー名を返す
+    if not a or not b:
+        return None
+    for key in list_keys:
+        if _has_unique_key(a, key) and _has_unique_key(b, key):
+            return key
+    return None
+
+
+def _diff_keyed_list(
+    a: List[Any],
+    b: List[Any],
+    trail: List[Any],
+    key: str,
+) -> Iterator[DiffStep]:
+    # キー（id など）で要素を対応付けて比較する。
+    # 対応する要素の並びのうち、最長増加部分列に入らないものを「移動」とする。
+    pos_a = {e[key]: i for i, e in enumerate(a)}
+    pos_b = {e[key]: j for j, e in enumerate(b)}
+
+    matched = [(pos_a[e[key]], j) for j, e in enumerate(b) if e[key] in pos_a]
+    stable = longest_increasing_subsequence([i for i, _j in matched])
+    moved_to = {j for n, (_i, j) in enumerate(matched) if n not in stable}
+
+    for j, e in enumerate(b):
+        i = pos_a.get(e[key])
+        if i is None:
+            yield _entry(trail, j, "added", None, e)
+            continue
+        if j in moved_to:
+            yield _entry(trail, j, "moved", i, j)
+        yield (a[i], e, j)
+
+    for i, e in enumerate(a):
+        if e[key] not in pos_b:
+            yield _entry(trail, i, "removed", e, None)
+
+
+def _element_token(v: Any, hashes: Optional[SubtreeHashes]) -> Any:
+    # リスト要素の同一性判定用トークン（True と 1 などを区別する）
+    if isinstance(v, (dict, list)):
+        if hashes is not None:
+            digest = hashes.get(id(v))
+            if digest is not None:
+                return digest
+        return structural_hash(v)
+    return (type(v).__name__, v)
+
+
+def _diff_unkeyed_list(
+    a: List[Any],
+    b: List[Any],
+    trail: List[Any],
+    hashes_a: Optional[SubtreeHashes],
+    hashes_b: Optional[SubtreeHashes],
+) -> Iterator[DiffStep]:
+    # キーのないリストは内容の一致で Myers アライメントする。
+    # 削除側と挿入側に同じ内容があれば「移動」、置換ブロック内の残りは位置で対にして比較する。
+    tokens_a = [_element_token(e, hashes_a) for e in a]
+    tokens_b = [_element_token(e, hashes_b) for e in b]
+    opcodes = myers_opcodes(tokens_a, tokens_b)
+
+    deleted: Dict[Any, List[int]] = {}
+    for tag, i1, i2, _j1, _j2 in opcodes:
+        if tag in ("delete", "replace"):
+            for i in range(i1, i2):
+                deleted.setdefault(tokens_a[i], []).append(i)
+
+    moved_from: Dict[int, int] = {}
+    for tag, _i1, _i2, j1, j2 in opcodes:
+        if tag in ("insert", "replace"):
+            for j in range(j1, j2):
+                candidates = deleted.get(tokens_b[j])
+                if candidates:
+                    moved_from[j] = candidates.pop(0)
+    moved_old = set(moved_from.values())
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            continue
+        rest_a = [i for i in range(i1, i2) if i not in moved_old]
+        rest_b = []
+        for j in range(j1, j2):
+            if j in moved_from:
+                yield _entry(trail, j, "moved", moved_from[j], j)
+            else:
+                rest_b.append(j)
+        for i, j in zip(rest_a, rest_b):
+            yield (a[i], b[j], j)
+        for j in rest_b[len(rest_a) :]:
+            yield _entry(trail, j, "added", None, b[j])
+        for i in rest_a[len(rest_b) :]:
+            yield _entry(trail, i, "removed", a[i], None)
+
+
+def classify_severity(path: str) -> Tuple[int, str, str]:
+    # 差分パスに基づいて重要度を判定する（ルールは ReportDX_xar_diff_rules を参照）。
+    # 戻り値: (severity, emoji, label)  / severity: 3=Critical, 2=Medium, 1=Minor
+    return get_severity_rules().classify(path)
+
+
+def compare_templates(
+    tpl_old: Dict[str, Any],
+    tpl_new: Dict[str, Any],
+    old_name: str = "old.xar",
+    new_name: str = "new.xar",
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    value_ref_min_chars: Optional[int] = VALUE_REF_MIN_CHARS,
+) -> Dict[str, Any]:
+    # 2つのテンプレートJSONを比較し、レポート生成に必要な結果一式を返す。
+    # 戻り値: {old_name, new_name, added, removed, changed_rows, changed_detail}
+    return compare_indexes(
+        index_objects(tpl_old),
+        index_objects(tpl_new),
+        old_name=old_name,
+        new_name=new_name,
+        list_mode=list_mode,
+        list_keys=list_keys,
+        value_ref_min_chars=value_ref_min_chars,
+    )
+
+
+def _walk_object(
+    o_old: Dict[str, Any],
+    o_new: Dict[str, Any],
+    list_mode: str,
+    list_keys: Sequence[str],
+    hashes_a: Optional[SubtreeHashes],
+    hashes_b: Optional[SubtreeHashes],
+    keep: bool,
+    max_diffs: Optional[int],
+    skip: Collection[Segments] = (),
+) -> Tuple[Optional[List[DiffEntry]], Dict[int, int]]:
+    # オブジェクト全体（rect/implなどすべて含む）の差分を辿り、重要度を付けて重要度別件数を数える。
+    # keep なら差分を（max_diffs があれば先頭からその件数まで）リストで返し、そうでなければ None。
+    # skip のパスの差分（まとめた領域の rect など）は数えず、保持もしない。
+    rules = get_severity_rules()
+    counts = {level: 0 for level in SEVERITY_LEVELS}
+    kept: Optional[List[DiffEntry]] = [] if keep else None
+    for d in iter_diff(o_old, o_new, ("object",), list_mode, list_keys, hashes_a, hashes_b):
+        if d.segments in skip:
+            continue
+        # 重要度は差分ごとに1回だけ判定して保持する
+        d.severity = rules.severity_of(d.segments)
+        counts[d.severity] += 1
+        if kept is not None and (max_diffs is None or len(kept) < max_diffs):
+            kept.append(d)
+    return kept, counts
+
+
+def _make_value_refs(
+    diffs: List[DiffEntry],
+    min_chars: Optional[int],
+    hashes_a: Optional[SubtreeHashes],
+    hashes_b: Optional[SubtreeHashes],
+) -> None:
+    # 大きな旧値・新値を ValueRef に置き換える（min_chars が None なら何もしない）
+    if min_chars is None:
+        return
+    for d in diffs:
+        d.old = make_value_ref(d.old, min_chars, hashes_a)
+        d.new = make_value_ref(d.new, min_chars, hashes_b)
+
+
+def _diff_object(
+    oid: str,
+    idx_old: ObjectIndex,
+    idx_new: ObjectIndex,
+    list_mode: str,
+    list_keys: Sequence[str],
+    value_ref_min_chars: Optional[int],
+    detail: str,
+    max_diffs: Optional[int],
+    timings: Optional[List[float]],
+    new_oid: Optional[str] = None,
+) -> Optional[Tuple[Optional[List[DiffEntry]], Dict[int, int], Dict[str, Any], Dict[str, Any]]]:
+    # 1オブジェクト分の比較。差分があれば (差分, 重要度別件数, 旧サマリー, 新サマリー)、なければ None。
+    # detail="counts" なら差分は保持せず None を返す（件数だけ数える）。
+    # timings を渡すと [部分木ハッシュ, deep_diff（重要度判定を含む）, 大きな値の参照化] の秒数を積算する。
+    # new_oid を渡すと、新側はそのIDのオブジェクトと比較する（ID が変わったオブジェクト用）。
+    new_oid = oid if new_oid is None else new_oid
+    o_old = idx_old[oid]
+    o_new = idx_new[new_oid]
+
+    if timings is not None:
+        t0 = time.perf_counter()
+    hashes_a = idx_old.subtree_hashes_for(oid)
+    hashes_b = idx_new.subtree_hashes_for(new_oid)
+    if timings is not None:
+        t1 = time.perf_counter()
+        timings[0] += t1 - t0
+    obj_diffs, counts = _walk_object(
+        o_old, o_new, list_mode, list_keys, hashes_a, hashes_b, detail == "full", max_diffs
+    )
+    if timings is not None:
+        t0 = time.perf_counter()
+        timings[1] += t0 - t1
+    if not any(counts.values()):
+        return None
+
+    if obj_diffs is not None:
+        _make_value_refs(obj_diffs, value_ref_min_chars, hashes_a, hashes_b)
+        if timings is not None:
+            timings[2] += time.perf_counter() - t0
+    return obj_diffs, counts, summarize_object(o_old), summarize_object(o_new)
+
+
+def object_diffs(det: Dict[str, Any]) -> List[DiffEntry]:
+    # changed_detail の1件（det）の差分一覧。
+    # detail="counts" で比較した結果では、最初に呼ばれたときにそのオブジェクトだけを比較して作り、
+    # det に保持する（まとめた領域の rect の差分は除き、max_diffs_per_object も適用する）。
+    diffs = det["diffs"]
+    if diffs is None:
+        list_mode, list_keys, value_ref_min_chars, max_diffs = det["diff_options"]
+        diffs, _counts = _walk_object(
+            det["old_full"],
+            det["new_full"],
+            list_mode,
+            list_keys,
+            None,
+            None,
+            True,
+            max_diffs,
+            det.get("collapsed", ()),
+        )
+        _make_value_refs(diffs, value_ref_min_chars, None, None)
+        det["diffs"] = diffs
+    return diffs
+
+
+def indexes_differ(
+    idx_old: Dict[str, Dict[str, Any]],
+    idx_new: Dict[str, Dict[str, Any]],
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+) -> bool:
+    # 2つのテンプレートに差分が1件でもあるか。最初の差分が見つかった時点で打ち切る
+    # （部分木ハッシュも作らない）。ID が変わっただけのオブジェクトも差分ありとする。
+    idx_old = as_object_index(idx_old)
+    idx_new = as_object_index(idx_new)
+    if idx_old.keys() != idx_new.keys():
+        return True
+    for oid, digest in idx_old.hashes.items():
+        if idx_new.hashes[oid] == digest:
+            continue
+        first = next(iter_diff(idx_old[oid], idx_new[oid], ("object",), list_mode, list_keys), None)
+        if first is not None:
+            return True
+    return False
+
+
+# --- 並列比較 -----------------------------------------------------------------
+# HTTP サービスやビューアのようにスレッドのあるプロセスからも呼ばれるので、ワーカーは fork ではなく
+# forkserver（ない環境では spawn）で起動する。ワーカーへ送るのはチャンク内のオブジェクトだけ
+# （各オブジェクトは1回だけ転送する）、戻すのは差分とサマリーだけ。重要度ルールは初期化時に渡す。
+# 差分中の ValueRef は値を転送せず、差分のパス（キー・添字の列）に置き換えて戻し、親プロセス側の
+# 同じ位置の値に付け直す。
+
+_worker_state: Optional[Tuple[Tuple[Any, ...], bool]] = None
+
+
+class _ValueRefStub:
+    # プロセス間で受け渡す ValueRef の代わり
+
+    __slots__ = ("locator", "preview", "digest", "value")
+
+    def __init__(self, locator: Optional[Tuple[Any, ...]], ref: ValueRef) -> None:
+        self.locator = locator
+        self.preview = ref.preview
+        self.digest = ref.raw_digest
+        # 位置が分からなかった場合だけ値そのものを送る
+        self.value = ref.value if locator is None else None
+
+
+def _pool_context() -> Any:
+    import multiprocessing
+
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _locator(root: Any, segments: Segments, value: Any) -> Optional[Tuple[Any, ...]]:
+    # 差分のパス（先頭の "object" を除く）が root の中の value（同一の値）を指していれば、その列を返す。
+    # リストの添字は新側のものなので、要素の並びが変わった旧側では別の値を指すことがある（None を返す）
+    locator = segments[1:]
+    node = root
+    try:
+        for k in locator:
+            node = node[k]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return locator if node is value else None
+
+
+def _resolve(root: Any, locator: Tuple[Any, ...]) -> Any:
+    for k in locator:
+        root = root[k]
+    return root
+
+
+def _init_diff_worker(opts: Tuple[Any, ...], timing: bool, rules: SeverityRules) -> None:
+    global _worker_state
+    _worker_state = (opts, timing)
+    set_severity_rules(rules)
+
+
+def _diff_chunk(
+    chunk: Tuple[List[str], ObjectIndex, ObjectIndex],
+) -> Tuple[List[Tuple[str, Any]], Optional[List[float]]]:
+    # ワーカー側：チャンク内のオブジェクトを順に比較する（差分のあったものだけ返す）
+    oids, idx_old, idx_new = chunk
+    opts, timing = _worker_state
+    timings = [0.0, 0.0, 0.0] if timing else None
+    out = []
+    for oid in oids:
+        diffed = _diff_object(oid, idx_old, idx_new, *opts, timings)
+        if diffed is None:
+            continue
+        for d in diffed[0] or ():
+            for key, root in (("old", idx_old[oid]), ("new", idx_new[oid])):
+                v = getattr(d, key)
+                if isinstance(v, ValueRef):
+                    setattr(d, key, _ValueRefStub(_locator(root, d.segments, v.value), v))
+        out.append((oid, diffed))
+    return out, timings
+
+
+def _diff_objects_parallel(
+    targets: List[str],
+    idx_old: ObjectIndex,
+    idx_new: ObjectIndex,
+    opts: Tuple[Any, ...],
+    workers: int,
+    timings: Optional[List[float]],
+) -> List[Tuple[str, Any]]:
+    # targets を連続したチャンクに分けて並列に比較し、targets の順に並べた結果を返す
+    # （プロセスプールは並列比較するときだけ import する）
+    from concurrent.futures import ProcessPoolExecutor
+
+    n_chunks = min(len(targets), workers * PARALLEL_CHUNKS_PER_WORKER)
+    size = -(-len(targets) // n_chunks)
+    chunks = [
+        (
+            oids,
+            ObjectIndex((oid, idx_old[oid]) for oid in oids),
+            ObjectIndex((oid, idx_new[oid]) for oid in oids),
+        )
+        for oids in (targets[i : i + size] for i in range(0, len(targets), size))
+    ]
+    results: List[Tuple[str, Any]] = []
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=_pool_context(),
+        initializer=_init_diff_worker,
+        initargs=(opts, timings is not None, get_severity_rules()),
+    ) as pool:
+        for out, chunk_timings in pool.map(_diff_chunk, chunks):
+            if timings is not None and chunk_timings is not None:
+                for i, t in enumerate(chunk_timings):
+                    timings[i] += t
+            for oid, diffed in out:
+                for d in diffed[0] or ():
+                    for key, root in (("old", idx_old[oid]), ("new", idx_new[oid])):
+                        v = getattr(d, key)
+                        if isinstance(v, _ValueRefStub):
+                            value = v.value if v.locator is None else _resolve(root, v.locator)
+                            setattr(d, key, ValueRef(value, v.preview, v.digest))
+                results.append((oid, diffed))
+    return results
+
+
+def _reid_features(idx: ObjectIndex, ids: Set[str]) -> Dict[str, Dict[str, Any]]:
+    # ID 変更の対応付けに使う特徴量（ID を除いた構造ハッシュを含む）
+    features = {}
+    for oid in ids:
+        o = idx[oid]
+        shape = structural_hash({k: v for k, v in o.items() if k != "id"})
+        features[oid] = match_features(summarize_object(o), shape)
+    return features
+
+
+# compare_indexes で「known_counts にない（比較が必要）」ことを表す目印
+_NOT_KNOWN = object()
+
+
+def compare_indexes(
+    idx_old: Dict[str, Dict[str, Any]],
+    idx_new: Dict[str, Dict[str, Any]],
+    old_name: str = "old.xar",
+    new_name: str = "new.xar",
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    value_ref_min_chars: Optional[int] = VALUE_REF_MIN_CHARS,
+    profiler: Optional[StageProfiler] = None,
+    workers: Optional[int] = None,
+    parallel_min_objects: int = PARALLEL_MIN_OBJECTS,
+    match_reid: bool = True,
+    reid_min_score: float = REID_MIN_SCORE,
+    analyze_layout: bool = True,
+    detail: str = "full",
+    max_diffs_per_object: Optional[int] = None,
+    known_counts: Optional[Dict[Tuple[str, str], Dict[int, int]]] = None,
+    max_overlaps: Optional[int] = MAX_NEW_OVERLAPS,
+) -> Dict[str, Any]:
+    # index_objects 済みのテンプレート同士を比較する（インデックスを使い回す場合用）。
+    # 差分の旧値・新値のうち正規化JSONで value_ref_min_chars 文字を超えるものは ValueRef にする
+    # （None なら常に値をそのまま持つ）。
+    # profiler を渡すと、部分木ハッシュ・deep_diff・重要度判定の時間をそれぞれ積算して記録する。
+    # workers > 1 で、比較対象（ハッシュが異なる共通オブジェクト）が parallel_min_objects 件以上なら
+    # プロセスプールで並列に比較する。結果は直列実行と同じ。
+    # match_reid なら削除と追加の組から ID だけが変わったオブジェクト（類似度 reid_min_score 以上）を
+    # 見つけ、追加・削除ではなく変更（ID の変更を含む差分）として扱う。
+    # analyze_layout なら、まとめて移動・サイズ変更された領域を1件にまとめ（layout_groups）、
+    # 新たに生じたオブジェクトの重なり（overlaps）を検出する（ReportDX_xar_diff_layout を参照）。
+    # 重なりは max_overlaps 組で打ち切り、調べきれなかったオブジェクトの数を overlaps_unchecked に入れる。
+    # detail は COMPARE_DETAILS のいずれか。"counts" では changed_detail の diffs が None になり、
+    # 差分一覧は object_diffs() で読む（件数・サマリーはどちらでも同じ）。
+    # max_diffs_per_object を指定すると、保持する差分はオブジェクトごとに先頭からその件数まで
+    # （重要度別件数は省いた分も含めて数える）。
+    # known_counts は (旧オブジェクトのハッシュ, 新オブジェクトのハッシュ) -> 重要度別件数 の表。
+    # 比較した組の件数を書き足し、detail="counts" ではここにある組を比較せずに件数を使う
+    # （list_mode・list_keys・重要度ルールが同じ比較の間でだけ共有すること）。
+    if detail not in COMPARE_DETAILS:
+        raise ValueError(f"未知の detail です: {detail}")
+    timings = [0.0, 0.0, 0.0] if profiler is not None and profiler.enabled else None
+    idx_old = as_object_index(idx_old)
+    idx_new = as_object_index(idx_new)
+    ids_old = set(idx_old.keys())
+    ids_new = set(idx_new.keys())
+
+    added_ids = ids_new - ids_old
+    removed_ids = ids_old - ids_new
+    common_ids = ids_old & ids_new
+
+    reid_pairs: List[Tuple[str, str, float]] = []
+    if match_reid and added_ids and removed_ids:
+        started = time.perf_counter()
+        reid_pairs = match_objects(
+            _reid_features(idx_old, removed_ids),
+            _reid_features(idx_new, added_ids),
+            reid_min_score,
+        )
+        if timings is not None:
+            profiler.add(
+                "compare.match_reid",
+                time.perf_counter() - started,
+                removed=len(removed_ids),
+                added=len(added_ids),
+                pairs=len(reid_pairs),
+            )
+        removed_ids -= {o for o, _n, _s in reid_pairs}
+        added_ids -= {n for _o, n, _s in reid_pairs}
+
+    # サマリー用データ作成
+    added = [summarize_object(idx_new[i]) for i in sorted(added_ids)]
+    removed = [summarize_object(idx_old[i]) for i in sorted(removed_ids)]
+
+    # 構造ハッシュが一致するオブジェクトは比較しない
+    targets = [oid for oid in sorted(common_ids) if idx_old.hashes[oid] != idx_new.hashes[oid]]
+    opts = (list_mode, tuple(list_keys), value_ref_min_chars, detail, max_diffs_per_object)
+    # detail="counts" のとき、object_diffs() が後から差分を作るための条件（全オブジェクトで共有）
+    lazy_options = (list_mode, tuple(list_keys), value_ref_min_chars, max_diffs_per_object)
+    reuse_counts = known_counts is not None and detail == "counts"
+    n_reused = 0
+
+    def pair_key(old_oid: str, new_oid: str) -> Tuple[str, str]:
+        return idx_old.hashes[old_oid], idx_new.hashes[new_oid]
+
+    def known_diff(old_oid: str, new_oid: str) -> Any:
+        # known_counts にある組なら比較済みとして (None, 件数, 旧サマリー, 新サマリー) を返す
+        nonlocal n_reused
+        counts = known_counts.get(pair_key(old_oid, new_oid)) if reuse_counts else None
+        if counts is None:
+            return _NOT_KNOWN
+        n_reused += 1
+        if not any(counts.values()):
+            return None
+        return None, dict(counts), summarize_object(idx_old[old_oid]), summarize_object(idx_new[new_oid])
+
+    def remember(old_oid: str, new_oid: str, diffed: Any) -> Any:
+        # 比較した組の件数を known_counts に書き足す
+        if known_counts is not None:
+            counts = diffed[1] if diffed is not None else {level: 0 for level in SEVERITY_LEVELS}
+            known_counts[pair_key(old_oid, new_oid)] = dict(counts)
+        return diffed
+
+    known = {oid: known_diff(oid, oid) for oid in targets} if reuse_counts else {}
+    to_diff = [oid for oid in targets if known.get(oid, _NOT_KNOWN) is _NOT_KNOWN]
+    parallel = workers is not None and workers > 1 and len(to_diff) >= parallel_min_objects
+    if parallel:
+        diffed_parallel = dict(
+            _diff_objects_parallel(to_diff, idx_old, idx_new, opts, workers, timings)
+        )
+        computed = ((oid, remember(oid, oid, diffed_parallel.get(oid))) for oid in to_diff)
+    else:
+        computed = (
+            (oid, remember(oid, oid, _diff_object(oid, idx_old, idx_new, *opts, timings)))
+            for oid in to_diff
+        )
+    if known:
+        # 件数を使い回すオブジェクトと比較したオブジェクトを、ID 順に戻す
+        computed_by_id = dict(computed)
+        per_object = (
+            (oid, computed_by_id[oid] if oid in computed_by_id else known[oid]) for oid in targets
+        )
+    else:
+        per_object = computed
+
+    changed_rows: List[Dict[str, Any]] = []
+    changed_detail: Dict[str, Any] = {}
+
+    def add_changed(oid: str, diffed: Any, old_oid: str, reid: Dict[str, Any]) -> None:
+        if diffed is None:
+            return
+        obj_diffs, sev_counts, sa, sb = diffed
+
+        changed_rows.append(
+            {
+                "id": oid,
+                **reid,
+                "name_old": sa.get("name"),
+                "name_new": sb.get("name"),
+                "kind": sa.get("kind"),
+                "type": sa.get("type"),
+                "minor_cnt": sev_counts[1],
+                "medium_cnt": sev_counts[2],
+                "critical_cnt": sev_counts[3],
+                "total_changes": sum(sev_counts.values()),
+            }
+        )
+        changed_detail[oid] = {
+            **reid,
+            "old_summary": sa,
+            "new_summary": sb,
+            "old_full": idx_old[old_oid],
+            "new_full": idx_new[oid],
+            "diffs": obj_diffs,
+        }
+        if obj_diffs is None:
+            changed_detail[oid]["diff_options"] = lazy_options
+
+    for oid, diffed in per_object:
+        add_changed(oid, diffed, oid, {})
+
+    if reid_pairs:
+        # ID が変わったオブジェクトは新IDで載せる（old_id に旧ID、reid_score に類似度）
+        for old_oid, new_oid, score in reid_pairs:
+            diffed = known_diff(old_oid, new_oid)
+            if diffed is _NOT_KNOWN:
+                diffed = remember(
+                    old_oid,
+                    new_oid,
+                    _diff_object(old_oid, idx_old, idx_new, *opts, timings, new_oid=new_oid),
+                )
+            add_changed(new_oid, diffed, old_oid, {"old_id": old_oid, "reid_score": round(score, 3)})
+        changed_rows.sort(key=lambda r: r["id"])
+
+    layout_groups: List[Dict[str, Any]] = []
+    overlaps: List[Dict[str, Any]] = []
+    overlap_stats: Dict[str, Any] = {"unchecked": 0}
+    if analyze_layout:
+        started = time.perf_counter()
+        layout_groups = group_layout_shifts(changed_rows, changed_detail)
+        overlaps = find_new_overlaps(
+            idx_old,
+            idx_new,
+            {n: o for o, n, _s in reid_pairs},
+            max_overlaps=max_overlaps,
+            stats=overlap_stats,
+        )
+        if timings is not None:
+            profiler.add(
+                "compare.layout",
+                time.perf_counter() - started,
+                groups=len(layout_groups),
+                overlaps=len(overlaps),
+                overlaps_unchecked=overlap_stats["unchecked"],
+            )
+
+    if timings is not None:
+        # 並列実行時は各ワーカーの合計（CPU 時間に近い値）
+        n_diffs = sum(r["total_changes"] for r in changed_rows)
+        n_objects = len(targets) + len(reid_pairs) - n_reused
+        profiler.add("compare.subtree_hashes", timings[0], objects=n_objects)
+        profiler.add(
+            "compare.deep_diff", timings[1], objects=n_objects, reused=n_reused, diffs=n_diffs
+        )
+        profiler.add("compare.value_refs", timings[2], objects=n_objects)
+
+    return {
+        "old_name": old_name,
+        "new_name": new_name,
+        "added": added,
+        "removed": removed,
+        "changed_rows": changed_rows,
+        "changed_detail": changed_detail,
+        "layout_groups": layout_groups,
+        "overlaps": overlaps,
+        "overlaps_unchecked": overlap_stats["unchecked"],
+    }
+
+
+def summarize_result(result: Dict[str, Any]) -> Dict[str, int]:
+    # 比較結果の件数サマリー（ダッシュボード・バッチ集計用）
+    # 重要度別件数は、まとめた領域（layout_groups）を1件ずつとして含める
+    changed_rows = result["changed_rows"]
+    layout_groups = result.get("layout_groups", [])
+    layout_counts = layout_severity_counts(layout_groups)
+    return {
+        "added": len(result["added"]),
+        "removed": len(result["removed"]),
+        "changed": len(changed_rows),
+        "critical": sum(r["critical_cnt"] for r in changed_rows) + layout_counts[3],
+        "medium": sum(r["medium_cnt"] for r in changed_rows) + layout_counts[2],
+        "minor": sum(r["minor_cnt"] for r in changed_rows) + layout_counts[1],
+        "reid": sum(1 for r in changed_rows if "old_id" in r),
+        "layout_groups": len(layout_groups),
+        "overlaps": len(result.get("overlaps", [])),
+        "overlaps_unchecked": result.get("overlaps_unchecked", 0),
+    }
+
+
+# --- レポート ----------------------------------------------------------------
+
+
+def select_report_scope(
+    result: Dict[str, Any],
+    min_severity: int = 1,
+    object_ids: Optional[Collection[str]] = None,
+) -> Dict[str, Any]:
+    # レポートに載せる範囲を絞った比較結果（元の result は変更せず、changed_detail は共有する）。
+    #   min_severity: この重要度以上の差分を含む変更オブジェクト・領域だけを残し、
+    #                 変更オブジェクトの件数もこの重要度以上の分だけにする
+    #   object_ids:   その ID（旧IDも可）の変更・追加・削除オブジェクトと、それを含む領域・重なりだけを残す
+    # 差分一覧そのものは絞らないので、レポートを作るときにも同じ min_severity を渡すこと。
+    ids = set(object_ids) if object_ids is not None else None
+    rows = []
+    for row in result["changed_rows"]:
+        if ids is not None and row["id"] not in ids and row.get("old_id") not in ids:
+            continue
+        if min_severity > 1:
+            row = dict(row)
+            for level, key in SEVERITY_COUNT_KEYS.items():
+                if level < min_severity:
+                    row[key] = 0
+            row["total_changes"] = sum(row[key] for key in SEVERITY_COUNT_KEYS.values())
+            if not row["total_changes"]:
+                continue
+        rows.append(row)
+    scoped = dict(result, changed_rows=rows)
+    if ids is not None:
+        scoped["added"] = [o for o in result["added"] if o.get("id") in ids]
+        scoped["removed"] = [o for o in result["removed"] if o.get("id") in ids]
+        scoped["overlaps"] = [
+            o for o in result.get("overlaps", []) if o["id_a"] in ids or o["id_b"] in ids
+        ]
+    scoped["layout_groups"] = [
+        g
+        for g in result.get("layout_groups", [])
+        if g["severity"] >= min_severity and (ids is None or not ids.isdisjoint(g["ids"]))
+    ]
+    return scoped
+
+
+def build_markdown_report(
+    old_name: str,
+    new_name: str,
+    added: List[Dict[str, Any]],
+    removed: List[Dict[str, Any]],
+    changed_rows: List[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    layout_groups: Optional[List[Dict[str, Any]]] = None,
+    overlaps: Optional[List[Dict[str, Any]]] = None,
+    min_severity: int = 1,
+    summary_only: bool = False,
+    overlaps_unchecked: int = 0,
+) -> str:
+    # Markdownレポートを生成する（旧値・新値は1件あたり max_value_chars 文字まで）。
+    # overlaps_unchecked は比較結果の同名の値（重なりの検出を打ち切ったときに注記する）。
+    # 大きなレポートをファイルへ書く場合は iter_markdown_report で少しずつ書き出す。
+    return "".join(
+        iter_markdown_report(
+            old_name,
+            new_name,
+            added,
+            removed,
+            changed_rows,
+            changed_detail,
+            max_value_chars,
+            layout_groups,
+            overlaps,
+            min_severity,
+            summary_only,
+            overlaps_unchecked=overlaps_unchecked,
+        )
+    )
+
+
+def iter_markdown_report(
+    old_name: str,
+    new_name: str,
+    added: List[Dict[str, Any]],
+    removed: List[Dict[str, Any]],
+    changed_rows: List[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    layout_groups: Optional[List[Dict[str, Any]]] = None,
+    overlaps: Optional[List[Dict[str, Any]]] = None,
+    min_severity: int = 1,
+    summary_only: bool = False,
+    chunk_lines: int = MARKDOWN_CHUNK_LINES,
+    overlaps_unchecked: int = 0,
+) -> Iterator[str]:
+    # Markdownレポートを chunk_lines 行ずつの文字列で返す（連結すると build_markdown_report と同じ）。
+    # 差分一覧は min_severity 以上の差分だけ載せ、summary_only なら差分一覧の代わりに変更オブジェクトの一覧を載せる。
+    buf: List[str] = []
+    for line in _markdown_lines(
+        old_name,
+        new_name,
+        added,
+        removed,
+        changed_rows,
+        changed_detail,
+        max_value_chars,
+        layout_groups or [],
+        overlaps or [],
+        min_severity,
+        summary_only,
+        overlaps_unchecked,
+    ):
+        buf.append(line)
+        if len(buf) >= chunk_lines:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    yield "\n".join(buf)
+
+
+def _markdown_lines(
+    old_name: str,
+    new_name: str,
+    added: List[Dict[str, Any]],
+    removed: List[Dict[str, Any]],
+    changed_rows: List[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int],
+    layout_groups: List[Dict[str, Any]],
+    overlaps: List[Dict[str, Any]],
+    min_severity: int,
+    summary_only: bool,
+    overlaps_unchecked: int,
+) -> Iterator[str]:
+    # Markdownレポートの行（改行なし）
+    if min_severity > 1:
+        # 件数・一覧も min_severity 以上の分だけにする（write_reports と同じ範囲）
+        scoped = select_report_scope(
+            {"changed_rows": changed_rows, "layout_groups": layout_groups}, min_severity
+        )
+        changed_rows, layout_groups = scoped["changed_rows"], scoped["layout_groups"]
+    yield "# 帳票DX テンプレート差分レポート"
+    yield ""
+    yield f"- 旧テンプレート: `{old_name}`"
+    yield f"- 新テンプレート: `{new_name}`"
+    if min_severity > 1:
+        emoji, label = SEVERITY_LEVELS[min_severity]
+        yield f"- 掲載範囲: {emoji} {label} 以上の差分"
+    if summary_only:
+        yield "- 掲載範囲: サマリーのみ（差分一覧なし）"
+    yield ""
+
+    layout_counts = layout_severity_counts(layout_groups)
+    total_critical = sum(r["critical_cnt"] for r in changed_rows) + layout_counts[3]
+    total_medium = sum(r["medium_cnt"] for r in changed_rows) + layout_counts[2]
+    total_minor = sum(r["minor_cnt"] for r in changed_rows) + layout_counts[1]
+
+    yield "## サマリー"
+    yield ""
+    yield f"- 追加オブジェクト数: **{len(added)}**"
+    yield f"- 削除オブジェクト数: **{len(removed)}**"
+    yield f"- 変更オブジェクト数: **{len(changed_rows)}**"
+    reid_count = sum(1 for r in changed_rows if "old_id" in r)
+    if reid_count:
+        yield f"  - うち ID が変わったオブジェクト: **{reid_count}**"
+    if layout_groups:
+        yield f"- まとめて移動・サイズ変更された領域: **{len(layout_groups)}**"
+    if overlaps:
+        yield f"- 新たに重なったオブジェクトの組: **{len(overlaps)}**"
+    if overlaps_unchecked:
+        yield f"  - 上限に達したため打ち切り（{overlaps_unchecked} オブジェクトの周りは未確認）"
+    yield f"- 重大変更(🔴): **{total_critical}**"
+    yield f"- 中変更(🟡): **{total_medium}**"
+    yield f"- 軽微変更(🟢): **{total_minor}**"
+    yield ""
+
+    for title, objects in (("追加されたオブジェクト", added), ("削除されたオブジェクト", removed)):
+        yield f"## {title}"
+        yield ""
+        if not objects:
+            yield "- なし"
+        else:
+            yield "| id | name | kind | type | x | y | width | height |"
+            yield "| --- | --- | --- | --- | --- | --- | --- | --- |"
+            for o in objects:
+                yield (
+                    f"| `{o.get('id')}` | {o.get('name','')} | {o.get('kind','')} | "
+                    f"{o.get('type','')} | {o.get('x','')} | {o.get('y','')} | "
+                    f"{o.get('width','')} | {o.get('height','')} |"
+                )
+        yield ""
+
+    if layout_groups:
+        yield "## まとめて移動・サイズ変更された領域"
+        yield ""
+        yield "| 重要度 | 種別 | 内容 | オブジェクト |"
+        yield "| --- | --- | --- | --- |"
+        for g in layout_groups:
+            emoji, label = SEVERITY_LEVELS[g["severity"]]
+            ids = ", ".join(f"`{i}`" for i in g["ids"][:5])
+            if len(g["ids"]) > 5:
+                ids += f" ほか {len(g['ids']) - 5} 件"
+            yield (
+                f"| {emoji} {label} | {LAYOUT_KIND_LABELS[g['kind']]} | "
+                f"{describe_layout_group(g)} | {ids} |"
+            )
+        yield ""
+
+    if overlaps:
+        yield "## 新たに重なったオブジェクト"
+        yield ""
+        if overlaps_unchecked:
+            yield f"上限に達したため打ち切り（{overlaps_unchecked} オブジェクトの周りは未確認）"
+            yield ""
+        yield "| id | id | 矩形 | 矩形 | 追加オブジェクトを含む |"
+        yield "| --- | --- | --- | --- | --- |"
+        for o in overlaps:
+            ra = ", ".join(f"{v:g}" for v in o["rect_a"])
+            rb = ", ".join(f"{v:g}" for v in o["rect_b"])
+            added_mark = "✔" if o["added"] else ""
+            yield f"| `{o['id_a']}` | `{o['id_b']}` | ({ra}) | ({rb}) | {added_mark} |"
+        yield ""
+
+    if summary_only:
+        yield "## 変更されたオブジェクト一覧"
+        yield ""
+        if not changed_rows:
+            yield "- なし"
+        else:
+            yield "| id | name | kind | type | 重大 | 中 | 軽微 |"
+            yield "| --- | --- | --- | --- | --- | --- | --- |"
+            for row in changed_rows:
+                yield (
+                    f"| `{row['id']}` | {row.get('name_new') or ''} | {row.get('kind') or ''} | "
+                    f"{row.get('type') or ''} | {row['critical_cnt']} | {row['medium_cnt']} | "
+                    f"{row['minor_cnt']} |"
+                )
+        yield ""
+        return
+
+    yield "## 変更されたオブジェクト詳細"
+    yield ""
+    if not changed_rows:
+        yield "- なし"
+        return
+    for row in changed_rows:
+        oid = row["id"]
+        det = changed_detail[oid]
+        yield f"### オブジェクト `{oid}`"
+        yield ""
+        if "old_id" in row:
+            yield f"- ID: `{row['old_id']}` → `{oid}`（類似度 {row['reid_score']}）"
+        yield f"- kind/type: `{row.get('kind')}` / `{row.get('type')}`"
+        yield f"- name: `{row.get('name_old')}` → `{row.get('name_new')}`"
+        yield (
+            f"- 変更件数: 重大={row.get('critical_cnt')} / 中={row.get('medium_cnt')} / 軽微={row.get('minor_cnt')}"
+        )
+        yield ""
+        yield "#### 差分一覧"
+        yield ""
+
+        diffs = [d for d in object_diffs(det) if d.severity >= min_severity]
+        if len(diffs) < row["total_changes"]:
+            yield f"先頭 {len(diffs)} 件のみ（全 {row['total_changes']} 件）"
+            yield ""
+        yield "| 重要度 | 種別 | パス | 旧値 | 新値 |"
+        yield "| --- | --- | --- | --- | --- |"
+        for d in sorted(diffs, key=lambda d: (-d.severity, d.path)):
+            emoji, label = SEVERITY_LEVELS[d.severity]
+            old_str = format_value(d.old, max_value_chars)
+            new_str = format_value(d.new, max_value_chars)
+            yield f"| {emoji} {label} | {OP_LABELS[d.op]} | `{d.path}` | `{old_str}` | `{new_str}` |"
+        yield ""
+
+
+def build_excel_report(
+    added: List[Dict[str, Any]],
+    removed: List[Dict[str, Any]],
+    changed_rows: List[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    layout_groups: Optional[List[Dict[str, Any]]] = None,
+    overlaps: Optional[List[Dict[str, Any]]] = None,
+    min_severity: int = 1,
+    summary_only: bool = False,
+) -> bytes:
+    # Excelレポート（複数シート）を生成。
+    # ファイルへ直接書き出す場合は ReportDX_xar_diff_excel.write_excel_report を使う（バイト列を保持しない）。
+    with io.BytesIO() as buffer:
+        write_excel_report(
+            buffer,
+            added,
+            removed,
+            changed_rows,
+            changed_detail,
+            max_value_chars,
+            layout_groups=layout_groups,
+            overlaps=overlaps,
+            min_severity=min_severity,
+            summary_only=summary_only,
+        )
+        return buffer.getvalue()
+
+
+def build_json_report(
+    result: Dict[str, Any], min_severity: int = 1, summary_only: bool = False
+) -> Dict[str, Any]:
+    # 機械処理向けのJSONレポート（json.dump 可能な dict）を生成。
+    # 差分一覧は min_severity 以上の差分だけ載せ、summary_only なら載せない（changed に diffs がない）。
+    if min_severity > 1:
+        result = select_report_scope(result, min_severity)
+    changed = []
+    for row in result["changed_rows"]:
+        if summary_only:
+            changed.append(dict(row))
+            continue
+        det = result["changed_detail"][row["id"]]
+        diffs = []
+        for d in sorted(object_diffs(det), key=lambda d: (-d.severity, d.path)):
+            if d.severity < min_severity:
+                continue
+            _emoji, label = SEVERITY_LEVELS[d.severity]
+            diffs.append(
+                {
+                    "severity": d.severity,
+                    "level": label,
+                    "op": d.op,
+                    "path": d.path,
+                    "old": value_for_json(d.old),
+                    "new": value_for_json(d.new),
+                }
+            )
+        changed.append(dict(row, diffs=diffs))
+
+    return {
+        "old_name": result["old_name"],
+        "new_name": result["new_name"],
+        "summary": summarize_result(result),
+        "added": result["added"],
+        "removed": result["removed"],
+        "changed": changed,
+        "layout_groups": result.get("layout_groups", []),
+        "overlaps": result.get("overlaps", []),
+    }
+
+
+def _report_value(v: Any, root: Any, segments: Segments) -> Any:
+    # JSONレポートの値を戻す。"$ref" の参照情報は、パスの位置にある値のハッシュが一致すれば
+    # ValueRef に戻し、見つからなければ参照情報の dict のまま残す
+    if not isinstance(v, dict) or not str(v.get("$ref", "")).startswith("blake2b:"):
+        return v
+    node = root
+    try:
+        for k in segments[1:]:
+            node = node[k]
+    except (KeyError, IndexError, TypeError):
+        return v
+    if not isinstance(node, (dict, list, str)):
+        return v
+    digest = structural_hash(node)
+    if digest.hex() != v["$ref"][len("blake2b:") :]:
+        return v
+    return ValueRef(node, v.get("preview", ""), digest)
+
+
+def result_from_json_report(
+    report: Dict[str, Any], idx_old: ObjectIndex, idx_new: ObjectIndex
+) -> Dict[str, Any]:
+    # build_json_report（min_severity=1、summary_only=False）の逆。差分一覧は report のものを使い、
+    # オブジェクト本体と概略は旧・新のインデックスから引く（ID が変わったオブジェクトは旧側を old_id で引く）。
+    # パスはキー名に "." や "[" を含むと元に戻らないことがある（parse_path と同じ）。
+    changed_rows: List[Dict[str, Any]] = []
+    changed_detail: Dict[str, Dict[str, Any]] = {}
+    for entry in report["changed"]:
+        row = {k: v for k, v in entry.items() if k != "diffs"}
+        oid = row["id"]
+        old_full, new_full = idx_old[row.get("old_id", oid)], idx_new[oid]
+        diffs = []
+        for d in entry["diffs"]:
+            segments = intern_path(parse_path(d["path"]))
+            diff = DiffEntry(
+                segments,
+                d["op"],
+                _report_value(d["old"], old_full, segments),
+                _report_value(d["new"], new_full, segments),
+            )
+            diff.severity = d["severity"]
+            diffs.append(diff)
+        changed_rows.append(row)
+        changed_detail[oid] = {
+            **{k: row[k] for k in ("old_id", "reid_score") if k in row},
+            "old_summary": summarize_object(old_full),
+            "new_summary": summarize_object(new_full),
+            "old_full": old_full,
+            "new_full": new_full,
+            "diffs": diffs,
+        }
+    return {
+        "old_name": report["old_name"],
+        "new_name": report["new_name"],
+        "added": report["added"],
+        "removed": report["removed"],
+        "changed_rows": changed_rows,
+        "changed_detail": changed_detail,
+        "layout_groups": report.get("layout_groups", []),
+        "overlaps": report.get("overlaps", []),
+        "overlaps_unchecked": report["summary"].get("overlaps_unchecked", 0),
+    }
+
+
+def write_reports(
+    result: Dict[str, Any],
+    out_dir: Union[str, Path],
+    formats: Sequence[str] = REPORT_FORMATS,
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    min_severity: int = 1,
+    summary_only: bool = False,
+    object_ids: Optional[Collection[str]] = None,
+) -> None:
+    # 差分結果から formats（md / xlsx / json）のレポートを out_dir に書き出す。
+    # min_severity / object_ids で載せる範囲を絞り（select_report_scope）、summary_only なら差分一覧を省く。
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if min_severity > 1 or object_ids is not None:
+        result = select_report_scope(result, min_severity, object_ids)
+    if "md" in formats:
+        # 組み立てた全文を持たずに少しずつ書き出す
+        with (out_dir / "xar_diff_report.md").open("w", encoding="utf-8") as f:
+            for chunk in iter_markdown_report(
+                old_name=result["old_name"],
+                new_name=result["new_name"],
+                added=result["added"],
+                removed=result["removed"],
+                changed_rows=result["changed_rows"],
+                changed_detail=result["changed_detail"],
+                max_value_chars=max_value_chars,
+                layout_groups=result.get("layout_groups"),
+                overlaps=result.get("overlaps"),
+                min_severity=min_severity,
+                summary_only=summary_only,
+                overlaps_unchecked=result.get("overlaps_unchecked", 0),
+            ):
+                f.write(chunk)
+    if "xlsx" in formats:
+        # 行を逐次ファイルへ書き出す（ブック全体をメモリに持たない）
+        write_excel_report(
+            out_dir / "xar_diff_report.xlsx",
+            added=result["added"],
+            removed=result["removed"],
+            changed_rows=result["changed_rows"],
+            changed_detail=result["changed_detail"],
+            max_value_chars=max_value_chars,
+            layout_groups=result.get("layout_groups"),
+            overlaps=result.get("overlaps"),
+            min_severity=min_severity,
+            summary_only=summary_only,
+        )
+    if "json" in formats:
+        with (out_dir / "xar_diff_report.json").open("w", encoding="utf-8") as f:
+            json.dump(
+                build_json_report(result, min_severity, summary_only),
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
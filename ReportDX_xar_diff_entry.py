@@ -0,0 +1,97 @@
+# 帳票DX テンプレート差分 差分エントリ
+#
+# deep_diff が返す差分1件分のレコード。dict の代わりに __slots__ のクラスにして、
+#   segments: パスのセグメント（キー名・添字）のタプル。同じパスは1つのタプルを共有する（intern_path）
+#   path:     "object.impl.tables[0].x" 形式の文字列。参照されたときに組み立てて保持する
+#   severity: 重要度（1〜3）。比較時に1回だけ判定する
+#   old/new:  旧値・新値（大きな値は ValueRef）
+# を持たせる。差分が数十万〜百万件になってもレコードあたりのメモリと生成コストを抑えられる。
+# レポート・画面はこのレコードをそのまま読む（d.path / d.op / d.old / d.new / d.severity）。
+
+import re
+from typing import Any, Dict, Tuple
+
+Segments = Tuple[Any, ...]
+
+# intern_path で共有するパスの最大数（超えたら新しいパスは共有しない）
+PATH_INTERN_MAX = 1 << 18
+
+ROOT_PATH = "(root)"
+
+_SEGMENT_RE = re.compile(r"\[(\d+)\]|([^.\[\]]+)")
+
+_interned: Dict[Segments, Segments] = {}
+
+
+def intern_path(segments: Segments) -> Segments:
+    # 同じ内容のパスタプルを1つにまとめる（多数のオブジェクトに同じパスの差分があるとき用）
+    hit = _interned.get(segments)
+    if hit is not None:
+        return hit
+    if len(_interned) < PATH_INTERN_MAX:
+        _interned[segments] = segments
+    return segments
+
+
+def render_path(segments: Segments) -> str:
+    # セグメントのタプルをパス文字列にする（キーは "."、添字は "[i]" で繋ぐ）
+    if not segments:
+        return ROOT_PATH
+    parts = []
+    for seg in segments:
+        if isinstance(seg, int):
+            parts.append(f"[{seg}]")
+        elif parts:
+            parts.append("." + seg)
+        else:
+            parts.append(seg)
+    return "".join(parts)
+
+
+def parse_path(text: str) -> Segments:
+    # render_path の逆（"object.impl.tables[0]" -> ("object", "impl", "tables", 0)）。
+    # キー名に "." や "[" を含むパスは元のセグメント列に戻らないことがある（表示・絞り込み用）。
+    text = text.strip()
+    if text in ("", ROOT_PATH):
+        return ()
+    return tuple(
+        int(index) if index else key for index, key in _SEGMENT_RE.findall(text)
+    )
+
+
+class DiffEntry:
+    # 差分1件（op は DIFF_OPS のいずれか。"moved" の old/new は移動元/移動先の添字）
+
+    __slots__ = ("segments", "op", "old", "new", "severity", "_path")
+
+    def __init__(self, segments: Segments, op: str, old: Any, new: Any) -> None:
+        self.segments = segments
+        self.op = op
+        self.old = old
+        self.new = new
+        self.severity = 0
+        self._path = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = render_path(self.segments)
+        return self._path
+
+    def __getitem__(self, key: str) -> Any:
+        # 従来の dict 形式（d["path"] など）で読むコード向け
+        if key not in ("path", "op", "old", "new", "severity"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        # プロセス間の受け渡しではパス文字列を送らない
+        return (self.segments, self.op, self.old, self.new, self.severity)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        self.segments, self.op, self.old, self.new, self.severity = state
+        self.segments = intern_path(self.segments)
+        self._path = None
+
+    def __repr__(self) -> str:
+        return f"DiffEntry({self.path!r}, {self.op!r}, {self.old!r}, {self.new!r}, severity={self.severity})"
@@ -0,0 +1,375 @@
+# 帳票DX テンプレート差分 Excelレポート書き出し
+#
+# xlsxwriter の constant_memory モードで、行を1行ずつ直接ファイル（またはファイルライク）へ書き出す。
+# DataFrame もシート全体のセルも保持しないので、差分が数十万行あってもメモリ使用量はほぼ一定。
+# constant_memory では行を上から順にしか書けないため、見出し・列幅・ウィンドウ枠の固定は先に設定し、
+# オートフィルタは最終行が決まってから範囲だけ設定する（どちらもセルの書き込みコストは増えない）。
+# xlsxwriter は Excel を書き出すときに初めて import する（読み込み・比較だけのプロセスの起動を軽くする）。
+
+import json
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+
+from ReportDX_xar_diff_rules import SEVERITY_LEVELS
+from ReportDX_xar_diff_values import DEFAULT_REPORT_MAX_VALUE_CHARS, format_value
+
+# Excel の1セルに入る最大文字数
+EXCEL_MAX_CELL_CHARS = 32767
+
+TRUNCATED_MARK = "…（{} 文字省略）"
+
+DETAIL_COLUMNS: Tuple[str, ...] = (
+    "id",
+    "name_old",
+    "name_new",
+    "kind",
+    "type",
+    "severity",
+    "level",
+    "emoji",
+    "op",
+    "path",
+    "old",
+    "new",
+)
+
+LAYOUT_COLUMNS: Tuple[str, ...] = (
+    "kind",
+    "dx",
+    "dy",
+    "dw",
+    "dh",
+    "count",
+    "x",
+    "y",
+    "width",
+    "height",
+    "severity",
+    "level",
+    "emoji",
+    "ids",
+)
+
+OVERLAP_COLUMNS: Tuple[str, ...] = (
+    "id_a",
+    "id_b",
+    "x_a",
+    "y_a",
+    "width_a",
+    "height_a",
+    "x_b",
+    "y_b",
+    "width_b",
+    "height_b",
+    "added",
+)
+
+THREE_WAY_COLUMNS: Tuple[str, ...] = (
+    "id",
+    "name",
+    "status",
+    "severity",
+    "level",
+    "emoji",
+    "path",
+    "base",
+    "a",
+    "b",
+)
+
+# 列幅（文字数）。未指定の列は既定幅。
+_COLUMN_WIDTHS = {
+    "id": 24,
+    "name": 24,
+    "name_old": 24,
+    "name_new": 24,
+    "type": 16,
+    "id_a": 24,
+    "id_b": 24,
+    "ids": 60,
+    "path": 48,
+    "old": 60,
+    "new": 60,
+    "base": 48,
+    "a": 48,
+    "b": 48,
+}
+
+ExcelTarget = Union[str, Path, BinaryIO]
+
+
+def excel_text(value: str, limit: int = EXCEL_MAX_CELL_CHARS) -> str:
+    # セルの上限文字数に収まるよう切り詰める（切り詰めた場合は省略文字数を末尾に付ける）
+    if len(value) <= limit:
+        return value
+    keep = limit - len(TRUNCATED_MARK.format(len(value)))
+    # 省略文字数の桁が減った分だけ残す文字を増やす
+    keep = max(limit - len(TRUNCATED_MARK.format(len(value) - keep)), 0)
+    return value[:keep] + TRUNCATED_MARK.format(len(value) - keep)
+
+
+def iter_detail_rows(
+    changed_rows: Iterable[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    min_severity: int = 1,
+) -> Iterator[Tuple[Any, ...]]:
+    # ChangedDetails シートの行（DETAIL_COLUMNS 順のタプル）を1行ずつ返す（min_severity 以上の差分だけ）
+    from ReportDX_xar_diff_engine import object_diffs
+
+    for row in changed_rows:
+        oid = row["id"]
+        for d in object_diffs(changed_detail[oid]):
+            if d.severity < min_severity:
+                continue
+            emoji, label = SEVERITY_LEVELS[d.severity]
+            yield (
+                oid,
+                row.get("name_old"),
+                row.get("name_new"),
+                row.get("kind"),
+                row.get("type"),
+                d.severity,
+                label,
+                emoji,
+                d.op,
+                d.path,
+                format_value(d.old, max_value_chars),
+                format_value(d.new, max_value_chars),
+            )
+
+
+def iter_layout_rows(layout_groups: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Any, ...]]:
+    # LayoutGroups シートの行（LAYOUT_COLUMNS 順。x〜height は旧テンプレートでの領域）
+    for g in layout_groups:
+        emoji, label = SEVERITY_LEVELS[g["severity"]]
+        yield (
+            g["kind"],
+            g["dx"],
+            g["dy"],
+            g["dw"],
+            g["dh"],
+            g["count"],
+            *g["old_bbox"],
+            g["severity"],
+            label,
+            emoji,
+            ", ".join(g["ids"]),
+        )
+
+
+def iter_overlap_rows(overlaps: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Any, ...]]:
+    # Overlaps シートの行（OVERLAP_COLUMNS 順）
+    for o in overlaps:
+        yield (o["id_a"], o["id_b"], *o["rect_a"], *o["rect_b"], o["added"])
+
+
+def iter_three_way_rows(
+    rows: Iterable[Dict[str, Any]],
+    detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> Iterator[Tuple[Any, ...]]:
+    # 3者比較の Paths シートの行（THREE_WAY_COLUMNS 順。a / b は「変更: 値」などの表示）
+    from ReportDX_xar_diff_threeway import (
+        THREE_WAY_STATUS_LABELS,
+        describe_base,
+        describe_side,
+        sorted_entries,
+    )
+
+    for row in rows:
+        oid = row["id"]
+        for t in sorted_entries(detail[oid]["entries"]):
+            emoji, label = SEVERITY_LEVELS[t.severity]
+            yield (
+                oid,
+                row.get("name"),
+                THREE_WAY_STATUS_LABELS[t.status],
+                t.severity,
+                label,
+                emoji,
+                t.path,
+                describe_base(t, max_value_chars) or None,
+                describe_side(t, "a", max_value_chars),
+                describe_side(t, "b", max_value_chars),
+            )
+
+
+def _columns(rows: Sequence[Dict[str, Any]], default: Sequence[str]) -> List[str]:
+    # 全行のキーを出現順に集めて列にする（DataFrame(rows) と同じ並び）
+    if not rows:
+        return list(default)
+    seen: Dict[str, None] = {}
+    for r in rows:
+        for k in r:
+            seen.setdefault(k, None)
+    return list(seen)
+
+
+class _SheetWriter:
+    # 1シート分の逐次書き込み（見出し行 + データ行）
+
+    def __init__(
+        self, workbook: Any, name: str, columns: Sequence[str], header_format: Any
+    ) -> None:
+        self.ws = workbook.add_worksheet(name)
+        self.columns = list(columns)
+        self.row = 1
+        self.truncated = 0
+        for col, title in enumerate(self.columns):
+            width = _COLUMN_WIDTHS.get(title)
+            if width:
+                self.ws.set_column(col, col, width)
+        self.ws.freeze_panes(1, 0)
+        self.ws.write_row(0, 0, self.columns, header_format)
+
+    def write(self, values: Iterable[Any]) -> None:
+        ws, r = self.ws, self.row
+        for col, v in enumerate(values):
+            if v is None:
+                continue
+            if isinstance(v, bool):
+                ws.write_boolean(r, col, v)
+            elif isinstance(v, (int, float)):
+                ws.write_number(r, col, v)
+            else:
+                if not isinstance(v, str):
+                    v = json.dumps(v, ensure_ascii=False)
+                if len(v) > EXCEL_MAX_CELL_CHARS:
+                    v = excel_text(v)
+                    self.truncated += 1
+                ws.write_string(r, col, v)
+        self.row += 1
+
+    def close(self) -> None:
+        # 見出し行 + データ行の範囲にオートフィルタを設定する
+        self.ws.autofilter(0, 0, max(self.row - 1, 0), max(len(self.columns) - 1, 0))
+
+
+def _open_workbook(target: ExcelTarget) -> Any:
+    # 行ごとに書き出す（constant_memory）Workbook を開く
+    import xlsxwriter
+
+    if isinstance(target, Path):
+        target = str(target)
+    return xlsxwriter.Workbook(
+        target,
+        {
+            "constant_memory": True,
+            # 値はすべて文字列として書く（"=" で始まる値や URL を数式・リンクにしない）
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "strings_to_numbers": False,
+            "nan_inf_to_errors": True,
+        },
+    )
+
+
+def write_excel_report(
+    target: ExcelTarget,
+    added: Sequence[Dict[str, Any]],
+    removed: Sequence[Dict[str, Any]],
+    changed_rows: Sequence[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    layout_groups: Optional[Sequence[Dict[str, Any]]] = None,
+    overlaps: Optional[Sequence[Dict[str, Any]]] = None,
+    min_severity: int = 1,
+    summary_only: bool = False,
+) -> Dict[str, int]:
+    # Excelレポート（Added / Removed / ChangedSummary / ChangedDetails）を target に書き出し、
+    # シートごとの行数と切り詰めたセル数を返す。target はファイルパスか書き込み可能なバイナリストリーム。
+    # 旧値・新値は1件あたり max_value_chars 文字まで（None でもセルの上限文字数で切り詰める）。
+    # layout_groups / overlaps があれば LayoutGroups / Overlaps シートも書く。
+    # ChangedDetails には min_severity 以上の差分だけを書き、summary_only ならシートごと省く。
+    if min_severity > 1:
+        # 件数・一覧も min_severity 以上の分だけにする（write_reports と同じ範囲）
+        from ReportDX_xar_diff_engine import select_report_scope
+
+        scoped = select_report_scope(
+            {"changed_rows": changed_rows, "layout_groups": layout_groups or []}, min_severity
+        )
+        changed_rows, layout_groups = scoped["changed_rows"], scoped["layout_groups"]
+
+    workbook = _open_workbook(target)
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    stats: Dict[str, int] = {"truncated_cells": 0}
+    try:
+        summary_sheets = (("Added", added), ("Removed", removed), ("ChangedSummary", changed_rows))
+        for name, rows in summary_sheets:
+            columns = _columns(rows, ("id", "name"))
+            sheet = _SheetWriter(workbook, name, columns, header_format)
+            for r in rows:
+                sheet.write(r.get(c) for c in sheet.columns)
+            sheet.close()
+            stats[name] = sheet.row - 1
+            stats["truncated_cells"] += sheet.truncated
+
+        # Changed details (flattened)
+        if not summary_only:
+            sheet = _SheetWriter(workbook, "ChangedDetails", DETAIL_COLUMNS, header_format)
+            for values in iter_detail_rows(
+                changed_rows, changed_detail, max_value_chars, min_severity
+            ):
+                sheet.write(values)
+            sheet.close()
+            stats["ChangedDetails"] = sheet.row - 1
+            stats["truncated_cells"] += sheet.truncated
+
+        extra_sheets = (
+            ("LayoutGroups", LAYOUT_COLUMNS, layout_groups, iter_layout_rows),
+            ("Overlaps", OVERLAP_COLUMNS, overlaps, iter_overlap_rows),
+        )
+        for name, columns, items, iter_rows in extra_sheets:
+            if not items:
+                continue
+            sheet = _SheetWriter(workbook, name, columns, header_format)
+            for values in iter_rows(items):
+                sheet.write(values)
+            sheet.close()
+            stats[name] = sheet.row - 1
+            stats["truncated_cells"] += sheet.truncated
+    finally:
+        workbook.close()
+    return stats
+
+
+def write_three_way_excel_report(
+    target: ExcelTarget,
+    rows: Sequence[Dict[str, Any]],
+    detail: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> Dict[str, int]:
+    # 3者比較の Excelレポート（Objects / Paths）を target に書き出し、シートごとの行数と切り詰めたセル数を返す
+    workbook = _open_workbook(target)
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    stats: Dict[str, int] = {"truncated_cells": 0}
+    try:
+        sheet = _SheetWriter(workbook, "Objects", _columns(rows, ("id", "name")), header_format)
+        for r in rows:
+            sheet.write(r.get(c) for c in sheet.columns)
+        sheet.close()
+        stats["Objects"] = sheet.row - 1
+        stats["truncated_cells"] += sheet.truncated
+
+        sheet = _SheetWriter(workbook, "Paths", THREE_WAY_COLUMNS, header_format)
+        for values in iter_three_way_rows(rows, detail, max_value_chars):
+            sheet.write(values)
+        sheet.close()
+        stats["Paths"] = sheet.row - 1
+        stats["truncated_cells"] += sheet.truncated
+    finally:
+        workbook.close()
+    return stats
@@ -0,0 +1,313 @@
+# 帳票DX テンプレート差分 レイアウト解析
+#
+# 1. まとめて移動・サイズ変更されたオブジェクト群の検出
+#    rect の変化量 (dx, dy, dw, dh) が同じオブジェクトを集め、その中で旧 rect が近接している
+#    （LAYOUT_REGION_GAP 以内）ものを1つの領域とする。LAYOUT_MIN_GROUP 件以上の領域は
+#    個々の rect.x / rect.y（/ width / height）の差分を外し、「領域を (dx, dy) 移動」の1件にまとめる。
+#    外す差分は旧/新の rect の値から決まるので、差分一覧を保持していない（件数だけの）比較結果にも使える。
+# 2. 新たに生じた重なりの検出
+#    新テンプレートで rect が部分的に重なっていて、旧テンプレートでは重なっていなかった組を返す
+#    （片方がもう片方に完全に含まれる配置は枠や背景として普通なので対象外）。
+#    密集した配置では組が膨大になるので、MAX_NEW_OVERLAPS 組見つかったところで打ち切る。
+# どちらも一様グリッドの空間インデックスで近傍だけを調べるので、総当たりにはならない。
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from ReportDX_xar_diff_rules import SEVERITY_COUNT_KEYS, get_severity_rules, severity_counts
+
+# 1つの領域としてまとめる最小のオブジェクト数
+LAYOUT_MIN_GROUP = 3
+
+# 同じ領域とみなすオブジェクト間の最大の隙間（座標値の単位）
+LAYOUT_REGION_GAP = 10.0
+
+# 変化量を同じとみなす丸め桁数
+LAYOUT_DELTA_DIGITS = 6
+
+# 新たな重なりを探すのをやめる組数（None なら無制限）
+MAX_NEW_OVERLAPS = 1000
+
+# 1つの領域にまとめたときに外す rect の差分パスと、object_rect の値の位置
+_MOVE_PATHS = ((("object", "rect", "x"), 0), (("object", "rect", "y"), 1))
+_RESIZE_PATHS = ((("object", "rect", "width"), 2), (("object", "rect", "height"), 3))
+
+LAYOUT_KIND_LABELS = {"move": "移動", "resize": "サイズ変更", "move_resize": "移動・サイズ変更"}
+
+Rect = Tuple[float, float, float, float]
+
+
+def object_rect(o: Any) -> Optional[Rect]:
+    # オブジェクトの rect を (x, y, width, height) で返す（数値でない項目があれば None）
+    rect = o.get("rect") if isinstance(o, dict) else None
+    if not isinstance(rect, dict):
+        return None
+    values = (rect.get("x"), rect.get("y"), rect.get("width"), rect.get("height"))
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return None
+    return values  # type: ignore[return-value]
+
+
+def _bbox(rects: Iterable[Rect]) -> Tuple[float, float, float, float]:
+    # 外接矩形 (x, y, width, height)
+    rects = list(rects)
+    x0 = min(r[0] for r in rects)
+    y0 = min(r[1] for r in rects)
+    x1 = max(r[0] + r[2] for r in rects)
+    y1 = max(r[1] + r[3] for r in rects)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+class _Grid:
+    # 一様グリッドの空間インデックス（セルごとに矩形の番号を持つ）
+
+    def __init__(self, rects: List[Rect], margin: float = 0.0) -> None:
+        # statistics は decimal / fractions ごと読み込むので、使うときに import する
+        import statistics
+
+        self.rects = rects
+        self.margin = margin
+        sizes = [max(r[2], r[3]) for r in rects if max(r[2], r[3]) > 0]
+        # セルは典型的なオブジェクトの倍程度（大きな矩形は複数セルに入る）
+        self.cell = max(2 * statistics.median(sizes) if sizes else 1.0, 2 * margin, 1e-9)
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, r in enumerate(rects):
+            for key in self._cells_of(r):
+                self.cells[key].append(i)
+
+    def _cells_of(self, r: Rect) -> Iterator[Tuple[int, int]]:
+        m, c = self.margin, self.cell
+        for cx in range(int((r[0] - m) // c), int((r[0] + r[2] + m) // c) + 1):
+            for cy in range(int((r[1] - m) // c), int((r[1] + r[3] + m) // c) + 1):
+                yield (cx, cy)
+
+    def neighbors(self, i: int) -> Set[int]:
+        # 矩形 i と同じセルに入っている矩形（i 自身を除く）
+        out: Set[int] = set()
+        for key in self._cells_of(self.rects[i]):
+            out.update(self.cells.get(key, ()))
+        out.discard(i)
+        return out
+
+    def candidate_pairs(self) -> Set[Tuple[int, int]]:
+        # 同じセルに入っている矩形の組（i < j）
+        pairs: Set[Tuple[int, int]] = set()
+        for members in self.cells.values():
+            for n, i in enumerate(members):
+                for j in members[n + 1 :]:
+                    pairs.add((i, j) if i < j else (j, i))
+        return pairs
+
+
+def _near(a: Rect, b: Rect, gap: float) -> bool:
+    # 2つの矩形の隙間が gap 以下か
+    return (
+        a[0] <= b[0] + b[2] + gap
+        and b[0] <= a[0] + a[2] + gap
+        and a[1] <= b[1] + b[3] + gap
+        and b[1] <= a[1] + a[3] + gap
+    )
+
+
+def _partial_overlap(a: Rect, b: Rect) -> bool:
+    # 面積を持って重なり、かつどちらも他方に完全には含まれない
+    ix = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    iy = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return False
+
+    def contains(p: Rect, q: Rect) -> bool:
+        return (
+            p[0] <= q[0]
+            and p[1] <= q[1]
+            and q[0] + q[2] <= p[0] + p[2]
+            and q[1] + q[3] <= p[1] + p[3]
+        )
+
+    return not contains(a, b) and not contains(b, a)
+
+
+def _clusters(rects: List[Rect], gap: float) -> List[List[int]]:
+    # 隙間 gap 以内で連結している矩形の集まり（Union-Find）
+    parent = list(range(len(rects)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in _Grid(rects, margin=gap / 2).candidate_pairs():
+        if _near(rects[i], rects[j], gap):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(rects)):
+        groups[find(i)].append(i)
+    return list(groups.values())
+
+
+def group_layout_shifts(
+    changed_rows: List[Dict[str, Any]],
+    changed_detail: Dict[str, Any],
+    min_group: int = LAYOUT_MIN_GROUP,
+    gap: float = LAYOUT_REGION_GAP,
+) -> List[Dict[str, Any]]:
+    # まとめて移動・サイズ変更された領域を検出し、該当する rect の差分を各オブジェクトから外す。
+    # changed_rows / changed_detail はその場で更新する（件数を減らし、外したパスを detail の
+    # collapsed に記録する。差分がなくなったオブジェクトは一覧から外す）。
+    # 戻り値: 領域ごとの {kind, dx, dy, dw, dh, count, ids, old_bbox, new_bbox, severity}
+    by_delta: Dict[Tuple[float, ...], List[Tuple[str, Rect, Rect]]] = defaultdict(list)
+    for row in changed_rows:
+        det = changed_detail[row["id"]]
+        a = object_rect(det["old_full"])
+        b = object_rect(det["new_full"])
+        if a is None or b is None:
+            continue
+        delta = tuple(round(b[k] - a[k], LAYOUT_DELTA_DIGITS) for k in range(4))
+        if any(delta):
+            by_delta[delta].append((row["id"], a, b))
+
+    rules = get_severity_rules()
+    rows_by_id = {row["id"]: row for row in changed_rows}
+    groups: List[Dict[str, Any]] = []
+    emptied: Set[str] = set()
+    for delta, members in by_delta.items():
+        if len(members) < min_group:
+            continue
+        dx, dy, dw, dh = delta
+        moved, resized = bool(dx or dy), bool(dw or dh)
+        paths = (_MOVE_PATHS if moved else ()) + (_RESIZE_PATHS if resized else ())
+        for cluster in _clusters([m[1] for m in members], gap):
+            if len(cluster) < min_group:
+                continue
+            severity = 1
+            for n in cluster:
+                oid, a, b = members[n]
+                # 値が変わっている rect の項目には、そのパスの差分がちょうど1件ある
+                removed = {path for path, k in paths if a[k] != b[k]}
+                row = rows_by_id[oid]
+                for path in removed:
+                    level = rules.severity_of(path)
+                    severity = max(severity, level)
+                    row[SEVERITY_COUNT_KEYS[level]] -= 1
+                    row["total_changes"] -= 1
+                det = changed_detail[oid]
+                det["collapsed"] = removed
+                if det["diffs"] is not None:
+                    det["diffs"] = [d for d in det["diffs"] if d.segments not in removed]
+                if row["total_changes"] == 0:
+                    emptied.add(oid)
+            ids = sorted(members[n][0] for n in cluster)
+            old_rects = [members[n][1] for n in cluster]
+            old_bbox = _bbox(old_rects)
+            groups.append(
+                {
+                    "kind": "move_resize" if moved and resized else ("move" if moved else "resize"),
+                    "dx": dx,
+                    "dy": dy,
+                    "dw": dw,
+                    "dh": dh,
+                    "count": len(ids),
+                    "ids": ids,
+                    "old_bbox": old_bbox,
+                    "new_bbox": _bbox(
+                        (r[0] + dx, r[1] + dy, r[2] + dw, r[3] + dh) for r in old_rects
+                    ),
+                    "severity": severity,
+                }
+            )
+
+    if emptied:
+        changed_rows[:] = [row for row in changed_rows if row["id"] not in emptied]
+        for oid in emptied:
+            del changed_detail[oid]
+
+    groups.sort(key=lambda g: (-g["count"], g["ids"][0]))
+    return groups
+
+
+def find_new_overlaps(
+    idx_old: Dict[str, Any],
+    idx_new: Dict[str, Any],
+    old_ids: Optional[Dict[str, str]] = None,
+    max_overlaps: Optional[int] = MAX_NEW_OVERLAPS,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    # 新テンプレートで部分的に重なっていて、旧テンプレートでは重なっていなかったオブジェクトの組。
+    # old_ids は ID が変わったオブジェクトの {新ID: 旧ID}。
+    # 戻り値: [{id_a, id_b, rect_a, rect_b, added}]（added は旧側に片方でも存在しなかった組）
+    # max_overlaps 組見つかったら打ち切り、stats["unchecked"] に近傍を調べきれなかった
+    # （rect が変わった・追加された）オブジェクトの数を書く（0 なら打ち切っていない）。
+    # 旧テンプレートと同じ位置・大きさのオブジェクト同士の重なりは変わらないので、
+    # rect が変わった（または追加された）オブジェクトの近傍だけを調べる
+    old_ids = old_ids or {}
+    stats = {} if stats is None else stats
+    stats["unchecked"] = 0
+    ids: List[str] = []
+    rects: List[Rect] = []
+    old_rects: List[Optional[Rect]] = []
+    moved: List[int] = []
+    for oid, o in idx_new.items():
+        r = object_rect(o)
+        if r is None or r[2] <= 0 or r[3] <= 0:
+            continue
+        o_old = idx_old.get(old_ids.get(oid, oid))
+        a = object_rect(o_old) if o_old is not None else None
+        if a != r:
+            moved.append(len(ids))
+        ids.append(oid)
+        rects.append(r)
+        old_rects.append(a)
+    if not moved or len(rects) < 2:
+        return []
+
+    grid = _Grid(rects)
+    seen: Set[Tuple[int, int]] = set()
+    overlaps: List[Dict[str, Any]] = []
+    for n, i in enumerate(moved):
+        for j in grid.neighbors(i):
+            if max_overlaps is not None and len(overlaps) >= max_overlaps:
+                # 途中まで調べたオブジェクトも未確認として数える
+                stats["unchecked"] = len(moved) - n
+                break
+            pair = (i, j) if ids[i] < ids[j] else (j, i)
+            if pair in seen:
+                continue
+            seen.add(pair)
+            if not _partial_overlap(rects[i], rects[j]):
+                continue
+            a, b = old_rects[i], old_rects[j]
+            if a is not None and b is not None and _partial_overlap(a, b):
+                continue
+            p, q = pair
+            overlaps.append(
+                {
+                    "id_a": ids[p],
+                    "id_b": ids[q],
+                    "rect_a": rects[p],
+                    "rect_b": rects[q],
+                    "added": a is None or b is None,
+                }
+            )
+        if stats["unchecked"]:
+            break
+    overlaps.sort(key=lambda o: (o["id_a"], o["id_b"]))
+    return overlaps
+
+
+def layout_severity_counts(groups: Iterable[Dict[str, Any]]) -> Dict[int, int]:
+    # まとめた領域を1件ずつ数えた重要度別件数
+    return severity_counts(g["severity"] for g in groups)
+
+
+def describe_layout_group(g: Dict[str, Any]) -> str:
+    # 「領域を (dx, dy) 移動」のような1行の説明
+    parts = []
+    if g["dx"] or g["dy"]:
+        parts.append(f"({g['dx']:+g}, {g['dy']:+g}) 移動")
+    if g["dw"] or g["dh"]:
+        parts.append(f"大きさ ({g['dw']:+g}, {g['dh']:+g})")
+    x, y, w, h = g["old_bbox"]
+    return f"{g['count']} オブジェクトの領域 (x={x:g}, y={y:g}, {w:g}×{h:g}) を " + "・".join(parts)
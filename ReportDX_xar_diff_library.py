@@ -0,0 +1,338 @@
+# 帳票DX テンプレート差分 ライブラリ一括比較
+#
+# フォルダまたは ZIP バンドルにまとめた .xar 群同士を、ライブラリ内の相対パスで対応付けて比較する。
+# 展開する前に ZIP の中央ディレクトリだけを見て、変わっていないテンプレートは読まずに飛ばす。
+#   1. バンドル同士: バンドル内の .xar エントリの CRC32・サイズが同じなら .xar を読まない
+#   2. .xar 同士:    .xar 内の .xat エントリの CRC32・展開後サイズが同じなら .xat を展開しない
+# 残った（変更の可能性がある）ものだけをプロセスプールで読み込んで比較し、
+# テンプレートごとの状態と重要度別件数の一覧（サマリー表）を返す。
+# 個別テンプレートの差分結果・レポートは compare_library_entry() で必要になったときに作る。
+
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from ReportDX_xar_diff_engine import (
+    DEFAULT_LIST_KEYS,
+    compare_indexes,
+    summarize_result,
+    write_reports,
+)
+from ReportDX_xar_diff_stream import find_xat_member, load_xar_streaming
+from ReportDX_xar_diff_values import DEFAULT_REPORT_MAX_VALUE_CHARS
+
+LIBRARY_SUFFIX = ".xar"
+
+# テンプレートの状態
+LIBRARY_STATUSES = ("added", "removed", "changed", "unchanged", "error")
+STATUS_LABELS = {
+    "added": "追加",
+    "removed": "削除",
+    "changed": "変更",
+    "unchanged": "変更なし",
+    "error": "エラー",
+}
+
+# 読まずに「変更なし」と判定した理由
+SKIPPED_BY_BUNDLE = "bundle_crc"
+SKIPPED_BY_XAT = "xat_crc"
+
+LibrarySource = Union[str, Path, BinaryIO]
+
+# ライブラリ内の .xar 1件（container はファイルパスかファイルライク、member はバンドル内のエントリ名）
+LibraryEntry = Dict[str, Any]
+
+
+# --- ライブラリの一覧 ---------------------------------------------------------
+
+
+def _strip_common_root(names: List[str]) -> List[str]:
+    # 全エントリが同じトップレベルのフォルダ配下にあれば、そのフォルダ名を除く
+    # （lib_v1/a.xar と lib_v2/a.xar を a.xar 同士として対応付けるため）
+    roots = {n.split("/", 1)[0] for n in names}
+    if len(roots) == 1 and all("/" in n for n in names):
+        return [n.split("/", 1)[1] for n in names]
+    return names
+
+
+def list_library(source: LibrarySource) -> Dict[str, LibraryEntry]:
+    # フォルダ（配下を再帰的に探索）または ZIP バンドル内の .xar を {名前: エントリ} で返す。
+    # 名前はライブラリ内の相対パス（区切りは "/"）。
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        root = Path(source)
+        entries: Dict[str, LibraryEntry] = {}
+        for p in sorted(root.rglob("*" + LIBRARY_SUFFIX)):
+            if not p.is_file():
+                continue
+            name = p.relative_to(root).as_posix()
+            entries[name] = {
+                "name": name,
+                "container": str(p),
+                "member": None,
+                "size": p.stat().st_size,
+                "crc": None,
+            }
+        return entries
+
+    if isinstance(source, Path):
+        source = str(source)
+    with zipfile.ZipFile(source) as z:
+        infos = [
+            info
+            for info in z.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(LIBRARY_SUFFIX)
+        ]
+    names = _strip_common_root([info.filename for info in infos])
+    return {
+        name: {
+            "name": name,
+            "container": source,
+            "member": info.filename,
+            "size": info.file_size,
+            "crc": info.CRC,
+        }
+        for name, info in sorted(zip(names, infos))
+    }
+
+
+def library_from_files(files: Sequence[Any]) -> Dict[str, LibraryEntry]:
+    # 個別の .xar と ZIP バンドル（パスまたは name 属性を持つファイルライク）の並びをライブラリとして扱う。
+    # .xar はファイル名、バンドル内の .xar はバンドル内の相対パスを名前にする。
+    # 名前が重なると比較の対応付けが決まらないので ValueError にする。
+    entries: Dict[str, LibraryEntry] = {}
+    for f in files:
+        source_name = str(getattr(f, "name", f))
+        if source_name.lower().endswith(".zip"):
+            found = list_library(f)
+        else:
+            name = Path(source_name).name
+            size = getattr(f, "size", None)
+            if size is None:
+                size = os.path.getsize(f)
+            found = {
+                name: {"name": name, "container": f, "member": None, "size": size, "crc": None}
+            }
+        for name, entry in found.items():
+            if name in entries:
+                raise ValueError(f"テンプレート名が重複しています: {name}（{Path(source_name).name}）")
+            entries[name] = entry
+    return dict(sorted(entries.items()))
+
+
+def read_entry(entry: LibraryEntry) -> Union[str, bytes, BinaryIO]:
+    # load_xar_streaming にそのまま渡せる読み込み元（バンドル内の .xar はバイト列として取り出す）
+    if entry["member"] is None:
+        return entry["container"]
+    with zipfile.ZipFile(entry["container"]) as z:
+        return z.read(entry["member"])
+
+
+def xat_fingerprint(source: Union[str, bytes, BinaryIO]) -> Tuple[int, int]:
+    # .xar 内の .xat の (CRC32, 展開後サイズ)。中央ディレクトリだけを読み、.xat は展開しない。
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    elif not isinstance(source, (str, Path)):
+        source.seek(0)
+    with zipfile.ZipFile(source) as z:
+        info = find_xat_member(z)
+        return info.CRC, info.file_size
+
+
+# --- 比較 ---------------------------------------------------------------------
+
+
+def _same_bundle_member(old: LibraryEntry, new: LibraryEntry) -> bool:
+    # 両方がバンドル内のエントリで、CRC32 とサイズが一致する
+    return (
+        old["crc"] is not None
+        and new["crc"] is not None
+        and (old["crc"], old["size"]) == (new["crc"], new["size"])
+    )
+
+
+def _entry_label(entry: LibraryEntry) -> str:
+    return Path(entry["name"]).name
+
+
+def compare_library_entry(
+    old: LibraryEntry,
+    new: LibraryEntry,
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    match_reid: bool = True,
+    analyze_layout: bool = True,
+) -> Dict[str, Any]:
+    # 1テンプレート分の差分結果一式（compare_indexes の結果。レポート作成用）
+    _m, idx_old, _s = load_xar_streaming(read_entry(old))
+    _m, idx_new, _s = load_xar_streaming(read_entry(new))
+    return compare_indexes(
+        idx_old,
+        idx_new,
+        old_name=_entry_label(old),
+        new_name=_entry_label(new),
+        list_mode=list_mode,
+        list_keys=list_keys,
+        match_reid=match_reid,
+        analyze_layout=analyze_layout,
+    )
+
+
+def _compare_pair(task: Dict[str, Any]) -> Dict[str, Any]:
+    # 変更の可能性がある1組を比較し、サマリー行の集計部分を返す（ワーカープロセスで実行）
+    old, new = task["old"], task["new"]
+    row: Dict[str, Any] = {}
+    try:
+        old_src = read_entry(old)
+        new_src = read_entry(new)
+        if xat_fingerprint(old_src) == xat_fingerprint(new_src):
+            return {"status": "unchanged", "skipped_by": SKIPPED_BY_XAT}
+
+        _m, idx_old, _s = load_xar_streaming(old_src)
+        _m, idx_new, _s = load_xar_streaming(new_src)
+        result = compare_indexes(
+            idx_old,
+            idx_new,
+            old_name=_entry_label(old),
+            new_name=_entry_label(new),
+            list_mode=task["list_mode"],
+            list_keys=task["list_keys"],
+            match_reid=task["match_reid"],
+            analyze_layout=task["analyze_layout"],
+            # レポートを書かないなら件数だけ数える（差分一覧は作らない）
+            detail="full" if task.get("report_dir") else "counts",
+        )
+        summary = summarize_result(result)
+        row.update(summary)
+        # .xat が書き直されただけ（キー順・空白など）なら差分は0件になる
+        row["status"] = (
+            "changed" if summary["added"] or summary["removed"] or summary["changed"] else "unchanged"
+        )
+        if row["status"] == "changed" and task.get("report_dir"):
+            write_reports(
+                result,
+                Path(task["report_dir"]) / report_dir_name(old["name"]),
+                task["formats"],
+                task["max_value_chars"],
+            )
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def report_dir_name(name: str) -> str:
+    # テンプレート名（相対パス）からレポートの出力先を決める（拡張子を除く）
+    return name[: -len(LIBRARY_SUFFIX)] if name.lower().endswith(LIBRARY_SUFFIX) else name
+
+
+def compare_libraries(
+    old_entries: Dict[str, LibraryEntry],
+    new_entries: Dict[str, LibraryEntry],
+    workers: Optional[int] = None,
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    report_dir: Optional[Union[str, Path]] = None,
+    formats: Sequence[str] = (),
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    progress: Optional[Callable[[int, int], None]] = None,
+    match_reid: bool = True,
+    analyze_layout: bool = True,
+) -> List[Dict[str, Any]]:
+    # ライブラリ同士を比較し、テンプレートごとのサマリー行（名前順）を返す。
+    #   status:     added / removed / changed / unchanged / error
+    #   skipped_by: 読まずに変更なしと判定した理由（bundle_crc / xat_crc）
+    #   added / removed / changed / critical / medium / minor: テンプレート内の件数（比較したものだけ）
+    # report_dir を指定すると、変更ありのテンプレートのレポートを <report_dir>/<名前>/ に書き出す。
+    # progress(完了数, 比較対象数) は比較が1件終わるごとに呼ばれる。
+    rows: Dict[str, Dict[str, Any]] = {}
+    tasks: List[Dict[str, Any]] = []
+    for name in sorted(set(old_entries) | set(new_entries)):
+        old, new = old_entries.get(name), new_entries.get(name)
+        row: Dict[str, Any] = {
+            "name": name,
+            "status": "",
+            "skipped_by": "",
+            "old_size": old["size"] if old else None,
+            "new_size": new["size"] if new else None,
+        }
+        rows[name] = row
+        if new is None:
+            row["status"] = "removed"
+        elif old is None:
+            row["status"] = "added"
+        elif _same_bundle_member(old, new):
+            row.update(status="unchanged", skipped_by=SKIPPED_BY_BUNDLE)
+        else:
+            tasks.append(
+                {
+                    "old": old,
+                    "new": new,
+                    "list_mode": list_mode,
+                    "list_keys": tuple(list_keys),
+                    "report_dir": str(report_dir) if report_dir is not None else None,
+                    "formats": tuple(formats),
+                    "max_value_chars": max_value_chars,
+                    "match_reid": match_reid,
+                    "analyze_layout": analyze_layout,
+                }
+            )
+
+    # ファイルライク（アップロードされたファイルなど）は別プロセスへ渡せないのでこのプロセスで比較する
+    picklable = all(
+        isinstance(t[side]["container"], (str, Path)) for t in tasks for side in ("old", "new")
+    )
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1 or not picklable:
+        results = map(_compare_pair, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        results = pool.map(_compare_pair, tasks)
+    try:
+        for done, (task, result) in enumerate(zip(tasks, results), 1):
+            rows[task["new"]["name"]].update(result)
+            if progress is not None:
+                progress(done, len(tasks))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return list(rows.values())
+
+
+def summarize_library(rows: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+    # サマリー表の合計（状態ごとのテンプレート数と、変更ありテンプレートの重要度別件数）
+    totals: Dict[str, int] = {"templates": len(rows)}
+    for status in LIBRARY_STATUSES:
+        totals[status] = sum(1 for r in rows if r["status"] == status)
+    totals["skipped"] = sum(1 for r in rows if r.get("skipped_by"))
+    for key in ("critical", "medium", "minor"):
+        totals[key] = sum(r.get(key) or 0 for r in rows if r["status"] == "changed")
+    return totals
+
+
+def write_library_reports(
+    old_entries: Dict[str, LibraryEntry],
+    new_entries: Dict[str, LibraryEntry],
+    names: Sequence[str],
+    out_dir: Union[str, Path],
+    formats: Sequence[str],
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+    match_reid: bool = True,
+    analyze_layout: bool = True,
+) -> None:
+    # 指定したテンプレートだけレポートを書き出す（サマリー表を見てから必要なものを作る場合）
+    for name in names:
+        result = compare_library_entry(
+            old_entries[name],
+            new_entries[name],
+            list_mode,
+            list_keys,
+            match_reid,
+            analyze_layout,
+        )
+        write_reports(result, Path(out_dir) / report_dir_name(name), formats, max_value_chars)
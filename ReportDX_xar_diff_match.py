@@ -0,0 +1,150 @@
+# 帳票DX テンプレート差分 ID変更オブジェクトの対応付け
+#
+# 削除されたオブジェクトと追加されたオブジェクトから「IDだけが変わった同じオブジェクト」
+# （コピー&ペーストやデザイナーでの再生成）の組を見つける。
+# 総当たり（削除数 × 追加数）では比べず、summarize_object の特徴量から作ったバケットキー
+# （内容・位置・大きさと書式・名前・ID以外の構造ハッシュ）のどれかが一致する組だけを候補にし、
+# 候補を類似度の高い順に1対1で確定させる。
+# 多くのオブジェクトが同じ値になるバケット（空のテキストなど）は手がかりにならないので使わない。
+
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# 対応付けとみなす類似度の下限（0〜1）
+REID_MIN_SCORE = 0.6
+
+# 片側の件数がこれを超えるバケットは候補作りに使わない（候補数の上限 = バケット数 × この値の2乗）
+REID_MAX_BUCKET = 32
+
+# 位置キーの量子化幅（座標値の単位）
+REID_POSITION_GRID = 5.0
+
+# 類似度の重み（両方に値がある特徴だけで重み付き平均を取る）
+_WEIGHTS = {
+    "text": 3.0,
+    "dataset_ref": 3.0,
+    "name": 1.0,
+    "font": 1.0,
+    "column_count": 1.0,
+    "position": 1.0,
+    "size": 1.0,
+}
+
+Features = Dict[str, Any]
+
+
+def match_features(summary: Dict[str, Any], shape: Optional[bytes] = None) -> Features:
+    # 対応付けに使う特徴量（summarize_object の結果と、ID を除いた構造ハッシュ）
+    font = (summary.get("font_name"), summary.get("font_size"), summary.get("font_color"))
+    return {
+        "type": summary.get("type"),
+        "text": summary.get("text"),
+        "dataset_ref": summary.get("dataset_ref"),
+        "column_count": summary.get("column_count"),
+        "name": summary.get("name"),
+        "font": font if any(v is not None for v in font) else None,
+        "rect": (summary.get("x"), summary.get("y"), summary.get("width"), summary.get("height")),
+        "shape": shape,
+    }
+
+
+def _quantize(v: Any) -> Any:
+    return round(v / REID_POSITION_GRID) if isinstance(v, (int, float)) else v
+
+
+def _bucket_keys(f: Features) -> Iterable[Hashable]:
+    # 特徴量のバケットキー。どれか1つでも一致すれば候補にする。
+    t = f["type"]
+    x, y, w, h = f["rect"]
+    if f["shape"] is not None:
+        yield ("shape", f["shape"])
+    if f["text"] is not None or f["dataset_ref"] is not None:
+        yield ("content", t, f["text"], f["dataset_ref"], f["column_count"])
+    if x is not None or y is not None:
+        yield ("position", t, _quantize(x), _quantize(y))
+    if w is not None or h is not None:
+        yield ("box", t, _quantize(w), _quantize(h), f["font"])
+    if f["name"]:
+        yield ("name", t, f["name"])
+
+
+def _close(a: Any, b: Any, tolerance: float) -> bool:
+    return isinstance(a, (int, float)) and isinstance(b, (int, float)) and abs(a - b) <= tolerance
+
+
+def similarity(a: Features, b: Features) -> float:
+    # 2つのオブジェクトの類似度（0〜1）。type が違えば 0、ID 以外が同じ構造なら 1。
+    if a["type"] != b["type"]:
+        return 0.0
+    if a["shape"] is not None and a["shape"] == b["shape"]:
+        return 1.0
+    total = 0.0
+    score = 0.0
+    for key in ("text", "dataset_ref", "name", "font", "column_count"):
+        if a[key] is None and b[key] is None:
+            continue
+        total += _WEIGHTS[key]
+        if a[key] == b[key]:
+            score += _WEIGHTS[key]
+
+    ax, ay, aw, ah = a["rect"]
+    bx, by, bw, bh = b["rect"]
+    if None not in (ax, ay, bx, by):
+        # 同じ位置なら満点、自分の大きさ程度の移動なら半分
+        total += _WEIGHTS["position"]
+        reach = max(aw or 0, ah or 0, REID_POSITION_GRID)
+        if ax == bx and ay == by:
+            score += _WEIGHTS["position"]
+        elif _close(ax, bx, reach) and _close(ay, by, reach):
+            score += _WEIGHTS["position"] / 2
+    if None not in (aw, ah, bw, bh):
+        # 同じ大きさなら満点、1割以内の違いなら半分
+        total += _WEIGHTS["size"]
+        if aw == bw and ah == bh:
+            score += _WEIGHTS["size"]
+        elif _close(aw, bw, abs(aw) / 10) and _close(ah, bh, abs(ah) / 10):
+            score += _WEIGHTS["size"] / 2
+    return score / total if total else 0.0
+
+
+def match_objects(
+    removed: Dict[str, Features],
+    added: Dict[str, Features],
+    min_score: float = REID_MIN_SCORE,
+    max_bucket: int = REID_MAX_BUCKET,
+) -> List[Tuple[str, str, float]]:
+    # 削除側・追加側の特徴量（{ID: 特徴量}）から、ID が変わった同じオブジェクトの組を返す。
+    # 戻り値: [(旧ID, 新ID, 類似度)]（旧ID順）。各 ID は高々1つの組にしか入らない。
+    buckets: Dict[Hashable, Tuple[List[str], List[str]]] = defaultdict(lambda: ([], []))
+    for oid, f in removed.items():
+        for key in _bucket_keys(f):
+            buckets[key][0].append(oid)
+    for oid, f in added.items():
+        for key in _bucket_keys(f):
+            buckets[key][1].append(oid)
+
+    candidates: Set[Tuple[str, str]] = set()
+    for olds, news in buckets.values():
+        if not olds or not news or len(olds) > max_bucket or len(news) > max_bucket:
+            continue
+        candidates.update((o, n) for o in olds for n in news)
+
+    scored = []
+    for o, n in candidates:
+        s = similarity(removed[o], added[n])
+        if s >= min_score:
+            scored.append((-s, o, n))
+    # 類似度の高い順（同点は ID 順）に確定させる
+    scored.sort()
+
+    used_old: Set[str] = set()
+    used_new: Set[str] = set()
+    pairs = []
+    for neg_score, o, n in scored:
+        if o in used_old or n in used_new:
+            continue
+        used_old.add(o)
+        used_new.add(n)
+        pairs.append((o, n, -neg_score))
+    pairs.sort()
+    return pairs
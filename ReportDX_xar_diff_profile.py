@@ -0,0 +1,158 @@
+# 帳票DX テンプレート差分 処理時間の計測
+#
+# 処理段階ごとの所要時間と件数（オブジェクト数・差分数・バイト数など）を記録する軽量プロファイラ。
+#   prof = StageProfiler()
+#   with prof.stage("load", bytes=len(data)) as s:
+#       ...
+#       s["objects"] = len(idx)
+# 無効（enabled=False）のときは stage() が共有の何もしないコンテキストを返すだけなので、
+# 計測を仕込んだままでもほぼコストはかからない。
+# 記録は JSON Lines で書き出せるほか、cprofile=True なら cProfile の統計も取れる（.prof / pstats 形式）。
+# cProfile / pstats は使うときに import する。
+
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+# ビューアで計測結果を追記する JSON Lines ファイル / cProfile の出力先を指定する環境変数
+PROFILE_JSONL_ENV_VAR = "XAR_DIFF_PROFILE_JSONL"
+PROFILE_CPROFILE_ENV_VAR = "XAR_DIFF_PROFILE_CPROFILE"
+
+
+class _Stage:
+    # 1段階分の計測（with の戻り値は件数を書き込む dict）
+
+    __slots__ = ("_profiler", "_record", "_started")
+
+    def __init__(self, profiler: "StageProfiler", name: str, counts: Dict[str, Any]) -> None:
+        self._profiler = profiler
+        self._record: Dict[str, Any] = {"stage": name, **counts}
+
+    def __enter__(self) -> Dict[str, Any]:
+        self._started = time.perf_counter()
+        return self._record
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        seconds = time.perf_counter() - self._started
+        self._record["seconds"] = seconds
+        if exc_type is not None:
+            self._record["error"] = exc_type.__name__
+        self._profiler.records.append(self._record)
+
+
+class _NullStage:
+    # 計測しないときの stage()。件数の書き込み先は使い捨ての dict。
+
+    __slots__ = ()
+
+    def __enter__(self) -> Dict[str, Any]:
+        return {}
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageProfiler:
+    # 段階ごとの計測結果（records）を持つ。records の各要素は {stage, seconds, 件数...}。
+
+    def __init__(self, enabled: bool = True, cprofile: bool = False) -> None:
+        self.enabled = enabled
+        self.records: List[Dict[str, Any]] = []
+        self._cprofile = None
+        if enabled and cprofile:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+        self._started = time.perf_counter()
+
+    def stage(self, name: str, **counts: Any) -> Any:
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, counts)
+
+    def add(self, name: str, seconds: float, **counts: Any) -> None:
+        # ループ内で積算した時間などを1段階として記録する
+        if self.enabled:
+            self.records.append({"stage": name, **counts, "seconds": seconds})
+
+    def start(self) -> "StageProfiler":
+        # 計測開始（cProfile を有効にしていればここから取り始める）
+        self._started = time.perf_counter()
+        if self._cprofile is not None:
+            try:
+                self._cprofile.enable()
+            except ValueError:
+                # 別のプロファイラが動作中（Python 3.12 以降は同時に1つまで）
+                self._cprofile = None
+        return self
+
+    def stop(self) -> float:
+        # 計測終了。start() からの経過秒を返す。
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        return time.perf_counter() - self._started
+
+    def to_jsonl(self, **meta: Any) -> str:
+        # 記録を JSON Lines にする（各行に meta と記録時刻を付ける）
+        stamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        return "".join(
+            json.dumps({"time": stamp, **meta, **r}, ensure_ascii=False, default=str) + "\n"
+            for r in self.records
+        )
+
+    def write_jsonl(self, path: Union[str, Path], **meta: Any) -> None:
+        # JSON Lines ファイルへ追記する
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(self.to_jsonl(**meta))
+
+    @property
+    def has_cprofile(self) -> bool:
+        return self._cprofile is not None
+
+    def dump_cprofile(self, path: Union[str, Path]) -> None:
+        # cProfile の統計を .prof（pstats で読める形式）で保存する
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(str(path))
+
+    def cprofile_bytes(self) -> bytes:
+        # dump_cprofile と同じ内容をバイト列で返す（ダウンロード用）
+        if self._cprofile is None:
+            return b""
+        import marshal
+        import pstats
+
+        return marshal.dumps(pstats.Stats(self._cprofile).stats)
+
+    def cprofile_text(self, limit: int = 30, sort: str = "cumulative") -> str:
+        # cProfile の上位関数を文字列で返す（画面表示用）
+        if self._cprofile is None:
+            return ""
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(self._cprofile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def profiler_from_env(enabled: bool = False, cprofile: bool = False) -> StageProfiler:
+    # 環境変数で出力先が指定されていれば、画面の設定に関わらず計測を有効にする
+    cprofile = cprofile or bool(os.environ.get(PROFILE_CPROFILE_ENV_VAR))
+    enabled = enabled or cprofile or bool(os.environ.get(PROFILE_JSONL_ENV_VAR))
+    return StageProfiler(enabled=enabled, cprofile=cprofile)
+
+
+def flush_profiler_to_env(profiler: StageProfiler, **meta: Any) -> None:
+    # 環境変数で指定された出力先へ記録を書き出す
+    jsonl_path = os.environ.get(PROFILE_JSONL_ENV_VAR)
+    if jsonl_path and profiler.records:
+        profiler.write_jsonl(jsonl_path, **meta)
+    cprofile_path = os.environ.get(PROFILE_CPROFILE_ENV_VAR)
+    if cprofile_path:
+        profiler.dump_cprofile(cprofile_path)
@@ -0,0 +1,200 @@
+# 帳票DX テンプレート差分 重要度ルール
+#
+# 差分パスの重要度（3=重大, 2=中, 1=軽微）を判定するルールエンジン。
+# ルールはパスのセグメント（キー名）単位で照合し、レベルごとに1本の正規表現へコンパイルする。
+# 判定結果は添字を正規化したパス（frames[12] と frames[13] は同じ）ごとにメモ化する。
+# 差分エントリ（DiffEntry）はパスのセグメント列のまま判定でき、その結果もセグメント列ごとに保持する。
+#
+# ルールファイル（JSON / TOML）の形式:
+#   {
+#     "default": 1,
+#     "rules": [
+#       {"severity": 3, "patterns": ["*dataset*", "impl_uri", "tables"]},
+#       {"severity": 2, "patterns": ["rect", "font.size", "x", "y"]}
+#     ]
+#   }
+# パターンは1セグメントに一致（* と ? はワイルドカード）。"font.size" のように
+# ドットで繋ぐと連続するセグメント列に一致する。大文字小文字は区別しない。先に書いたルールが優先。
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from ReportDX_xar_diff_entry import Segments, render_path
+
+# 重要度 -> (絵文字, ラベル)
+SEVERITY_LEVELS: Dict[int, Tuple[str, str]] = {
+    3: ("🔴", "重大"),
+    2: ("🟡", "中"),
+    1: ("🟢", "軽微"),
+}
+
+# 重要度 -> 比較結果の changed_rows で件数を持つ列
+SEVERITY_COUNT_KEYS: Dict[int, str] = {1: "minor_cnt", 2: "medium_cnt", 3: "critical_cnt"}
+
+# ルールファイルを指定する環境変数（ビューアなど、引数で渡せない場合用）
+RULES_ENV_VAR = "XAR_DIFF_SEVERITY_RULES"
+
+DEFAULT_RULES: Dict[str, Any] = {
+    "default": 1,
+    "rules": [
+        # 重大：データバインドやタイプ、列数、画像など
+        {
+            "severity": 3,
+            "patterns": [
+                "*dataset*",
+                "*bind*",
+                "impl_uri",
+                "column_count",
+                "tables",
+                "*image*",
+                "*img*",
+                "*resource*",
+            ],
+        },
+        # 中程度：レイアウト・スタイル・フォントサイズ・テキストなど
+        {
+            "severity": 2,
+            "patterns": [
+                "rect",
+                "x",
+                "y",
+                "width",
+                "height",
+                "*stroke*",
+                "font_size",
+                "font.size",
+                "fill.color",
+                "fill_colour",
+                "*align*",
+                "rotation",
+                "skew",
+                "data.value",
+                "*text*",
+            ],
+        },
+    ],
+}
+
+# severity_of でメモ化するセグメント列の最大数
+SEGMENT_CACHE_MAX = 1 << 18
+
+_INDEX_RE = re.compile(r"\[\d+\]")
+
+
+def _segment_regex(seg: str) -> str:
+    # 1セグメント分のパターン。ワイルドカードはセグメント境界（. や [）を越えない。
+    out = []
+    for ch in seg:
+        if ch == "*":
+            out.append(r"[^.\[]*")
+        elif ch == "?":
+            out.append(r"[^.\[]")
+        else:
+            out.append(re.escape(ch))
+    return "".join(out)
+
+
+def _pattern_regex(pattern: str) -> str:
+    # パターンを、正規化パス上でセグメント境界に揃って一致する正規表現片に変換する
+    segs = pattern.lower().split(".")
+    if not all(segs):
+        raise ValueError(f"空のセグメントを含むパターンです: {pattern!r}")
+    body = r"(?:\[\])*\.".join(_segment_regex(seg) for seg in segs)
+    return r"(?:^|\.)" + body + r"(?:\[\])*(?=\.|$)"
+
+
+class SeverityRules:
+    # コンパイル済みの重要度ルール。classify() は (severity, emoji, label) を返す。
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None) -> None:
+        config = DEFAULT_RULES if config is None else config
+        self.default = int(config.get("default", 1))
+        if self.default not in SEVERITY_LEVELS:
+            raise ValueError(f"未知の重要度です: {self.default}")
+        self._compiled: List[Tuple[int, "re.Pattern[str]"]] = []
+        effective: List[Tuple[int, List[str]]] = []
+        for rule in config.get("rules", []):
+            severity = int(rule["severity"])
+            if severity not in SEVERITY_LEVELS:
+                raise ValueError(f"未知の重要度です: {severity}")
+            patterns = rule.get("patterns") or []
+            if not patterns:
+                continue
+            regex = "|".join(_pattern_regex(p) for p in patterns)
+            self._compiled.append((severity, re.compile(regex)))
+            effective.append((severity, [p.lower() for p in patterns]))
+        # 判定結果を左右する内容のハッシュ（永続ストアのキー用。同じ判定になるルールは同じ値）
+        canonical = json.dumps([self.default, effective], ensure_ascii=False, separators=(",", ":"))
+        self.fingerprint = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+        self._cache: Dict[str, Tuple[int, str, str]] = {}
+        self._segment_cache: Dict[Segments, int] = {}
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        # メモ化キー：小文字化して添字を [] に揃える
+        return _INDEX_RE.sub("[]", path.lower())
+
+    def classify(self, path: str) -> Tuple[int, str, str]:
+        key = self.normalize(path)
+        hit = self._cache.get(key)
+        if hit is None:
+            severity = self.default
+            for level, regex in self._compiled:
+                if regex.search(key):
+                    severity = level
+                    break
+            emoji, label = SEVERITY_LEVELS[severity]
+            hit = self._cache[key] = (severity, emoji, label)
+        return hit
+
+    def severity_of(self, segments: Segments) -> int:
+        # セグメント列の重要度。同じセグメント列はパス文字列を組み立てずに返す。
+        hit = self._segment_cache.get(segments)
+        if hit is None:
+            hit = self.classify(render_path(segments))[0]
+            if len(self._segment_cache) < SEGMENT_CACHE_MAX:
+                self._segment_cache[segments] = hit
+        return hit
+
+
+def load_severity_rules(path: Union[str, Path]) -> SeverityRules:
+    # ルールファイル（.json / .toml）を読み込んでコンパイルする
+    path = Path(path)
+    if path.suffix.lower() == ".toml":
+        import tomllib
+
+        with path.open("rb") as f:
+            config = tomllib.load(f)
+    else:
+        config = json.loads(path.read_text(encoding="utf-8"))
+    return SeverityRules(config)
+
+
+_active_rules: Optional[SeverityRules] = None
+
+
+def get_severity_rules() -> SeverityRules:
+    # 現在有効なルール。未設定なら環境変数のファイル、なければ既定ルールを使う。
+    global _active_rules
+    if _active_rules is None:
+        env_path = os.environ.get(RULES_ENV_VAR)
+        _active_rules = load_severity_rules(env_path) if env_path else SeverityRules()
+    return _active_rules
+
+
+def set_severity_rules(rules: Optional[SeverityRules]) -> None:
+    # 以降の判定に使うルールを差し替える（None で既定に戻す）
+    global _active_rules
+    _active_rules = rules
+
+
+def severity_counts(severities: Iterable[int]) -> Dict[int, int]:
+    # 重要度ごとの件数
+    counts = {level: 0 for level in SEVERITY_LEVELS}
+    for s in severities:
+        counts[s] += 1
+    return counts
@@ -0,0 +1,794 @@
+# 帳票DX テンプレート差分 ローカル差分サービス
+#
+# 差分エンジンを localhost の HTTP/JSON サービスとして動かす（標準ライブラリだけを使う）。
+# 複数のビューア・スクリプトから同じ .xar の組を比較しても、解析・比較は1回だけ行う。
+#
+#   python ReportDX_xar_diff_service.py --port 8765 -j 4
+#   XAR_DIFF_SERVICE=http://127.0.0.1:8765 streamlit run ReportDX_xar_diff_viewer.py
+#
+# API
+#   PUT  /blobs/<sha256>   .xar 本体を送る（HEAD で送信済みか確かめられる）
+#   POST /jobs             {"old": sha256, "new": sha256, "old_name", "new_name", オプション} -> ジョブ
+#   GET  /jobs/<id>        ジョブの状態（queued / running / done / error、段階と進み具合）
+#   GET  /jobs/<id>/result?format=json|md|xlsx&min_severity=1&summary_only=0
+#   GET  /health
+#
+#   - ジョブ ID は旧・新の内容ハッシュと比較オプション（重要度ルールを含む）から決める。同じ比較の依頼は
+#     待ち・実行中・完了済みのジョブにまとめる（ファイル名は最初の依頼のものになる）
+#   - 比較は上限付きのプロセスプールで実行し、待ち・実行中のジョブが上限に達していれば 503 で断る
+#   - 比較結果は pickle にしてスプールディレクトリに置き（HTTP では返さない）、レポートは形式・範囲
+#     ごとに初めて求められたときにプールで作る（同じレポートを同時に求められても1回だけ作る）
+#   - 完了したジョブは max_jobs 件まで残し、超えたら古いものから結果・レポート・.xar を消す
+#     （.xar は他のジョブが使っておらず、blob_grace 秒以上送信・確認されていないものだけ）
+#   - ワーカーは forkserver（ない環境では spawn）で起動する
+#   - 環境変数 XAR_DIFF_STORE があれば、ワーカーは永続ストアで解析・比較結果を再利用する
+# 応答はレポート（json / md / xlsx）だけで、ビューアは json のレポートから比較結果を組み立て直す
+# （result_from_json_report）。既定では 127.0.0.1 だけで待ち受ける。
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from ReportDX_xar_diff_engine import (
+    DEFAULT_LIST_KEYS,
+    REPORT_FORMATS,
+    compare_indexes,
+    content_hash,
+    summarize_result,
+    write_reports,
+)
+from ReportDX_xar_diff_layout import MAX_NEW_OVERLAPS
+from ReportDX_xar_diff_rules import (
+    RULES_ENV_VAR,
+    SEVERITY_LEVELS,
+    SeverityRules,
+    get_severity_rules,
+    load_severity_rules,
+    set_severity_rules,
+)
+from ReportDX_xar_diff_store import store_from_env
+from ReportDX_xar_diff_stream import load_xar_streaming
+
+# ビューアなどが使うサービスの URL を指定する環境変数
+SERVICE_ENV_VAR = "XAR_DIFF_SERVICE"
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+
+# 待ち・実行中のジョブの上限（超えた依頼は 503）
+SERVICE_MAX_PENDING = 32
+# 残しておくジョブの上限（完了・エラーのものから古い順に消す）
+SERVICE_MAX_JOBS = 64
+# 1つの .xar の上限バイト数
+SERVICE_MAX_UPLOAD_BYTES = 1 << 30
+# ジョブに使われていない .xar を消すまでの猶予（秒）。送信してから POST するまでの間に消さないため
+SERVICE_BLOB_GRACE = 600.0
+
+# クライアントの既定のタイムアウト（秒）。レポートは作り終わるまで待つので長めにする
+SERVICE_TIMEOUT = 600.0
+
+RESULT_CONTENT_TYPES = {
+    "md": "text/markdown; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "json": "application/json; charset=utf-8",
+}
+
+# ジョブの段階（progress はこの並びの位置から決める）
+JOB_STAGES = ("queued", "load_old", "load_new", "compare", "save", "done")
+JOB_STAGE_LABELS = {
+    "queued": "順番待ち",
+    "load_old": "旧テンプレートの読み込み",
+    "load_new": "新テンプレートの読み込み",
+    "compare": "比較",
+    "save": "結果の保存",
+    "done": "完了",
+}
+
+# ジョブで指定できる比較オプションと既定値
+JOB_OPTIONS: Dict[str, Any] = {
+    "list_mode": "align",
+    "list_keys": list(DEFAULT_LIST_KEYS),
+    "match_reid": True,
+    "analyze_layout": True,
+    "max_diffs_per_object": None,
+    "max_overlaps": MAX_NEW_OVERLAPS,
+}
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_COPY_CHUNK = 1 << 20
+
+
+class ServiceError(Exception):
+    # HTTP のステータスコード付きのエラー（クライアントでは応答のエラーをこれで投げ直す）
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def normalize_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    # 比較オプションを検証し、既定値を補う（ジョブ ID の計算に使うので並びも揃える）
+    unknown = sorted(set(options) - set(JOB_OPTIONS))
+    if unknown:
+        raise ServiceError(400, f"未対応のオプションです: {', '.join(unknown)}")
+    merged = dict(JOB_OPTIONS, **options)
+    if merged["list_mode"] not in ("align", "index"):
+        raise ServiceError(400, f"list_mode は align / index のどちらかです: {merged['list_mode']}")
+    if not isinstance(merged["list_keys"], list) or not all(
+        isinstance(k, str) for k in merged["list_keys"]
+    ):
+        raise ServiceError(400, "list_keys は文字列のリストです。")
+    for key in ("max_diffs_per_object", "max_overlaps"):
+        limit = merged[key]
+        if limit is not None and (not isinstance(limit, int) or limit < 1):
+            raise ServiceError(400, f"{key} は 1 以上の整数です。")
+    merged["match_reid"] = bool(merged["match_reid"])
+    merged["analyze_layout"] = bool(merged["analyze_layout"])
+    return {key: merged[key] for key in JOB_OPTIONS}
+
+
+def job_id_for(old_digest: str, new_digest: str, options: Dict[str, Any]) -> str:
+    # 同じ比較なら同じ ID（重要度ルールが変われば別のジョブ）
+    key = [old_digest, new_digest, options, get_severity_rules().fingerprint]
+    return content_hash(json.dumps(key, sort_keys=True).encode("utf-8"))
+
+
+# --- ワーカープロセスで実行する処理 -------------------------------------------
+
+_progress_queue: Any = None
+_worker_store: Any = None
+
+
+def _init_worker(progress_queue: Any, rules: SeverityRules) -> None:
+    global _progress_queue, _worker_store
+    _progress_queue = progress_queue
+    set_severity_rules(rules)
+    _worker_store = store_from_env()
+
+
+def _report_progress(job_id: str, stage: str) -> None:
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage))
+
+
+def _blob_path(spool: Path, digest: str) -> Path:
+    return spool / "blobs" / f"{digest}.xar"
+
+
+def _result_path(spool: Path, job_id: str) -> Path:
+    return spool / "results" / f"{job_id}.pickle"
+
+
+def _report_dir(spool: Path, job_id: str, min_severity: int, summary_only: bool) -> Path:
+    return spool / "reports" / f"{job_id}_{min_severity}_{int(summary_only)}"
+
+
+def run_job(
+    spool: str,
+    job_id: str,
+    old_digest: str,
+    new_digest: str,
+    old_name: str,
+    new_name: str,
+    options: Dict[str, Any],
+) -> Dict[str, Any]:
+    # 旧・新を読み込んで比較し（detail="counts"、差分一覧は使うときに作る）、結果を pickle で
+    # スプールに書く。戻り値はサマリーと読み込み統計。
+    spool_dir = Path(spool)
+    loaded = []
+    for stage, digest in (("load_old", old_digest), ("load_new", new_digest)):
+        _report_progress(job_id, stage)
+        path = str(_blob_path(spool_dir, digest))
+        if _worker_store is not None:
+            _meta, idx, stats, xat = _worker_store.load_template(path, digest)
+            stats = dict(stats, xat_sha256=xat)
+        else:
+            _meta, idx, stats = load_xar_streaming(path)
+        loaded.append((idx, stats))
+    (idx_old, stats_old), (idx_new, stats_new) = loaded
+
+    _report_progress(job_id, "compare")
+    if _worker_store is not None:
+        result = _worker_store.compare(
+            stats_old["xat_sha256"],
+            stats_new["xat_sha256"],
+            idx_old,
+            idx_new,
+            old_name=old_name,
+            new_name=new_name,
+            **options,
+        )
+    else:
+        result = compare_indexes(
+            idx_old, idx_new, old_name=old_name, new_name=new_name, detail="counts", **options
+        )
+
+    _report_progress(job_id, "save")
+    target = _result_path(spool_dir, job_id)
+    partial_path = target.with_suffix(".tmp")
+    with partial_path.open("wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(partial_path, target)
+    return {"summary": summarize_result(result), "load_stats": [stats_old, stats_new]}
+
+
+def build_report(
+    spool: str, job_id: str, fmt: str, min_severity: int, summary_only: bool
+) -> str:
+    # 保存済みの比較結果からレポート1形式を書き出し、そのパスを返す
+    spool_dir = Path(spool)
+    with _result_path(spool_dir, job_id).open("rb") as f:
+        result = pickle.load(f)
+    out_dir = _report_dir(spool_dir, job_id, min_severity, summary_only)
+    write_reports(result, out_dir, [fmt], min_severity=min_severity, summary_only=summary_only)
+    return str(out_dir / f"xar_diff_report.{fmt}")
+
+
+# --- サービス本体 -------------------------------------------------------------
+
+
+class DiffService:
+    # ジョブの登録・状態・結果の管理。HTTP サーバーの各スレッドから呼ばれる。
+    # spool を省くと一時ディレクトリを使い、close() で消す。
+
+    def __init__(
+        self,
+        spool: Optional[Union[str, Path]] = None,
+        workers: Optional[int] = None,
+        max_pending: int = SERVICE_MAX_PENDING,
+        max_jobs: int = SERVICE_MAX_JOBS,
+        max_upload_bytes: int = SERVICE_MAX_UPLOAD_BYTES,
+        blob_grace: float = SERVICE_BLOB_GRACE,
+    ) -> None:
+        self._tmp = None
+        if spool is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix="xar_diff_service_")
+            spool = self._tmp.name
+        self.spool = Path(spool)
+        for sub in ("blobs", "results", "reports"):
+            (self.spool / sub).mkdir(parents=True, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.max_upload_bytes = max_upload_bytes
+        self.blob_grace = blob_grace
+
+        # HTTP のスレッドがあるプロセスから fork しないよう、ワーカーは forkserver（なければ spawn）で
+        # 起動する。重要度ルールは初期化時に渡す
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._progress = context.Queue()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress, get_severity_rules()),
+        )
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._reports: Dict[Tuple[str, str, int, bool], Future] = {}
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._progress.put(None)
+        self._listener.join()
+        if self._tmp is not None:
+            self._tmp.cleanup()
+
+    # --- .xar ---
+
+    def has_blob(self, digest: str) -> bool:
+        # 送信済みか確かめる。あれば更新時刻を進め、続く POST までに消されないようにする
+        if not isinstance(digest, str) or not _DIGEST.match(digest):
+            return False
+        try:
+            os.utime(_blob_path(self.spool, digest))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_blob(self, digest: str, stream: BinaryIO, length: int) -> Dict[str, Any]:
+        # .xar 本体を受け取る（内容の SHA-256 が digest と一致しなければ 400）
+        if not isinstance(digest, str) or not _DIGEST.match(digest):
+            raise ServiceError(400, f"SHA-256 の16進表記ではありません: {digest}")
+        if length > self.max_upload_bytes:
+            raise ServiceError(413, f".xar が大きすぎます（上限 {self.max_upload_bytes:,} バイト）")
+        target = _blob_path(self.spool, digest)
+        if target.is_file():
+            # 送信済み。本文は読み捨てる（接続を使い回せるように）
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(remaining, _COPY_CHUNK))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+            os.utime(target)
+            return {"digest": digest, "size": target.stat().st_size}
+        hasher = hashlib.sha256()
+        fd, partial_name = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(remaining, _COPY_CHUNK))
+                    if not chunk:
+                        raise ServiceError(400, "本文が Content-Length より短いです。")
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if hasher.hexdigest() != digest:
+                raise ServiceError(400, "内容の SHA-256 が URL と一致しません。")
+            os.replace(partial_name, target)
+        finally:
+            if os.path.exists(partial_name):
+                os.remove(partial_name)
+        return {"digest": digest, "size": length}
+
+    # --- ジョブ ---
+
+    def submit(
+        self,
+        old_digest: str,
+        new_digest: str,
+        old_name: str = "old.xar",
+        new_name: str = "new.xar",
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        # ジョブを登録する。同じ比較のジョブ（エラー以外）があればそれを返す（coalesced が True）
+        options = normalize_options(options or {})
+        for digest in (old_digest, new_digest):
+            if not isinstance(digest, str) or not _DIGEST.match(digest):
+                raise ServiceError(400, f"SHA-256 の16進表記ではありません: {digest}")
+            if not self.has_blob(digest):
+                raise ServiceError(404, f".xar が送信されていません: {digest}")
+        job_id = job_id_for(old_digest, new_digest, options)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] != "error":
+                self._jobs.move_to_end(job_id)
+                return dict(self._view(job), coalesced=True)
+            pending = sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise ServiceError(503, f"待ちのジョブが上限（{self.max_pending} 件）に達しています。")
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "stage": "queued",
+                "progress": 0.0,
+                "old": old_digest,
+                "new": new_digest,
+                "old_name": old_name,
+                "new_name": new_name,
+                "options": options,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+            }
+            self._jobs[job_id] = job
+            self._evict()
+            future = self._pool.submit(
+                run_job, str(self.spool), job_id, old_digest, new_digest, old_name, new_name, options
+            )
+        future.add_done_callback(partial(self._finished, job_id))
+        return dict(self._view(job), coalesced=False)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._view(self._job(job_id))
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._view(job) for job in self._jobs.values()]
+
+    def result(
+        self, job_id: str, fmt: str = "json", min_severity: int = 1, summary_only: bool = False
+    ) -> Path:
+        # 完了したジョブの結果ファイル。レポートはまだなければプールで作り、できるまで待つ
+        if fmt not in REPORT_FORMATS:
+            raise ServiceError(400, f"未対応の形式です: {fmt}")
+        if min_severity not in SEVERITY_LEVELS:
+            raise ServiceError(400, f"min_severity は {sorted(SEVERITY_LEVELS)} のいずれかです。")
+        with self._lock:
+            job = self._job(job_id)
+            if job["status"] == "error":
+                raise ServiceError(500, job["error"])
+            if job["status"] != "done":
+                raise ServiceError(409, f"ジョブはまだ終わっていません（{job['status']}）。")
+            key = (job_id, fmt, min_severity, summary_only)
+            future = self._reports.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._pool.submit(
+                    build_report, str(self.spool), job_id, fmt, min_severity, summary_only
+                )
+                self._reports[key] = future
+        return Path(future.result())
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"status": "ok", "workers": self.workers, "jobs": counts}
+
+    # --- 内部 ---
+
+    def _job(self, job_id: str) -> Dict[str, Any]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ServiceError(404, f"ジョブがありません: {job_id}")
+        return job
+
+    def _view(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # 応答用のジョブ情報（JSON 化できる dict）。queued_ahead は先に待っているジョブの数
+        view = {k: v for k, v in job.items() if k not in ("old", "new")}
+        end = job["finished"] or time.time()
+        view["elapsed"] = round(end - job["submitted"], 3)
+        view["queued_ahead"] = 0
+        if job["status"] == "queued":
+            for other in self._jobs.values():
+                if other is job:
+                    break
+                if other["status"] in ("queued", "running"):
+                    view["queued_ahead"] += 1
+        return view
+
+    def _listen(self) -> None:
+        # ワーカーからの段階の通知を反映する
+        while True:
+            item = self._progress.get()
+            if item is None:
+                return
+            job_id, stage = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] not in ("queued", "running"):
+                    continue
+                job["status"] = "running"
+                job["stage"] = stage
+                job["progress"] = round(JOB_STAGES.index(stage) / (len(JOB_STAGES) - 1), 3)
+                if job["started"] is None:
+                    job["started"] = time.time()
+
+    def _finished(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["finished"] = time.time()
+            error = future.exception() if not future.cancelled() else ServiceError(503, "中止しました")
+            if error is not None:
+                job["status"] = "error"
+                job["error"] = f"{type(error).__name__}: {error}"
+                return
+            job.update(future.result(), status="done", stage="done", progress=1.0)
+
+    def _evict(self) -> None:
+        # 残すジョブが上限を超えたら、終わったジョブを古い順に消す（ロックを持って呼ぶ）
+        # .xar はどのジョブも使っていないものを消す。ただし送信・確認から blob_grace 秒以内のものは
+        # これから POST されるかもしれないので残す
+        finished = [j for j, job in self._jobs.items() if job["status"] in ("done", "error")]
+        evicted = finished[: max(len(self._jobs) - self.max_jobs, 0)]
+        for job_id in evicted:
+            del self._jobs[job_id]
+            for key in [k for k in self._reports if k[0] == job_id]:
+                del self._reports[key]
+            _result_path(self.spool, job_id).unlink(missing_ok=True)
+            for report_dir in (self.spool / "reports").glob(f"{job_id}_*"):
+                shutil.rmtree(report_dir, ignore_errors=True)
+        if not evicted:
+            return
+        in_use = {d for job in self._jobs.values() for d in (job["old"], job["new"])}
+        cutoff = time.time() - self.blob_grace
+        for path in (self.spool / "blobs").glob("*.xar"):
+            if path.stem in in_use:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# --- HTTP ---------------------------------------------------------------------
+
+
+class _ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: DiffService) -> None:
+        super().__init__(address, _ServiceHandler)
+        self.service = service
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    server: _ServiceHTTPServer
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, code: Any = "-", size: Any = "-") -> None:
+        # 進み具合の確認が多いので、エラー応答だけを記録する（HEAD の 404 は送信前の確認なので除く）
+        if isinstance(code, int) and code >= 400 and self.command != "HEAD":
+            super().log_request(code, size)
+
+    def do_GET(self) -> None:
+        self._dispatch(self._get)
+
+    def do_HEAD(self) -> None:
+        self._dispatch(self._head)
+
+    def do_PUT(self) -> None:
+        self._dispatch(self._put)
+
+    def do_POST(self) -> None:
+        self._dispatch(self._post)
+
+    def _dispatch(self, handler: Any) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            handler(parts, query)
+        except ServiceError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _get(self, parts: List[str], query: Dict[str, str]) -> None:
+        service = self.server.service
+        if parts == ["health"]:
+            self._send_json(200, service.health())
+        elif parts == ["jobs"]:
+            self._send_json(200, service.jobs())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self._send_json(200, service.status(parts[1]))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            fmt = query.get("format", "json")
+            try:
+                min_severity = int(query.get("min_severity", "1"))
+            except ValueError:
+                raise ServiceError(400, "min_severity は整数です。")
+            summary_only = query.get("summary_only", "0").lower() in ("1", "true", "yes")
+            path = service.result(parts[1], fmt, min_severity, summary_only)
+            self._send_file(path, RESULT_CONTENT_TYPES[fmt])
+        else:
+            raise ServiceError(404, f"不明なパスです: {self.path}")
+
+    def _head(self, parts: List[str], query: Dict[str, str]) -> None:
+        if len(parts) == 2 and parts[0] == "blobs":
+            status = 200 if self.server.service.has_blob(parts[1]) else 404
+        else:
+            status = 404
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _put(self, parts: List[str], query: Dict[str, str]) -> None:
+        if len(parts) != 2 or parts[0] != "blobs":
+            raise ServiceError(404, f"不明なパスです: {self.path}")
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise ServiceError(411, "Content-Length が必要です。")
+        self._send_json(200, self.server.service.put_blob(parts[1], self.rfile, int(length)))
+
+    def _post(self, parts: List[str], query: Dict[str, str]) -> None:
+        if parts != ["jobs"]:
+            raise ServiceError(404, f"不明なパスです: {self.path}")
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or not all(
+            isinstance(request.get(key), str) for key in ("old", "new")
+        ):
+            raise ServiceError(400, 'JSON の本文に "old" と "new"（.xar の SHA-256）が必要です。')
+        old_digest = request.pop("old")
+        new_digest = request.pop("new")
+        old_name = request.pop("old_name", "old.xar")
+        new_name = request.pop("new_name", "new.xar")
+        if not isinstance(old_name, str) or not isinstance(new_name, str):
+            raise ServiceError(400, '"old_name" と "new_name" は文字列です。')
+        job = self.server.service.submit(old_digest, new_digest, old_name, new_name, request)
+        self._send_json(200 if job["coalesced"] else 202, job)
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, path: Path, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with path.open("rb") as f:
+            shutil.copyfileobj(f, self.wfile, _COPY_CHUNK)
+
+
+def serve(
+    service: DiffService, host: str = DEFAULT_SERVICE_HOST, port: int = DEFAULT_SERVICE_PORT
+) -> ThreadingHTTPServer:
+    # HTTP サーバーを作る（serve_forever() で待ち受ける。port=0 なら空いているポート）
+    return _ServiceHTTPServer((host, port), service)
+
+
+# --- クライアント -------------------------------------------------------------
+
+
+class DiffServiceClient:
+    # サービスを呼ぶ側（ビューア・スクリプト用）。エラー応答は ServiceError で投げる。
+
+    def __init__(self, base_url: str, timeout: float = SERVICE_TIMEOUT) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(
+        self, method: str, path: str, body: Optional[bytes] = None, json_body: Any = None
+    ) -> bytes:
+        headers = {}
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(
+            self.base_url + path, data=body, headers=headers, method=method
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            detail = e.read()
+            try:
+                message = json.loads(detail)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = e.reason
+            raise ServiceError(e.code, message) from None
+
+    def health(self) -> Dict[str, Any]:
+        return json.loads(self._request("GET", "/health"))
+
+    def has_blob(self, digest: str) -> bool:
+        try:
+            self._request("HEAD", f"/blobs/{digest}")
+        except ServiceError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def upload(self, data: Union[bytes, memoryview], digest: Optional[str] = None) -> str:
+        # .xar を送る（送信済みなら送らない）。内容の SHA-256 を返す
+        digest = digest or content_hash(data)
+        if not self.has_blob(digest):
+            self._request("PUT", f"/blobs/{digest}", body=bytes(data))
+        return digest
+
+    def submit(
+        self,
+        old_digest: str,
+        new_digest: str,
+        old_name: str = "old.xar",
+        new_name: str = "new.xar",
+        **options: Any,
+    ) -> Dict[str, Any]:
+        body = dict(options, old=old_digest, new=new_digest, old_name=old_name, new_name=new_name)
+        return json.loads(self._request("POST", "/jobs", json_body=body))
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return json.loads(self._request("GET", f"/jobs/{job_id}"))
+
+    def wait(self, job_id: str, interval: float = 0.5) -> Dict[str, Any]:
+        # ジョブが終わるまで interval 秒おきに確かめる（エラーで終わったら ServiceError）
+        while True:
+            job = self.status(job_id)
+            if job["status"] == "error":
+                raise ServiceError(500, job["error"])
+            if job["status"] == "done":
+                return job
+            time.sleep(interval)
+
+    def result(
+        self, job_id: str, fmt: str = "json", min_severity: int = 1, summary_only: bool = False
+    ) -> bytes:
+        query = urllib.parse.urlencode(
+            {"format": fmt, "min_severity": min_severity, "summary_only": int(summary_only)}
+        )
+        return self._request("GET", f"/jobs/{job_id}/result?{query}")
+
+
+def service_from_env() -> Optional[DiffServiceClient]:
+    # 環境変数でサービスの URL が指定されていればクライアントを作る（未指定なら None）
+    url = os.environ.get(SERVICE_ENV_VAR)
+    return DiffServiceClient(url) if url else None
+
+
+# --- エントリーポイント --------------------------------------------------------
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="帳票DX テンプレート（.xar）の差分を HTTP/JSON で提供するローカルサービスです。"
+    )
+    parser.add_argument("--host", default=DEFAULT_SERVICE_HOST, help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVICE_PORT, help="待ち受けるポート")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None,
+        help="比較の並列プロセス数（既定: CPUコア数）",
+    )
+    parser.add_argument(
+        "--spool", type=Path, default=None,
+        help="受け取った .xar・比較結果・レポートを置くディレクトリ（既定: 終了時に消す一時ディレクトリ）",
+    )
+    parser.add_argument(
+        "--max-pending", type=int, default=SERVICE_MAX_PENDING,
+        help="待ち・実行中のジョブの上限（超えた依頼は 503）",
+    )
+    parser.add_argument(
+        "--max-jobs", type=int, default=SERVICE_MAX_JOBS,
+        help="残しておくジョブの上限（超えたら終わったものから古い順に消す）",
+    )
+    parser.add_argument(
+        "--blob-grace", type=float, default=SERVICE_BLOB_GRACE,
+        help="どのジョブにも使われていない .xar を消すまでの猶予（秒、送信・確認からの時間）",
+    )
+    parser.add_argument(
+        "--severity-rules", type=Path, default=None,
+        help="重要度ルールファイル（.json / .toml、形式は severity_rules.sample.json を参照）",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.severity_rules:
+        # 先に読み込んで形式を検証し、ワーカープロセスへは環境変数で引き継ぐ
+        try:
+            set_severity_rules(load_severity_rules(args.severity_rules))
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"重要度ルールを読み込めません: {e}")
+        os.environ[RULES_ENV_VAR] = str(args.severity_rules.resolve())
+
+    service = DiffService(
+        args.spool,
+        args.workers,
+        max_pending=args.max_pending,
+        max_jobs=args.max_jobs,
+        blob_grace=args.blob_grace,
+    )
+    server = serve(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"http://{host}:{port} で待ち受けています（ワーカー {service.workers} 個、Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
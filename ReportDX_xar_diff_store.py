@@ -0,0 +1,360 @@
+# 帳票DX テンプレート差分 永続ストア
+#
+# 解析済みのインデックス・オブジェクト単位の比較件数・比較結果を SQLite（WAL）に保存し、
+# ビューアのセッション・再起動・複数のワーカープロセスをまたいで共有する。キーはすべて内容ハッシュ:
+#   source:<.xar の SHA-256>                      -> .xat の SHA-256（.xat を展開せずに引くため）
+#   index:<.xat の SHA-256>:<読み込み条件>          -> (meta, インデックス, 読み込み統計)。オブジェクトハッシュを含む
+#   result:<旧 .xat>:<新 .xat>:<比較条件>           -> 比較結果（detail="counts"）。オブジェクト本体は含めず、
+#                                                   読み出し時にインデックスのオブジェクトを付け直す
+#   counts:<差分条件>:<旧オブジェクト>:<新オブジェクト> -> 重要度別件数（オブジェクトハッシュの組ごと）
+# 新しいリビジョンとの比較では counts を引き、ハッシュの組が未知のオブジェクトだけを比較する。
+# 合計サイズが max_bytes を超えたら、最後に使われたのが古いものから消す（LRU）。
+# 値は pickle で保存するため、ストアのファイルは信頼できる場所に置くこと。
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from ReportDX_xar_diff_engine import DEFAULT_LIST_KEYS, ObjectIndex, compare_indexes
+from ReportDX_xar_diff_layout import MAX_NEW_OVERLAPS
+from ReportDX_xar_diff_match import REID_MIN_SCORE
+from ReportDX_xar_diff_profile import StageProfiler
+from ReportDX_xar_diff_rules import SEVERITY_LEVELS, get_severity_rules
+from ReportDX_xar_diff_stream import BLOB_MIN_CHARS, XarSource, load_xar_streaming, xat_digest
+from ReportDX_xar_diff_values import VALUE_REF_MIN_CHARS
+
+# ビューアで使うストアのファイルと上限サイズ（MB）を指定する環境変数
+STORE_ENV_VAR = "XAR_DIFF_STORE"
+STORE_MAX_MB_ENV_VAR = "XAR_DIFF_STORE_MAX_MB"
+
+DEFAULT_STORE_MAX_BYTES = 1 << 30
+
+# 保存形式の版（変えると以前のエントリは使われなくなり、いずれ LRU で消える）
+STORE_FORMAT = 2
+
+# 上限を超えたら、合計がこの割合になるまで消す（上限付近で毎回消さないように）
+EVICT_TO_RATIO = 0.9
+
+# 最終使用時刻を更新する間隔（秒）。読むたびに書き込みが起きないようにする
+TOUCH_INTERVAL = 60.0
+
+# 他のプロセスが書き込み中のときに待つ秒数
+BUSY_TIMEOUT = 30.0
+
+# IN (...) で一度に引くキーの数（SQLite の変数の上限より小さく）
+_KEY_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+class DiffStore:
+    # SQLite のファイル1つに置く内容アドレス方式のストア。
+    # 接続はスレッドごとに作る（Streamlit はセッションごとに別スレッドでスクリプトを実行する）。
+    # 書き込みは BEGIN IMMEDIATE で直列化し、読み込みは WAL により書き込み中でも待たない。
+
+    def __init__(
+        self, path: Union[str, Path], max_bytes: int = DEFAULT_STORE_MAX_BYTES
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- キーと値 ---------------------------------------------------------------
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        # 見つかったキーの値だけを返す（使われた時刻が古いものは更新する）
+        conn = self._conn()
+        found: Dict[str, bytes] = {}
+        stale: List[str] = []
+        now = time.time()
+        for i in range(0, len(keys), _KEY_BATCH):
+            batch = keys[i : i + _KEY_BATCH]
+            marks = ",".join("?" * len(batch))
+            for key, data, last_used in conn.execute(
+                f"SELECT key, data, last_used FROM entries WHERE key IN ({marks})", batch
+            ):
+                found[key] = data
+                if now - last_used > TOUCH_INTERVAL:
+                    stale.append(key)
+        if stale:
+            with self._write(conn):
+                conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in stale]
+                )
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]) -> None:
+        # まとめて保存し、上限を超えていれば古いものから消す。
+        # 1件で上限を超える値は保存しない。
+        now = time.time()
+        rows = [
+            (key, data, len(key) + len(data), now)
+            for key, data in items
+            if len(key) + len(data) <= self.max_bytes
+        ]
+        if not rows:
+            return
+        conn = self._conn()
+        with self._write(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.put_many([(key, data)])
+
+    def delete(self, key: str) -> None:
+        conn = self._conn()
+        with self._write(conn):
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def clear(self) -> None:
+        conn = self._conn()
+        with self._write(conn):
+            conn.execute("DELETE FROM entries")
+
+    def _write(self, conn: sqlite3.Connection) -> "_WriteTransaction":
+        return _WriteTransaction(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # 合計が上限を超えていれば、最終使用時刻の古い順に消す（書き込みトランザクション内で呼ぶ）
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        goal = int(self.max_bytes * EVICT_TO_RATIO)
+        while total > goal:
+            victims = conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_used LIMIT ?", (_KEY_BATCH,)
+            ).fetchall()
+            if not victims:
+                break
+            doomed = []
+            for key, size in victims:
+                doomed.append((key,))
+                total -= size
+                if total <= goal:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def _load(self, key: str) -> Any:
+        # pickle した値を読む。読めない（壊れた・形式が古い）ものは消して None
+        data = self.get(key)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            self.delete(key)
+            return None
+
+    def _save(self, key: str, value: Any) -> None:
+        self.put(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    # --- テンプレート -------------------------------------------------------------
+
+    def load_template(
+        self,
+        source: XarSource,
+        source_digest: Optional[str] = None,
+        blob_min_chars: Optional[int] = BLOB_MIN_CHARS,
+    ) -> Tuple[Dict[str, Any], ObjectIndex, Dict[str, Any], str]:
+        # .xar を読み込み、(meta, インデックス, 読み込み統計, .xat の SHA-256) を返す。
+        # 同じ .xat を読み込み済みなら解析せずにストアから返す（統計の store が "hit"）。
+        # source_digest（.xar 全体の SHA-256 など）を渡すと、2回目以降は .xat の展開も省く。
+        digest = None
+        if source_digest is not None:
+            hit = self.get(f"source:{source_digest}")
+            digest = hit.decode("ascii") if hit is not None else None
+        if digest is None:
+            digest = xat_digest(source)
+            if source_digest is not None:
+                self.put(f"source:{source_digest}", digest.encode("ascii"))
+
+        key = f"index:{digest}:{STORE_FORMAT}:{blob_min_chars}"
+        loaded = self._load(key)
+        if loaded is not None:
+            meta, idx, stats = loaded
+            return meta, idx, dict(stats, store="hit"), digest
+        meta, idx, stats = load_xar_streaming(source, blob_min_chars)
+        self._save(key, (meta, idx, stats))
+        return meta, idx, dict(stats, store="miss"), digest
+
+    # --- 比較 ---------------------------------------------------------------------
+
+    def compare(
+        self,
+        old_digest: str,
+        new_digest: str,
+        idx_old: ObjectIndex,
+        idx_new: ObjectIndex,
+        old_name: str = "old.xar",
+        new_name: str = "new.xar",
+        list_mode: str = "align",
+        list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+        value_ref_min_chars: Optional[int] = VALUE_REF_MIN_CHARS,
+        match_reid: bool = True,
+        reid_min_score: float = REID_MIN_SCORE,
+        analyze_layout: bool = True,
+        max_diffs_per_object: Optional[int] = None,
+        max_overlaps: Optional[int] = MAX_NEW_OVERLAPS,
+        profiler: Optional[StageProfiler] = None,
+    ) -> Dict[str, Any]:
+        # compare_indexes(detail="counts") と同じ結果を返す。old_digest / new_digest は
+        # load_template が返す .xat の SHA-256。同じ組・同じ条件の比較は保存済みの結果を返し、
+        # それ以外も前に比較したことのあるオブジェクトの組（ハッシュが同じもの）は比較しない。
+        rules = get_severity_rules().fingerprint
+        diff_options = _options_digest(STORE_FORMAT, list_mode, list(list_keys), rules)
+        options = _options_digest(
+            diff_options,
+            value_ref_min_chars,
+            match_reid,
+            reid_min_score,
+            analyze_layout,
+            max_diffs_per_object,
+            max_overlaps,
+        )
+        key = f"result:{old_digest}:{new_digest}:{options}"
+        stored = self._load(key)
+        if stored is not None:
+            return _attach_objects(stored, idx_old, idx_new, old_name, new_name)
+
+        started = time.perf_counter()
+        known_counts = self._known_counts(diff_options, idx_old, idx_new)
+        prefetched = set(known_counts)
+        if profiler is not None:
+            profiler.add(
+                "compare.store_counts", time.perf_counter() - started, pairs=len(prefetched)
+            )
+        result = compare_indexes(
+            idx_old,
+            idx_new,
+            old_name=old_name,
+            new_name=new_name,
+            list_mode=list_mode,
+            list_keys=list_keys,
+            value_ref_min_chars=value_ref_min_chars,
+            profiler=profiler,
+            match_reid=match_reid,
+            reid_min_score=reid_min_score,
+            analyze_layout=analyze_layout,
+            detail="counts",
+            max_diffs_per_object=max_diffs_per_object,
+            known_counts=known_counts,
+            max_overlaps=max_overlaps,
+        )
+        levels = sorted(SEVERITY_LEVELS)
+        self.put_many(
+            (
+                f"counts:{diff_options}:{old_hash}:{new_hash}",
+                json.dumps([counts[level] for level in levels]).encode("ascii"),
+            )
+            for (old_hash, new_hash), counts in known_counts.items()
+            if (old_hash, new_hash) not in prefetched
+        )
+        self._save(key, _detach_objects(result))
+        return result
+
+    def _known_counts(
+        self, diff_options: str, idx_old: ObjectIndex, idx_new: ObjectIndex
+    ) -> Dict[Tuple[str, str], Dict[int, int]]:
+        # ハッシュが異なる共通オブジェクトの組について、保存済みの重要度別件数を引く
+        pairs = {}
+        for oid, old_hash in idx_old.hashes.items():
+            new_hash = idx_new.hashes.get(oid)
+            if new_hash is not None and new_hash != old_hash:
+                pairs[f"counts:{diff_options}:{old_hash}:{new_hash}"] = (old_hash, new_hash)
+        levels = sorted(SEVERITY_LEVELS)
+        return {
+            pairs[key]: dict(zip(levels, json.loads(data)))
+            for key, data in self.get_many(list(pairs)).items()
+        }
+
+
+class _WriteTransaction:
+    # BEGIN IMMEDIATE ... COMMIT（例外なら ROLLBACK）
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def __enter__(self) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def _options_digest(*options: Any) -> str:
+    canonical = json.dumps(options, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _detach_objects(result: Dict[str, Any]) -> Dict[str, Any]:
+    # 保存用に、changed_detail からオブジェクト本体（old_full / new_full）と作成済みの差分一覧を外す
+    stored = dict(result)
+    stored["changed_detail"] = {
+        oid: dict(
+            {k: v for k, v in det.items() if k not in ("old_full", "new_full")}, diffs=None
+        )
+        for oid, det in result["changed_detail"].items()
+    }
+    return stored
+
+
+def _attach_objects(
+    stored: Dict[str, Any],
+    idx_old: ObjectIndex,
+    idx_new: ObjectIndex,
+    old_name: str,
+    new_name: str,
+) -> Dict[str, Any]:
+    # _detach_objects の逆。ID が変わったオブジェクトは旧側を old_id で引く
+    for oid, det in stored["changed_detail"].items():
+        det["old_full"] = idx_old[det.get("old_id", oid)]
+        det["new_full"] = idx_new[oid]
+    stored["old_name"] = old_name
+    stored["new_name"] = new_name
+    return stored
+
+
+def store_from_env() -> Optional[DiffStore]:
+    # 環境変数でファイルが指定されていればストアを開く（未指定なら None）
+    path = os.environ.get(STORE_ENV_VAR)
+    if not path:
+        return None
+    max_mb = os.environ.get(STORE_MAX_MB_ENV_VAR)
+    max_bytes = int(float(max_mb) * (1 << 20)) if max_mb else DEFAULT_STORE_MAX_BYTES
+    return DiffStore(path, max_bytes)
@@ -0,0 +1,312 @@
+# 帳票DX テンプレート差分 ストリーミング読み込み
+#
+# .xar（ZIP）内の .xat を少しずつ展開しながら読み、objects[] の要素を1つずつ
+# デコードしてインデックスへ入れる。テキスト全体や JSON 全体を同時に保持しないので、
+# 読み込み中に保持するのは「処理中の1オブジェクト分のテキスト + 読み込みチャンク」だけ。
+# base64 画像などの大きな文字列はハッシュ参照（"@blob:sha256:<hex>:<文字数>"）に置き換える。
+
+import hashlib
+import io
+import json
+import re
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple, Union
+
+from ReportDX_xar_diff_engine import ObjectIndex
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 読み込みチャンク（文字数）
+CHUNK_CHARS = 1 << 20
+
+# この文字数以上の base64 / data URI 文字列はハッシュ参照にする
+BLOB_MIN_CHARS = 16 * 1024
+
+BLOB_REF_PREFIX = "@blob:"
+
+XarSource = Union[bytes, str, Path, BinaryIO]
+
+_WS_RE = re.compile(r"[ \t\r\n]*")
+_NUMBER_RE = re.compile(r"[-+0-9.eE]*")
+_BLOB_RE = re.compile(r"(?:data:[^,]{0,200},)?[A-Za-z0-9+/=\r\n]+")
+
+
+def is_blob_ref(v: Any) -> bool:
+    return isinstance(v, str) and v.startswith(BLOB_REF_PREFIX)
+
+
+def blob_ref(s: str) -> str:
+    # 大きな文字列をハッシュ参照に置き換える
+    digest = hashlib.sha256(s.encode("utf-8")).hexdigest()
+    return f"{BLOB_REF_PREFIX}sha256:{digest}:{len(s)}"
+
+
+def find_xat_member(z: zipfile.ZipFile) -> zipfile.ZipInfo:
+    # .xar 内の .xat エントリ（中央ディレクトリの情報）を返す
+    for info in z.infolist():
+        if info.filename.lower().endswith(".xat"):
+            return info
+    raise ValueError(".xar 内に .xat ファイルが見つかりませんでした。")
+
+
+def xat_digest(source: XarSource) -> str:
+    # .xar 内の .xat の SHA-256（展開しながらハッシュし、JSON としては解析しない）
+    h = hashlib.sha256()
+    fileobj, owned = _open_source(source)
+    try:
+        with zipfile.ZipFile(fileobj) as z:
+            with z.open(find_xat_member(z)) as raw:
+                for chunk in iter(lambda: raw.read(CHUNK_CHARS), b""):
+                    h.update(chunk)
+    finally:
+        if owned:
+            fileobj.close()
+    return h.hexdigest()
+
+
+class _HashingReader(io.RawIOBase):
+    # 読んだバイト列をハッシュにも通す読み込み元（解析と同じ展開で .xat の SHA-256 を求める）
+
+    def __init__(self, raw: BinaryIO, hasher: Any) -> None:
+        self._raw = raw
+        self._hasher = hasher
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        data = self._raw.read(len(b))
+        self._hasher.update(data)
+        b[: len(data)] = data
+        return len(data)
+
+
+class _JsonStream:
+    # テキストストリーム上の簡易インクリメンタル JSON リーダー。
+    # トップレベルの構造だけを自前で辿り、値そのものの解析は JSONDecoder.raw_decode に任せる。
+
+    def __init__(
+        self,
+        text: io.TextIOBase,
+        max_value_chars: Optional[int],
+        chunk_chars: Optional[int] = None,
+    ) -> None:
+        self._text = text
+        self._decoder = json.JSONDecoder()
+        self._max_value_chars = max_value_chars
+        self._chunk_chars = chunk_chars or CHUNK_CHARS
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.chars_read = 0
+        self.peak_buffer_chars = 0
+        self.max_value_seen = 0
+
+    def _fill(self) -> bool:
+        # バッファを補充する（消費済みの先頭は捨てる）。これ以上読めなければ False。
+        if self.eof:
+            return False
+        # 1つの値が複数チャンクにまたがる場合は読み込み量を倍々に増やし、連結コストを線形に抑える
+        chunk = self._text.read(max(self._chunk_chars, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.chars_read += len(chunk)
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        self.peak_buffer_chars = max(self.peak_buffer_chars, len(self.buf))
+        return True
+
+    def skip_ws(self) -> None:
+        while True:
+            self.pos = _WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return
+
+    def peek(self) -> str:
+        self.skip_ws()
+        if self.pos >= len(self.buf):
+            raise ValueError(".xat の JSON が途中で終わっています。")
+        return self.buf[self.pos]
+
+    def expect(self, ch: str) -> None:
+        if self.peek() != ch:
+            raise ValueError(f".xat の JSON 形式が不正です（'{ch}' がありません）。")
+        self.pos += 1
+
+    def read_value(self) -> Tuple[Any, int]:
+        # 現在位置から JSON 値を1つ解析し、(値, テキスト上の文字数) を返す。
+        # 値がバッファ末尾で切れていれば補充して解析し直す（補充量は倍々に増えるので再解析は少ない）。
+        self.skip_ws()
+        while True:
+            start = self.pos
+            try:
+                value, end = self._decoder.raw_decode(self.buf, start)
+            except json.JSONDecodeError as e:
+                if self._max_value_chars is not None and len(self.buf) - start > self._max_value_chars:
+                    raise ValueError(
+                        f"1オブジェクトのサイズが上限（{self._max_value_chars} 文字）を超えました。"
+                    ) from None
+                if self._fill():
+                    continue
+                raise ValueError(f".xat の JSON 形式が不正です: {e.msg}") from None
+            # 数値はチャンク境界で切れていても解析できてしまうので、数値文字の並びが
+            # バッファ末尾まで続いていれば補充して解析し直す
+            if (
+                isinstance(value, (int, float))
+                and _NUMBER_RE.match(self.buf, start).end() == len(self.buf)
+                and self._fill()
+            ):
+                continue
+            break
+        self.pos = end
+        span = end - start
+        if self._max_value_chars is not None and span > self._max_value_chars:
+            # 1つのチャンクに収まった値も同じ上限で断る
+            raise ValueError(f"1オブジェクトのサイズが上限（{self._max_value_chars} 文字）を超えました。")
+        self.max_value_seen = max(self.max_value_seen, span)
+        return value, span
+
+
+def _elide_blobs(v: Any, min_chars: int, stats: Dict[str, Any]) -> Any:
+    # 大きな base64 / data URI 文字列をハッシュ参照に置き換える（dict/list はその場で書き換え）
+    if isinstance(v, str):
+        if len(v) >= min_chars and _BLOB_RE.fullmatch(v):
+            stats["blobs"] += 1
+            stats["blob_chars"] += len(v)
+            return blob_ref(v)
+        return v
+    if isinstance(v, dict):
+        for k, e in v.items():
+            if isinstance(e, (str, dict, list)):
+                v[k] = _elide_blobs(e, min_chars, stats)
+    elif isinstance(v, list):
+        for i, e in enumerate(v):
+            if isinstance(e, (str, dict, list)):
+                v[i] = _elide_blobs(e, min_chars, stats)
+    return v
+
+
+def _open_source(source: XarSource) -> Tuple[BinaryIO, bool]:
+    # 読み込み元をシーク可能なバイナリストリームにする（戻り値の bool は close が必要か）
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+    if isinstance(source, (str, Path)):
+        return open(source, "rb"), True
+    source.seek(0)
+    return source, False
+
+
+def iter_xar_objects(
+    source: XarSource,
+    meta: Optional[Dict[str, Any]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    blob_min_chars: Optional[int] = BLOB_MIN_CHARS,
+    max_object_chars: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    # .xar 内の .xat を展開しながら objects[] の要素を1つずつ返す。
+    # objects 以外のトップレベル項目は meta に、読み込み統計は stats に書き込む
+    # （読み終えると .xat の CRC・サイズ・SHA-256 も入る。どれも同じ1回の展開から求める）。
+    meta = {} if meta is None else meta
+    stats = {} if stats is None else stats
+
+    stats.update(objects=0, blobs=0, blob_chars=0)
+    fileobj, owned = _open_source(source)
+    try:
+        with zipfile.ZipFile(fileobj) as z:
+            info = find_xat_member(z)
+            stats["compressed_bytes"] = info.compress_size
+            stats["uncompressed_bytes"] = info.file_size
+            stats["crc32"] = info.CRC
+            with z.open(info) as raw:
+                hasher = hashlib.sha256()
+                hashed = io.BufferedReader(_HashingReader(raw, hasher), CHUNK_CHARS)
+                text = io.TextIOWrapper(hashed, encoding="utf-8-sig")
+                reader = _JsonStream(text, max_object_chars)
+                reader.expect("{")
+                if reader.peek() != "}":
+                    while True:
+                        key, _span = reader.read_value()
+                        reader.expect(":")
+                        if key == "objects" and reader.peek() == "[":
+                            reader.expect("[")
+                            if reader.peek() != "]":
+                                while True:
+                                    o, span = reader.read_value()
+                                    # テキスト長がしきい値未満なら大きな文字列は含まれない
+                                    if blob_min_chars and span >= blob_min_chars:
+                                        o = _elide_blobs(o, blob_min_chars, stats)
+                                    stats["objects"] += 1
+                                    yield o
+                                    if reader.peek() == ",":
+                                        reader.pos += 1
+                                        continue
+                                    reader.expect("]")
+                                    break
+                            else:
+                                reader.pos += 1
+                        else:
+                            value, span = reader.read_value()
+                            if blob_min_chars and span >= blob_min_chars:
+                                value = _elide_blobs(value, blob_min_chars, stats)
+                            meta[key] = value
+                        if reader.peek() == ",":
+                            reader.pos += 1
+                            continue
+                        reader.expect("}")
+                        break
+                else:
+                    reader.pos += 1
+                reader.skip_ws()
+                if reader.pos < len(reader.buf):
+                    raise ValueError(".xat の JSON の後ろに余分なデータがあります。")
+                stats["chars_read"] = reader.chars_read
+                stats["peak_buffer_chars"] = reader.peak_buffer_chars
+                stats["max_object_chars"] = reader.max_value_seen
+                # 末尾まで読み終えているので、xat_digest() と同じ値になる
+                stats["xat_sha256"] = hasher.hexdigest()
+    finally:
+        if owned:
+            fileobj.close()
+
+
+def load_xar_streaming(
+    source: XarSource,
+    blob_min_chars: Optional[int] = BLOB_MIN_CHARS,
+    max_object_chars: Optional[int] = None,
+) -> Tuple[Dict[str, Any], ObjectIndex, Dict[str, Any]]:
+    # .xar をストリーミングで読み込み、(objects 以外のトップレベル項目, インデックス, 統計) を返す。
+    # 統計の peak_buffer_chars が読み込み中に保持したテキストの最大量（最大オブジェクト + チャンク）。
+    # max_object_chars を指定すると、それを超えるオブジェクトがあれば ValueError にする。
+    started = time.perf_counter()
+    meta: Dict[str, Any] = {}
+    stats: Dict[str, Any] = {}
+    idx = ObjectIndex()
+    without_id = 0
+    for o in iter_xar_objects(source, meta, stats, blob_min_chars, max_object_chars):
+        oid = o.get("id") if isinstance(o, dict) else None
+        if oid is None:
+            without_id += 1
+            continue
+        idx[oid] = o
+    idx.ensure_hashes()
+    stats["objects_without_id"] = without_id
+    stats["seconds"] = time.perf_counter() - started
+    if resource is not None:
+        # プロセス全体の最大常駐メモリ（バイト）。ru_maxrss は macOS ではバイト、それ以外は KiB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+    return meta, idx, stats
+
+
+def template_from_index(meta: Dict[str, Any], idx: ObjectIndex) -> Dict[str, Any]:
+    # インデックスからテンプレートJSON相当の dict を組み立てる（オブジェクトは共有）
+    tpl = dict(meta)
+    tpl["objects"] = list(idx.values())
+    return tpl
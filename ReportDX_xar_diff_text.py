@@ -0,0 +1,131 @@
+# 帳票DX テンプレート差分 JSONテキスト差分
+#
+# 両テンプレートを正規化したテキスト（キーをソートし、インデント幅を固定、1オブジェクト1ブロック）
+# に直して unified diff 形式で比較する。ブロックは id 順に並べ、オブジェクト単位のハッシュが
+# 一致するブロックは整形もしないので、巨大なテンプレートでも変更のあったブロック分の処理で済む。
+# ハンクの行番号は各ブロック内での行番号、ハンク見出しの末尾にブロック名（オブジェクト id）を付ける。
+
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ReportDX_xar_diff_align import Opcode, patience_opcodes
+from ReportDX_xar_diff_engine import ObjectIndex, object_hash
+
+DEFAULT_CONTEXT_LINES = 3
+DEFAULT_MAX_HUNKS = 200
+DEFAULT_MAX_LINES = 5000
+
+# ブロック内の行比較で Myers に許す編集距離（超えた区間は置換として表示）
+TEXT_MAX_EDIT_DISTANCE = 1000
+
+META_BLOCK = "(template)"
+
+
+def canonical_lines(value: Any) -> List[str]:
+    # 正規化したテキスト（キー順ソート・インデント2）を行のリストで返す
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, indent=2).splitlines()
+
+
+def _group_opcodes(opcodes: List[Opcode], n: int) -> Iterator[List[Opcode]]:
+    # 前後 n 行の文脈ごとにハンクへ分ける（difflib.SequenceMatcher.get_grouped_opcodes と同じ規則）
+    codes = list(opcodes)
+    if not codes:
+        return
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = (tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2)
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n))
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start: int, stop: int) -> str:
+    # unified diff の行範囲表記（difflib と同じ）
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def canonical_text_diff(
+    meta_old: Dict[str, Any],
+    idx_old: ObjectIndex,
+    meta_new: Dict[str, Any],
+    idx_new: ObjectIndex,
+    context: int = DEFAULT_CONTEXT_LINES,
+    max_hunks: Optional[int] = DEFAULT_MAX_HUNKS,
+    max_lines: Optional[int] = DEFAULT_MAX_LINES,
+    fromfile: str = "old.xat",
+    tofile: str = "new.xat",
+) -> Tuple[str, Dict[str, Any]]:
+    # 正規化テキスト同士の unified diff と統計を返す。
+    # max_hunks / max_lines に達したらそこで打ち切る（統計の truncated が True になる）。
+    blocks: List[Tuple[str, Any, Any]] = []
+    if object_hash(meta_old) != object_hash(meta_new):
+        blocks.append((META_BLOCK, meta_old, meta_new))
+    hashes_old = idx_old.ensure_hashes().hashes
+    hashes_new = idx_new.ensure_hashes().hashes
+    for oid in sorted(set(idx_old) | set(idx_new), key=str):
+        h_old = hashes_old.get(oid)
+        h_new = hashes_new.get(oid)
+        if h_old != h_new:
+            blocks.append((f"object {oid}", idx_old.get(oid), idx_new.get(oid)))
+
+    out: List[str] = [f"--- {fromfile}", f"+++ {tofile}"]
+    stats: Dict[str, Any] = {
+        "changed_blocks": len(blocks),
+        "shown_blocks": 0,
+        "hunks": 0,
+        "lines": 0,
+        "truncated": False,
+    }
+    for label, v_old, v_new in blocks:
+        lines_a = canonical_lines(v_old) if v_old is not None else []
+        lines_b = canonical_lines(v_new) if v_new is not None else []
+        opcodes = patience_opcodes(lines_a, lines_b, TEXT_MAX_EDIT_DISTANCE)
+        for group in _group_opcodes(opcodes, context):
+            if max_hunks is not None and stats["hunks"] >= max_hunks:
+                stats["truncated"] = True
+                break
+            first, last = group[0], group[-1]
+            out.append(
+                f"@@ -{_format_range(first[1], last[2])} "
+                f"+{_format_range(first[3], last[4])} @@ {label}"
+            )
+            stats["hunks"] += 1
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    out.extend(" " + line for line in lines_a[i1:i2])
+                    continue
+                if tag in ("replace", "delete"):
+                    out.extend("-" + line for line in lines_a[i1:i2])
+                if tag in ("replace", "insert"):
+                    out.extend("+" + line for line in lines_b[j1:j2])
+            if max_lines is not None and len(out) - 2 > max_lines:
+                del out[max_lines + 2 :]
+                stats["truncated"] = True
+                break
+        if stats["truncated"]:
+            break
+        stats["shown_blocks"] += 1
+
+    stats["lines"] = len(out) - 2
+    if stats["truncated"]:
+        rest = stats["changed_blocks"] - stats["shown_blocks"]
+        out.append(f"... 表示上限に達したため打ち切りました（未表示の変更ブロック: {rest}）")
+    if not blocks:
+        return "", stats
+    return "\n".join(out), stats
@@ -0,0 +1,610 @@
+# 帳票DX テンプレート差分 3者比較（基準 / A / B）
+#
+# 同じ基準テンプレートを2つのチームが別々に編集した A と B を、基準との差分として1回の走査で比べ、
+# 差分のパスごとに「A のみ」「B のみ」「同じ変更」「競合」に分類する。
+#   1. 基準・A・B はそれぞれ1回だけ読み込んでインデックス化し、基準の部分木ハッシュは A 側・B 側で共有する
+#   2. オブジェクトハッシュで基準から変化したオブジェクトだけを集め、それ以外は辿らない。
+#      片側だけ（または A と B で同じ）の変更は、両側で同じ値のキーを除いてから基準との2者比較を1回だけ行う
+#      （部分木ハッシュは作らない。変更オブジェクト数が2者比較の倍になっても、手間をほぼ同じに抑える）
+#   3. オブジェクトの中は3つを同時に辿り、A（または B）が基準と同じ部分木はもう一方と基準の差分だけ、
+#      A と B が同じ部分木は1回だけ辿る。3つとも違う dict だけさらに降りる
+#   4. 3つとも違うリスト・値・型の違いは、基準との2者比較（deep_diff と同じ対応付け）をパスで突き合わせる。
+#      同じパスで同じ変更なら「同じ変更」、同じパスで違う変更、または祖先・子孫のパスで変更があれば「競合」
+# ID の付け直しの対応付け・レイアウトの集約は行わない（ID が変わったオブジェクトは削除 + 追加になる）。
+
+import io
+import json
+import marshal
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from ReportDX_xar_diff_engine import (
+    DEFAULT_LIST_KEYS,
+    REPORT_FORMATS,
+    OP_LABELS,
+    ObjectIndex,
+    SubtreeHashes,
+    as_object_index,
+    iter_diff,
+    summarize_object,
+)
+from ReportDX_xar_diff_entry import DiffEntry, Segments, render_path
+from ReportDX_xar_diff_excel import write_three_way_excel_report
+from ReportDX_xar_diff_profile import StageProfiler
+from ReportDX_xar_diff_rules import SEVERITY_COUNT_KEYS, SEVERITY_LEVELS, get_severity_rules
+from ReportDX_xar_diff_values import (
+    DEFAULT_REPORT_MAX_VALUE_CHARS,
+    VALUE_REF_MIN_CHARS,
+    format_value,
+    make_value_ref,
+    value_for_json,
+)
+
+# 差分1件の分類
+THREE_WAY_STATUSES = ("a_only", "b_only", "same", "conflict")
+THREE_WAY_STATUS_LABELS = {
+    "a_only": "A のみ",
+    "b_only": "B のみ",
+    "same": "同じ変更",
+    "conflict": "競合",
+}
+
+# オブジェクト単位の分類（"both" は A と B が競合せずに別々の箇所を変えたもの）
+OBJECT_STATUSES = ("conflict", "both", "a_only", "b_only", "same")
+OBJECT_STATUS_LABELS = dict(THREE_WAY_STATUS_LABELS, both="A・B 別々の変更")
+
+# 分類 -> rows で件数を持つ列
+STATUS_COUNT_KEYS = {status: f"{status}_cnt" for status in THREE_WAY_STATUSES}
+
+ObjectSource = Dict[str, Dict[str, Any]]
+
+# オブジェクト全体を表すパス
+OBJECT_ROOT: Segments = ("object",)
+
+
+class ThreeWayEntry:
+    # 分類済みの差分1件。a / b は基準との2者比較の差分（DiffEntry）で、その側に変更がなければ None。
+    # 「同じ変更」では a と b は同じ DiffEntry。競合で a / b の一方が None のものは、
+    # その側の変更が祖先・子孫のパスにある。
+
+    __slots__ = ("segments", "status", "a", "b", "severity", "_path")
+
+    def __init__(
+        self,
+        segments: Segments,
+        status: str,
+        a: Optional[DiffEntry],
+        b: Optional[DiffEntry],
+    ) -> None:
+        self.segments = segments
+        self.status = status
+        self.a = a
+        self.b = b
+        self.severity = 0
+        self._path = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = render_path(self.segments)
+        return self._path
+
+    @property
+    def base(self) -> Any:
+        # 基準側の値（"moved" では移動元の添字）
+        return (self.a or self.b).old
+
+    def __repr__(self) -> str:
+        return f"ThreeWayEntry({self.path!r}, {self.status!r}, a={self.a!r}, b={self.b!r})"
+
+
+# _three_way_node が返すもの: 分類済みの差分、または辿る子ノード (基準, A, B, セグメント)
+ThreeWayStep = Union[ThreeWayEntry, Tuple[Any, Any, Any, Any]]
+
+
+def _same(x: Any, y: Any, hx: Optional[SubtreeHashes], hy: Optional[SubtreeHashes]) -> bool:
+    # 部分木が同じか（dict/list は部分木ハッシュがあればハッシュで、なければ値で比べる）
+    if hx is not None and hy is not None and type(x) is type(y) and isinstance(x, (dict, list)):
+        dx = hx.get(id(x))
+        dy = hy.get(id(y))
+        if dx is not None and dy is not None:
+            return dx == dy
+    return x == y
+
+
+def _one_side(diffs: Iterator[DiffEntry], status: str) -> Iterator[ThreeWayEntry]:
+    # 片側（または両側で同じ）だけの変更
+    for d in diffs:
+        yield ThreeWayEntry(
+            d.segments, status, None if status == "b_only" else d, None if status == "a_only" else d
+        )
+
+
+def _overlaps(segments: Segments, paths: Set[Segments], prefixes: Set[Segments]) -> bool:
+    # 相手側に同じパス・祖先のパス・子孫のパスの変更があるか
+    if segments in paths or segments in prefixes:
+        return True
+    return any(segments[:i] in paths for i in range(len(segments)))
+
+
+def _same_change(d: DiffEntry, e: DiffEntry) -> bool:
+    return d.op == e.op and d.old == e.old and d.new == e.new
+
+
+def match_two_way(diffs_a: List[DiffEntry], diffs_b: List[DiffEntry]) -> Iterator[ThreeWayEntry]:
+    # 同じ部分に対する基準→A と 基準→B の差分をパスで突き合わせて分類する（A の順、続けて B の残り）。
+    # 同じパスの差分は種類が同じものを先に組にし、残りを種類が違っても組にする。
+    by_path: Dict[Segments, List[DiffEntry]] = {}
+    for e in diffs_b:
+        by_path.setdefault(e.segments, []).append(e)
+    paired: Dict[int, DiffEntry] = {}
+    for exact in (True, False):
+        for d in diffs_a:
+            candidates = by_path.get(d.segments)
+            if not candidates or id(d) in paired:
+                continue
+            e = next((c for c in candidates if c.op == d.op), None) if exact else candidates[0]
+            if e is not None:
+                candidates.remove(e)
+                paired[id(d)] = e
+
+    paths_a = {d.segments for d in diffs_a}
+    paths_b = {e.segments for e in diffs_b}
+    prefixes_a = {p[:i] for p in paths_a for i in range(len(p))}
+    prefixes_b = {p[:i] for p in paths_b for i in range(len(p))}
+    for d in diffs_a:
+        e = paired.get(id(d))
+        if e is not None:
+            status = "same" if _same_change(d, e) else "conflict"
+            yield ThreeWayEntry(d.segments, status, d, d if status == "same" else e)
+        elif _overlaps(d.segments, paths_b, prefixes_b):
+            yield ThreeWayEntry(d.segments, "conflict", d, None)
+        else:
+            yield ThreeWayEntry(d.segments, "a_only", d, None)
+    for remaining in by_path.values():
+        for e in remaining:
+            status = "conflict" if _overlaps(e.segments, paths_a, prefixes_a) else "b_only"
+            yield ThreeWayEntry(e.segments, status, None, e)
+
+
+def _three_way_node(
+    base: Any, a: Any, b: Any, trail: List[Any], opts: Tuple[Any, ...]
+) -> Iterator[ThreeWayStep]:
+    # 1ノード分の3者比較。分類済みの差分と、3つとも違う dict の子ノードを順に返す。
+    # trail はこのノードまでのパス（このジェネレータが動いている間だけ有効）。
+    list_mode, list_keys, h_base, h_a, h_b = opts
+    a_same = _same(base, a, h_base, h_a)
+    b_same = _same(base, b, h_base, h_b)
+    if a_same and b_same:
+        return
+    path = tuple(trail)
+    if b_same:
+        yield from _one_side(iter_diff(base, a, path, list_mode, list_keys, h_base, h_a), "a_only")
+        return
+    if a_same:
+        yield from _one_side(iter_diff(base, b, path, list_mode, list_keys, h_base, h_b), "b_only")
+        return
+    if _same(a, b, h_a, h_b):
+        yield from _one_side(iter_diff(base, a, path, list_mode, list_keys, h_base, h_a), "same")
+        return
+
+    if type(base) is dict and type(a) is dict and type(b) is dict:
+        for k in sorted(set(base) | set(a) | set(b)):
+            if k in base and k in a and k in b:
+                yield (base[k], a[k], b[k], k)
+                continue
+            # どこかで追加・削除されたキーは、そのキーだけの2者比較を突き合わせる
+            sub_base, sub_a, sub_b = ({k: v[k]} if k in v else {} for v in (base, a, b))
+            yield from match_two_way(
+                list(iter_diff(sub_base, sub_a, path, list_mode, list_keys, h_base, h_a)),
+                list(iter_diff(sub_base, sub_b, path, list_mode, list_keys, h_base, h_b)),
+            )
+        return
+
+    # 3つとも違うリスト・値（型の違いを含む）は、基準との2者比較を突き合わせる
+    yield from match_two_way(
+        list(iter_diff(base, a, path, list_mode, list_keys, h_base, h_a)),
+        list(iter_diff(base, b, path, list_mode, list_keys, h_base, h_b)),
+    )
+
+
+def iter_three_way_diff(
+    base: Any,
+    a: Any,
+    b: Any,
+    path: Union[str, Segments] = (),
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    hashes_base: Optional[SubtreeHashes] = None,
+    hashes_a: Optional[SubtreeHashes] = None,
+    hashes_b: Optional[SubtreeHashes] = None,
+) -> Iterator[ThreeWayEntry]:
+    # 基準・A・B（JSONの一部）を同時に辿り、分類済みの差分を1件ずつ返す。
+    # hashes_*（ObjectIndex.subtree_hashes）があれば、部分木が同じかをハッシュで判定する。
+    # iter_diff と同じく再帰せず、ノードごとのジェネレータをスタックに積んで辿る。
+    if isinstance(path, str):
+        path = (path,) if path else ()
+    opts = (list_mode, list_keys, hashes_base, hashes_a, hashes_b)
+    trail = list(path)
+    stack = [_three_way_node(base, a, b, trail, opts)]
+    while stack:
+        for step in stack[-1]:
+            if type(step) is ThreeWayEntry:
+                yield step
+            else:
+                child_base, child_a, child_b, seg = step
+                trail.append(seg)
+                stack.append(_three_way_node(child_base, child_a, child_b, trail, opts))
+                break
+        else:
+            stack.pop()
+            if stack:
+                trail.pop()
+
+
+def _side_op(oid: str, idx_base: ObjectIndex, idx_side: ObjectIndex) -> Optional[str]:
+    # オブジェクト単位での基準からの変化（変化なしは None）
+    if oid not in idx_side:
+        return "removed" if oid in idx_base else None
+    if oid not in idx_base:
+        return "added"
+    return "changed" if idx_side.hashes[oid] != idx_base.hashes[oid] else None
+
+
+def _changed_ids(idx_base: ObjectIndex, idx_side: ObjectIndex) -> Set[str]:
+    # 基準から変化した（追加・削除・変更された）オブジェクトの id
+    base_hashes = idx_base.hashes
+    changed = {oid for oid, h in idx_side.hashes.items() if base_hashes.get(oid) != h}
+    changed.update(idx_base.keys() - idx_side.keys())
+    return changed
+
+
+def _strictly_equal(x: Any, y: Any) -> bool:
+    # 型まで含めて同じ値か（1 と 1.0、True と 1 のように == だけが一致するものは違う）。
+    # 入れ子の dict/list は marshal（参照を使わない版 0）のバイト列で比べる（キー順が違えば違う扱い）
+    if type(x) is not type(y) or x != y:
+        return False
+    if not isinstance(x, (dict, list)):
+        return True
+    try:
+        return marshal.dumps(x, 0) == marshal.dumps(y, 0)
+    except ValueError:
+        return False
+
+
+def _drop_same_keys(
+    old: Dict[str, Any], new: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # 値が同じキーを両側から除いた dict の組を返す（残りのキーの差分は変わらない）。
+    # 両側とも dict の値はその中も同じように除く（元の dict は変更しない）
+    trimmed_old: Dict[str, Any] = {}
+    trimmed_new: Dict[str, Any] = {}
+    for k, x in old.items():
+        if k not in new:
+            trimmed_old[k] = x
+            continue
+        y = new[k]
+        if _strictly_equal(x, y):
+            continue
+        if type(x) is dict and type(y) is dict:
+            x, y = _drop_same_keys(x, y)
+        trimmed_old[k] = x
+        trimmed_new[k] = y
+    for k, y in new.items():
+        if k not in old:
+            trimmed_new[k] = y
+    return trimmed_old, trimmed_new
+
+
+def _same_object(oid: str, idx_a: ObjectIndex, idx_b: ObjectIndex) -> bool:
+    # A と B でオブジェクトが同じ（どちらにもない場合を含む）か
+    if oid not in idx_a or oid not in idx_b:
+        return oid not in idx_a and oid not in idx_b
+    return idx_a.hashes[oid] == idx_b.hashes[oid]
+
+
+def _object_status(counts: Dict[str, int]) -> str:
+    if counts["conflict"]:
+        return "conflict"
+    present = [s for s in ("a_only", "b_only", "same") if counts[s]]
+    return present[0] if len(present) == 1 else "both"
+
+
+def compare_three_way(
+    idx_base: ObjectSource,
+    idx_a: ObjectSource,
+    idx_b: ObjectSource,
+    base_name: str = "base.xar",
+    a_name: str = "a.xar",
+    b_name: str = "b.xar",
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+    value_ref_min_chars: Optional[int] = VALUE_REF_MIN_CHARS,
+    profiler: Optional[StageProfiler] = None,
+) -> Dict[str, Any]:
+    # index_objects 済みの基準・A・B を3者比較する。
+    # 戻り値: {base_name, a_name, b_name, rows, detail}
+    #   rows:   変化のあったオブジェクトごとの行（a_op / b_op、分類、分類別・重要度別の件数）
+    #   detail: id -> {"summary": オブジェクトの概略, "entries": ThreeWayEntry のリスト}
+    # 重要度は2者比較と同じルール（ReportDX_xar_diff_rules）でパスごとに判定する。
+    timing = profiler is not None and profiler.enabled
+    idx_base = as_object_index(idx_base)
+    idx_a = as_object_index(idx_a)
+    idx_b = as_object_index(idx_b)
+    rules = get_severity_rules()
+    top_level = max(SEVERITY_LEVELS)
+
+    started = time.perf_counter()
+    hash_seconds = 0.0
+    n_walked = 0
+    rows: List[Dict[str, Any]] = []
+    detail: Dict[str, Any] = {}
+    for oid in sorted(_changed_ids(idx_base, idx_a) | _changed_ids(idx_base, idx_b)):
+        a_op = _side_op(oid, idx_base, idx_a)
+        b_op = _side_op(oid, idx_base, idx_b)
+        n_walked += 1
+        sources = (idx_base, idx_a, idx_b)
+        if a_op is None or b_op is None or _same_object(oid, idx_a, idx_b):
+            # 片側だけの変更、または A と B が同じ変更は、基準との2者比較1回で済む
+            status = "b_only" if a_op is None else ("a_only" if b_op is None else "same")
+            compared = (0, 2 if a_op is None else 1)
+        else:
+            status = None
+            compared = (0, 1, 2)
+        hashes: List[Optional[SubtreeHashes]] = [None, None, None]
+        if all(oid in sources[i] for i in compared):
+            if status is None:
+                # 基準の部分木ハッシュは A 側・B 側の両方の比較で使う。
+                # 2者比較1回で済むオブジェクトは、両側を丸ごとハッシュするより素直に辿るほうが速い
+                # （差分は同じ。リストの対応付けは要素ごとにハッシュする）
+                t0 = time.perf_counter()
+                for i in compared:
+                    hashes[i] = sources[i].subtree_hashes_for(oid)
+                hash_seconds += time.perf_counter() - t0
+            values = [idx.get(oid) for idx in sources]
+            path: Segments = OBJECT_ROOT
+        else:
+            # 追加・削除されたオブジェクトは "object" の下の値として比べる
+            values = [{"object": idx[oid]} if oid in idx else {} for idx in sources]
+            path = ()
+        h_base, h_a, h_b = hashes
+        if status is None:
+            walk = iter_three_way_diff(*values, path, list_mode, list_keys, h_base, h_a, h_b)
+        else:
+            side = compared[1]
+            old, new = values[0], values[side]
+            if path:
+                old, new = _drop_same_keys(old, new)
+            walk = _one_side(
+                iter_diff(old, new, path, list_mode, list_keys, h_base, hashes[side]), status
+            )
+
+        entries: List[ThreeWayEntry] = []
+        status_counts = {status: 0 for status in THREE_WAY_STATUSES}
+        severity_counts = {level: 0 for level in SEVERITY_LEVELS}
+        for t in walk:
+            # オブジェクトごとの追加・削除は、2者比較の追加・削除オブジェクトと同じく重大として数える
+            # （オブジェクト全体の値はインデックスが持っているので ValueRef にしない）
+            whole = t.segments == OBJECT_ROOT
+            t.severity = top_level if whole else rules.severity_of(t.segments)
+            status_counts[t.status] += 1
+            severity_counts[t.severity] += 1
+            if value_ref_min_chars is not None and not whole:
+                # 「同じ変更」の a と b は同じ差分（2回目は ValueRef のまま）
+                for side, hashes in ((t.a, h_a), (t.b, h_b)):
+                    if side is not None:
+                        side.old = make_value_ref(side.old, value_ref_min_chars, h_base)
+                        side.new = make_value_ref(side.new, value_ref_min_chars, hashes)
+            entries.append(t)
+        if not entries:
+            continue
+
+        shown = idx_base.get(oid) or idx_a.get(oid) or idx_b[oid]
+        summary = summarize_object(shown)
+        rows.append(
+            {
+                "id": oid,
+                "name": summary.get("name"),
+                "kind": summary.get("kind"),
+                "type": summary.get("type"),
+                "a_op": a_op,
+                "b_op": b_op,
+                "status": _object_status(status_counts),
+                **{STATUS_COUNT_KEYS[s]: n for s, n in status_counts.items()},
+                **{SEVERITY_COUNT_KEYS[level]: n for level, n in severity_counts.items()},
+                "total_changes": len(entries),
+            }
+        )
+        detail[oid] = {"summary": summary, "entries": entries}
+
+    if timing:
+        profiler.add("three_way.subtree_hashes", hash_seconds, objects=n_walked)
+        profiler.add(
+            "three_way.walk",
+            time.perf_counter() - started - hash_seconds,
+            objects=n_walked,
+            entries=sum(r["total_changes"] for r in rows),
+        )
+
+    return {
+        "base_name": base_name,
+        "a_name": a_name,
+        "b_name": b_name,
+        "rows": rows,
+        "detail": detail,
+    }
+
+
+def summarize_three_way(result: Dict[str, Any]) -> Dict[str, int]:
+    # 3者比較の集計（オブジェクト単位の分類ごとの件数、差分の分類別・重要度別の件数）
+    rows = result["rows"]
+    summary = {"objects": len(rows)}
+    for status in OBJECT_STATUSES:
+        summary[f"objects_{status}"] = sum(1 for r in rows if r["status"] == status)
+    for status, key in STATUS_COUNT_KEYS.items():
+        summary[status] = sum(r[key] for r in rows)
+    summary["critical"] = sum(r["critical_cnt"] for r in rows)
+    summary["medium"] = sum(r["medium_cnt"] for r in rows)
+    summary["minor"] = sum(r["minor_cnt"] for r in rows)
+    return summary
+
+
+# --- レポート -----------------------------------------------------------------
+
+
+def describe_base(t: ThreeWayEntry, max_value_chars: Optional[int]) -> str:
+    # 基準側の値の表示（追加・移動では空）
+    if (t.a or t.b).op in ("added", "moved"):
+        return ""
+    return format_value(t.base, max_value_chars)
+
+
+def describe_side(t: ThreeWayEntry, side: str, max_value_chars: Optional[int]) -> str:
+    # A / B 側の変更の表示（"変更: 値" など。変更のない側は "（基準のまま）"）
+    d = t.a if side == "a" else t.b
+    if d is None:
+        return "（祖先・子孫のパスで変更）" if t.status == "conflict" else "（基準のまま）"
+    if d.op == "moved":
+        return f"{OP_LABELS[d.op]}: [{d.old}] → [{d.new}]"
+    if d.op == "removed":
+        return OP_LABELS[d.op]
+    return f"{OP_LABELS[d.op]}: {format_value(d.new, max_value_chars)}"
+
+
+def sorted_entries(entries: List[ThreeWayEntry]) -> List[ThreeWayEntry]:
+    # 競合を先に、重要度の高い順・パス順
+    order = {status: n for n, status in enumerate(("conflict", "a_only", "b_only", "same"))}
+    return sorted(entries, key=lambda t: (order[t.status], -t.severity, t.path))
+
+
+def _side_label(op: Optional[str]) -> str:
+    return OP_LABELS[op] if op else "-"
+
+
+def iter_three_way_markdown(
+    result: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> Iterator[str]:
+    # 3者比較の Markdown レポートの行（改行なし）
+    summary = summarize_three_way(result)
+    yield "# 帳票DX テンプレート3者比較レポート"
+    yield ""
+    yield f"- 基準テンプレート: `{result['base_name']}`"
+    yield f"- A: `{result['a_name']}`"
+    yield f"- B: `{result['b_name']}`"
+    yield ""
+    yield "## サマリー"
+    yield ""
+    yield f"- 変化のあったオブジェクト数: **{summary['objects']}**"
+    for status in OBJECT_STATUSES:
+        yield f"  - {OBJECT_STATUS_LABELS[status]}: **{summary[f'objects_{status}']}**"
+    for status in THREE_WAY_STATUSES:
+        yield f"- {THREE_WAY_STATUS_LABELS[status]}の差分: **{summary[status]}**"
+    yield f"- 重大変更(🔴): **{summary['critical']}**"
+    yield f"- 中変更(🟡): **{summary['medium']}**"
+    yield f"- 軽微変更(🟢): **{summary['minor']}**"
+    yield ""
+
+    yield "## オブジェクト一覧"
+    yield ""
+    if not result["rows"]:
+        yield "- なし"
+        return
+    yield "| id | name | kind | A | B | 分類 | 競合 | 重大 | 中 | 軽微 |"
+    yield "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |"
+    for row in result["rows"]:
+        yield (
+            f"| `{row['id']}` | {row.get('name') or ''} | {row.get('kind') or ''} | "
+            f"{_side_label(row['a_op'])} | {_side_label(row['b_op'])} | "
+            f"{OBJECT_STATUS_LABELS[row['status']]} | {row['conflict_cnt']} | "
+            f"{row['critical_cnt']} | {row['medium_cnt']} | {row['minor_cnt']} |"
+        )
+    yield ""
+
+    yield "## オブジェクト詳細"
+    yield ""
+    for row in result["rows"]:
+        yield f"### オブジェクト `{row['id']}`（{OBJECT_STATUS_LABELS[row['status']]}）"
+        yield ""
+        yield "| 重要度 | 分類 | パス | 基準 | A | B |"
+        yield "| --- | --- | --- | --- | --- | --- |"
+        for t in sorted_entries(result["detail"][row["id"]]["entries"]):
+            emoji, label = SEVERITY_LEVELS[t.severity]
+            yield (
+                f"| {emoji} {label} | {THREE_WAY_STATUS_LABELS[t.status]} | `{t.path}` | "
+                f"`{describe_base(t, max_value_chars)}` | `{describe_side(t, 'a', max_value_chars)}` | "
+                f"`{describe_side(t, 'b', max_value_chars)}` |"
+            )
+        yield ""
+
+
+def build_three_way_markdown(
+    result: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> str:
+    return "\n".join(iter_three_way_markdown(result, max_value_chars))
+
+
+def _json_side(d: Optional[DiffEntry]) -> Optional[Dict[str, Any]]:
+    if d is None:
+        return None
+    return {"op": d.op, "old": value_for_json(d.old), "new": value_for_json(d.new)}
+
+
+def build_three_way_json(result: Dict[str, Any]) -> Dict[str, Any]:
+    # 機械処理向けの JSON レポート（json.dump 可能な dict）
+    objects = []
+    for row in result["rows"]:
+        entries = []
+        for t in sorted_entries(result["detail"][row["id"]]["entries"]):
+            _emoji, label = SEVERITY_LEVELS[t.severity]
+            entries.append(
+                {
+                    "status": t.status,
+                    "severity": t.severity,
+                    "level": label,
+                    "path": t.path,
+                    "a": _json_side(t.a),
+                    "b": _json_side(t.b),
+                }
+            )
+        objects.append(dict(row, entries=entries))
+    return {
+        "base_name": result["base_name"],
+        "a_name": result["a_name"],
+        "b_name": result["b_name"],
+        "summary": summarize_three_way(result),
+        "objects": objects,
+    }
+
+
+def build_three_way_excel(
+    result: Dict[str, Any],
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> bytes:
+    with io.BytesIO() as buffer:
+        write_three_way_excel_report(buffer, result["rows"], result["detail"], max_value_chars)
+        return buffer.getvalue()
+
+
+def write_three_way_reports(
+    result: Dict[str, Any],
+    out_dir: Union[str, Path],
+    formats: Sequence[str] = REPORT_FORMATS,
+    max_value_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS,
+) -> None:
+    # 3者比較の結果から formats（md / xlsx / json）のレポートを out_dir に書き出す
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if "md" in formats:
+        with (out_dir / "xar_three_way_report.md").open("w", encoding="utf-8") as f:
+            for line in iter_three_way_markdown(result, max_value_chars):
+                f.write(line + "\n")
+    if "xlsx" in formats:
+        write_three_way_excel_report(
+            out_dir / "xar_three_way_report.xlsx", result["rows"], result["detail"], max_value_chars
+        )
+    if "json" in formats:
+        with (out_dir / "xar_three_way_report.json").open("w", encoding="utf-8") as f:
+            json.dump(build_three_way_json(result), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,154 @@
+# 帳票DX テンプレート差分 大きな値の参照
+#
+# 片側にしかない部分木（追加されたテーブルや埋め込みリソースなど）を差分エントリに丸ごと持たせると、
+# 各レポートがそのたびに全体を JSON 化してしまう。一定サイズを超える値は ValueRef に包み、
+# 先頭のプレビューと件数・構造ハッシュだけを持たせる。元の値への参照は残すので（インデックスと共有、
+# コピーはしない）、画面で展開したときなど必要になった時点で全体を JSON 化できる。
+# プレビューの作成は上限文字数に達した時点で打ち切るので、値の大きさに比例しない。
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# 正規化JSONでこの文字数を超える値は ValueRef にする
+VALUE_REF_MIN_CHARS = 2048
+
+# ValueRef に持たせるプレビューの文字数
+VALUE_PREVIEW_CHARS = 160
+
+# レポートに書く1値あたりの既定の最大文字数（None なら無制限）
+DEFAULT_REPORT_MAX_VALUE_CHARS = 1000
+
+
+def _json_prefix(v: Any, limit: int) -> Tuple[str, bool]:
+    # 値を正規化JSON（キー順ソート）にしながら、limit 文字を超えた時点で打ち切る。
+    # 戻り値: (先頭のテキスト, 全体を書き切れたか)
+    parts: List[str] = []
+    total = 0
+
+    def emit(s: str) -> bool:
+        nonlocal total
+        parts.append(s)
+        total += len(s)
+        return total > limit
+
+    def walk(x: Any) -> bool:
+        # 打ち切ったら True
+        if isinstance(x, dict):
+            if emit("{"):
+                return True
+            for n, k in enumerate(sorted(x, key=str)):
+                if emit((", " if n else "") + json.dumps(str(k), ensure_ascii=False) + ": "):
+                    return True
+                if walk(x[k]):
+                    return True
+            return emit("}")
+        if isinstance(x, list):
+            if emit("["):
+                return True
+            for n, e in enumerate(x):
+                if n and emit(", "):
+                    return True
+                if walk(e):
+                    return True
+            return emit("]")
+        if isinstance(x, str) and len(x) > limit:
+            # 長い文字列は必要な分だけ JSON 化する
+            return emit(json.dumps(x[: limit + 1], ensure_ascii=False)[:-1])
+        return emit(json.dumps(x, ensure_ascii=False))
+
+    truncated = walk(v)
+    text = "".join(parts)
+    return (text[:limit], False) if truncated else (text, True)
+
+
+class ValueRef:
+    # 差分エントリ内の大きな値への参照。
+    #   value:   元の値（インデックス内のオブジェクトと共有）
+    #   kind:    "dict" / "list" / "str"
+    #   length:  キー数・要素数・文字数
+    #   preview: 正規化JSONの先頭
+    # digest（構造ハッシュ）と chars（正規化JSONの文字数）は参照された時点で計算する。
+
+    __slots__ = ("value", "kind", "length", "preview", "_digest", "_chars")
+
+    def __init__(self, value: Any, preview: str, digest: Optional[bytes] = None) -> None:
+        self.value = value
+        self.kind = type(value).__name__
+        self.length = len(value)
+        self.preview = preview
+        self._digest = digest
+        self._chars: Optional[int] = None
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            from ReportDX_xar_diff_engine import structural_hash
+
+            self._digest = structural_hash(self.value)
+        return self._digest.hex()
+
+    @property
+    def raw_digest(self) -> Optional[bytes]:
+        # 計算済みのダイジェスト（未計算なら None。計算はしない）
+        return self._digest
+
+    @property
+    def chars(self) -> int:
+        if self._chars is None:
+            self._chars = len(self.to_json(indent=None))
+        return self._chars
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        # 値全体の正規化JSON（必要になったときだけ呼ぶ）
+        return json.dumps(self.value, ensure_ascii=False, sort_keys=True, indent=indent)
+
+    def describe(self) -> str:
+        unit = {"dict": "キー", "list": "要素", "str": "文字"}.get(self.kind, "")
+        return f"{self.kind} {self.length} {unit}, #{self.digest[:12]}"
+
+    def as_dict(self) -> Dict[str, Any]:
+        # JSONレポート用の表現（値全体は含めない）
+        return {
+            "$ref": f"blake2b:{self.digest}",
+            "kind": self.kind,
+            "length": self.length,
+            "preview": self.preview,
+        }
+
+    def __repr__(self) -> str:
+        return f"ValueRef({self.describe()})"
+
+
+def make_value_ref(
+    v: Any,
+    min_chars: int = VALUE_REF_MIN_CHARS,
+    hashes: Optional[Dict[int, bytes]] = None,
+) -> Any:
+    # 正規化JSONで min_chars 文字を超える dict/list/文字列なら ValueRef を、そうでなければ v をそのまま返す。
+    # hashes（部分木ハッシュの表）に値があればそれを digest に使う。
+    if not isinstance(v, (dict, list, str)) or isinstance(v, ValueRef):
+        return v
+    if isinstance(v, str) and len(v) + 2 <= min_chars:
+        return v
+    text, complete = _json_prefix(v, min_chars)
+    if complete:
+        return v
+    digest = hashes.get(id(v)) if hashes is not None else None
+    return ValueRef(v, text[:VALUE_PREVIEW_CHARS], digest)
+
+
+def format_value(v: Any, max_chars: Optional[int] = DEFAULT_REPORT_MAX_VALUE_CHARS) -> str:
+    # レポート用に値を1行のJSONテキストにする。
+    # ValueRef はプレビューと概要だけ、それ以外も max_chars を超えた分は省略する（キー順はソート）。
+    if isinstance(v, ValueRef):
+        preview = v.preview if max_chars is None else v.preview[:max_chars]
+        return f"{preview}…（{v.describe()}）"
+    if max_chars is None:
+        return json.dumps(v, ensure_ascii=False, sort_keys=True)
+    text, complete = _json_prefix(v, max_chars)
+    return text if complete else text + "…"
+
+
+def value_for_json(v: Any) -> Any:
+    # JSONレポートに書く値（ValueRef は参照情報の dict にする）
+    return v.as_dict() if isinstance(v, ValueRef) else v
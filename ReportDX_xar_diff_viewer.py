@@ -1,12 +1,79 @@
 
+import html
 import io
-import zipfile
 import json
-import difflib
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import streamlit as st
-import pandas as pd
+
+from ReportDX_xar_diff_bindings import Binding, BindingIndex, summarize_by_dataset
+from ReportDX_xar_diff_browse import (
+    DIFF_PAGE_SIZE,
+    ROW_PAGE_SIZE,
+    filter_diffs,
+    json_preview,
+    match_rows,
+    page_count,
+    page_slice,
+    subtree_at,
+)
+from ReportDX_xar_diff_engine import (
+    OP_LABELS,
+    ObjectIndex,
+    build_excel_report,
+    classify_severity,
+    compare_indexes,
+    content_hash,
+    iter_markdown_report,
+    object_diffs,
+    result_from_json_report,
+    select_report_scope,
+    summarize_result,
+)
+from ReportDX_xar_diff_layout import LAYOUT_KIND_LABELS, describe_layout_group
+from ReportDX_xar_diff_library import (
+    STATUS_LABELS,
+    LibraryEntry,
+    compare_libraries,
+    compare_library_entry,
+    library_from_files,
+    report_dir_name,
+    summarize_library,
+)
+from ReportDX_xar_diff_profile import StageProfiler, flush_profiler_to_env, profiler_from_env
+from ReportDX_xar_diff_rules import SEVERITY_LEVELS
+from ReportDX_xar_diff_service import (
+    JOB_STAGE_LABELS,
+    DiffServiceClient,
+    ServiceError,
+    service_from_env,
+)
+from ReportDX_xar_diff_store import DiffStore, store_from_env
+from ReportDX_xar_diff_stream import load_xar_streaming
+from ReportDX_xar_diff_text import DEFAULT_MAX_HUNKS, DEFAULT_MAX_LINES, canonical_text_diff
+from ReportDX_xar_diff_threeway import (
+    OBJECT_STATUS_LABELS,
+    OBJECT_STATUSES,
+    THREE_WAY_STATUS_LABELS,
+    build_three_way_excel,
+    compare_three_way,
+    describe_base,
+    describe_side,
+    iter_three_way_markdown,
+    sorted_entries,
+    summarize_three_way,
+)
+from ReportDX_xar_diff_values import DEFAULT_REPORT_MAX_VALUE_CHARS, ValueRef, format_value
+from ReportDX_xar_diff_watch import DEFAULT_WATCH_INTERVAL, TemplateWatcher
+
+# キャッシュ件数の上限（超えたものは古い順に破棄される）
+CACHE_MAX_TEMPLATES = 8
+CACHE_MAX_RESULTS = 4
+# レポートは形式・条件ごとに別に持つ
+CACHE_MAX_REPORTS = 8
+# 差分サービスのジョブの進み具合を確認する間隔（秒）
+SERVICE_POLL_INTERVAL = 1.0
 
 st.set_page_config(page_title="帳票DX テンプレート差分ビューア（MD & Excelレポート版）", layout="wide")
 
@@ -17,201 +84,356 @@ st.write(
 
 # --- ファイルアップロード UI -------------------------------------------------
 
+compare_mode = st.radio(
+    "比較モード",
+    ["テンプレート1組", "ライブラリ一括", "ファイルを監視", "3者比較"],
+    horizontal=True,
+    key="compare_mode",
+    help=(
+        "ライブラリ一括: .xar をまとめた ZIP バンドル（または複数の .xar）同士を名前で対応付けて比較します。\n\n"
+        "ファイルを監視: ディスク上の .xar を監視し、保存し直されるたびに変わったオブジェクトだけ比較し直します。\n\n"
+        "3者比較: 同じ基準テンプレートを別々に編集した A と B を、基準との差分として比べて競合を探します。"
+    ),
+)
+library_mode = compare_mode == "ライブラリ一括"
+watch_mode = compare_mode == "ファイルを監視"
+three_way_mode = compare_mode == "3者比較"
+
 col1, col2 = st.columns(2)
-with col1:
-    old_file = st.file_uploader("旧テンプレート (.xar)", type=["xar"], key="old")
-with col2:
-    new_file = st.file_uploader("新テンプレート (.xar)", type=["xar"], key="new")
+old_file = new_file = None
+old_lib_files = new_lib_files = []
+watch_old = watch_new = ""
+watch_interval = DEFAULT_WATCH_INTERVAL
+three_way_files: List[Any] = []
+if three_way_mode:
+    for column, label, key in zip(
+        st.columns(3),
+        ("基準テンプレート (.xar)", "A (.xar)", "B (.xar)"),
+        ("three_way_base", "three_way_a", "three_way_b"),
+    ):
+        with column:
+            three_way_files.append(st.file_uploader(label, type=["xar"], key=key))
+elif watch_mode:
+    with col1:
+        watch_old = st.text_input("基準 .xar のパス（旧）", key="watch_old").strip()
+    with col2:
+        watch_new = st.text_input("作業中 .xar のパス（新）", key="watch_new").strip()
+    watch_interval = st.number_input(
+        "確認間隔（秒）",
+        min_value=0.5,
+        value=DEFAULT_WATCH_INTERVAL,
+        step=0.5,
+        key="watch_interval",
+    )
+elif library_mode:
+    with col1:
+        old_lib_files = st.file_uploader(
+            "旧ライブラリ（.zip・.xar、複数可）",
+            type=["zip", "xar"],
+            accept_multiple_files=True,
+            key="old_lib",
+        )
+    with col2:
+        new_lib_files = st.file_uploader(
+            "新ライブラリ（.zip・.xar、複数可）",
+            type=["zip", "xar"],
+            accept_multiple_files=True,
+            key="new_lib",
+        )
+else:
+    with col1:
+        old_file = st.file_uploader("旧テンプレート (.xar)", type=["xar"], key="old")
+    with col2:
+        new_file = st.file_uploader("新テンプレート (.xar)", type=["xar"], key="new")
 
+p1, p2 = st.columns(2)
+profiling = p1.toggle("⏱ 処理時間を計測する", key="profiling")
+use_cprofile = p2.toggle("cProfile も取得する", key="profiling_cprofile", disabled=not profiling)
+# 計測しないときも stage() は呼ぶが、何もしない共有オブジェクトが返るだけ
+profiler = profiler_from_env(profiling, profiling and use_cprofile).start()
 
-# --- ユーティリティ ----------------------------------------------------------
 
+# --- ユーティリティ ----------------------------------------------------------
 
-def load_xar_from_bytes(bytes_data: bytes) -> Tuple[Dict[str, Any], str]:
-    # Uploadされた .xar (ZIP) から .xat JSON と元テキストを返す
-    with zipfile.ZipFile(io.BytesIO(bytes_data)) as z:
-        xat_name = None
-        for name in z.namelist():
-            if name.lower().endswith(".xat"):
-                xat_name = name
-                break
-        if not xat_name:
-            raise ValueError(".xar 内に .xat ファイルが見つかりませんでした。")
-        data = z.read(xat_name)
-        txt = data.decode("utf-8")
-        return json.loads(txt), txt
-
-
-def index_objects(tpl_json: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
-    # objects配列をidで引けるdictに変換
-    return {
-        o.get("id"): o
-        for o in tpl_json.get("objects", [])
-        if o.get("id") is not None
-    }
 
+def uploaded_digest(uploaded: Any) -> str:
+    # アップロードファイルの内容ハッシュ。再実行のたびに全体をハッシュしないよう
+    # file_id ごとにセッションへ覚えておく。
+    digests: Dict[str, str] = st.session_state.setdefault("_xar_digests", {})
+    file_id = getattr(uploaded, "file_id", None)
+    if file_id is not None and file_id in digests:
+        return digests[file_id]
+    digest = content_hash(uploaded.getbuffer())
+    if file_id is not None:
+        digests[file_id] = digest
+    return digest
+
+
+def library_digest(files: Sequence[Any]) -> str:
+    # ライブラリ（アップロードされたファイル群）全体のハッシュ。ファイル名と内容ハッシュから作る。
+    listing = "\n".join(sorted(f"{f.name}\t{uploaded_digest(f)}" for f in files))
+    return content_hash(listing.encode("utf-8"))
+
+
+# 以下のキャッシュは内容ハッシュをキーにし、先頭が _ の引数はキー計算から除外される。
+# cache_resource は値をコピーせずに共有するため、戻り値は変更しないこと
+# （object_diffs() が差分一覧を changed_detail に書き足すのは除く。同じ内容になるので共有して構わない）。
+
+
+@st.cache_resource(show_spinner=False)
+def diff_store() -> Optional[DiffStore]:
+    # 環境変数 XAR_DIFF_STORE で指定された永続ストア（未指定なら None）。プロセス内で1つを共有する
+    return store_from_env()
+
+
+@st.cache_resource(max_entries=CACHE_MAX_TEMPLATES, show_spinner=False)
+def cached_template(
+    digest: str, _uploaded: Any, _profiler: StageProfiler
+) -> Tuple[Dict[str, Any], ObjectIndex, Dict[str, Any]]:
+    # .xar の解析結果（objects 以外のトップレベル項目・オブジェクトインデックス・読み込み統計）。
+    # 元テキストは保持せず、ストリーミングで読み込む。永続ストアがあれば、同じ .xat の解析結果は
+    # そこから読む（統計の xat_sha256 が比較結果を保存するときのキー）。
+    # _profiler への記録はキャッシュにない（実際に解析した）ときだけ残る。以下同様。
+    store = diff_store()
+    with _profiler.stage("load.parse", bytes=_uploaded.size) as s:
+        if store is not None:
+            meta, idx, stats, xat = store.load_template(_uploaded, digest)
+            stats = dict(stats, xat_sha256=xat)
+            s["store"] = stats["store"]
+        else:
+            meta, idx, stats = load_xar_streaming(_uploaded)
+        s["objects"] = len(idx)
+    return meta, idx, stats
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_comparison(
+    old_digest: str,
+    new_digest: str,
+    old_name: str,
+    new_name: str,
+    _idx_old: ObjectIndex,
+    _idx_new: ObjectIndex,
+    _stats_old: Dict[str, Any],
+    _stats_new: Dict[str, Any],
+    _profiler: StageProfiler,
+) -> Dict[str, Any]:
+    # 差分結果一式。サマリーをすぐ出せるよう件数だけ数え、差分一覧はオブジェクトを選んだとき
+    # （またはレポートを作るとき）に object_diffs() で作る。
+    # 永続ストアがあれば、同じ .xat の組の結果はそこから読み、新しいリビジョンとの比較でも
+    # 前に比較したことのあるオブジェクトの組は比較しない。
+    store = diff_store()
+    if store is not None:
+        return store.compare(
+            _stats_old["xat_sha256"],
+            _stats_new["xat_sha256"],
+            _idx_old,
+            _idx_new,
+            old_name=old_name,
+            new_name=new_name,
+            profiler=_profiler,
+        )
+    return compare_indexes(
+        _idx_old,
+        _idx_new,
+        old_name=old_name,
+        new_name=new_name,
+        profiler=_profiler,
+        detail="counts",
+    )
 
-def summarize_object(o: Dict[str, Any]) -> Dict[str, Any]:
-    # オブジェクトの概略を取り出す（一覧表示用）
-    impl_uri = o.get("impl_uri")
-    rect = o.get("rect", {}) or {}
-    base = {
-        "id": o.get("id"),
-        "name": o.get("name"),
-        "type": impl_uri,
-        "x": rect.get("x"),
-        "y": rect.get("y"),
-        "width": rect.get("width"),
-        "height": rect.get("height"),
-        "show": o.get("show"),
-        "lock": o.get("lock"),
-        "enabled": o.get("enabled"),
-    }
 
-    impl = o.get("impl", {}) or {}
-
-    if impl_uri == "oxa:text":
-        data = impl.get("data", {}) or {}
-        font = impl.get("font", {}) or {}
-        base.update(
-            {
-                "kind": "text",
-                "text": data.get("value"),
-                "font_name": font.get("name"),
-                "font_size": font.get("size"),
-                "font_color": font.get("color"),
-                "align": font.get("align"),
-            }
-        )
-    elif impl_uri == "oxa:rect":
-        stroke = impl.get("stroke", {}) or {}
-        fill = stroke.get("fill", {}) or {}
-        base.update(
-            {
-                "kind": "rect",
-                "stroke_size": stroke.get("size"),
-                "stroke_color": fill.get("color"),
-            }
+@st.cache_resource(max_entries=CACHE_MAX_REPORTS, show_spinner=False)
+def cached_report(
+    old_digest: str,
+    new_digest: str,
+    old_name: str,
+    new_name: str,
+    fmt: str,
+    min_severity: int,
+    summary_only: bool,
+    object_id: str,
+    _result: Dict[str, Any],
+    _profiler: StageProfiler,
+) -> bytes:
+    # 1形式・1条件分のレポート（fmt は "md" / "xlsx"、object_id が空ならすべてのオブジェクト）。
+    # ダウンロードボタンが押されたときに別スレッドから呼ばれ、同じ結果・条件なら2回目以降は作らない。
+    result = _result
+    if min_severity > 1 or object_id:
+        result = select_report_scope(result, min_severity, [object_id] if object_id else None)
+    parts = dict(
+        added=result["added"],
+        removed=result["removed"],
+        changed_rows=result["changed_rows"],
+        changed_detail=result["changed_detail"],
+        layout_groups=result.get("layout_groups"),
+        overlaps=result.get("overlaps"),
+        min_severity=min_severity,
+        summary_only=summary_only,
+    )
+    with _profiler.stage(f"report.{fmt}") as s:
+        if fmt == "md":
+            # 全文の文字列を作らず、少しずつエンコードして書き足す
+            with io.BytesIO() as buffer:
+                for chunk in iter_markdown_report(
+                    old_name,
+                    new_name,
+                    overlaps_unchecked=result.get("overlaps_unchecked", 0),
+                    **parts,
+                ):
+                    buffer.write(chunk.encode("utf-8"))
+                data = buffer.getvalue()
+        else:
+            data = build_excel_report(**parts)
+        s["bytes"] = len(data)
+    return data
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_text_diff(
+    old_digest: str,
+    new_digest: str,
+    max_hunks: int,
+    max_lines: int,
+    _tpl_old: Tuple[Dict[str, Any], ObjectIndex],
+    _tpl_new: Tuple[Dict[str, Any], ObjectIndex],
+    _profiler: StageProfiler,
+) -> Tuple[str, Dict[str, Any]]:
+    # 正規化したJSONテキストの unified diff
+    with _profiler.stage("text_diff.compute") as s:
+        text, stats = canonical_text_diff(
+            *_tpl_old, *_tpl_new, max_hunks=max_hunks, max_lines=max_lines
         )
-    elif impl_uri == "oxa:tableregion":
-        tables = impl.get("tables", []) or []
-        table = tables[0] if tables else {}
-        drive_ds = table.get("drive_dataset", {}) or {}
-        details = table.get("details", []) or []
-        col_count = 0
-        if details:
-            first_detail = details[0]
-            frames = first_detail.get("frames", []) or []
-            col_count = len(frames)
-        base.update(
-            {
-                "kind": "tableregion",
-                "dataset_ref": drive_ds.get("ref"),
-                "column_count": col_count,
-            }
+        s.update(blocks=stats["changed_blocks"], lines=stats["lines"])
+    return text, stats
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_library(
+    old_digest: str,
+    new_digest: str,
+    _old_entries: Dict[str, LibraryEntry],
+    _new_entries: Dict[str, LibraryEntry],
+    _profiler: StageProfiler,
+) -> List[Dict[str, Any]]:
+    # ライブラリのサマリー表（アップロードされたファイルは別プロセスへ渡せないので、このプロセスで比較する）
+    with _profiler.stage("library.compare") as s:
+        rows = compare_libraries(_old_entries, _new_entries, workers=1)
+        s["templates"] = len(rows)
+    return rows
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_library_entry(
+    old_digest: str,
+    new_digest: str,
+    name: str,
+    _old_entry: LibraryEntry,
+    _new_entry: LibraryEntry,
+    _profiler: StageProfiler,
+) -> Dict[str, Any]:
+    # ライブラリ内の1テンプレートの差分結果一式（レポートを作るときだけ計算する）
+    with _profiler.stage("library.entry", template=name) as s:
+        result = compare_library_entry(_old_entry, _new_entry)
+        s["changed"] = len(result["changed_rows"])
+    return result
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_three_way(
+    digests: Tuple[str, str, str],
+    names: Tuple[str, str, str],
+    _indexes: Tuple[ObjectIndex, ObjectIndex, ObjectIndex],
+    _profiler: StageProfiler,
+) -> Dict[str, Any]:
+    # 3者比較の結果一式（基準・A・B の内容ハッシュの組ごと）
+    with _profiler.stage("three_way.compare") as s:
+        result = compare_three_way(
+            *_indexes, base_name=names[0], a_name=names[1], b_name=names[2], profiler=_profiler
         )
-    else:
-        base.update({"kind": "other"})
-
-    return base
-
-
-def deep_diff(a: Any, b: Any, path: str = "") -> List[Dict[str, Any]]:
-    # JSONの一部（dict/list/値）同士を比較して、差分のリストを返す。
-    # 各要素は {path, old, new} を持つ。
-    diffs: List[Dict[str, Any]] = []
-
-    # 型が違う場合は即差分
-    if type(a) is not type(b):
-        if a != b:
-            diffs.append({"path": path or "(root)", "old": a, "new": b})
-        return diffs
-
-    # dict
-    if isinstance(a, dict):
-        keys = set(a.keys()) | set(b.keys())
-        for k in sorted(keys):
-            sub_path = f"{path}.{k}" if path else k
-            if k not in a:
-                diffs.append({"path": sub_path, "old": None, "new": b.get(k)})
-            elif k not in b:
-                diffs.append({"path": sub_path, "old": a.get(k), "new": None})
-            else:
-                diffs.extend(deep_diff(a.get(k), b.get(k), sub_path))
-        return diffs
-
-    # list
-    if isinstance(a, list):
-        max_len = max(len(a), len(b))
-        for i in range(max_len):
-            sub_path = f"{path}[{i}]"
-            if i >= len(a):
-                diffs.append({"path": sub_path, "old": None, "new": b[i]})
-            elif i >= len(b):
-                diffs.append({"path": sub_path, "old": a[i], "new": None})
-            else:
-                diffs.extend(deep_diff(a[i], b[i], sub_path))
-        return diffs
-
-    # 値
-    if a != b:
-        diffs.append({"path": path or "(root)", "old": a, "new": b})
-    return diffs
-
-
-def classify_severity(path: str) -> Tuple[int, str, str]:
-    # 差分パスに基づいて重要度を判定する。
-    # 戻り値: (severity, emoji, label)  / severity: 3=Critical, 2=Medium, 1=Minor
-    p = path.lower()
-
-    # 重大：データバインドやタイプ、列数など
-    critical_keywords = [
-        "drive_dataset",
-        "dataset_ref",
-        "dataset",
-        "bind",
-        "impl_uri",
-        "column_count",
-        ".tables",
-        "image",
-        "img",
-        "resource",
-    ]
-    if any(k in p for k in critical_keywords):
-        return 3, "🔴", "重大"
-
-    # 中程度：レイアウト・スタイル・フォントサイズなど
-    medium_keywords = [
-        "rect.",
-        ".rect",
-        "stroke",
-        "font_size",
-        "font.size",
-        "fill.color",
-        "fill_colour",
-        "alignment",
-        "align",
-        "width",
-        "height",
-        "x",
-        "y",
-        "rotation",
-        "skew",
-    ]
-    if any(k in p for k in medium_keywords):
-        return 2, "🟡", "中"
-
-    # テキスト変更は中〜重大とも考えられるが、ここでは中に寄せる
-    if "impl.data.value" in p or "text" in p:
-        return 2, "🟡", "中"
-
-    # それ以外は軽微
-    return 1, "🟢", "軽微"
-
-
-def html_colored_change(path: str, old: Any, new: Any) -> str:
-    # 差分1件をHTML（色付き）で表現する
-    severity, emoji, label = classify_severity(path)
+        s["objects"] = len(result["rows"])
+    return result
+
+
+@st.cache_resource(max_entries=CACHE_MAX_REPORTS, show_spinner=False)
+def cached_three_way_report(
+    digests: Tuple[str, str, str], fmt: str, _result: Dict[str, Any], _profiler: StageProfiler
+) -> bytes:
+    # 3者比較のレポート（fmt は "md" / "xlsx"）。ダウンロードボタンが押されたときに作る
+    with _profiler.stage(f"three_way.report.{fmt}") as s:
+        if fmt == "md":
+            data = "\n".join(iter_three_way_markdown(_result)).encode("utf-8")
+        else:
+            data = build_three_way_excel(_result)
+        s["bytes"] = len(data)
+    return data
+
+
+@st.cache_resource(show_spinner=False)
+def diff_service() -> Optional[DiffServiceClient]:
+    # 環境変数 XAR_DIFF_SERVICE で指定された差分サービス（未指定なら None、手元で比較する）
+    return service_from_env()
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_service_result(
+    job_id: str,
+    _service: DiffServiceClient,
+    _idx_old: ObjectIndex,
+    _idx_new: ObjectIndex,
+    _profiler: StageProfiler,
+) -> Dict[str, Any]:
+    # 差分サービスの比較結果（ジョブ ID は内容ハッシュと比較条件から決まる）。
+    # json のレポートを受け取り、オブジェクト本体は手元で読み込んだ旧・新から補う
+    with _profiler.stage("service.fetch") as s:
+        data = _service.result(job_id, "json")
+        s["bytes"] = len(data)
+        result = result_from_json_report(json.loads(data), _idx_old, _idx_new)
+        s["changed"] = len(result["changed_rows"])
+    return result
+
+
+@st.cache_resource(show_spinner=False)
+def binding_memo() -> Dict[str, List[Binding]]:
+    # オブジェクトハッシュごとのデータバインド抽出結果。セッション・比較をまたいで共有し、
+    # 保存し直したテンプレートでも変わったオブジェクトだけ辿る
+    return {}
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def cached_bindings(
+    old_digest: str,
+    new_digest: str,
+    old_label: str,
+    new_label: str,
+    _idx_old: ObjectIndex,
+    _idx_new: ObjectIndex,
+    _profiler: StageProfiler,
+) -> BindingIndex:
+    # 旧・新テンプレートのデータバインド逆引き索引（old_label / new_label の名前で入れる）
+    index = BindingIndex(binding_memo())
+    with _profiler.stage("bindings.index") as s:
+        for label, idx in ((old_label, _idx_old), (new_label, _idx_new)):
+            stats = index.add_template(label, idx)
+            s["objects"] = s.get("objects", 0) + stats["objects"]
+            s["scanned"] = s.get("scanned", 0) + stats["scanned"]
+        s["references"] = len(index.references())
+    return index
+
+
+@st.cache_resource(max_entries=CACHE_MAX_RESULTS, show_spinner=False)
+def file_watcher(old_path: str, new_path: str) -> TemplateWatcher:
+    # 監視モードの状態（読み込んだインデックス・比較結果）。同じパスの組はセッション間で共有する
+    return TemplateWatcher(old_path, new_path)
+
+
+def html_colored_change(
+    path: str, old: Any, new: Any, op: str = "changed", severity: Optional[int] = None
+) -> str:
+    # 差分1件をHTML（色付き）で表現する（severity 未指定ならパスから判定）
+    if severity is None:
+        severity = classify_severity(path)[0]
+    emoji, label = SEVERITY_LEVELS[severity]
     if severity == 3:
         color = "red"
     elif severity == 2:
@@ -219,12 +441,14 @@ def html_colored_change(path: str, old: Any, new: Any) -> str:
     else:
         color = "green"
 
-    old_str = json.dumps(old, ensure_ascii=False)
-    new_str = json.dumps(new, ensure_ascii=False)
+    # 大きな値（ValueRef）はプレビューと概要だけ表示する
+    old_str = html.escape(format_value(old, DEFAULT_REPORT_MAX_VALUE_CHARS))
+    new_str = html.escape(format_value(new, DEFAULT_REPORT_MAX_VALUE_CHARS))
 
     return (
         f'<div style="margin-bottom:4px;">'
         f'<span style="color:{color}; font-weight:bold;">{emoji} [{label}]</span> '
+        f"[{OP_LABELS[op]}] "
         f'<code>{path}</code><br>'
         f'<span style="color:{color};">旧: {old_str}</span><br>'
         f'<span style="color:{color};">新: {new_str}</span>'
@@ -232,402 +456,786 @@ def html_colored_change(path: str, old: Any, new: Any) -> str:
     )
 
 
-def build_markdown_report(
-    old_name: str,
-    new_name: str,
-    added: List[Dict[str, Any]],
-    removed: List[Dict[str, Any]],
-    changed_rows: List[Dict[str, Any]],
-    changed_detail: Dict[str, Any],
-) -> str:
-    # Markdownレポートを生成する
-    lines: List[str] = []
-    lines.append("# 帳票DX テンプレート差分レポート")
-    lines.append("")
-    lines.append(f"- 旧テンプレート: `{old_name}`")
-    lines.append(f"- 新テンプレート: `{new_name}`")
-    lines.append("")
-
-    total_critical = sum(r["critical_cnt"] for r in changed_rows)
-    total_medium = sum(r["medium_cnt"] for r in changed_rows)
-    total_minor = sum(r["minor_cnt"] for r in changed_rows)
-
-    lines.append("## サマリー")
-    lines.append("")
-    lines.append(f"- 追加オブジェクト数: **{len(added)}**")
-    lines.append(f"- 削除オブジェクト数: **{len(removed)}**")
-    lines.append(f"- 変更オブジェクト数: **{len(changed_rows)}**")
-    lines.append(f"- 重大変更(🔴): **{total_critical}**")
-    lines.append(f"- 中変更(🟡): **{total_medium}**")
-    lines.append(f"- 軽微変更(🟢): **{total_minor}**")
-    lines.append("")
-
-    lines.append("## 追加されたオブジェクト")
-    lines.append("")
-    if not added:
-        lines.append("- なし")
-    else:
-        lines.append("| id | name | kind | type | x | y | width | height |")
-        lines.append("| --- | --- | --- | --- | --- | --- | --- | --- |")
-        for o in added:
-            lines.append(
-                f"| `{o.get('id')}` | {o.get('name','')} | {o.get('kind','')} | "
-                f"{o.get('type','')} | {o.get('x','')} | {o.get('y','')} | "
-                f"{o.get('width','')} | {o.get('height','')} |"
-            )
-    lines.append("")
-
-    lines.append("## 削除されたオブジェクト")
-    lines.append("")
-    if not removed:
-        lines.append("- なし")
-    else:
-        lines.append("| id | name | kind | type | x | y | width | height |")
-        lines.append("| --- | --- | --- | --- | --- | --- | --- | --- |")
-        for o in removed:
-            lines.append(
-                f"| `{o.get('id')}` | {o.get('name','')} | {o.get('kind','')} | "
-                f"{o.get('type','')} | {o.get('x','')} | {o.get('y','')} | "
-                f"{o.get('width','')} | {o.get('height','')} |"
+def paged(items: Sequence[Any], key: str, page_size: int) -> Sequence[Any]:
+    # items のうち、ページ番号（key の入力欄）で選んだ1ページ分を返す。
+    # 絞り込みで件数が減ったときは最終ページに寄せる。
+    n_pages = page_count(len(items), page_size)
+    if st.session_state.get(key, 1) > n_pages:
+        st.session_state[key] = n_pages
+    page = 1
+    if n_pages > 1:
+        page = int(
+            st.number_input(
+                f"ページ（全 {n_pages:,} ページ）", min_value=1, max_value=n_pages, step=1, key=key
             )
-    lines.append("")
-
-    lines.append("## 変更されたオブジェクト詳細")
-    lines.append("")
-    if not changed_rows:
-        lines.append("- なし")
+        )
+    shown = page_slice(items, page, page_size)
+    if items:
+        start = (page - 1) * page_size
+        st.caption(f"{len(items):,} 件中 {start + 1:,}〜{start + len(shown):,} 件を表示")
+    return shown
+
+
+def render_object_detail(
+    selected_id: str, detail: Dict[str, Any], render_stats: Dict[str, Any]
+) -> None:
+    # 変更オブジェクト1件の詳細。差分は重要度・種別・パスで絞り込み、1ページ分だけ表示する。
+    if "old_id" in detail:
+        st.write(
+            f"**ID:** `{detail['old_id']}` → `{selected_id}`"
+            f"（ID 変更として対応付け、類似度 {detail['reid_score']}）"
+        )
     else:
-        for row in changed_rows:
-            oid = row["id"]
-            det = changed_detail[oid]
-            lines.append(f"### オブジェクト `{oid}`")
-            lines.append("")
-            lines.append(
-                f"- kind/type: `{row.get('kind')}` / `{row.get('type')}`"
-            )
-            lines.append(
-                f"- name: `{row.get('name_old')}` → `{row.get('name_new')}`"
-            )
-            lines.append(
-                f"- 変更件数: 重大={row.get('critical_cnt')} / 中={row.get('medium_cnt')} / 軽微={row.get('minor_cnt')}"
-            )
-            lines.append("")
-            lines.append("#### 差分一覧")
-            lines.append("")
-
-            diffs = det["diffs"]
-            decorated: List[Tuple[int, str, str, Any, Any]] = []
-            for d in diffs:
-                severity, emoji, label = classify_severity(d["path"])
-                decorated.append(
-                    (severity, emoji, label, d["path"], d["old"], d["new"])
-                )
-            decorated.sort(key=lambda x: (-x[0], x[3]))
-
-            lines.append("| 重要度 | パス | 旧値 | 新値 |")
-            lines.append("| --- | --- | --- | --- |")
-            for severity, emoji, label, path, old, new in decorated:
-                old_str = json.dumps(old, ensure_ascii=False)
-                new_str = json.dumps(new, ensure_ascii=False)
-                lines.append(
-                    f"| {emoji} {label} | `{path}` | `{old_str}` | `{new_str}` |"
-                )
-            lines.append("")
-
-    return "\n".join(lines)
-
+        st.write(f"**ID:** `{selected_id}`")
+    st.write(
+        f"**旧name:** {detail['old_summary'].get('name')} / "
+        f"**新name:** {detail['new_summary'].get('name')}"
+    )
+    st.write(
+        f"**kind/type:** {detail['old_summary'].get('kind')} / "
+        f"{detail['old_summary'].get('type')}"
+    )
 
-def build_excel_report(
-    added: List[Dict[str, Any]],
-    removed: List[Dict[str, Any]],
-    changed_rows: List[Dict[str, Any]],
-    changed_detail: Dict[str, Any],
-) -> bytes:
-    # Excelレポート（複数シート）を生成
-    with io.BytesIO() as buffer:
-        with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-            # Added / Removed / Changed summary
-            if added:
-                df_added = pd.DataFrame(added)
-                df_added.to_excel(writer, sheet_name="Added", index=False)
-            else:
-                pd.DataFrame(columns=["id", "name"]).to_excel(
-                    writer, sheet_name="Added", index=False
-                )
+    # 差分一覧はここで初めて、選んだオブジェクトの分だけ作る
+    all_diffs = object_diffs(detail)
+    render_stats["diffs"] = len(all_diffs)
+
+    st.markdown("##### 差分一覧（色分け）")
+    d1, d2, d3 = st.columns([1, 1, 2])
+    severities = d1.multiselect(
+        "重要度",
+        list(SEVERITY_LEVELS),
+        format_func=lambda s: "{} {}".format(*SEVERITY_LEVELS[s]),
+        key="diff_severities",
+    )
+    ops = d2.multiselect("種別", list(OP_LABELS), format_func=OP_LABELS.get, key="diff_ops")
+    prefix = d3.text_input(
+        "パス（前方一致）", key="diff_prefix", placeholder="例: impl.tables[0]"
+    )
 
-            if removed:
-                df_removed = pd.DataFrame(removed)
-                df_removed.to_excel(writer, sheet_name="Removed", index=False)
-            else:
-                pd.DataFrame(columns=["id", "name"]).to_excel(
-                    writer, sheet_name="Removed", index=False
-                )
+    # 別のオブジェクトを選んだら1ページ目から
+    if st.session_state.get("_diff_page_object") != selected_id:
+        st.session_state["_diff_page_object"] = selected_id
+        st.session_state["diff_page"] = 1
 
-            if changed_rows:
-                df_changed = pd.DataFrame(changed_rows)
-                df_changed.to_excel(writer, sheet_name="ChangedSummary", index=False)
-            else:
-                pd.DataFrame(columns=["id", "name"]).to_excel(
-                    writer, sheet_name="ChangedSummary", index=False
-                )
+    # 重要度ごとにソートして表示（重大 → 中 → 軽微）
+    diffs = sorted(
+        filter_diffs(all_diffs, severities, ops, prefix), key=lambda d: (-d.severity, d.path)
+    )
+    render_stats["filtered"] = len(diffs)
+    if not all_diffs:
+        st.write("このオブジェクトには差分がありません。")
+    elif not diffs:
+        st.info("条件に一致する差分はありません。")
+    page = paged(diffs, "diff_page", DIFF_PAGE_SIZE)
+    render_stats["shown"] = len(page)
+    if page:
+        st.markdown(
+            "\n".join(html_colored_change(d.path, d.old, d.new, d.op, d.severity) for d in page),
+            unsafe_allow_html=True,
+        )
 
-            # Changed details (flattened)
-            detail_rows: List[Dict[str, Any]] = []
-            for row in changed_rows:
-                oid = row["id"]
-                det = changed_detail[oid]
-                diffs = det["diffs"]
-                for d in diffs:
-                    sev, emoji, label = classify_severity(d["path"])
-                    detail_rows.append(
-                        {
-                            "id": oid,
-                            "name_old": row.get("name_old"),
-                            "name_new": row.get("name_new"),
-                            "kind": row.get("kind"),
-                            "type": row.get("type"),
-                            "severity": sev,
-                            "level": label,
-                            "emoji": emoji,
-                            "path": d["path"],
-                            "old": json.dumps(d["old"], ensure_ascii=False),
-                            "new": json.dumps(d["new"], ensure_ascii=False),
-                        }
-                    )
+    # 大きな値・オブジェクト全体は、表示を選んだときだけ JSON にする
+    # （expander の中身も毎回実行されるため toggle で切り替える）
+    refs = {
+        f"{d.path}（{side}）": v
+        for d in page
+        for side, v in (("旧", d.old), ("新", d.new))
+        if isinstance(v, ValueRef)
+    }
+    if refs:
+        st.markdown(f"##### 表示中の大きな値（{len(refs)} 件）")
+        picked = st.selectbox("値を選択", list(refs), key="value_ref_pick")
+        if st.toggle("選択した値の全体を表示", key="value_ref_show"):
+            ref = refs[picked]
+            st.caption(f"{ref.describe()} / 正規化JSON {ref.chars:,} 文字")
+            st.code(ref.to_json(), language="json")
+
+    # パスで絞り込んでいれば、その位置の部分だけを表示する
+    if st.toggle("旧/新オブジェクト（JSON）を表示", key="show_full_objects"):
+        render_stats["full_json"] = True
+        j1, j2 = st.columns(2)
+        for col, label, obj in ((j1, "旧", detail["old_full"]), (j2, "新", detail["new_full"])):
+            with col:
+                where, part = subtree_at(obj, prefix)
+                text, truncated = json_preview(part)
+                st.markdown(f"{label}オブジェクト `{where}`")
+                if truncated:
+                    st.caption(f"先頭 {len(text):,} 文字のみ表示しています（パスで絞り込めます）。")
+                st.code(text, language="json")
+
+
+def local_templates(
+    old_file: Any, new_file: Any, old_digest: str, new_digest: str
+) -> Tuple[Dict[str, Any], ObjectIndex, Dict[str, Any], ObjectIndex]:
+    # 差分サービスで比較したときに、手元でも旧・新を読み込む（テキスト差分・データバインド用）
+    with profiler.stage("load") as s:
+        meta_old, idx_old, _stats = cached_template(old_digest, old_file, profiler)
+        meta_new, idx_new, _stats = cached_template(new_digest, new_file, profiler)
+        s["objects"] = len(idx_old) + len(idx_new)
+    return meta_old, idx_old, meta_new, idx_new
+
+
+def service_comparison(
+    service: DiffServiceClient,
+    old_file: Any,
+    new_file: Any,
+    old_digest: str,
+    new_digest: str,
+    old_name: str,
+    new_name: str,
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any], Tuple[Any, ...]]]:
+    # 差分サービスで比較し、(結果, 旧・新の読み込み統計, local_templates の戻り値) を返す。
+    # .xar は送信済みなら送らず、同じ比較のジョブがあればそれにまとまる。
+    # 終わっていなければ進み具合を表示して None を返す（終わったら画面全体を更新する）。
+    try:
+        with profiler.stage("service.submit"):
+            service.upload(old_file.getbuffer(), old_digest)
+            service.upload(new_file.getbuffer(), new_digest)
+            job = service.submit(old_digest, new_digest, old_name, new_name)
+    except (OSError, ServiceError) as e:
+        st.error(f"差分サービスに依頼できませんでした（{service.base_url}）: {e}")
+        return None
+    if job["status"] == "error":
+        st.error(f"差分サービスでの比較に失敗しました: {job['error']}")
+        return None
+    if job["status"] == "done":
+        # 結果のオブジェクト本体は手元で読み込んだ旧・新から引く
+        templates = local_templates(old_file, new_file, old_digest, new_digest)
+        _meta_old, idx_old, _meta_new, idx_new = templates
+        result = cached_service_result(job["id"], service, idx_old, idx_new, profiler)
+        stats_old, stats_new = job["load_stats"]
+        return result, stats_old, stats_new, templates
+
+    @st.fragment(run_every=SERVICE_POLL_INTERVAL)
+    def poll() -> None:
+        try:
+            current = service.status(job["id"])
+        except (OSError, ServiceError) as e:
+            # ジョブが消された・サービスが再起動したなど。次の確認で戻れば表示を続ける
+            st.error(f"差分サービスからジョブの状態を取得できませんでした（{service.base_url}）: {e}")
+            return
+        if current["status"] in ("done", "error"):
+            st.rerun()
+        waiting = f"、先に {current['queued_ahead']} 件待ち" if current["queued_ahead"] else ""
+        st.progress(
+            current["progress"],
+            text=f"差分サービスで比較中: {JOB_STAGE_LABELS[current['stage']]}"
+            f"（{current['elapsed']:.1f} 秒{waiting}）",
+        )
 
-            if detail_rows:
-                df_detail = pd.DataFrame(detail_rows)
-            else:
-                df_detail = pd.DataFrame(
-                    columns=[
-                        "id",
-                        "name_old",
-                        "name_new",
-                        "kind",
-                        "type",
-                        "severity",
-                        "level",
-                        "emoji",
-                        "path",
-                        "old",
-                        "new",
-                    ]
-                )
-            df_detail.to_excel(writer, sheet_name="ChangedDetails", index=False)
+    poll()
+    return None
+
+
+def render_watch_status(watcher: TemplateWatcher, version: int, interval: float) -> None:
+    # 監視の状態表示。interval 秒ごとにファイルを確認し、比較し直したら画面全体を更新する
+
+    @st.fragment(run_every=interval)
+    def poll() -> None:
+        if watcher.poll() or watcher.version != version:
+            st.rerun()
+        update = watcher.last_update
+        if not update:
+            st.caption(f"🔄 {interval:g} 秒ごとに確認中（まだ比較できていません）")
+            return
+        reloaded = "・".join(update["reloaded"]) or "なし"
+        st.caption(
+            f"🔄 {interval:g} 秒ごとに確認中 / 最終更新 "
+            f"{time.strftime('%H:%M:%S', time.localtime(update['updated_at']))}"
+            f"（読み込み直し: {reloaded}、比較したオブジェクト {update['diffed']:,} 件、"
+            f"{update['seconds']:.2f} 秒）"
+        )
 
-        return buffer.getvalue()
+    poll()
+
+
+def render_report_downloads(
+    key: str,
+    old_digest: str,
+    new_digest: str,
+    result: Dict[str, Any],
+    file_stem: str,
+    profiler: StageProfiler,
+) -> None:
+    # レポートの条件とダウンロードボタン。レポートはボタンが押されたときに作る（画面の更新では作らない）
+    o1, o2, o3 = st.columns(3)
+    summary_only = (
+        o1.radio("内容", ["差分一覧まで", "サマリーのみ"], horizontal=True, key=f"{key}_content")
+        == "サマリーのみ"
+    )
+    min_severity = o2.selectbox(
+        "載せる差分の重要度",
+        sorted(SEVERITY_LEVELS),
+        format_func=lambda s: "{} {} 以上".format(*SEVERITY_LEVELS[s]),
+        key=f"{key}_severity",
+    )
+    object_id = o3.text_input(
+        "オブジェクトID（1件だけのレポート）", key=f"{key}_object", placeholder="空欄ならすべて"
+    ).strip()
+    if object_id:
+        known = {row["id"] for row in result["changed_rows"]}
+        known.update(row["old_id"] for row in result["changed_rows"] if "old_id" in row)
+        known.update(o.get("id") for o in result["added"] + result["removed"])
+        if object_id not in known:
+            st.warning(f"ID `{object_id}` の追加・削除・変更はありません。")
+            return
+        file_stem = f"{file_stem}_{object_id}"
+
+    args = (
+        old_digest,
+        new_digest,
+        result["old_name"],
+        result["new_name"],
+    )
+    options = (min_severity, summary_only, object_id, result, profiler)
+    st.download_button(
+        label="Markdownレポート（.md）をダウンロード",
+        data=lambda: cached_report(*args, "md", *options),
+        file_name=f"{file_stem}.md",
+        mime="text/markdown",
+        on_click="ignore",
+    )
+    st.download_button(
+        label="Excelレポート（.xlsx）をダウンロード",
+        data=lambda: cached_report(*args, "xlsx", *options),
+        file_name=f"{file_stem}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore",
+    )
+    st.caption("レポートはボタンを押したときに作成します（同じ条件の2回目以降は作成済みのものを使います）。")
+
+
+def render_profiler_panel(profiler: StageProfiler, **meta: Any) -> None:
+    # 計測を終了して環境変数の出力先へ書き出し、計測が有効なら結果を表示する
+    total_seconds = profiler.stop()
+    flush_profiler_to_env(profiler, **meta)
+    if not profiler.enabled:
+        return
+    with st.expander("⏱ パフォーマンス", expanded=True):
+        st.write(f"この実行の合計: **{total_seconds * 1000:,.1f} ms**")
+        st.dataframe(
+            [dict(r, ms=round(r["seconds"] * 1000, 2)) for r in profiler.records],
+            use_container_width=True,
+        )
+        st.caption(
+            "load / compare / report / text_diff はキャッシュ参照を含む時間、"
+            ".parse / compare.* / report.* / .compute は実際に計算した場合だけ表示されます。"
+            "render.* はサーバ側で画面要素を組み立てる時間（ブラウザでの描画は含みません）。"
+        )
+        st.download_button(
+            label="計測結果（JSON Lines）をダウンロード",
+            data=profiler.to_jsonl(**meta).encode("utf-8"),
+            file_name="xar_diff_profile.jsonl",
+            mime="application/x-ndjson",
+        )
+        if profiler.has_cprofile:
+            st.code(profiler.cprofile_text(limit=25), language="text")
+            st.download_button(
+                label="cProfile 統計（.prof）をダウンロード",
+                data=profiler.cprofile_bytes(),
+                file_name="xar_diff_profile.prof",
+                mime="application/octet-stream",
+            )
 
 
-# --- メイン処理 --------------------------------------------------------------
+# --- ライブラリ一括比較 -------------------------------------------------------
 
-if old_file is not None and new_file is not None:
+if library_mode and old_lib_files and new_lib_files:
     try:
-        old_bytes = old_file.read()
-        new_bytes = new_file.read()
-        tpl_old, txt_old = load_xar_from_bytes(old_bytes)
-        tpl_new, txt_new = load_xar_from_bytes(new_bytes)
+        with profiler.stage("digest", bytes=sum(f.size for f in old_lib_files + new_lib_files)):
+            old_lib_digest = library_digest(old_lib_files)
+            new_lib_digest = library_digest(new_lib_files)
+        old_entries = library_from_files(old_lib_files)
+        new_entries = library_from_files(new_lib_files)
     except Exception as e:
-        st.error(f".xar の読み込みに失敗しました: {e}")
+        st.error(f"ライブラリの読み込みに失敗しました: {e}")
     else:
-        idx_old = index_objects(tpl_old)
-        idx_new = index_objects(tpl_new)
-
-        ids_old = set(idx_old.keys())
-        ids_new = set(idx_new.keys())
-
-        added_ids = ids_new - ids_old
-        removed_ids = ids_old - ids_new
-        common_ids = ids_old & ids_new
-
-        # サマリー用データ作成
-        added = [summarize_object(idx_new[i]) for i in sorted(added_ids)]
-        removed = [summarize_object(idx_old[i]) for i in sorted(removed_ids)]
+        with profiler.stage("library") as s, st.spinner("ライブラリを比較しています…"):
+            lib_rows = cached_library(
+                old_lib_digest, new_lib_digest, old_entries, new_entries, profiler
+            )
+            s["templates"] = len(lib_rows)
+        totals = summarize_library(lib_rows)
 
-        changed_rows: List[Dict[str, Any]] = []
-        changed_detail: Dict[str, Any] = {}
+        st.subheader("ライブラリ差分サマリー")
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("追加テンプレート", totals["added"])
+        c2.metric("削除テンプレート", totals["removed"])
+        c3.metric("変更テンプレート", totals["changed"])
+        c4.metric("変更なし（うち未展開）", f"{totals['unchanged']} ({totals['skipped']})")
+        c5.metric(
+            "🔴 / 🟡 / 🟢", f"{totals['critical']} / {totals['medium']} / {totals['minor']}"
+        )
+        if totals["error"]:
+            st.warning(f"{totals['error']} 件のテンプレートを比較できませんでした（status=エラー）。")
 
-        for oid in sorted(common_ids):
-            o_old = idx_old[oid]
-            o_new = idx_new[oid]
-            sa = summarize_object(o_old)
-            sb = summarize_object(o_new)
+        st.dataframe(
+            [dict(r, status=STATUS_LABELS[r["status"]]) for r in lib_rows],
+            use_container_width=True,
+        )
+        st.caption(
+            "skipped_by: bundle_crc = バンドル内の .xar の CRC32・サイズが一致（読み込みなし） / "
+            "xat_crc = .xar 内の .xat の CRC32・サイズが一致（展開なし）"
+        )
+        st.download_button(
+            label="サマリー表（.json）をダウンロード",
+            data=json.dumps(
+                {"totals": totals, "templates": lib_rows}, ensure_ascii=False, indent=2
+            ).encode("utf-8"),
+            file_name="library_summary.json",
+            mime="application/json",
+        )
 
-            # オブジェクト全体のdeep diff（rect/implなどすべて含む）
-            obj_diffs = deep_diff(o_old, o_new, path="object")
+        changed_names = [r["name"] for r in lib_rows if r["status"] == "changed"]
+        if changed_names:
+            st.markdown("### 📥 テンプレート別の差分レポート")
+            picked = st.selectbox("テンプレートを選択", changed_names, key="library_pick")
+            # 選んだテンプレートだけ、表示を選んだときに読み込み直して比較する
+            if st.toggle("選択したテンプレートのレポートを作成", key="library_reports"):
+                result = cached_library_entry(
+                    old_lib_digest,
+                    new_lib_digest,
+                    picked,
+                    old_entries[picked],
+                    new_entries[picked],
+                    profiler,
+                )
+                entry_summary = summarize_result(result)
+                st.write(
+                    f"追加 {entry_summary['added']} / 削除 {entry_summary['removed']} / "
+                    f"変更 {entry_summary['changed']}"
+                    f"（🔴{entry_summary['critical']} 🟡{entry_summary['medium']} 🟢{entry_summary['minor']}）"
+                )
+                render_report_downloads(
+                    "library_report",
+                    f"{old_lib_digest}:{picked}",
+                    f"{new_lib_digest}:{picked}",
+                    result,
+                    report_dir_name(picked).replace("/", "_") + "_xar_diff_report",
+                    profiler,
+                )
 
-            if obj_diffs:
-                # 重要度ごとにカウント
-                sev_counts = {1: 0, 2: 0, 3: 0}
-                for d in obj_diffs:
-                    severity, _emoji, _label = classify_severity(d["path"])
-                    sev_counts[severity] += 1
+        render_profiler_panel(profiler, old_library=old_lib_digest, new_library=new_lib_digest)
 
-                changed_rows.append(
-                    {
-                        "id": oid,
-                        "name_old": sa.get("name"),
-                        "name_new": sb.get("name"),
-                        "kind": sa.get("kind"),
-                        "type": sa.get("type"),
-                        "minor_cnt": sev_counts[1],
-                        "medium_cnt": sev_counts[2],
-                        "critical_cnt": sev_counts[3],
-                        "total_changes": sum(sev_counts.values()),
-                    }
-                )
-                changed_detail[oid] = {
-                    "old_summary": sa,
-                    "new_summary": sb,
-                    "old_full": o_old,
-                    "new_full": o_new,
-                    "diffs": obj_diffs,
-                }
+elif library_mode:
+    st.info("左に旧ライブラリ、右に新ライブラリを指定してください（.xar をまとめた .zip 1つ、または複数の .xar）。")
 
-        st.subheader("差分サマリー")
+# --- 3者比較 -----------------------------------------------------------------
 
-        total_critical = sum(r["critical_cnt"] for r in changed_rows)
-        total_medium = sum(r["medium_cnt"] for r in changed_rows)
-        total_minor = sum(r["minor_cnt"] for r in changed_rows)
+if three_way_mode and all(f is not None for f in three_way_files):
+    try:
+        with profiler.stage("digest", bytes=sum(f.size for f in three_way_files)):
+            tw_digests = tuple(uploaded_digest(f) for f in three_way_files)
+        with profiler.stage("load") as s:
+            tw_indexes = tuple(
+                cached_template(digest, f, profiler)[1]
+                for digest, f in zip(tw_digests, three_way_files)
+            )
+            s["objects"] = sum(len(idx) for idx in tw_indexes)
+    except Exception as e:
+        st.error(f".xar の読み込みに失敗しました: {e}")
+    else:
+        tw_names = tuple(getattr(f, "name", "") for f in three_way_files)
+        with profiler.stage("three_way") as s:
+            tw_result = cached_three_way(tw_digests, tw_names, tw_indexes, profiler)
+            s["objects"] = len(tw_result["rows"])
+        tw_summary = summarize_three_way(tw_result)
 
+        st.subheader("3者比較サマリー")
         c1, c2, c3, c4, c5 = st.columns(5)
-        c1.metric("追加オブジェクト", len(added_ids))
-        c2.metric("削除オブジェクト", len(removed_ids))
-        c3.metric("変更オブジェクト", len(changed_rows))
-        c4.metric("重大変更(🔴)", total_critical)
-        c5.metric("中変更(🟡) / 軽微(🟢)", f"{total_medium} / {total_minor}")
-
-        # レポート生成＆ダウンロードボタン
-        st.markdown("### 📥 差分レポートのダウンロード")
-
-        md_report = build_markdown_report(
-            old_name=getattr(old_file, "name", "old.xar"),
-            new_name=getattr(new_file, "name", "new.xar"),
-            added=added,
-            removed=removed,
-            changed_rows=changed_rows,
-            changed_detail=changed_detail,
+        c1.metric("競合オブジェクト", tw_summary["objects_conflict"])
+        c2.metric("A・B 別々の変更", tw_summary["objects_both"])
+        c3.metric(
+            "A のみ / B のみ", f"{tw_summary['objects_a_only']} / {tw_summary['objects_b_only']}"
+        )
+        c4.metric("同じ変更", tw_summary["objects_same"])
+        c5.metric(
+            "🔴 / 🟡 / 🟢",
+            f"{tw_summary['critical']} / {tw_summary['medium']} / {tw_summary['minor']}",
         )
 
+        st.markdown("### 📥 3者比較レポートのダウンロード")
         st.download_button(
             label="Markdownレポート（.md）をダウンロード",
-            data=md_report.encode("utf-8"),
-            file_name="xar_diff_report.md",
+            data=lambda: cached_three_way_report(tw_digests, "md", tw_result, profiler),
+            file_name="xar_three_way_report.md",
             mime="text/markdown",
+            on_click="ignore",
         )
-
-        excel_bytes = build_excel_report(
-            added=added,
-            removed=removed,
-            changed_rows=changed_rows,
-            changed_detail=changed_detail,
-        )
-
         st.download_button(
             label="Excelレポート（.xlsx）をダウンロード",
-            data=excel_bytes,
-            file_name="xar_diff_report.xlsx",
+            data=lambda: cached_three_way_report(tw_digests, "xlsx", tw_result, profiler),
+            file_name="xar_three_way_report.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
         )
 
-        st.markdown("---")
+        st.markdown("### 変化のあったオブジェクト")
+        with profiler.stage("render.three_way", rows=len(tw_result["rows"])):
+            statuses = st.multiselect(
+                "分類",
+                list(OBJECT_STATUSES),
+                format_func=OBJECT_STATUS_LABELS.get,
+                key="three_way_statuses",
+                placeholder="すべて",
+            )
+            tw_rows = [r for r in tw_result["rows"] if not statuses or r["status"] in statuses]
+            page_rows = paged(tw_rows, "three_way_page", ROW_PAGE_SIZE)
+            if not tw_rows:
+                st.info("条件に一致するオブジェクトはありません。")
+            else:
+                st.dataframe(
+                    [
+                        dict(
+                            r,
+                            status=OBJECT_STATUS_LABELS[r["status"]],
+                            a_op=OP_LABELS.get(r["a_op"], "-"),
+                            b_op=OP_LABELS.get(r["b_op"], "-"),
+                        )
+                        for r in page_rows
+                    ],
+                    use_container_width=True,
+                )
+                picked = st.selectbox(
+                    "オブジェクトIDを選択（一覧の表示中のページから）",
+                    [r["id"] for r in page_rows],
+                    key="three_way_pick",
+                )
+                entries = sorted_entries(tw_result["detail"][picked]["entries"])
+                st.dataframe(
+                    [
+                        {
+                            "重要度": "{} {}".format(*SEVERITY_LEVELS[t.severity]),
+                            "分類": THREE_WAY_STATUS_LABELS[t.status],
+                            "パス": t.path,
+                            "基準": describe_base(t, DEFAULT_REPORT_MAX_VALUE_CHARS),
+                            "A": describe_side(t, "a", DEFAULT_REPORT_MAX_VALUE_CHARS),
+                            "B": describe_side(t, "b", DEFAULT_REPORT_MAX_VALUE_CHARS),
+                        }
+                        for t in paged(entries, "three_way_entries_page", DIFF_PAGE_SIZE)
+                    ],
+                    use_container_width=True,
+                )
+
+        render_profiler_panel(profiler, base=tw_names[0], a=tw_names[1], b=tw_names[2])
+
+elif three_way_mode:
+    st.info("基準テンプレートと、それを別々に編集した A・B の .xar を指定してください。")
+
+# --- メイン処理 --------------------------------------------------------------
 
-        # 追加・削除・変更ごとのタブ + JSON diffタブ
-        tab1, tab2, tab3, tab4 = st.tabs(
-            ["➕ 追加", "➖ 削除", "✏️ 変更（色分け付き）", "🧾 JSONテキスト差分"]
+ready = False
+if watch_mode and watch_old and watch_new:
+    watcher = file_watcher(watch_old, watch_new)
+    with profiler.stage("watch.poll") as s:
+        s["changed"] = watcher.poll()
+    version, result, old_state, new_state = watcher.snapshot()
+    old_digest, meta_old, idx_old, load_stats_old = old_state
+    new_digest, meta_new, idx_new, load_stats_new = new_state
+    if watcher.error:
+        shown = "前回読み込めた内容で表示しています" if result is not None else "読み込めるまで待ちます"
+        st.warning(f".xar を読み込めませんでした（{shown}）: {watcher.error}")
+    # まだ読み込めていなくても確認を続ける（読み込めたら画面全体を更新する）
+    render_watch_status(watcher, version, watch_interval)
+    if result is not None:
+        old_name, new_name = result["old_name"], result["new_name"]
+        ready = True
+elif old_file is not None and new_file is not None:
+    service = diff_service()
+    old_name = getattr(old_file, "name", "old.xar")
+    new_name = getattr(new_file, "name", "new.xar")
+    try:
+        with profiler.stage("digest", bytes=old_file.size + new_file.size):
+            old_digest = uploaded_digest(old_file)
+            new_digest = uploaded_digest(new_file)
+        if service is None:
+            with profiler.stage("load") as s:
+                meta_old, idx_old, load_stats_old = cached_template(old_digest, old_file, profiler)
+                meta_new, idx_new, load_stats_new = cached_template(new_digest, new_file, profiler)
+                s["objects"] = len(idx_old) + len(idx_new)
+    except Exception as e:
+        st.error(f".xar の読み込みに失敗しました: {e}")
+    else:
+        if service is not None:
+            # 比較は差分サービスで行い、終わったら手元でも読み込む（結果のオブジェクト本体・テキスト差分用）
+            meta_old = idx_old = meta_new = idx_new = None
+            remote = service_comparison(
+                service, old_file, new_file, old_digest, new_digest, old_name, new_name
+            )
+            if remote is not None:
+                result, load_stats_old, load_stats_new, templates = remote
+                meta_old, idx_old, meta_new, idx_new = templates
+                ready = True
+        else:
+            with profiler.stage("compare") as s:
+                result = cached_comparison(
+                    old_digest,
+                    new_digest,
+                    old_name,
+                    new_name,
+                    idx_old,
+                    idx_new,
+                    load_stats_old,
+                    load_stats_new,
+                    profiler,
+                )
+                s["changed"] = len(result["changed_rows"])
+            ready = True
+
+if ready:
+    added = result["added"]
+    removed = result["removed"]
+    changed_rows = result["changed_rows"]
+    changed_detail = result["changed_detail"]
+
+    st.subheader("差分サマリー")
+
+    summary = summarize_result(result)
+
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("追加オブジェクト", summary["added"])
+    c2.metric("削除オブジェクト", summary["removed"])
+    c3.metric(
+        "変更オブジェクト",
+        summary["changed"],
+        help=f"うち ID が変わったオブジェクト {summary['reid']} 件" if summary["reid"] else None,
+    )
+    c4.metric("重大変更(🔴)", summary["critical"])
+    c5.metric("中変更(🟡) / 軽微(🟢)", f"{summary['medium']} / {summary['minor']}")
+
+    with st.expander("📊 読み込み統計"):
+        st.dataframe(
+            [
+                dict(file=old_name, **load_stats_old),
+                dict(file=new_name, **load_stats_new),
+            ],
+            use_container_width=True,
+        )
+        st.caption(
+            "peak_buffer_chars: 読み込み中に保持したテキストの最大量（最大オブジェクト + 読み込みチャンク） / "
+            "blobs: ハッシュ参照に置き換えた大きな文字列の数 / peak_rss: プロセス全体の最大常駐メモリ（バイト）"
         )
 
-        with tab1:
-            st.markdown("### 追加されたオブジェクト")
-            if not added:
-                st.info("追加されたオブジェクトはありません。")
-            else:
-                st.dataframe(added, use_container_width=True)
+    # レポート生成＆ダウンロードボタン
+    st.markdown("### 📥 差分レポートのダウンロード")
 
-        with tab2:
-            st.markdown("### 削除されたオブジェクト")
-            if not removed:
-                st.info("削除されたオブジェクトはありません。")
-            else:
-                st.dataframe(removed, use_container_width=True)
+    render_report_downloads(
+        "report", old_digest, new_digest, result, "xar_diff_report", profiler
+    )
 
-        with tab3:
-            st.markdown("### 変更されたオブジェクト一覧")
-            if not changed_rows:
-                st.info("変更されたオブジェクトはありません。")
-            else:
-                st.dataframe(changed_rows, use_container_width=True)
+    st.markdown("---")
+
+    # 追加・削除・変更ごとのタブ + JSON diffタブ
+    tab1, tab2, tab3, tab5, tab6, tab4 = st.tabs(
+        [
+            "➕ 追加",
+            "➖ 削除",
+            "✏️ 変更（色分け付き）",
+            "🧭 レイアウト",
+            "🔗 データバインド",
+            "🧾 JSONテキスト差分",
+        ]
+    )
 
-                st.markdown("#### オブジェクト別の詳細差分")
+    with tab1, profiler.stage("render.added", rows=len(added)):
+        st.markdown("### 追加されたオブジェクト")
+        if not added:
+            st.info("追加されたオブジェクトはありません。")
+        else:
+            st.dataframe(paged(added, "added_page", ROW_PAGE_SIZE), use_container_width=True)
+
+    with tab2, profiler.stage("render.removed", rows=len(removed)):
+        st.markdown("### 削除されたオブジェクト")
+        if not removed:
+            st.info("削除されたオブジェクトはありません。")
+        else:
+            st.dataframe(
+                paged(removed, "removed_page", ROW_PAGE_SIZE), use_container_width=True
+            )
 
+    with tab3, profiler.stage("render.changed", rows=len(changed_rows)) as render_stats:
+        st.markdown("### 変更されたオブジェクト一覧")
+        if not changed_rows:
+            st.info("変更されたオブジェクトはありません。")
+        else:
+            # 一覧・選択肢・差分は絞り込んだうえで1ページ分だけ画面へ送る
+            f1, f2, f3 = st.columns([2, 1, 1])
+            query = f1.text_input(
+                "ID・name で検索", key="changed_query", placeholder="部分一致（旧IDも対象）"
+            )
+            kinds = f2.multiselect(
+                "kind",
+                sorted({str(r.get("kind")) for r in changed_rows}),
+                key="changed_kinds",
+            )
+            row_severities = f3.multiselect(
+                "含む差分の重要度",
+                list(SEVERITY_LEVELS),
+                format_func=lambda s: "{} {}".format(*SEVERITY_LEVELS[s]),
+                key="changed_severities",
+            )
+            rows = match_rows(changed_rows, query, kinds, row_severities)
+            render_stats["matched"] = len(rows)
+            page_rows = paged(rows, "changed_page", ROW_PAGE_SIZE)
+            if page_rows:
+                st.dataframe(page_rows, use_container_width=True)
+
+            st.markdown("#### オブジェクト別の詳細差分")
+
+            if not rows:
+                st.info("条件に一致する変更オブジェクトはありません。")
+            else:
+                # 選択肢は表示中のページのオブジェクトだけ（検索・ページで切り替える）
                 selected_id = st.selectbox(
-                    "オブジェクトIDを選択", [row["id"] for row in changed_rows]
+                    "オブジェクトIDを選択（一覧の表示中のページから）",
+                    [row["id"] for row in page_rows],
+                    key="changed_pick",
                 )
-                detail = changed_detail[selected_id]
+                render_object_detail(selected_id, changed_detail[selected_id], render_stats)
+
+    layout_groups = result.get("layout_groups", [])
+    overlaps = result.get("overlaps", [])
+    with tab5, profiler.stage(
+        "render.layout", groups=len(layout_groups), overlaps=len(overlaps)
+    ):
+        st.markdown("### まとめて移動・サイズ変更された領域")
+        st.caption(
+            "同じだけ移動・サイズ変更された近接オブジェクト群は、個々の rect の差分の代わりにここへ1件でまとめます。"
+        )
+        if not layout_groups:
+            st.info("まとめて移動・サイズ変更された領域はありません。")
+        else:
+            st.dataframe(
+                [
+                    {
+                        "重要度": "{} {}".format(*SEVERITY_LEVELS[g["severity"]]),
+                        "種別": LAYOUT_KIND_LABELS[g["kind"]],
+                        "内容": describe_layout_group(g),
+                        "オブジェクト": ", ".join(g["ids"]),
+                    }
+                    for g in layout_groups
+                ],
+                use_container_width=True,
+            )
+        st.markdown("### 新たに重なったオブジェクト")
+        if result.get("overlaps_unchecked"):
+            st.warning(
+                f"重なりが {len(overlaps):,} 組に達したため検出を打ち切りました"
+                f"（{result['overlaps_unchecked']:,} オブジェクトの周りは未確認）。"
+            )
+        if not overlaps:
+            st.info("新たに重なったオブジェクトはありません。")
+        else:
+            st.dataframe(
+                paged(overlaps, "overlaps_page", ROW_PAGE_SIZE), use_container_width=True
+            )
 
-                st.write(f"**ID:** `{selected_id}`")
-                st.write(
-                    f"**旧name:** {detail['old_summary'].get('name')} / "
-                    f"**新name:** {detail['new_summary'].get('name')}"
-                )
-                st.write(
-                    f"**kind/type:** {detail['old_summary'].get('kind')} / "
-                    f"{detail['old_summary'].get('type')}"
+    with tab6, profiler.stage("render.bindings"):
+        st.markdown("### データセット別の変更")
+        st.caption(
+            "キー名に bind / dataset を含む値をデータセット・フィールドへの参照として索引にし、"
+            "変更のあったオブジェクトを参照先のデータセットごとにまとめます。"
+        )
+        # タブを開いただけでは索引を作らない
+        if st.toggle("データバインドの索引を作って表示", key="show_bindings"):
+            if idx_old is None:
+                meta_old, idx_old, meta_new, idx_new = local_templates(
+                    old_file, new_file, old_digest, new_digest
                 )
-
-                # 重要度ごとにソートして表示（重大 → 中 → 軽微）
-                diffs = detail["diffs"]
-                diffs_with_sev = []
-                for d in diffs:
-                    severity, emoji, label = classify_severity(d["path"])
-                    diffs_with_sev.append(
+            old_label, new_label = f"旧: {old_name}", f"新: {new_name}"
+            bindings = cached_bindings(
+                old_digest, new_digest, old_label, new_label, idx_old, idx_new, profiler
+            )
+            dataset_rows = summarize_by_dataset(result, bindings, old_label, new_label)
+            if not dataset_rows:
+                st.info("データセットを参照しているオブジェクトに変更はありません。")
+            else:
+                st.dataframe(
+                    [
                         {
-                            "severity": severity,
-                            "emoji": emoji,
-                            "label": label,
-                            "path": d["path"],
-                            "old": d["old"],
-                            "new": d["new"],
+                            "データセット": r["dataset"],
+                            "参照の変更": r["binding_changes"],
+                            "追加": r["added"],
+                            "削除": r["removed"],
+                            "変更": r["changed"],
+                            "🔴": r["critical_cnt"],
+                            "🟡": r["medium_cnt"],
+                            "🟢": r["minor_cnt"],
+                            "オブジェクト": ", ".join(r["ids"]),
                         }
+                        for r in paged(dataset_rows, "bindings_page", ROW_PAGE_SIZE)
+                    ],
+                    use_container_width=True,
+                )
+                with_changes = [r for r in dataset_rows if r["changes"]]
+                if with_changes:
+                    picked = st.selectbox(
+                        "参照が変わった箇所を見るデータセット",
+                        with_changes,
+                        format_func=lambda r: f"{r['dataset']}（{r['binding_changes']} 件）",
+                        key="bindings_pick",
+                    )
+                    st.dataframe(
+                        paged(picked["changes"], "binding_changes_page", DIFF_PAGE_SIZE),
+                        use_container_width=True,
                     )
 
-                diffs_with_sev.sort(
-                    key=lambda x: (-x["severity"], x["path"])
-                )  # 重大から
-
-                st.markdown("##### 差分一覧（色分け）")
-
-                if not diffs_with_sev:
-                    st.write("このオブジェクトには差分がありません。")
+            st.markdown("### 影響調査（参照箇所の逆引き）")
+            ref = st.text_input(
+                "データセット・フィールド",
+                key="bindings_ref",
+                placeholder="例: DS.Order（配下の DS.Order.amount なども含む）",
+            )
+            if ref.strip():
+                sites = bindings.impact(ref.strip())
+                if not sites:
+                    st.info("参照している箇所はありません。")
                 else:
-                    html_blocks = [
-                        html_colored_change(
-                            d["path"],
-                            d["old"],
-                            d["new"],
-                        )
-                        for d in diffs_with_sev
-                    ]
-                    st.markdown(
-                        "\n".join(html_blocks),
-                        unsafe_allow_html=True,
+                    st.caption(f"参照 {len(sites)} 件")
+                    st.dataframe(
+                        paged(sites, "bindings_sites_page", ROW_PAGE_SIZE),
+                        use_container_width=True,
                     )
 
-                with st.expander("旧オブジェクト（JSON）"):
-                    st.json(detail["old_full"])
-                with st.expander("新オブジェクト（JSON）"):
-                    st.json(detail["new_full"])
-
-        with tab4:
-            st.markdown("### JSON テキストの完全 diff")
-            diff_lines = difflib.unified_diff(
-                txt_old.splitlines(),
-                txt_new.splitlines(),
-                fromfile="old.xat",
-                tofile="new.xat",
-                lineterm="",
+    with tab4, profiler.stage("render.text_diff"):
+        st.markdown("### JSON テキスト差分（正規化）")
+        st.caption(
+            "キー順・インデントを揃え、オブジェクトごとのブロックに分けたテキスト同士を比較します。"
+            "ハンクの行番号は各ブロック内の行番号です。"
+        )
+        # タブを開いただけでは計算しない（Streamlit は全タブの中身を毎回実行するため）
+        if st.toggle("テキスト差分を計算して表示", key="show_text_diff"):
+            h1, h2 = st.columns(2)
+            max_hunks = h1.number_input(
+                "最大ハンク数", min_value=1, value=DEFAULT_MAX_HUNKS, step=50
+            )
+            max_lines = h2.number_input(
+                "最大行数", min_value=100, value=DEFAULT_MAX_LINES, step=1000
             )
-            diff_text = "\n".join(diff_lines)
+            if idx_old is None:
+                meta_old, idx_old, meta_new, idx_new = local_templates(
+                    old_file, new_file, old_digest, new_digest
+                )
+            diff_text, text_stats = cached_text_diff(
+                old_digest,
+                new_digest,
+                int(max_hunks),
+                int(max_lines),
+                (meta_old, idx_old),
+                (meta_new, idx_new),
+                profiler,
+            )
+            if text_stats["truncated"]:
+                st.warning(
+                    f"表示上限に達したため一部のみ表示しています"
+                    f"（変更ブロック {text_stats['changed_blocks']} 件中 {text_stats['shown_blocks']} 件）。"
+                )
             st.code(diff_text or "差分はありませんでした。", language="diff")
 
-else:
+    render_profiler_panel(profiler, old=old_name, new=new_name)
+
+elif watch_mode and not (watch_old and watch_new):
+    st.info("基準（旧）と作業中（新）の .xar のパスを指定してください。保存し直すと差分が自動で更新されます。")
+elif not library_mode and not three_way_mode:
     st.info("左に旧テンプレート、右に新テンプレートの .xar ファイルを指定してください。")
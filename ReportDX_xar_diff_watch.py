@@ -0,0 +1,179 @@
+# 帳票DX テンプレート差分 ファイル監視（差分の逐次更新）
+#
+# ディスク上の基準 .xar と作業中の .xar を監視し、書き出し直されたら変わった分だけ比較し直す。
+#   1. os.stat（更新時刻・サイズ）が前回と同じなら何もしない
+#   2. .xar 内の .xat の CRC32・展開後サイズ（ZIP の中央ディレクトリ）が同じなら読み込まない
+#   3. 読み込み直したテンプレートは、ハッシュが前回と同じオブジェクトに前回の dict を使い回す
+#   4. 比較はオブジェクトハッシュの組ごとの重要度別件数（known_counts）を引き継ぎ、
+#      ハッシュが変わったオブジェクトだけを比較する。作成済みの差分一覧も組が同じなら引き継ぐ
+# 書き出し途中のファイル（ZIP や JSON として読めない）は前回の状態のまま、次回に読み直す。
+
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from ReportDX_xar_diff_engine import ObjectIndex, compare_indexes
+from ReportDX_xar_diff_rules import get_severity_rules
+from ReportDX_xar_diff_stream import find_xat_member, load_xar_streaming
+
+# ビューアの既定の監視間隔（秒）
+DEFAULT_WATCH_INTERVAL = 2.0
+
+# 引き継ぐオブジェクト単位の件数の上限（超えたら捨てて、次の比較で作り直す）
+WATCH_COUNTS_MAX = 1 << 18
+
+ObjectPair = Tuple[str, str]
+
+# 監視中の .xar 1つ分の読み込み結果（.xat の SHA-256, meta, インデックス, 読み込み統計）
+WatchedTemplate = Tuple[str, Dict[str, Any], ObjectIndex, Dict[str, Any]]
+
+
+class _WatchedFile:
+    # 監視中の .xar 1つ分の状態
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.stat_sig: Optional[Tuple[int, int, int]] = None
+        self.xat_sig: Optional[Tuple[int, int]] = None
+        self.digest: Optional[str] = None
+        self.meta: Dict[str, Any] = {}
+        self.idx: Optional[ObjectIndex] = None
+        self.stats: Dict[str, Any] = {}
+
+    def refresh(self) -> bool:
+        # 内容が変わっていれば読み込み直して True を返す。
+        # 確認・解析・SHA-256 は同じファイルを1回開いて行う（途中で書き換えられても食い違わない）
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            stat_sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if stat_sig == self.stat_sig:
+                return False
+            with zipfile.ZipFile(f) as z:
+                info = find_xat_member(z)
+                if (info.CRC, info.file_size) == self.xat_sig:
+                    # 書き出し直されたが .xat は同じ
+                    self.stat_sig = stat_sig
+                    return False
+            started = time.perf_counter()
+            meta, idx, stats = load_xar_streaming(f)
+        xat_sig = (stats["crc32"], stats["uncompressed_bytes"])
+        digest = stats["xat_sha256"]
+        reused = 0
+        if self.idx is not None:
+            # 変わっていないオブジェクトは前回の dict を使う（作成済みの差分一覧の値と同じものを指すように）
+            prev = self.idx
+            for oid, h in idx.hashes.items():
+                if prev.hashes.get(oid) == h:
+                    idx[oid] = prev[oid]
+                    reused += 1
+        stats["objects_reused"] = reused
+        stats["seconds"] = time.perf_counter() - started
+        self.meta, self.idx, self.stats = meta, idx, stats
+        self.digest = digest
+        self.stat_sig, self.xat_sig = stat_sig, xat_sig
+        return True
+
+
+class TemplateWatcher:
+    # 基準（old）と作業中（new）の .xar を監視して比較結果を保つ。
+    # poll() で変更を調べ、比較し直したら version を進める。複数のスレッドから呼んでよい。
+    # compare_options は compare_indexes へそのまま渡す（detail は常に "counts"）。
+
+    def __init__(
+        self,
+        old_path: Union[str, Path],
+        new_path: Union[str, Path],
+        **compare_options: Any,
+    ) -> None:
+        self.old = _WatchedFile(Path(old_path))
+        self.new = _WatchedFile(Path(new_path))
+        self.compare_options = compare_options
+        self.result: Optional[Dict[str, Any]] = None
+        self.version = 0
+        self.error: Optional[str] = None
+        # 直近の更新の内容（reloaded / diffed / reused_diffs / seconds / updated_at）
+        self.last_update: Dict[str, Any] = {}
+        self._known_counts: Dict[ObjectPair, Dict[int, int]] = {}
+        self._rules = None
+        self._pairs: Dict[str, ObjectPair] = {}
+        self._lock = threading.Lock()
+
+    def poll(self) -> bool:
+        # ファイルが変わっていれば比較し直して True。読めなかったときは error に理由を残す
+        with self._lock:
+            started = time.perf_counter()
+            reloaded = []
+            try:
+                for side in (self.old, self.new):
+                    if side.refresh():
+                        reloaded.append(side.path.name)
+            except Exception as e:
+                # 書き出し途中など（ZIP・JSON として読めない）。次の poll で読み直す
+                self.error = f"{type(e).__name__}: {e}"
+                return False
+            self.error = None
+            if not reloaded and self.result is not None:
+                return False
+            self._recompare(reloaded, started)
+            return True
+
+    def _recompare(self, reloaded: List[str], started: float) -> None:
+        rules = get_severity_rules()
+        if rules is not self._rules or len(self._known_counts) > WATCH_COUNTS_MAX:
+            # 重要度ルールが変わったら件数は使えない
+            self._known_counts = {}
+            self._pairs = {}
+            self._rules = rules
+
+        # 前回作成済みの差分一覧（オブジェクトハッシュの組 -> (外した rect のパス, 差分)）
+        carried: Dict[ObjectPair, Tuple[Any, Any]] = {}
+        if self.result is not None:
+            for oid, det in self.result["changed_detail"].items():
+                pair = self._pairs.get(oid)
+                if det["diffs"] is not None and pair is not None:
+                    carried[pair] = (set(det.get("collapsed", ())), det["diffs"])
+
+        idx_old, idx_new = self.old.idx, self.new.idx
+        n_known = len(self._known_counts)
+        result = compare_indexes(
+            idx_old,
+            idx_new,
+            old_name=self.old.path.name,
+            new_name=self.new.path.name,
+            **dict(self.compare_options, detail="counts", known_counts=self._known_counts),
+        )
+
+        pairs = {}
+        for oid, det in result["changed_detail"].items():
+            pair = (idx_old.hashes[det.get("old_id", oid)], idx_new.hashes[oid])
+            pairs[oid] = pair
+            hit = carried.get(pair)
+            if hit is not None and hit[0] == set(det.get("collapsed", ())):
+                det["diffs"] = hit[1]
+        self._pairs = pairs
+        self.result = result
+        self.version += 1
+        self.last_update = {
+            "reloaded": reloaded,
+            "diffed": len(self._known_counts) - n_known,
+            "reused_diffs": sum(
+                1 for det in result["changed_detail"].values() if det["diffs"] is not None
+            ),
+            "seconds": time.perf_counter() - started,
+            "updated_at": time.time(),
+        }
+
+    def snapshot(
+        self,
+    ) -> Tuple[int, Optional[Dict[str, Any]], WatchedTemplate, WatchedTemplate]:
+        # (version, 比較結果, 旧, 新) を同じ時点の組で返す
+        with self._lock:
+            return (
+                self.version,
+                self.result,
+                (self.old.digest, self.old.meta, self.old.idx, self.old.stats),
+                (self.new.digest, self.new.meta, self.new.idx, self.new.stats),
+            )
@@ -0,0 +1,543 @@
+# 帳票DX テンプレート差分 エンジン（比較）のテスト
+#
+# deep_diff は、リスト要素の対応付けを入れた時点の再帰版（_reference_deep_diff）と同じ差分を同じ順に返す。
+# 部分木ハッシュで同じ部分木を飛ばしても差分は変わらない。乱数で作った JSON の組で確かめる。
+# 件数だけの比較・差分の上限・最初の差分での打ち切りでも件数・差分は変わらない。
+# min_severity で絞ったレポートのサマリー件数は、載せた差分・領域の件数と一致する。
+# オブジェクト単位の並列比較は、ValueRef の値・ID 変更の組も含めて直列と同じ結果になる。
+# JSONレポートから組み立て直した比較結果は、元の結果と同じ行・差分・レポートになる。
+# 実行: python -m pytest -q
+
+import copy
+import json
+import random
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import pytest
+
+import ReportDX_xar_diff_engine as engine_module
+from ReportDX_xar_diff_align import longest_increasing_subsequence, myers_opcodes
+from ReportDX_xar_diff_bench import generate_template, mutate_template
+from ReportDX_xar_diff_engine import (
+    DEFAULT_LIST_KEYS,
+    _locator,
+    build_json_report,
+    compare_indexes,
+    layout_severity_counts,
+    deep_diff,
+    index_objects,
+    indexes_differ,
+    iter_diff,
+    object_diffs,
+    object_hash,
+    result_from_json_report,
+    select_report_scope,
+    structural_hash,
+    summarize_result,
+    write_reports,
+)
+from ReportDX_xar_diff_entry import render_path
+from ReportDX_xar_diff_excel import iter_detail_rows
+from ReportDX_xar_diff_rules import SEVERITY_COUNT_KEYS, SEVERITY_LEVELS
+from ReportDX_xar_diff_values import ValueRef
+
+SEEDS = range(40)
+
+
+# --- 参照実装（リスト対応付けを入れた時点の再帰版 deep_diff） -----------------
+
+
+def _reference_deep_diff(
+    a: Any,
+    b: Any,
+    path: str = "",
+    list_mode: str = "align",
+    list_keys: Sequence[str] = DEFAULT_LIST_KEYS,
+) -> List[Dict[str, Any]]:
+    diffs: List[Dict[str, Any]] = []
+    if type(a) is not type(b):
+        if a != b:
+            diffs.append({"path": path or "(root)", "op": "changed", "old": a, "new": b})
+        return diffs
+    if isinstance(a, dict):
+        for k in sorted(set(a) | set(b)):
+            sub_path = f"{path}.{k}" if path else k
+            if k not in a:
+                diffs.append({"path": sub_path, "op": "added", "old": None, "new": b[k]})
+            elif k not in b:
+                diffs.append({"path": sub_path, "op": "removed", "old": a[k], "new": None})
+            else:
+                diffs.extend(_reference_deep_diff(a[k], b[k], sub_path, list_mode, list_keys))
+        return diffs
+    if isinstance(a, list):
+        if list_mode == "index":
+            for i in range(max(len(a), len(b))):
+                sub_path = f"{path}[{i}]"
+                if i >= len(a):
+                    diffs.append({"path": sub_path, "op": "added", "old": None, "new": b[i]})
+                elif i >= len(b):
+                    diffs.append({"path": sub_path, "op": "removed", "old": a[i], "new": None})
+                else:
+                    diffs.extend(_reference_deep_diff(a[i], b[i], sub_path, list_mode, list_keys))
+            return diffs
+        key = _reference_list_key(a, b, list_keys)
+        if key is not None:
+            return _reference_keyed_list(a, b, path, key, list_mode, list_keys)
+        return _reference_unkeyed_list(a, b, path, list_mode, list_keys)
+    if a != b:
+        diffs.append({"path": path or "(root)", "op": "changed", "old": a, "new": b})
+    return diffs
+
+
+def _reference_unique_key(elements: List[Any], key: str) -> bool:
+    seen = set()
+    for e in elements:
+        if not isinstance(e, dict):
+            return False
+        v = e.get(key)
+        if not isinstance(v, (str, int)) or v in seen:
+            return False
+        seen.add(v)
+    return True
+
+
+def _reference_list_key(a: List[Any], b: List[Any], list_keys: Sequence[str]) -> Optional[str]:
+    if not a or not b:
+        return None
+    for key in list_keys:
+        if _reference_unique_key(a, key) and _reference_unique_key(b, key):
+            return key
+    return None
+
+
+def _reference_keyed_list(
+    a: List[Any], b: List[Any], path: str, key: str, list_mode: str, list_keys: Sequence[str]
+) -> List[Dict[str, Any]]:
+    diffs: List[Dict[str, Any]] = []
+    pos_a = {e[key]: i for i, e in enumerate(a)}
+    pos_b = {e[key]: j for j, e in enumerate(b)}
+    matched = [(pos_a[e[key]], j) for j, e in enumerate(b) if e[key] in pos_a]
+    stable = longest_increasing_subsequence([i for i, _j in matched])
+    moved_to = {j for n, (_i, j) in enumerate(matched) if n not in stable}
+    for j, e in enumerate(b):
+        sub_path = f"{path}[{j}]"
+        i = pos_a.get(e[key])
+        if i is None:
+            diffs.append({"path": sub_path, "op": "added", "old": None, "new": e})
+            continue
+        if j in moved_to:
+            diffs.append({"path": sub_path, "op": "moved", "old": i, "new": j})
+        diffs.extend(_reference_deep_diff(a[i], e, sub_path, list_mode, list_keys))
+    for i, e in enumerate(a):
+        if e[key] not in pos_b:
+            diffs.append({"path": f"{path}[{i}]", "op": "removed", "old": e, "new": None})
+    return diffs
+
+
+def _reference_token(v: Any) -> Any:
+    if isinstance(v, (dict, list)):
+        return repr(_typed(v))
+    return (type(v).__name__, v)
+
+
+def _typed(v: Any) -> Any:
+    # 1 と 1.0、True と 1 を区別する比較用の値（キー順は正規化する）
+    if isinstance(v, dict):
+        return sorted((k, _typed(e)) for k, e in v.items())
+    if isinstance(v, list):
+        return [_typed(e) for e in v]
+    return (type(v).__name__, v)
+
+
+def _reference_unkeyed_list(
+    a: List[Any], b: List[Any], path: str, list_mode: str, list_keys: Sequence[str]
+) -> List[Dict[str, Any]]:
+    diffs: List[Dict[str, Any]] = []
+    tokens_a = [_reference_token(e) for e in a]
+    tokens_b = [_reference_token(e) for e in b]
+    opcodes = myers_opcodes(tokens_a, tokens_b)
+    deleted: Dict[Any, List[int]] = {}
+    for tag, i1, i2, _j1, _j2 in opcodes:
+        if tag in ("delete", "replace"):
+            for i in range(i1, i2):
+                deleted.setdefault(tokens_a[i], []).append(i)
+    moved_from: Dict[int, int] = {}
+    for tag, _i1, _i2, j1, j2 in opcodes:
+        if tag in ("insert", "replace"):
+            for j in range(j1, j2):
+                candidates = deleted.get(tokens_b[j])
+                if candidates:
+                    moved_from[j] = candidates.pop(0)
+    moved_old = set(moved_from.values())
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            continue
+        rest_a = [i for i in range(i1, i2) if i not in moved_old]
+        rest_b = []
+        for j in range(j1, j2):
+            if j in moved_from:
+                diffs.append(
+                    {"path": f"{path}[{j}]", "op": "moved", "old": moved_from[j], "new": j}
+                )
+            else:
+                rest_b.append(j)
+        for i, j in zip(rest_a, rest_b):
+            diffs.extend(_reference_deep_diff(a[i], b[j], f"{path}[{j}]", list_mode, list_keys))
+        for j in rest_b[len(rest_a) :]:
+            diffs.append({"path": f"{path}[{j}]", "op": "added", "old": None, "new": b[j]})
+        for i in rest_a[len(rest_b) :]:
+            diffs.append({"path": f"{path}[{i}]", "op": "removed", "old": a[i], "new": None})
+    return diffs
+
+
+# --- 乱数で作る JSON とその変更 ---------------------------------------------------
+
+
+def _random_scalar(rnd: random.Random) -> Any:
+    return rnd.choice([0, 1, 2, 1.0, 2.5, True, False, None, "", "a", "b", "テキスト"])
+
+
+def _random_value(rnd: random.Random, depth: int) -> Any:
+    roll = rnd.random()
+    if depth <= 0 or roll < 0.4:
+        return _random_scalar(rnd)
+    if roll < 0.65:
+        keys = rnd.sample(range(8), rnd.randint(0, 5))
+        return {f"k{i}": _random_value(rnd, depth - 1) for i in keys}
+    if roll < 0.85:
+        return [_random_value(rnd, depth - 1) for _ in range(rnd.randint(0, 6))]
+    # id を持つ dict のリスト（キーで対応付けられる）
+    ids = rnd.sample(range(20), rnd.randint(1, 6))
+    return [{"id": f"f{i}", "w": _random_value(rnd, depth - 1)} for i in ids]
+
+
+def _mutate(rnd: random.Random, v: Any, depth: int) -> Any:
+    # v のコピーに、値の変更・型の変更・キーや要素の追加/削除/移動をいくつか加える
+    if rnd.random() < 0.15:
+        return _random_value(rnd, depth)
+    if isinstance(v, dict):
+        v = dict(v)
+        for k in list(v):
+            if rnd.random() < 0.3:
+                v[k] = _mutate(rnd, v[k], depth - 1)
+        if rnd.random() < 0.2 and v:
+            del v[rnd.choice(sorted(v))]
+        if rnd.random() < 0.2:
+            v[f"k{rnd.randrange(10)}"] = _random_value(rnd, depth - 1)
+        return v
+    if isinstance(v, list):
+        v = [_mutate(rnd, e, depth - 1) if rnd.random() < 0.3 else e for e in v]
+        if rnd.random() < 0.3 and v:
+            del v[rnd.randrange(len(v))]
+        if rnd.random() < 0.3:
+            v.insert(rnd.randrange(len(v) + 1), copy.deepcopy(rnd.choice(v)) if v else 0)
+        if rnd.random() < 0.3 and len(v) > 1:
+            v.insert(rnd.randrange(len(v)), v.pop(rnd.randrange(len(v))))
+        return v
+    return _random_scalar(rnd)
+
+
+def _random_pair(seed: int) -> Any:
+    rnd = random.Random(seed)
+    a = {f"k{i}": _random_value(rnd, 4) for i in range(6)}
+    return a, _mutate(rnd, a, 4)
+
+
+def _as_records(diffs: Any) -> List[Any]:
+    return [(render_path(d.segments), d.op, d.old, d.new) for d in diffs]
+
+
+def _reference_records(a: Any, b: Any, list_mode: str) -> List[Any]:
+    diffs = _reference_deep_diff(a, b, "", list_mode)
+    return [(d["path"], d["op"], d["old"], d["new"]) for d in diffs]
+
+
+def _typed_records(records: List[Any]) -> List[Any]:
+    return [(path, op, _typed(old), _typed(new)) for path, op, old, new in records]
+
+
+# --- deep_diff --------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("list_mode", ["align", "index"])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_deep_diff_matches_reference(seed: int, list_mode: str) -> None:
+    a, b = _random_pair(seed)
+    expected = _typed_records(_reference_records(a, b, list_mode))
+    assert _typed_records(_as_records(deep_diff(a, b, list_mode=list_mode))) == expected
+
+
+def test_deep_diff_keeps_type_differences() -> None:
+    assert _as_records(deep_diff({"x": 1}, {"x": 1.0})) == []
+    assert [op for _p, op, _o, _n in _as_records(deep_diff([1, True], [True, 1]))] == ["moved"]
+    assert _as_records(deep_diff("a", 1)) == [("(root)", "changed", "a", 1)]
+
+
+def test_deep_diff_aligns_lists() -> None:
+    # キーのあるリストはキーで、ないリストは内容で対応付ける（挿入で後ろの要素が全部変わらない）
+    old = {"frames": [{"id": "a", "w": 1}, {"id": "b", "w": 2}], "tags": ["x", "y"]}
+    new = {
+        "frames": [{"id": "c", "w": 0}, {"id": "a", "w": 1}, {"id": "b", "w": 3}],
+        "tags": ["y", "x"],
+    }
+    assert [(p, op) for p, op, _o, _n in _as_records(deep_diff(old, new))] == [
+        ("frames[0]", "added"),
+        ("frames[2].w", "changed"),
+        ("tags[1]", "moved"),
+    ]
+    index = [(p, op) for p, op, _o, _n in _as_records(deep_diff(old, new, list_mode="index"))]
+    assert ("frames[2]", "added") in index and ("tags[0]", "changed") in index
+
+
+def test_deep_diff_does_not_recurse() -> None:
+    a: Any = 0
+    b: Any = 1
+    for _ in range(5000):
+        a, b = {"c": a}, {"c": b}
+    (entry,) = deep_diff(a, b)
+    assert len(entry.segments) == 5000 and entry.op == "changed"
+
+
+# --- 件数だけの比較・差分の上限・打ち切り --------------------------------------------
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_compare_indexes_details_agree(seed: int) -> None:
+    base = generate_template(150, table_depth=1 + seed % 2, seed=seed)
+    new = mutate_template(base, 0.3, seed=seed + 100)
+    options = dict(match_reid=False, analyze_layout=False, value_ref_min_chars=None)
+    full = compare_indexes(index_objects(base), index_objects(new), **options)
+    counts = compare_indexes(index_objects(base), index_objects(new), detail="counts", **options)
+    capped = compare_indexes(
+        index_objects(base), index_objects(new), max_diffs_per_object=2, **options
+    )
+    assert full["changed_rows"] == counts["changed_rows"] == capped["changed_rows"]
+    assert summarize_result(full) == summarize_result(counts)
+    idx_base = index_objects(base)
+    idx_new = index_objects(new)
+    for oid, det in full["changed_detail"].items():
+        expected = _reference_records(idx_base[oid], idx_new[oid], "align")
+        records = [
+            (path[len("object.") :], op, old, new)
+            for path, op, old, new in _as_records(det["diffs"])
+        ]
+        assert records == expected
+        assert _as_records(object_diffs(counts["changed_detail"][oid])) == _as_records(det["diffs"])
+        assert _as_records(capped["changed_detail"][oid]["diffs"]) == _as_records(det["diffs"])[:2]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_indexes_differ_agrees_with_compare(seed: int) -> None:
+    base = generate_template(100, seed=seed)
+    for rate in (0.0, 0.02, 0.3):
+        new = mutate_template(base, rate, seed=seed + 100)
+        result = compare_indexes(index_objects(base), index_objects(new), analyze_layout=False)
+        summary = summarize_result(result)
+        expected = any(summary[k] for k in ("added", "removed", "changed"))
+        assert indexes_differ(index_objects(base), index_objects(new)) == expected
+
+
+def test_indexes_differ_stops_at_first_diff(monkeypatch: Any) -> None:
+    old = {"objects": [{"id": f"o{i}", "v": list(range(50))} for i in range(20)]}
+    new = copy.deepcopy(old)
+    for o in new["objects"]:
+        o["v"].reverse()
+    consumed: List[Any] = []
+
+    def counting(*args: Any) -> Any:
+        for d in iter_diff(*args):
+            consumed.append(d)
+            yield d
+
+    monkeypatch.setattr(engine_module, "iter_diff", counting)
+    assert indexes_differ(index_objects(old), index_objects(new))
+    assert len(consumed) == 1
+    # ハッシュが違っても差分のない組（1 と 1.0）は差分なし、ID の変更は差分あり
+    one = index_objects({"objects": [{"id": "a", "v": 1}]})
+    assert not indexes_differ(one, index_objects({"objects": [{"id": "a", "v": 1.0}]}))
+    assert indexes_differ(one, index_objects({"objects": [{"id": "b", "v": 1}]}))
+
+
+# --- 構造ハッシュ -----------------------------------------------------------------
+
+
+@pytest.mark.parametrize("list_mode", ["align", "index"])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_subtree_hashes_do_not_change_diffs(seed: int, list_mode: str) -> None:
+    a, b = _random_pair(seed)
+    hashes_a: Dict[int, bytes] = {}
+    hashes_b: Dict[int, bytes] = {}
+    structural_hash(a, hashes_a)
+    structural_hash(b, hashes_b)
+    hashed = iter_diff(a, b, (), list_mode, DEFAULT_LIST_KEYS, hashes_a, hashes_b)
+    assert _typed_records(_as_records(hashed)) == _typed_records(
+        _reference_records(a, b, list_mode)
+    )
+
+
+def test_structural_hash_ignores_key_order_but_not_types() -> None:
+    assert structural_hash({"a": 1, "b": [1, 2]}) == structural_hash({"b": [1, 2], "a": 1})
+    assert structural_hash([1]) != structural_hash([1.0])
+    assert structural_hash([1]) != structural_hash([True])
+    assert structural_hash(["ab"]) != structural_hash(["a", "b"])
+    assert object_hash({"a": 1, "b": 2}) == object_hash({"b": 2, "a": 1})
+
+
+def test_index_objects_hashes_each_object() -> None:
+    tpl = {"objects": [{"id": "x", "v": 1}, {"id": "y", "v": 2}, {"name": "no_id"}]}
+    idx = index_objects(tpl)
+    assert sorted(idx) == ["x", "y"]
+    assert idx.hashes["x"] == object_hash({"v": 1, "id": "x"})
+    assert idx.subtree_hashes == {}
+    table = idx.subtree_hashes_for("x")
+    assert table[id(idx["x"])] == structural_hash(idx["x"])
+
+
+# --- レポートの範囲 ---------------------------------------------------------------
+
+
+@pytest.mark.parametrize("detail", ["full", "counts"])
+@pytest.mark.parametrize("min_severity", [1, 2, 3])
+def test_scoped_summary_matches_listed_rows(tmp_path: Any, min_severity: int, detail: str) -> None:
+    base = generate_template(300, table_depth=2, seed=11)
+    new = mutate_template(base, 0.3, seed=12)
+    # まとめて移動する領域も作る
+    for i in range(4):
+        rect = {"x": 1000.0 + 12 * i, "y": 2000.0, "width": 10.0, "height": 10.0}
+        base["objects"].append({"id": f"grp{i}", "name": f"grp{i}", "rect": rect})
+        new["objects"].append({"id": f"grp{i}", "name": f"grp{i}", "rect": dict(rect, y=2007.0)})
+    result = compare_indexes(index_objects(base), index_objects(new), detail=detail)
+    assert result["layout_groups"]
+    levels = [level for level in SEVERITY_LEVELS if level >= min_severity]
+
+    scoped = select_report_scope(result, min_severity)
+    summary = summarize_result(scoped)
+    report = build_json_report(result, min_severity)
+    assert report["summary"] == summary
+    assert len(report["changed"]) == summary["changed"]
+    listed = {level: 0 for level in SEVERITY_LEVELS}
+    for row in report["changed"]:
+        assert row["diffs"] and all(d["severity"] >= min_severity for d in row["diffs"])
+        for level in SEVERITY_LEVELS:
+            n = sum(1 for d in row["diffs"] if d["severity"] == level)
+            assert row[SEVERITY_COUNT_KEYS[level]] == n
+            listed[level] += n
+        assert row["total_changes"] == len(row["diffs"])
+    assert all(g["severity"] >= min_severity for g in report["layout_groups"])
+    layout_counts = layout_severity_counts(report["layout_groups"])
+    for level, key in ((3, "critical"), (2, "medium"), (1, "minor")):
+        expected = listed[level] + layout_counts[level] if level in levels else 0
+        assert summary[key] == expected
+
+    detail_rows = list(
+        iter_detail_rows(scoped["changed_rows"], scoped["changed_detail"], None, min_severity)
+    )
+    assert len(detail_rows) == sum(listed.values())
+
+    write_reports(result, tmp_path, ["md"], min_severity=min_severity)
+    md = (tmp_path / "xar_diff_report.md").read_text(encoding="utf-8")
+    assert f"- 変更オブジェクト数: **{summary['changed']}**" in md
+    for emoji, key in (("🔴", "critical"), ("🟡", "medium"), ("🟢", "minor")):
+        assert f"({emoji}): **{summary[key]}**" in md
+    md_rows = re.findall(r"^\| \S+ \S+ \| (?:変更|追加|削除|移動) \| `", md, re.M)
+    assert len(md_rows) == sum(listed.values())
+
+
+# --- 並列比較 -----------------------------------------------------------------
+
+
+def _parallel_case() -> Any:
+    old = generate_template(3000, seed=7)
+    new = mutate_template(old, rate=0.3, seed=8)
+    # ID だけを付け直したオブジェクト（ID 変更の組として比較される）
+    for o in new["objects"][::500]:
+        o["id"] += "_reid"
+    # 並べ替えたリストの要素内の削除（差分のパスは新側の添字なので、旧側の値は辿れない）
+    reordered = {o["id"] for o in new["objects"][1::700]}
+    for o in new["objects"][1::700]:
+        o["impl"]["notes"] = [{"id": "q"}, {"id": "p"}]
+    for o in old["objects"]:
+        if o["id"] in reordered:
+            o["impl"]["notes"] = [{"id": "p", "v": ["p"] * 20}, {"id": "q", "v": ["q"] * 20}]
+    return index_objects(old), index_objects(new)
+
+
+def test_parallel_compare_matches_serial() -> None:
+    idx_old, idx_new = _parallel_case()
+    options = {"value_ref_min_chars": 40, "parallel_min_objects": 1}
+    serial = compare_indexes(idx_old, idx_new, **options)
+    parallel = compare_indexes(idx_old, idx_new, workers=4, **options)
+
+    assert json.dumps(build_json_report(parallel), ensure_ascii=False) == json.dumps(
+        build_json_report(serial), ensure_ascii=False
+    )
+    assert [r for r in parallel["changed_rows"] if "old_id" in r]
+    assert parallel["changed_rows"] == serial["changed_rows"]
+    n_refs = 0
+    for oid, det in serial["changed_detail"].items():
+        other = parallel["changed_detail"][oid]
+        assert other["old_full"] is det["old_full"] and other["new_full"] is det["new_full"]
+        assert len(other["diffs"]) == len(det["diffs"])
+        for d, p in zip(det["diffs"], other["diffs"]):
+            assert (p.segments, p.op, p.severity) == (d.segments, d.op, d.severity)
+            for key in ("old", "new"):
+                v, w = getattr(d, key), getattr(p, key)
+                if isinstance(v, ValueRef):
+                    n_refs += 1
+                    assert isinstance(w, ValueRef) and w.value == v.value
+                    # 新側の値は差分のパスで辿れるので、親プロセス側のインデックスの値そのもの
+                    assert key == "old" or w.value is v.value
+                    assert (w.preview, w.digest) == (v.preview, v.digest)
+                else:
+                    assert w == v and type(w) is type(v)
+    assert n_refs > 20
+
+
+def test_value_ref_locator_follows_diff_segments() -> None:
+    old = {"impl": {"notes": [{"t": "a"}, {"t": "c"}], "rect": {"x": 1}}}
+    new = {"impl": {"notes": [{"t": "b"}, {"t": "a"}], "rect": {"x": 1}}}
+    diffs = deep_diff(old, new, ("object",))
+    removed = next(d for d in diffs if d.op == "removed")
+    added = next(d for d in diffs if d.op == "added")
+    assert _locator(new, added.segments, added.new) == ("impl", "notes", 0)
+    assert _locator(old, removed.segments, removed.old) == ("impl", "notes", 1)
+    # 添字の位置に別の値がある・パスを辿れない場合は位置を返さない
+    assert _locator(old, added.segments, added.new) is None
+    assert _locator(old, ("object", "impl", "rect", 0), old["impl"]["rect"]) is None
+
+
+# --- JSONレポートからの復元 -------------------------------------------------------
+
+
+def test_result_from_json_report_round_trips() -> None:
+    idx_old, idx_new = _parallel_case()
+    result = compare_indexes(idx_old, idx_new, detail="counts", value_ref_min_chars=40)
+    report = json.loads(json.dumps(build_json_report(result), ensure_ascii=False))
+    restored = result_from_json_report(report, idx_old, idx_new)
+
+    assert restored["changed_rows"] == result["changed_rows"]
+    assert summarize_result(restored) == summarize_result(result)
+    assert build_json_report(restored) == report
+    n_refs = 0
+    for oid, det in result["changed_detail"].items():
+        got = restored["changed_detail"][oid]
+        assert got["old_full"] is det["old_full"] and got["new_full"] is det["new_full"]
+        assert (got["old_summary"], got["new_summary"]) == (det["old_summary"], det["new_summary"])
+        assert got.get("old_id") == det.get("old_id")
+        expected = {(d.segments, d.op): d for d in object_diffs(det)}
+        assert len(got["diffs"]) == len(expected)
+        for p in got["diffs"]:
+            d = expected[(p.segments, p.op)]
+            assert p.severity == d.severity
+            for key in ("old", "new"):
+                v, w = getattr(d, key), getattr(p, key)
+                if isinstance(w, ValueRef):
+                    # パスで辿れた値は、インデックスの値そのものを参照する
+                    n_refs += 1
+                    assert w.value is v.value and w.digest == v.digest
+                elif isinstance(v, ValueRef):
+                    assert w == v.as_dict()
+                else:
+                    assert w == v and type(w) is type(v)
+    assert n_refs > 20
@@ -0,0 +1,112 @@
+# 帳票DX テンプレート差分 レイアウト解析のテスト
+#
+# まとめて移動した領域が1件にまとまり、rect の差分を外した後の行の件数が合うこと
+# （差分がなくなったオブジェクトは一覧から外れる）、新たな重なりの検出と
+# max_overlaps での打ち切り（overlaps_unchecked）を確かめる。
+# 実行: python -m pytest -q
+
+from typing import Any, Dict, List
+
+import pytest
+
+from ReportDX_xar_diff_engine import (
+    compare_indexes,
+    index_objects,
+    object_diffs,
+    summarize_result,
+)
+from ReportDX_xar_diff_layout import find_new_overlaps
+
+
+def _obj(oid: str, x: float, y: float, w: float = 10.0, h: float = 10.0) -> Dict[str, Any]:
+    return {"id": oid, "name": oid, "rect": {"x": x, "y": y, "width": w, "height": h}}
+
+
+def _index(objects: List[Dict[str, Any]]) -> Any:
+    return index_objects({"objects": objects})
+
+
+def _row_counts(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        r["id"]: (r["minor_cnt"], r["medium_cnt"], r["critical_cnt"], r["total_changes"])
+        for r in result["changed_rows"]
+    }
+
+
+@pytest.mark.parametrize("detail", ["full", "counts"])
+def test_grouped_shift_collapses_rect_diffs(detail: str) -> None:
+    # a0〜a3 は隣り合って (5, 0) 移動、a3 は名前も変更。far は同じ移動量だが離れた1件だけ
+    old = [_obj(f"a{i}", 12.0 * i, 0.0) for i in range(4)] + [_obj("far", 500.0, 500.0)]
+    new = [_obj(f"a{i}", 12.0 * i + 5, 0.0) for i in range(4)] + [_obj("far", 505.0, 500.0)]
+    new[3]["name"] = "renamed"
+    result = compare_indexes(_index(old), _index(new), detail=detail)
+
+    (group,) = result["layout_groups"]
+    assert (group["kind"], group["dx"], group["dy"], group["count"]) == ("move", 5.0, 0.0, 4)
+    assert group["ids"] == ["a0", "a1", "a2", "a3"]
+    assert group["old_bbox"] == (0.0, 0.0, 46.0, 10.0)
+    assert group["new_bbox"] == (5.0, 0.0, 46.0, 10.0)
+    assert group["severity"] == 2
+
+    # 移動だけのオブジェクトは一覧から外れ、名前も変えた a3 は名前の差分だけが残る
+    assert _row_counts(result) == {"a3": (1, 0, 0, 1), "far": (0, 1, 0, 1)}
+    assert set(result["changed_detail"]) == {"a3", "far"}
+    assert [d.path for d in object_diffs(result["changed_detail"]["a3"])] == ["object.name"]
+    assert [d.path for d in object_diffs(result["changed_detail"]["far"])] == ["object.rect.x"]
+    summary = summarize_result(result)
+    assert (summary["changed"], summary["layout_groups"]) == (2, 1)
+    assert (summary["minor"], summary["medium"]) == (1, 2)
+
+
+def test_small_groups_are_not_collapsed() -> None:
+    old = [_obj("a", 0.0, 0.0), _obj("b", 12.0, 0.0)]
+    new = [_obj("a", 0.0, 3.0), _obj("b", 12.0, 3.0)]
+    result = compare_indexes(_index(old), _index(new))
+    assert result["layout_groups"] == []
+    assert _row_counts(result) == {"a": (0, 1, 0, 1), "b": (0, 1, 0, 1)}
+
+
+def test_new_overlaps_only() -> None:
+    old = [
+        _obj("a", 0.0, 0.0),
+        _obj("b", 20.0, 0.0),
+        # 以前から重なっている組・完全に含む組は対象外
+        _obj("c", 100.0, 0.0),
+        _obj("d", 105.0, 5.0),
+        _obj("frame", 200.0, 0.0, 50.0, 50.0),
+        _obj("inner", 260.0, 10.0),
+    ]
+    new = [
+        _obj("a", 0.0, 0.0),
+        _obj("b", 5.0, 5.0),
+        _obj("c", 100.0, 0.0),
+        _obj("d", 104.0, 4.0),
+        _obj("frame", 200.0, 0.0, 50.0, 50.0),
+        _obj("inner", 210.0, 10.0),
+        _obj("added", 8.0, -2.0),
+    ]
+    overlaps = compare_indexes(_index(old), _index(new))["overlaps"]
+    assert [(o["id_a"], o["id_b"], o["added"]) for o in overlaps] == [
+        ("a", "added", True),
+        ("a", "b", False),
+        ("added", "b", True),
+    ]
+    assert overlaps[1]["rect_b"] == (5.0, 5.0, 10.0, 10.0)
+
+
+def test_max_overlaps_stops_and_counts_unchecked() -> None:
+    old = [_obj(f"o{i:02d}", 20.0 * i, 0.0) for i in range(10)]
+    # 全部を半分ずつ重なるように詰める
+    new = [_obj(f"o{i:02d}", 5.0 * i, 0.0) for i in range(10)]
+    full = compare_indexes(_index(old), _index(new), max_overlaps=None)
+    assert len(full["overlaps"]) == 9 and full["overlaps_unchecked"] == 0
+
+    capped = compare_indexes(_index(old), _index(new), max_overlaps=3)
+    assert len(capped["overlaps"]) == 3
+    assert 0 < capped["overlaps_unchecked"] <= 10
+    assert summarize_result(capped)["overlaps_unchecked"] == capped["overlaps_unchecked"]
+    assert all(o in full["overlaps"] for o in capped["overlaps"])
+
+    stats: Dict[str, Any] = {}
+    assert find_new_overlaps(_index(old), _index(new), max_overlaps=10, stats=stats)
+    assert stats == {"unchecked": 0}
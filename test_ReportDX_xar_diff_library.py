@@ -0,0 +1,147 @@
+# 帳票DX テンプレート差分 ライブラリ一括比較のテスト
+#
+# バンドル・.xar の CRC が同じテンプレートは読まずに（差分を取らずに）変更なしとすること、
+# 複数の ZIP にまたがって名前が重なるとエラーにすること、状態ごとの集計を確かめる。
+# 実行: python -m pytest -q
+
+import io
+import json
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+import ReportDX_xar_diff_library as library_module
+from ReportDX_xar_diff_bench import template_to_xar
+from ReportDX_xar_diff_library import (
+    SKIPPED_BY_BUNDLE,
+    SKIPPED_BY_XAT,
+    compare_libraries,
+    library_from_files,
+    list_library,
+    summarize_library,
+)
+
+
+def _tpl(*names: str) -> Dict[str, Any]:
+    rect = {"x": 0, "y": 0, "width": 5, "height": 5}
+    return {"objects": [{"id": n, "name": n, "rect": dict(rect)} for n in names]}
+
+
+def _bundle(path: Path, members: Dict[str, bytes]) -> Path:
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    return path
+
+
+def _fail(*_args: Any, **_kwargs: Any) -> Any:
+    raise AssertionError("読まずに飛ばすはずのテンプレートを読みました")
+
+
+def _by_name(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {r["name"]: r for r in rows}
+
+
+def test_list_library_strips_common_root(tmp_path: Any) -> None:
+    xar = template_to_xar(_tpl("a"))
+    bundle = _bundle(tmp_path / "v1.zip", {"lib_v1/a.xar": xar, "lib_v1/sub/b.xar": xar})
+    assert list(list_library(bundle)) == ["a.xar", "sub/b.xar"]
+    (tmp_path / "dir" / "sub").mkdir(parents=True)
+    (tmp_path / "dir" / "sub" / "c.xar").write_bytes(xar)
+    (tmp_path / "dir" / "note.txt").write_text("x")
+    assert list(list_library(tmp_path / "dir")) == ["sub/c.xar"]
+
+
+def test_duplicate_name_across_zips_is_rejected(tmp_path: Any) -> None:
+    xar = template_to_xar(_tpl("a"))
+    first = _bundle(tmp_path / "first.zip", {"a.xar": xar, "b.xar": xar})
+    second = _bundle(tmp_path / "second.zip", {"c.xar": xar, "a.xar": xar})
+    with pytest.raises(ValueError, match="a.xar"):
+        library_from_files([str(first), str(second)])
+
+    loose = tmp_path / "b.xar"
+    loose.write_bytes(xar)
+    with pytest.raises(ValueError, match="b.xar"):
+        library_from_files([str(first), str(loose)])
+    assert list(library_from_files([str(second), str(loose)])) == ["a.xar", "b.xar", "c.xar"]
+
+
+def test_identical_bundle_crc_skips_without_reading(tmp_path: Any, monkeypatch: Any) -> None:
+    xar = template_to_xar(_tpl("a", "b"))
+    old = list_library(_bundle(tmp_path / "old.zip", {"lib/a.xar": xar}))
+    new = list_library(_bundle(tmp_path / "new.zip", {"lib/a.xar": xar}))
+    monkeypatch.setattr(library_module, "read_entry", _fail)
+    monkeypatch.setattr(library_module, "compare_indexes", _fail)
+    (row,) = compare_libraries(old, new, workers=1)
+    assert (row["status"], row["skipped_by"]) == ("unchanged", SKIPPED_BY_BUNDLE)
+
+
+def test_identical_xat_crc_skips_the_diff(tmp_path: Any, monkeypatch: Any) -> None:
+    tpl = _tpl("a", "b")
+    old_dir, new_dir = tmp_path / "old", tmp_path / "new"
+    old_dir.mkdir()
+    new_dir.mkdir()
+    (old_dir / "a.xar").write_bytes(template_to_xar(tpl))
+    # .xar（ZIP）としてのバイト列は違うが、中の .xat は同じ
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("template.xat", json.dumps(tpl, ensure_ascii=False))
+    (new_dir / "a.xar").write_bytes(buffer.getvalue())
+    assert (old_dir / "a.xar").read_bytes() != (new_dir / "a.xar").read_bytes()
+
+    monkeypatch.setattr(library_module, "load_xar_streaming", _fail)
+    monkeypatch.setattr(library_module, "compare_indexes", _fail)
+    (row,) = compare_libraries(list_library(old_dir), list_library(new_dir), workers=1)
+    assert (row["status"], row["skipped_by"]) == ("unchanged", SKIPPED_BY_XAT)
+
+
+def test_statuses_and_totals(tmp_path: Any) -> None:
+    tpl = _tpl("a", "b")
+    changed = _tpl("a", "b")
+    changed["objects"][0]["rect"]["x"] = 3
+    # キー順を変えて書き直しただけの .xat は、比較したうえで変更なしになる
+    rewritten = {"objects": [dict(reversed(list(o.items()))) for o in tpl["objects"]]}
+    old = list_library(
+        _bundle(
+            tmp_path / "old.zip",
+            {
+                "same.xar": template_to_xar(tpl),
+                "changed.xar": template_to_xar(tpl),
+                "rewritten.xar": template_to_xar(tpl),
+                "removed.xar": template_to_xar(tpl),
+                "broken.xar": template_to_xar(tpl),
+            },
+        )
+    )
+    new = list_library(
+        _bundle(
+            tmp_path / "new.zip",
+            {
+                "same.xar": template_to_xar(tpl),
+                "changed.xar": template_to_xar(changed),
+                "rewritten.xar": template_to_xar(rewritten),
+                "added.xar": template_to_xar(tpl),
+                "broken.xar": b"not a zip",
+            },
+        )
+    )
+    progress: List[Any] = []
+    rows = _by_name(compare_libraries(old, new, workers=1, progress=lambda *a: progress.append(a)))
+    assert {name: r["status"] for name, r in rows.items()} == {
+        "added.xar": "added",
+        "broken.xar": "error",
+        "changed.xar": "changed",
+        "removed.xar": "removed",
+        "rewritten.xar": "unchanged",
+        "same.xar": "unchanged",
+    }
+    assert rows["same.xar"]["skipped_by"] == SKIPPED_BY_BUNDLE
+    assert rows["rewritten.xar"]["skipped_by"] == ""
+    assert rows["changed.xar"]["changed"] == 1 and rows["changed.xar"]["medium"] == 1
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+
+    totals = summarize_library(list(rows.values()))
+    assert totals["templates"] == 6 and totals["unchanged"] == 2 and totals["skipped"] == 1
+    assert (totals["error"], totals["medium"]) == (1, 1)
@@ -0,0 +1,66 @@
+# 帳票DX テンプレート差分 ID変更オブジェクトの対応付けのテスト
+#
+# ID だけを変えたオブジェクトが元のオブジェクトと組になること、組は類似度の高い順に1対1で
+# 決まること、手がかりにならない大きなバケットからは候補を作らないことを確かめる。
+# 実行: python -m pytest -q
+
+import copy
+import random
+from typing import Any, Dict, Optional
+
+import pytest
+
+from ReportDX_xar_diff_bench import generate_template
+from ReportDX_xar_diff_engine import compare_indexes, index_objects
+from ReportDX_xar_diff_match import match_features, match_objects, similarity
+
+
+def _features(
+    text: Optional[str] = None, x: float = 0.0, y: float = 0.0, type_: str = "text", **kw: Any
+) -> Dict[str, Any]:
+    summary = {"type": type_, "text": text, "x": x, "y": y, "width": 20.0, "height": 5.0, **kw}
+    return match_features(summary)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_reid_pairs_renamed_objects(seed: int) -> None:
+    rnd = random.Random(seed)
+    base = generate_template(300, seed=seed)
+    new = copy.deepcopy(base)
+    renamed = {}
+    for o in rnd.sample(new["objects"], 15):
+        renamed[o["id"]] = o["id"] = f"renamed_{o['id']}"
+    result = compare_indexes(index_objects(base), index_objects(new), analyze_layout=False)
+    assert result["added"] == [] and result["removed"] == []
+    pairs = {r["old_id"]: r["id"] for r in result["changed_rows"]}
+    assert pairs == renamed
+    assert all(r["total_changes"] == 1 for r in result["changed_rows"])
+
+    plain = compare_indexes(
+        index_objects(base), index_objects(new), match_reid=False, analyze_layout=False
+    )
+    assert len(plain["added"]) == len(plain["removed"]) == len(renamed)
+    assert plain["changed_rows"] == []
+
+
+def test_pairs_are_one_to_one_best_first() -> None:
+    removed = {"r1": _features("見出し", x=0.0), "r2": _features("見出し", x=200.0)}
+    added = {"a1": _features("見出し", x=201.0), "a2": _features("見出し", x=1.0)}
+    pairs = match_objects(removed, added)
+    assert [(o, n) for o, n, _s in pairs] == [("r1", "a2"), ("r2", "a1")]
+    assert all(0.6 <= s < 1.0 for _o, _n, s in pairs)
+
+
+def test_different_types_and_low_scores_are_not_paired() -> None:
+    assert similarity(_features("a"), _features("a", type_="image")) == 0.0
+    assert match_objects({"r": _features("a")}, {"a": _features("a", type_="image")}) == []
+    far = _features("b", x=500.0, y=500.0, name="other")
+    assert match_objects({"r": _features("a", name="n")}, {"a": far}) == []
+
+
+def test_large_buckets_do_not_make_candidates() -> None:
+    # 全件が同じ内容・位置なので、どのバケットも max_bucket を超える
+    removed = {f"r{i}": _features("同じ") for i in range(5)}
+    added = {f"a{i}": _features("同じ") for i in range(5)}
+    assert len(match_objects(removed, added)) == 5
+    assert match_objects(removed, added, max_bucket=4) == []
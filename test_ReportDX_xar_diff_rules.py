@@ -0,0 +1,178 @@
+# 帳票DX テンプレート差分 重要度ルールのテスト
+#
+# 既定ルールは、実際のテンプレートのパスでは置き換え前のキーワード判定と同じ重要度になる
+# （違うのは "style" の y のように、キーワードがセグメントの一部に現れるだけのパス）。
+# ルールファイル・環境変数からの読み込み、メモ化、fingerprint とサービスのジョブ ID も確かめる。
+# 実行: python -m pytest -q
+
+import json
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+import pytest
+
+import ReportDX_xar_diff_rules as rules_module
+from ReportDX_xar_diff_bench import generate_template
+from ReportDX_xar_diff_entry import render_path
+from ReportDX_xar_diff_rules import (
+    RULES_ENV_VAR,
+    SeverityRules,
+    get_severity_rules,
+    load_severity_rules,
+    set_severity_rules,
+)
+from ReportDX_xar_diff_service import job_id_for
+
+
+@pytest.fixture(autouse=True)
+def _default_rules() -> Iterator[None]:
+    set_severity_rules(None)
+    yield
+    set_severity_rules(None)
+
+
+def _keyword_severity(path: str) -> int:
+    # 置き換え前の判定（パス文字列の部分一致）
+    p = path.lower()
+    critical = ["drive_dataset", "dataset_ref", "dataset", "bind", "impl_uri", "column_count"]
+    critical += [".tables", "image", "img", "resource"]
+    if any(k in p for k in critical):
+        return 3
+    medium = ["rect.", ".rect", "stroke", "font_size", "font.size", "fill.color", "fill_colour"]
+    medium += ["alignment", "align", "width", "height", "x", "y", "rotation", "skew"]
+    if any(k in p for k in medium):
+        return 2
+    if "impl.data.value" in p or "text" in p:
+        return 2
+    return 1
+
+
+def _paths(v: Any, segments: Tuple[Any, ...]) -> Iterator[Tuple[Any, ...]]:
+    yield segments
+    if isinstance(v, dict):
+        for k, e in v.items():
+            yield from _paths(e, (*segments, k))
+    elif isinstance(v, list):
+        for i, e in enumerate(v):
+            yield from _paths(e, (*segments, i))
+
+
+def test_default_rules_match_keyword_classification() -> None:
+    rules = SeverityRules()
+    paths = {
+        render_path(segments)
+        for o in generate_template(300, table_depth=2)["objects"]
+        for segments in _paths(o, ("object",))
+    }
+    assert len(paths) > 50
+    for path in paths:
+        assert rules.classify(path)[0] == _keyword_severity(path), path
+
+
+@pytest.mark.parametrize(
+    "path, severity",
+    [
+        ("object.impl.style", 1),
+        ("object.impl.index", 1),
+        ("object.impl.size", 1),
+        ("object.rect", 2),
+        ("object.rect.x", 2),
+        ("object.impl.font.size", 2),
+        ("object.impl.data.value", 2),
+        ("object.impl.textAlign", 2),
+        ("object.impl.dataset_ref", 3),
+        ("object.impl.tables[3].frames[0].bind", 3),
+        ("OBJECT.IMPL_URI", 3),
+    ],
+)
+def test_rules_match_whole_segments(path: str, severity: int) -> None:
+    assert SeverityRules().classify(path)[0] == severity
+
+
+def test_first_matching_rule_wins() -> None:
+    rules = SeverityRules(
+        {
+            "default": 2,
+            "rules": [
+                {"severity": 1, "patterns": ["rect.x"]},
+                {"severity": 3, "patterns": ["rect", "a?c"]},
+            ],
+        }
+    )
+    assert rules.classify("object.rect.x")[0] == 1
+    assert rules.classify("object.rect.y")[0] == 3
+    assert rules.classify("object.abc")[0] == 3
+    assert rules.classify("object.abbc")[0] == 2
+    assert rules.classify("object.rect_x") == (2, "🟡", "中")
+
+
+def test_invalid_rules_are_rejected() -> None:
+    with pytest.raises(ValueError):
+        SeverityRules({"default": 4})
+    with pytest.raises(ValueError):
+        SeverityRules({"rules": [{"severity": 0, "patterns": ["x"]}]})
+    with pytest.raises(ValueError):
+        SeverityRules({"rules": [{"severity": 3, "patterns": ["font..size"]}]})
+
+
+def test_classify_is_memoized_per_normalized_path() -> None:
+    rules = SeverityRules()
+    first = rules.classify("object.impl.tables[12].frames[0].bind")
+    assert rules.classify("Object.impl.tables[13].frames[7].BIND") is first
+    assert list(rules._cache) == ["object.impl.tables[].frames[].bind"]
+
+
+def test_severity_of_caches_segments(monkeypatch: Any) -> None:
+    rules = SeverityRules()
+    segments = ("object", "rect", "x")
+    assert rules.severity_of(segments) == rules.classify("object.rect.x")[0] == 2
+    assert rules._segment_cache == {segments: 2}
+    monkeypatch.setattr(rules_module, "SEGMENT_CACHE_MAX", 1)
+    assert rules.severity_of(("object", "name")) == 1
+    assert len(rules._segment_cache) == 1
+
+
+def test_rules_load_from_json_toml_and_env(tmp_path: Any, monkeypatch: Any) -> None:
+    config = {"default": 2, "rules": [{"severity": 3, "patterns": ["name"]}]}
+    json_path = tmp_path / "rules.json"
+    json_path.write_text(json.dumps(config), encoding="utf-8")
+    toml_path = tmp_path / "rules.toml"
+    toml_path.write_text('default = 2\n[[rules]]\nseverity = 3\npatterns = ["name"]\n', "utf-8")
+
+    from_json = load_severity_rules(json_path)
+    from_toml = load_severity_rules(toml_path)
+    assert from_json.classify("object.name")[0] == from_toml.classify("object.name")[0] == 3
+    assert from_json.classify("object.rect.x")[0] == 2
+    assert from_json.fingerprint == from_toml.fingerprint == SeverityRules(config).fingerprint
+
+    monkeypatch.setenv(RULES_ENV_VAR, str(json_path))
+    set_severity_rules(None)
+    assert get_severity_rules().fingerprint == from_json.fingerprint
+    monkeypatch.delenv(RULES_ENV_VAR)
+    set_severity_rules(None)
+    assert get_severity_rules().fingerprint == SeverityRules().fingerprint
+
+
+def test_sample_rules_file_is_the_default() -> None:
+    sample = load_severity_rules(Path(__file__).with_name("severity_rules.sample.json"))
+    assert sample.fingerprint == SeverityRules().fingerprint
+
+
+def test_fingerprint_follows_rule_content() -> None:
+    base = {"default": 1, "rules": [{"severity": 3, "patterns": ["Name"]}]}
+    same = {"default": 1, "rules": [{"severity": 3, "patterns": ["name"]}, {"severity": 2}]}
+    changed = {"default": 1, "rules": [{"severity": 2, "patterns": ["name"]}]}
+    assert SeverityRules(base).fingerprint == SeverityRules(same).fingerprint
+    assert SeverityRules(base).fingerprint != SeverityRules(changed).fingerprint
+    assert SeverityRules(base).fingerprint != SeverityRules(dict(base, default=2)).fingerprint
+
+
+def test_rules_change_changes_service_job_id() -> None:
+    options = {"list_mode": "align"}
+    default_id = job_id_for("old", "new", options)
+    assert job_id_for("old", "new", options) == default_id
+    set_severity_rules(SeverityRules({"default": 1, "rules": [{"severity": 3, "patterns": ["x"]}]}))
+    changed_id = job_id_for("old", "new", options)
+    assert changed_id != default_id
+    set_severity_rules(None)
+    assert job_id_for("old", "new", options) == default_id
@@ -0,0 +1,181 @@
+# 帳票DX テンプレート差分 ローカル差分サービスのテスト
+#
+# 同じプロセスで HTTP サーバーを立て、クライアントから呼んで確かめる。同じ比較の依頼は1つのジョブに
+# まとまること、待ちのジョブが上限に達したら 503、不正な依頼は 400 で断ること、終わったジョブを
+# 消すときに送信されたばかりの .xar は残すことを確かめる。
+# 実行: python -m pytest -q
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+
+from ReportDX_xar_diff_bench import template_to_xar
+from ReportDX_xar_diff_engine import compare_indexes, index_objects, result_from_json_report
+from ReportDX_xar_diff_service import (
+    DiffService,
+    DiffServiceClient,
+    ServiceError,
+    _blob_path,
+    _result_path,
+    serve,
+)
+
+
+def _tpl(n: int = 5, **names: str) -> Dict[str, Any]:
+    objects = []
+    for i in range(n):
+        oid = f"o{i}"
+        rect = {"x": 20.0 * i, "y": 0.0, "width": 10.0, "height": 10.0}
+        objects.append({"id": oid, "name": names.get(oid, oid), "rect": rect})
+    return {"objects": objects}
+
+
+class _PendingPool:
+    # 依頼を受け取るだけで実行しないプール（ジョブを待ちのままにする）
+
+    def __init__(self) -> None:
+        self.futures: List[Future] = []
+
+    def submit(self, *_args: Any, **_kwargs: Any) -> Future:
+        future: Future = Future()
+        self.futures.append(future)
+        return future
+
+
+@contextmanager
+def _start(tmp_path: Any, **kwargs: Any) -> Iterator[Tuple[DiffService, DiffServiceClient]]:
+    service = DiffService(tmp_path / "spool", workers=1, **kwargs)
+    server = serve(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield service, DiffServiceClient(f"http://127.0.0.1:{server.server_port}", timeout=60)
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+@pytest.fixture
+def running(tmp_path: Any) -> Iterator[Tuple[DiffService, DiffServiceClient]]:
+    with _start(tmp_path) as started:
+        yield started
+
+
+def _status(client: DiffServiceClient, method: str, path: str, body: bytes = b"") -> int:
+    try:
+        client._request(method, path, body=body)
+    except ServiceError as e:
+        return e.status
+    return 200
+
+
+def test_same_comparison_is_coalesced(running: Any) -> None:
+    service, client = running
+    old, new = _tpl(), _tpl(o1="renamed")
+    old_digest = client.upload(template_to_xar(old))
+    new_digest = client.upload(template_to_xar(new))
+
+    first = client.submit(old_digest, new_digest, "old.xar", "new.xar")
+    second = client.submit(old_digest, new_digest, "other.xar", "other.xar")
+    assert first["coalesced"] is False and second["coalesced"] is True
+    assert second["id"] == first["id"] and second["old_name"] == "old.xar"
+    # 条件が違えば別のジョブ
+    other = client.submit(old_digest, new_digest, analyze_layout=False)
+    assert other["id"] != first["id"] and other["coalesced"] is False
+
+    done = client.wait(first["id"], interval=0.05)
+    assert done["summary"]["changed"] == 1
+    assert client.submit(old_digest, new_digest)["coalesced"] is True
+    assert len(service.jobs()) == 2
+
+    idx_old, idx_new = index_objects(old), index_objects(new)
+    report = json.loads(client.result(first["id"], "json"))
+    result = result_from_json_report(report, idx_old, idx_new)
+    expected = compare_indexes(idx_old, idx_new, old_name="old.xar", new_name="new.xar")
+    assert result["changed_rows"] == expected["changed_rows"]
+    assert [d.path for d in result["changed_detail"]["o1"]["diffs"]] == ["object.name"]
+
+
+def test_pending_limit_rejects_with_503(tmp_path: Any) -> None:
+    with _start(tmp_path, max_pending=1) as (service, client):
+        real_pool, pool = service._pool, _PendingPool()
+        service._pool = pool
+        try:
+            a = client.upload(template_to_xar(_tpl()))
+            b = client.upload(template_to_xar(_tpl(o1="x")))
+            job = client.submit(a, b)
+            assert job["status"] == "queued"
+            # 同じ比較はまとまるので上限に数えない
+            assert client.submit(a, b)["coalesced"] is True
+            with pytest.raises(ServiceError) as raised:
+                client.submit(b, a)
+            assert raised.value.status == 503
+
+            (future,) = pool.futures
+            future.set_result({"summary": {}, "load_stats": [{}, {}]})
+            assert client.status(job["id"])["status"] == "done"
+            assert client.submit(b, a)["status"] == "queued"
+        finally:
+            service._pool = real_pool
+
+
+def test_malformed_requests_are_rejected(running: Any) -> None:
+    _service, client = running
+    digest = client.upload(template_to_xar(_tpl()))
+    assert _status(client, "POST", "/jobs", b"not json") == 400
+    assert _status(client, "POST", "/jobs", b"[]") == 400
+    assert _status(client, "POST", "/jobs", json.dumps({"old": digest}).encode()) == 400
+    body = {"old": digest, "new": digest, "old_name": 1}
+    assert _status(client, "POST", "/jobs", json.dumps(body).encode()) == 400
+    body = {"old": digest, "new": digest, "colour": "red"}
+    assert _status(client, "POST", "/jobs", json.dumps(body).encode()) == 400
+    body = {"old": digest, "new": digest, "max_overlaps": 0}
+    assert _status(client, "POST", "/jobs", json.dumps(body).encode()) == 400
+    body = {"old": digest, "new": "not-a-digest"}
+    assert _status(client, "POST", "/jobs", json.dumps(body).encode()) == 400
+    # 内容と一致しない SHA-256 で送った .xar は受け取らない
+    assert _status(client, "PUT", f"/blobs/{'0' * 64}", b"xar") == 400
+    assert not client.has_blob("0" * 64)
+
+    job = client.submit(digest, digest)
+    client.wait(job["id"], interval=0.05)
+    assert _status(client, "GET", f"/jobs/{job['id']}/result?format=pickle") == 400
+    assert _status(client, "GET", f"/jobs/{job['id']}/result?min_severity=x") == 400
+    assert _status(client, "GET", f"/jobs/{job['id']}/result?min_severity=4") == 400
+    assert _status(client, "GET", f"/jobs/{job['id']}/result?format=json") == 200
+
+
+def test_eviction_keeps_fresh_uploads(tmp_path: Any) -> None:
+    with _start(tmp_path, max_jobs=1) as (service, client):
+        a = client.upload(template_to_xar(_tpl()))
+        b = client.upload(template_to_xar(_tpl(o1="b")))
+        first = client.submit(a, b)
+        client.wait(first["id"], interval=0.05)
+        assert _result_path(service.spool, first["id"]).is_file()
+
+        # a・b は猶予を過ぎた古い .xar、c・d はこれから使う送信したばかりの .xar
+        past = time.time() - 2 * service.blob_grace
+        for digest in (a, b):
+            os.utime(_blob_path(service.spool, digest), (past, past))
+        c = client.upload(template_to_xar(_tpl(o1="c")))
+        d = client.upload(template_to_xar(_tpl(o1="d")))
+        second = client.submit(c, d)
+        assert _status(client, "GET", f"/jobs/{first['id']}") == 404
+        assert not _result_path(service.spool, first["id"]).exists()
+        assert not client.has_blob(a) and not client.has_blob(b)
+        assert client.has_blob(c) and client.has_blob(d)
+
+        # 前のジョブを消しても、送信・確認から猶予の間の .xar はどのジョブも使っていなくても残す
+        client.wait(second["id"], interval=0.05)
+        e = client.upload(template_to_xar(_tpl(o1="e")))
+        third = client.submit(c, e)
+        assert _status(client, "GET", f"/jobs/{second['id']}") == 404
+        assert client.has_blob(d) and client.has_blob(e)
+        client.wait(third["id"], interval=0.05)
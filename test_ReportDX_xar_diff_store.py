@@ -0,0 +1,117 @@
+# 帳票DX テンプレート差分 永続ストアのテスト
+#
+# DiffStore.compare が compare_indexes(detail="counts") と同じ結果を返すこと（保存済みの結果・
+# オブジェクト単位の件数の使い回しを含む）、上限サイズでの LRU 削除、壊れたエントリの扱いを確かめる。
+# 実行: python -m pytest -q
+
+import time
+from typing import Any, Dict, List
+
+import ReportDX_xar_diff_engine as engine_module
+import ReportDX_xar_diff_store as store_module
+from ReportDX_xar_diff_bench import generate_template, mutate_template, template_to_xar
+from ReportDX_xar_diff_engine import (
+    compare_indexes,
+    index_objects,
+    object_diffs,
+    summarize_result,
+)
+from ReportDX_xar_diff_entry import render_path
+from ReportDX_xar_diff_rules import SeverityRules, set_severity_rules
+from ReportDX_xar_diff_store import DiffStore
+
+
+def _as_records(diffs: Any) -> List[Any]:
+    return [(render_path(d.segments), d.op, d.old, d.new) for d in diffs]
+
+
+def _without_timings(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: result[k] for k in ("added", "removed", "changed_rows", "layout_groups", "overlaps")}
+
+
+def _count_object_diffs(monkeypatch: Any) -> List[str]:
+    compared: List[str] = []
+    original = engine_module._diff_object
+
+    def counting(oid: str, *args: Any, **kwargs: Any) -> Any:
+        compared.append(oid)
+        return original(oid, *args, **kwargs)
+
+    monkeypatch.setattr(engine_module, "_diff_object", counting)
+    return compared
+
+
+def test_store_compare_matches_compare_indexes(tmp_path: Any) -> None:
+    store = DiffStore(tmp_path / "store.sqlite")
+    base = generate_template(300, seed=3)
+    versions = [mutate_template(base, 0.1, seed=s) for s in (1, 2)]
+    _m, idx_base, _s, digest_base = store.load_template(template_to_xar(base))
+    for tpl in versions:
+        _m, idx_new, _s, digest_new = store.load_template(template_to_xar(tpl))
+        expected = compare_indexes(index_objects(base), index_objects(tpl), detail="counts")
+        for _ in range(2):
+            # 2回目は保存済みの結果
+            got = store.compare(digest_base, digest_new, idx_base, idx_new)
+            assert _without_timings(got) == _without_timings(expected)
+            assert summarize_result(got) == summarize_result(expected)
+            for oid, det in got["changed_detail"].items():
+                assert _as_records(object_diffs(det)) == _as_records(
+                    object_diffs(expected["changed_detail"][oid])
+                )
+    _m, idx_again, stats, _d = store.load_template(template_to_xar(base))
+    assert stats["store"] == "hit" and dict(idx_again) == dict(idx_base)
+
+
+def test_known_object_pairs_are_not_compared_again(tmp_path: Any, monkeypatch: Any) -> None:
+    store = DiffStore(tmp_path / "store.sqlite")
+    base = generate_template(200, seed=5)
+    new = mutate_template(base, 0.2, seed=6)
+    _m, idx_base, _s, digest_base = store.load_template(template_to_xar(base))
+    _m, idx_new, _s, digest_new = store.load_template(template_to_xar(new))
+    compared = _count_object_diffs(monkeypatch)
+
+    first = store.compare(digest_base, digest_new, idx_base, idx_new, analyze_layout=False)
+    assert compared
+    # 比較条件（結果のキー）は違うが、差分の条件が同じなのでオブジェクトの組は比較しない
+    del compared[:]
+    second = store.compare(
+        digest_base, digest_new, idx_base, idx_new, analyze_layout=False, max_overlaps=5
+    )
+    assert compared == []
+    assert second["changed_rows"] == first["changed_rows"]
+
+    # 重要度ルールが変わると件数は使い回さない
+    del compared[:]
+    set_severity_rules(SeverityRules({"default": 3}))
+    try:
+        store.compare(digest_base, digest_new, idx_base, idx_new, analyze_layout=False)
+    finally:
+        set_severity_rules(None)
+    assert len(compared) >= len(first["changed_rows"])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Any, monkeypatch: Any) -> None:
+    monkeypatch.setattr(store_module, "TOUCH_INTERVAL", 0.0)
+    store = DiffStore(tmp_path / "store.sqlite", max_bytes=1000)
+    for i in range(4):
+        store.put(f"k{i}", b"x" * 200)
+        time.sleep(0.01)
+    # k0 を使うと、次に古い k1 から消える
+    assert store.get("k0") is not None
+    store.put("k4", b"x" * 300)
+    assert [k for k in ("k0", "k1", "k2", "k3", "k4") if store.get(k) is not None] == [
+        "k0",
+        "k3",
+        "k4",
+    ]
+    assert store.total_bytes() <= 1000 * store_module.EVICT_TO_RATIO
+    # 1件で上限を超える値は保存しない
+    store.put("huge", b"x" * 2000)
+    assert store.get("huge") is None
+
+
+def test_unreadable_entries_are_dropped(tmp_path: Any) -> None:
+    store = DiffStore(tmp_path / "store.sqlite")
+    store.put("result:broken", b"not a pickle")
+    assert store._load("result:broken") is None
+    assert store.get("result:broken") is None
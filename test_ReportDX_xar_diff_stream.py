@@ -0,0 +1,51 @@
+# 帳票DX テンプレート差分 ストリーミング読み込みのテスト
+#
+# load_xar_streaming は一括読み込み（load_xar_from_bytes + index_objects）と同じインデックスを返し、
+# 読みながら計算した .xat の SHA-256 は xat_digest と一致する。
+# 実行: python -m pytest -q
+
+import io
+from typing import Any
+
+import pytest
+
+from ReportDX_xar_diff_bench import generate_template, template_to_xar
+from ReportDX_xar_diff_engine import index_objects, load_xar_from_bytes
+from ReportDX_xar_diff_stream import blob_ref, load_xar_streaming, xat_digest
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_streaming_loader_matches_full_load(seed: int, tmp_path: Any) -> None:
+    tpl = generate_template(200, table_depth=1 + seed % 3, seed=seed)
+    tpl["objects"].append({"name": "no_id"})
+    tpl["objects"][0]["impl"]["note"] = "「引用」\\\"\n\t😀 {[,]}"
+    data = template_to_xar(tpl)
+    loaded, _text = load_xar_from_bytes(data)
+    expected = index_objects(loaded)
+
+    path = tmp_path / "t.xar"
+    path.write_bytes(data)
+    for source in (data, path, str(path), io.BytesIO(data)):
+        meta, idx, stats = load_xar_streaming(source, blob_min_chars=None)
+        assert dict(idx) == dict(expected)
+        assert idx.hashes == expected.hashes
+        assert meta == {k: v for k, v in loaded.items() if k != "objects"}
+        assert stats["objects_without_id"] == 1
+        assert stats["xat_sha256"] == xat_digest(data)
+
+
+def test_streaming_loader_elides_blobs() -> None:
+    blob = "QUJD" * 64
+    tpl = {"objects": [{"id": "img", "impl": {"data": blob, "alt": "説明 " * 100}}]}
+    _meta, idx, stats = load_xar_streaming(template_to_xar(tpl), blob_min_chars=100)
+    assert idx["img"]["impl"] == {"data": blob_ref(blob), "alt": "説明 " * 100}
+    assert stats["blobs"] == 1
+
+
+def test_streaming_loader_rejects_oversized_objects() -> None:
+    tpl = {"objects": [{"id": "a", "v": "x" * 500}, {"id": "b"}]}
+    with pytest.raises(ValueError):
+        load_xar_streaming(template_to_xar(tpl), max_object_chars=100)
+    _meta, idx, stats = load_xar_streaming(template_to_xar(tpl), max_object_chars=1000)
+    assert sorted(idx) == ["a", "b"]
+    assert stats["peak_rss"] > 1 << 20
@@ -0,0 +1,115 @@
+# 帳票DX テンプレート差分 JSONテキスト差分のテスト
+#
+# 正規化（キー順・インデント・空白の違いは差分にしない）、変更のないオブジェクトを整形しないこと、
+# ハンクの行番号がブロック（オブジェクト）内の行番号であること、ハンク数・行数の上限を確かめる。
+# 実行: python -m pytest -q
+
+import difflib
+import json
+from typing import Any, Dict, List
+
+import ReportDX_xar_diff_text as text_module
+from ReportDX_xar_diff_engine import index_objects
+from ReportDX_xar_diff_text import META_BLOCK, canonical_lines, canonical_text_diff
+
+
+def _obj(oid: str, **fields: Any) -> Dict[str, Any]:
+    o = {"id": oid, "name": f"n_{oid}", "rect": {"x": 0, "y": 0, "width": 10, "height": 5}}
+    o.update(fields)
+    return o
+
+
+def _diff(old: List[Dict[str, Any]], new: List[Dict[str, Any]], **kwargs: Any) -> Any:
+    return canonical_text_diff(
+        {}, index_objects({"objects": old}), {}, index_objects({"objects": new}), **kwargs
+    )
+
+
+def test_canonical_lines_sort_keys_and_fix_indent() -> None:
+    assert canonical_lines({"b": 1, "a": [1, "あ"]}) == [
+        "{",
+        '  "a": [',
+        "    1,",
+        '    "あ"',
+        "  ],",
+        '  "b": 1',
+        "}",
+    ]
+
+
+def test_key_order_and_whitespace_are_not_differences() -> None:
+    old = [_obj("a"), _obj("b")]
+    # JSON テキストとしての書き方が違うだけの同じ内容
+    new = json.loads(json.dumps(list(reversed([dict(reversed(o.items())) for o in old])), indent=7))
+    text, stats = _diff(old, new)
+    assert text == ""
+    assert stats["changed_blocks"] == 0 and not stats["truncated"]
+
+
+def test_only_changed_objects_are_formatted(monkeypatch: Any) -> None:
+    formatted = []
+
+    def counting(value: Any) -> List[str]:
+        formatted.append(value["id"])
+        return canonical_lines(value)
+
+    monkeypatch.setattr(text_module, "canonical_lines", counting)
+    old = [_obj(f"o{i:03d}") for i in range(200)]
+    new = [dict(o) for o in old]
+    new[17] = _obj("o017", name="renamed")
+    _text, stats = _diff(old, new)
+    assert formatted == ["o017", "o017"]
+    assert stats["changed_blocks"] == stats["shown_blocks"] == 1
+
+
+def test_hunk_line_numbers_are_per_block() -> None:
+    # 2つ目のブロックのハンクも、テンプレート全体ではなくそのオブジェクト内の行番号になる
+    old = [_obj("a"), _obj("b")]
+    new = [_obj("a", name="A"), _obj("b", rect={"x": 0, "y": 9, "width": 10, "height": 5})]
+    text, stats = _diff(old, new, context=1)
+    lines = text.splitlines()
+    assert lines[:2] == ["--- old.xat", "+++ new.xat"]
+    headers = [line for line in lines if line.startswith("@@")]
+    assert headers == ["@@ -2,3 +2,3 @@ object a", "@@ -7,3 +7,3 @@ object b"]
+    for block, o_old, o_new in (("object a", old[0], new[0]), ("object b", old[1], new[1])):
+        expected = list(
+            difflib.unified_diff(
+                canonical_lines(o_old), canonical_lines(o_new), n=1, lineterm=""
+            )
+        )[2:]
+        expected[0] += f" {block}"
+        start = lines.index(expected[0])
+        assert lines[start : start + len(expected)] == expected
+    assert stats["hunks"] == 2 and stats["lines"] == len(lines) - 2
+
+
+def test_added_removed_objects_and_meta_blocks() -> None:
+    text, stats = canonical_text_diff(
+        {"name": "old"},
+        index_objects({"objects": [_obj("gone")]}),
+        {"name": "new"},
+        index_objects({"objects": [_obj("new")]}),
+    )
+    headers = [line for line in text.splitlines() if line.startswith("@@")]
+    assert headers == [
+        f"@@ -1,3 +1,3 @@ {META_BLOCK}",
+        "@@ -1,10 +0,0 @@ object gone",
+        "@@ -0,0 +1,10 @@ object new",
+    ]
+    assert stats["changed_blocks"] == 3
+
+
+def test_hunk_and_line_caps_truncate() -> None:
+    old = [_obj(f"o{i}") for i in range(5)]
+    new = [_obj(f"o{i}", name="changed") for i in range(5)]
+    full, stats = _diff(old, new)
+    assert stats["hunks"] == 5 and not stats["truncated"]
+
+    text, stats = _diff(old, new, max_hunks=2)
+    assert stats["hunks"] == 2 and stats["shown_blocks"] == 2 and stats["truncated"]
+    assert text.splitlines()[-1].endswith("（未表示の変更ブロック: 3）")
+    assert text.startswith("\n".join(full.splitlines()[: stats["lines"] + 2]))
+
+    text, stats = _diff(old, new, max_lines=10)
+    assert stats["lines"] == 10 and stats["truncated"]
+    assert len(text.splitlines()) == 2 + 10 + 1
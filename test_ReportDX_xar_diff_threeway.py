@@ -0,0 +1,141 @@
+# 帳票DX テンプレート差分 3者比較のテスト
+#
+# 手で作った例の分類（A のみ・B のみ・同じ変更・両方・競合）と、A 側・B 側の差分が
+# 基準版との2者比較（deep_diff）と一致することを確かめる。
+# 実行: python -m pytest -q
+
+import copy
+from typing import Any, Dict, List
+
+import pytest
+
+from ReportDX_xar_diff_bench import generate_template, mutate_template
+from ReportDX_xar_diff_engine import deep_diff, index_objects
+from ReportDX_xar_diff_entry import render_path
+from ReportDX_xar_diff_threeway import compare_three_way
+
+
+def _typed(v: Any) -> Any:
+    # 1 と 1.0、True と 1 を区別する比較用の値（キー順は正規化する）
+    if isinstance(v, dict):
+        return sorted((k, _typed(e)) for k, e in v.items())
+    if isinstance(v, list):
+        return [_typed(e) for e in v]
+    return (type(v).__name__, v)
+
+
+def _obj(oid: str, **changes: Any) -> Dict[str, Any]:
+    o = {
+        "id": oid,
+        "name": f"n_{oid}",
+        "impl_uri": "oxa:text",
+        "rect": {"x": 0.0, "y": 0.0, "width": 10.0, "height": 5.0},
+        "impl": {"data": {"value": oid}, "list": [1, 2, 3]},
+    }
+    for path, value in changes.items():
+        node = o
+        *parents, last = path.split("__")
+        for p in parents:
+            node = node[p]
+        node[last] = value
+    return o
+
+
+def _index(*objects: Dict[str, Any]) -> Any:
+    return index_objects({"objects": list(objects)})
+
+
+def test_three_way_classification() -> None:
+    ids = ["o1", "o2", "o3", "o4", "o5", "o6", "o9"]
+    base = [_obj(i) for i in ids] + [_obj("o8", impl__list=[1, True])]
+    a = [
+        _obj("o1", name="a"),
+        _obj("o2"),
+        _obj("o3", rect__x=5.0),
+        _obj("o4", name="a"),
+        _obj("o6", rect__x=1.0),
+        _obj("o8", impl__list=[True, 1]),
+        _obj("o9"),
+        _obj("o7"),
+    ]
+    b = [
+        _obj("o1"),
+        _obj("o2", rect__y=3.0),
+        _obj("o3", rect__x=5.0),
+        _obj("o4", name="b"),
+        _obj("o5", name="b"),
+        _obj("o6", rect__y=1.0),
+        _obj("o8", impl__list=[1, True]),
+        _obj("o9"),
+    ]
+    result = compare_three_way(_index(*base), _index(*a), _index(*b), value_ref_min_chars=None)
+    rows = {r["id"]: r for r in result["rows"]}
+    statuses = {oid: r["status"] for oid, r in rows.items()}
+    assert statuses == {
+        "o1": "a_only",
+        "o2": "b_only",
+        "o3": "same",
+        "o4": "conflict",
+        "o5": "conflict",
+        "o6": "both",
+        "o7": "a_only",
+        "o8": "a_only",
+    }
+    assert (rows["o5"]["a_op"], rows["o5"]["b_op"]) == ("removed", "changed")
+    assert (rows["o7"]["a_op"], rows["o7"]["b_op"]) == ("added", None)
+
+    def entries(oid: str) -> List[Any]:
+        return [(render_path(t.segments), t.status) for t in result["detail"][oid]["entries"]]
+
+    assert entries("o4") == [("object.name", "conflict")]
+    # 削除（祖先のパス）と名前の変更（子孫のパス）は競合
+    assert entries("o5") == [("object", "conflict"), ("object.name", "conflict")]
+    assert entries("o6") == [("object.rect.x", "a_only"), ("object.rect.y", "b_only")]
+    assert entries("o7") == [("object", "a_only")]
+    (same,) = result["detail"]["o3"]["entries"]
+    assert same.a is same.b and same.a.new == 5.0
+    (conflict,) = result["detail"]["o4"]["entries"]
+    assert (conflict.a.new, conflict.b.new) == ("a", "b")
+    # == では同じでも型の並びが違うリストは、A のみの移動として残る
+    assert entries("o8") == [("object.impl.list[1]", "a_only")]
+
+
+def _side_records(diffs: Any) -> List[Any]:
+    return sorted(
+        repr((render_path(d.segments), d.op, _typed(d.old), _typed(d.new))) for d in diffs
+    )
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_three_way_sides_match_two_way(seed: int) -> None:
+    base = generate_template(200, table_depth=1 + seed % 2, seed=seed)
+    a = mutate_template(base, 0.2, seed=seed + 100)
+    # 一部は A と同じ変更、一部は A と競合する変更
+    b = mutate_template(base, 0.2, seed=seed + 200)
+    for o_a, o_b in zip(a["objects"][:40:4], b["objects"][:40:4]):
+        if o_a["id"] == o_b["id"]:
+            o_b.clear()
+            o_b.update(copy.deepcopy(o_a))
+    idx_base, idx_a, idx_b = index_objects(base), index_objects(a), index_objects(b)
+    result = compare_three_way(idx_base, idx_a, idx_b, value_ref_min_chars=None)
+
+    rows = {r["id"]: r for r in result["rows"]}
+    for oid in set(idx_base) | set(idx_a) | set(idx_b):
+        two_way = {}
+        for side, idx in (("a", idx_a), ("b", idx_b)):
+            old = {"object": idx_base[oid]} if oid in idx_base else {}
+            new = {"object": idx[oid]} if oid in idx else {}
+            two_way[side] = _side_records(deep_diff(old, new))
+        if not two_way["a"] and not two_way["b"]:
+            assert oid not in rows
+            continue
+        entries = result["detail"][oid]["entries"]
+        assert _side_records(t.a for t in entries if t.a is not None) == two_way["a"]
+        assert _side_records(t.b for t in entries if t.b is not None) == two_way["b"]
+        for t in entries:
+            if t.status == "same":
+                assert t.a is t.b
+            elif t.status == "a_only":
+                assert t.b is None
+            elif t.status == "b_only":
+                assert t.a is None
@@ -0,0 +1,161 @@
+# 帳票DX テンプレート差分 大きな値の参照のテスト
+#
+# 正規化JSONで上限を超える値だけが ValueRef になり、元の値を共有すること、
+# プレビューとダイジェストがキー順に依存せず安定していること、
+# レポートの旧値・新値が max_value_chars に収まることを確かめる。
+# 実行: python -m pytest -q
+
+import json
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from ReportDX_xar_diff_engine import (
+    build_json_report,
+    build_markdown_report,
+    compare_indexes,
+    index_objects,
+    structural_hash,
+)
+from ReportDX_xar_diff_values import (
+    VALUE_PREVIEW_CHARS,
+    ValueRef,
+    _json_prefix,
+    format_value,
+    make_value_ref,
+    value_for_json,
+)
+
+
+def _canonical(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, sort_keys=True)
+
+
+def _table(rows: int, seed: int = 0) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+    return {
+        "name": "明細",
+        "rows": [{"no": i, "text": f"行{i}", "w": rnd.randint(1, 99)} for i in range(rows)],
+    }
+
+
+def _random_value(rnd: random.Random, depth: int = 0) -> Any:
+    r = rnd.random()
+    if depth < 3 and r < 0.3:
+        return {f"k{rnd.randint(0, 20)}": _random_value(rnd, depth + 1) for _ in range(4)}
+    if depth < 3 and r < 0.5:
+        return [_random_value(rnd, depth + 1) for _ in range(rnd.randint(0, 5))]
+    return rnd.choice([None, True, 1, -2.5, "a", "説明\n", "x" * rnd.randint(0, 50)])
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_json_prefix_is_a_prefix_of_the_canonical_json(seed: int) -> None:
+    rnd = random.Random(seed)
+    v = _random_value(rnd)
+    full = _canonical(v)
+    for limit in (0, 1, 7, 40, len(full) - 1, len(full), len(full) + 5):
+        if limit < 0:
+            continue
+        text, complete = _json_prefix(v, limit)
+        assert complete == (len(full) <= limit)
+        assert text == (full if complete else full[:limit])
+
+
+def test_small_values_are_kept_as_is() -> None:
+    small = {"a": [1, 2, 3], "b": "x" * 100}
+    assert make_value_ref(small, 2048) is small
+    assert make_value_ref(12345, 1) == 12345
+    # 文字列は引用符を含めた長さで判定する
+    assert make_value_ref("x" * 8, 10) == "x" * 8
+    assert isinstance(make_value_ref("x" * 9, 10), ValueRef)
+
+
+def test_large_values_become_shared_refs() -> None:
+    table = _table(200)
+    ref = make_value_ref(table, 2048)
+    assert isinstance(ref, ValueRef)
+    assert ref.value is table
+    assert (ref.kind, ref.length) == ("dict", 2)
+    assert ref.preview == _canonical(table)[:VALUE_PREVIEW_CHARS]
+    assert ref.chars == len(_canonical(table))
+    assert json.loads(ref.to_json()) == table
+    assert make_value_ref(ref, 1) is ref
+
+    text = make_value_ref("あ" * 5000, 2048)
+    assert (text.kind, text.length) == ("str", 5000)
+
+
+def test_preview_and_digest_are_stable() -> None:
+    table = _table(200)
+    reordered = json.loads(json.dumps(dict(reversed(list(table.items())))))
+    a = make_value_ref(table, 2048)
+    b = make_value_ref(reordered, 2048)
+    assert a.preview == b.preview
+    assert a.digest == b.digest == structural_hash(table).hex()
+    assert a.as_dict() == b.as_dict() == value_for_json(a)
+    assert a.as_dict()["$ref"] == f"blake2b:{a.digest}"
+
+    changed = _table(200)
+    changed["rows"][150]["w"] = 1000
+    assert make_value_ref(changed, 2048).digest != a.digest
+
+
+def test_digest_comes_from_the_subtree_hash_table() -> None:
+    table = _table(200)
+    ref = make_value_ref(table, 2048, {id(table): b"\x01" * 16})
+    assert ref.raw_digest == b"\x01" * 16
+    assert ref.digest == "01" * 16
+    assert make_value_ref(table, 2048, {}).raw_digest is None
+
+
+def test_format_value_respects_max_chars() -> None:
+    table = _table(200)
+    assert format_value(table, None) == _canonical(table)
+    assert format_value(table, 50) == _canonical(table)[:50] + "…"
+    assert format_value({"a": 1}, 50) == '{"a": 1}'
+
+    ref = make_value_ref(table, 2048)
+    text = format_value(ref, 20)
+    assert text.startswith(ref.preview[:20] + "…（dict 2 キー, #")
+    assert format_value(ref, None).startswith(ref.preview + "…")
+
+
+def _objects(table: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"id": "t1", "name": "表", "impl": {"tables": [table]}}]
+
+
+def test_reports_carry_refs_and_respect_max_value_chars() -> None:
+    new_table = _table(200)
+    objects = _objects(_table(3))
+    old = index_objects({"objects": objects})
+    objects = json.loads(json.dumps(objects))
+    objects[0]["impl"]["extra"] = new_table
+    new = index_objects({"objects": objects})
+    result = compare_indexes(old, new)
+
+    report = build_json_report(result)
+    diffs = {d["path"]: d for d in report["changed"][0]["diffs"]}
+    added = diffs["object.impl.extra"]["new"]
+    assert added["$ref"] == f"blake2b:{structural_hash(new_table).hex()}"
+    assert added["preview"] == _canonical(new_table)[:VALUE_PREVIEW_CHARS]
+    # レポートは ValueRef のまま JSON 化でき、表の全体は含まない
+    assert len(json.dumps(report, ensure_ascii=False)) < len(_canonical(new_table))
+
+    full = compare_indexes(old, new, value_ref_min_chars=None)
+    plain = build_json_report(full)
+    plain_diffs = {d["path"]: d for d in plain["changed"][0]["diffs"]}
+    assert plain_diffs["object.impl.extra"]["new"] == new_table
+
+    for res, expected in ((full, _canonical(new_table)[:30] + "…"), (result, None)):
+        md = build_markdown_report(
+            "old", "new", [], [], res["changed_rows"], res["changed_detail"], 30
+        )
+        (line,) = [line for line in md.splitlines() if "`object.impl.extra`" in line]
+        cell = line.split("`")[-2]
+        if expected is None:
+            # ValueRef はプレビューを max_value_chars で切り、概要を付ける
+            (d,) = res["changed_detail"]["t1"]["diffs"]
+            expected = format_value(d.new, 30)
+            assert cell.startswith(_canonical(new_table)[:30] + "…（dict 2 キー")
+        assert cell == expected
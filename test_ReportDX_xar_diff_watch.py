@@ -0,0 +1,117 @@
+# 帳票DX テンプレート差分 ファイル監視のテスト
+#
+# 読めなかった（書き出し途中の）ファイルは次の poll で読み直すこと、.xat の CRC が同じなら
+# 読み込まないこと、変わったオブジェクトだけを比較し直すことを確かめる。
+# 実行: python -m pytest -q
+
+import io
+import json
+import os
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+import ReportDX_xar_diff_watch as watch_module
+from ReportDX_xar_diff_bench import template_to_xar
+from ReportDX_xar_diff_engine import compare_indexes, index_objects
+from ReportDX_xar_diff_watch import TemplateWatcher, _WatchedFile
+
+_MTIME = [1_700_000_000_000_000_000]
+
+
+def _tpl(n: int = 5, **names: str) -> Dict[str, Any]:
+    objects = []
+    for i in range(n):
+        oid = f"o{i}"
+        rect = {"x": 20.0 * i, "y": 0.0, "width": 10.0, "height": 10.0}
+        objects.append({"id": oid, "name": names.get(oid, oid), "rect": rect})
+    return {"objects": objects}
+
+
+def _write(path: Path, data: bytes) -> None:
+    # 更新時刻は書くたびに進める（ファイルシステムの時刻の粒度に左右されないように）
+    path.write_bytes(data)
+    _MTIME[0] += 1_000_000_000
+    os.utime(path, ns=(_MTIME[0], _MTIME[0]))
+
+
+def _stored_xar(tpl: Dict[str, Any]) -> bytes:
+    # template_to_xar と同じ .xat を無圧縮で格納した（バイト列の違う）.xar
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("template.xat", json.dumps(tpl, ensure_ascii=False))
+    return buffer.getvalue()
+
+
+def _fail(*_args: Any, **_kwargs: Any) -> Any:
+    raise AssertionError("読み込まないはずのファイルを読み込みました")
+
+
+def test_failed_first_load_is_retried(tmp_path: Any) -> None:
+    old_path, new_path = tmp_path / "old.xar", tmp_path / "new.xar"
+    _write(old_path, template_to_xar(_tpl()))
+    _write(new_path, template_to_xar(_tpl())[:40])
+    watcher = TemplateWatcher(old_path, new_path)
+    assert not watcher.poll()
+    assert watcher.error and watcher.result is None and watcher.version == 0
+
+    # ZIP としては読めるが .xat が途中までのもの
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr("template.xat", json.dumps(_tpl())[:30])
+    _write(new_path, buffer.getvalue())
+    assert not watcher.poll()
+    assert watcher.error and watcher.result is None
+
+    _write(new_path, template_to_xar(_tpl(o1="renamed")))
+    assert watcher.poll()
+    assert watcher.error is None and watcher.version == 1
+    assert [r["id"] for r in watcher.result["changed_rows"]] == ["o1"]
+    # 旧側は最初の poll で読み込み済み
+    assert watcher.last_update["reloaded"] == ["new.xar"]
+
+
+def test_unchanged_xat_crc_skips_reload(tmp_path: Any, monkeypatch: Any) -> None:
+    path = tmp_path / "a.xar"
+    _write(path, template_to_xar(_tpl()))
+    watched = _WatchedFile(path)
+    assert watched.refresh()
+    idx, digest = watched.idx, watched.digest
+    # 同じ内容を別の ZIP として書き出し直しても、.xat の CRC が同じなら読み込まない
+    monkeypatch.setattr(watch_module, "load_xar_streaming", _fail)
+    _write(path, _stored_xar(_tpl()))
+    assert not watched.refresh()
+    assert watched.idx is idx and watched.digest == digest
+    # 時刻・サイズが同じなら ZIP も開かない
+    monkeypatch.setattr(watch_module, "find_xat_member", _fail)
+    assert not watched.refresh()
+
+
+def test_poll_rediffs_only_changed_objects(tmp_path: Any, monkeypatch: Any) -> None:
+    old_path, new_path = tmp_path / "old.xar", tmp_path / "new.xar"
+    _write(old_path, template_to_xar(_tpl(20)))
+    _write(new_path, template_to_xar(_tpl(20, o1="a")))
+    watcher = TemplateWatcher(old_path, new_path, analyze_layout=False)
+    assert watcher.poll()
+    assert watcher.last_update["diffed"] == 1
+    assert not watcher.poll()
+
+    prev_idx = watcher.new.idx
+    _write(new_path, template_to_xar(_tpl(20, o1="a", o2="b")))
+    assert watcher.poll()
+    assert watcher.version == 2
+    assert watcher.last_update["reloaded"] == ["new.xar"]
+    # o2 だけを比較し、変わっていないオブジェクトは前回の dict を使い回す
+    assert watcher.last_update["diffed"] == 1
+    assert watcher.new.stats["objects_reused"] == 19
+    assert watcher.new.idx["o0"] is prev_idx["o0"]
+
+    expected = compare_indexes(
+        index_objects(_tpl(20)), index_objects(_tpl(20, o1="a", o2="b")), analyze_layout=False
+    )
+    version, result, _old, _new = watcher.snapshot()
+    assert version == 2 and result["changed_rows"] == expected["changed_rows"]
+
+    calls: List[Any] = []
+    monkeypatch.setattr(watch_module, "compare_indexes", lambda *a, **k: calls.append(a))
+    assert not watcher.poll() and calls == []